@@ -1,16 +1,27 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import FileResponse
+from sqlalchemy import Date, String, cast, func, literal_column, select, text, tuple_
+from sqlalchemy.orm import Session, joinedload, selectinload
 from app.db.session import SessionLocal
 from app.db import models
 from app import schemas
-from app.services.history import log_event, list_history
-from datetime import datetime, timezone
+from app.services import change_feed, rollup, search, supplier_registry
+from app.services.history import log_event
+from datetime import date, datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from uuid import UUID
 from zoneinfo import ZoneInfo
+import base64
 import os
+import time
 
 router = APIRouter()
 
 LOCAL_TZ = os.environ.get('LOCAL_TZ', 'UTC')
+PREVIEW_SIZES = ('thumb', 'medio', 'grande')
+PREVIEW_FORMATS = ('png', 'webp')
+PREVIEW_CACHE_CONTROL = 'private, max-age=86400'
+COUNT_TTL = float(os.environ.get('DOCUMENTOS_COUNT_TTL', '30'))  # seconds a list total is reused
 
 def get_db():
     db = SessionLocal()
@@ -19,50 +30,435 @@ def get_db():
     finally:
         db.close()
 
-@router.get("/", response_model=list[schemas.DocumentoOut])
-def list_documentos(tipo: str | None = None, status: str | None = None, db: Session = Depends(get_db)):
-    q = db.query(models.DocumentoFinanceiro)
+def _encode_cursor(criado_em: datetime, doc_id) -> str:
+    raw = f'{criado_em.isoformat()}|{doc_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        criado_em, doc_id = raw.split('|')
+        return datetime.fromisoformat(criado_em), UUID(doc_id)
+    except Exception:
+        raise HTTPException(status_code=422, detail="cursor inválido")
+
+
+def _enum_filter(enum_cls, value: str):
+    try:
+        return enum_cls[value]
+    except KeyError:
+        raise HTTPException(status_code=422, detail=f"valor inválido: {value}")
+
+
+_count_cache: dict = {}
+
+RELTUPLES_SQL = text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'documentos_financeiros'")
+
+
+def _cached_count(key: tuple):
+    hit = _count_cache.get(key)
+    if hit and hit[0] > time.monotonic():
+        return hit[1], hit[2]
+    return None
+
+
+def _store_count(key: tuple, total: int, estimated: bool) -> tuple:
+    if len(_count_cache) > 1024:
+        _count_cache.clear()
+    _count_cache[key] = (time.monotonic() + COUNT_TTL, total, estimated)
+    return total, estimated
+
+
+def _count_statement(stmt):
+    return select(func.count()).select_from(stmt.order_by(None).subquery())
+
+
+def _count_documentos(db: Session, stmt, key: tuple) -> tuple:
+    """Total for the list filters: cached for COUNT_TTL seconds; unfiltered totals on
+    Postgres come from the planner estimate (pg_class.reltuples). Returns (total, estimated)."""
+    hit = _cached_count(key)
+    if hit:
+        return hit
+    if not any(key) and db.get_bind().dialect.name == 'postgresql':
+        reltuples = db.execute(RELTUPLES_SQL).scalar()
+        if reltuples is not None and reltuples >= 0:
+            return _store_count(key, int(reltuples), True)
+    return _store_count(key, db.execute(_count_statement(stmt)).scalar(), False)
+
+
+def _metadado(key: str):
+    """metadados->>'key': the expression of the migration 0010 indexes (SQLite >= 3.38 has ->> too)."""
+    return models.DocumentoFinanceiro.metadados.op('->>', return_type=String)(literal_column(f"'{key}'"))
+
+
+def _list_statement(tipo, subtipo, status, fornecedor, de, ate, transportadora=None, ncm=None, cnae=None):
+    """Filtered (unpaginated) list query shared by the sync and async routes."""
+    D = models.DocumentoFinanceiro
+    stmt = select(
+        D.id, D.tipo, D.subtipo, D.fornecedor, D.numero_documento, D.valor,
+        D.status, D.confirmado_em, D.criado_em,
+    )
     if tipo:
-        q = q.filter(models.DocumentoFinanceiro.tipo == tipo)
+        stmt = stmt.where(D.tipo == _enum_filter(models.DocumentType, tipo))
+    if subtipo:
+        stmt = stmt.where(D.subtipo == _enum_filter(models.DocumentSubtipo, subtipo))
     if status:
-        q = q.filter(models.DocumentoFinanceiro.status == status)
-    docs = q.all()
-    return docs
+        stmt = stmt.where(D.status == _enum_filter(models.DocumentStatus, status))
+    if fornecedor:
+        stmt = stmt.where(D.fornecedor.ilike(f'%{fornecedor}%'))
+    if de:
+        stmt = stmt.where(D.criado_em >= de)
+    if ate:
+        stmt = stmt.where(D.criado_em < ate)
+    for key, value in (('transportadora', transportadora), ('ncm', ncm), ('cnae', cnae)):
+        if value:
+            stmt = stmt.where(_metadado(key) == value)
+    return stmt
 
-@router.get("/{documento_id}", response_model=schemas.DocumentoDetail)
-def get_documento(documento_id: str, db: Session = Depends(get_db)):
-    doc = db.query(models.DocumentoFinanceiro).filter(models.DocumentoFinanceiro.id == documento_id).first()
-    if not doc:
-        raise HTTPException(status_code=404, detail="Documento não encontrado")
 
-    # Attach historico and anexos (via Email)
-    historicos = list_history(db, doc.id)
-    email = db.query(models.Email).filter(models.Email.id == doc.email_id).first()
-    anexos = email.anexos if email else []
-
-    resp = {
-        'id': doc.id,
-        'email_id': doc.email_id,
-        'tipo': doc.tipo.value,
-        'subtipo': doc.subtipo.value if doc.subtipo else None,
-        'fornecedor': doc.fornecedor,
-        'cnpj': doc.cnpj,
-        'numero_documento': doc.numero_documento,
-        'valor': float(doc.valor) if doc.valor is not None else None,
-        'metadados': (None if not doc.metadados else __import__('json').loads(doc.metadados)),
-        'status': doc.status.value,
-        'confirmado_em': doc.confirmado_em,
-        'confirmado_por': doc.confirmado_por,
-        'historicos': historicos,
-        'anexos': anexos,
+def _page_statement(stmt, cursor: str | None, limit: int):
+    D = models.DocumentoFinanceiro
+    if cursor:
+        stmt = stmt.where(tuple_(D.criado_em, D.id) < tuple_(*_decode_cursor(cursor)))
+    # one extra row tells whether there is a next page
+    return stmt.order_by(D.criado_em.desc(), D.id.desc()).limit(limit + 1)
+
+
+def _list_item(r) -> dict:
+    """Inbox row (also the data of the /documentos/eventos feed)."""
+    return {
+        'id': r.id,
+        'tipo': r.tipo.value,
+        'subtipo': r.subtipo.value if r.subtipo else None,
+        'fornecedor': r.fornecedor,
+        'numero_documento': r.numero_documento,
+        'valor': float(r.valor) if r.valor is not None else None,
+        'status': r.status.value,
+        'confirmado_em': r.confirmado_em,
+        'criado_em': r.criado_em,
     }
-    return resp
 
-@router.post("/{documento_id}/confirmar")
-def confirmar_documento(documento_id: str, usuario: str, db: Session = Depends(get_db)):
-    doc = db.query(models.DocumentoFinanceiro).filter(models.DocumentoFinanceiro.id == documento_id).first()
+
+def _page(rows, limit: int) -> dict:
+    items = [_list_item(r) for r in rows[:limit]]
+    page = {'items': items}
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        page['next_cursor'] = _encode_cursor(last.criado_em, last.id)
+    return page
+
+
+@router.get("/", response_model=schemas.DocumentoPage)
+def list_documentos(
+    tipo: str | None = None,
+    subtipo: str | None = None,
+    status: str | None = None,
+    fornecedor: str | None = None,
+    de: datetime | None = None,
+    ate: datetime | None = None,
+    transportadora: str | None = None,
+    ncm: str | None = None,
+    cnae: str | None = None,
+    cursor: str | None = None,
+    limit: int = Query(50, ge=1, le=500),
+    total: bool = False,
+    db: Session = Depends(get_db),
+):
+    """Keyset-paginated list (newest first) with only the columns the inbox shows.
+
+    `transportadora`, `ncm` and `cnae` match the extracted metadados exactly.
+    Pass `next_cursor` back as `cursor` to get the next page.
+    """
+    filters = (tipo, subtipo, status, fornecedor, de, ate, transportadora, ncm, cnae)
+    stmt = _list_statement(*filters)
+    page = {}
+    if total:
+        page['total'], page['total_estimado'] = _count_documentos(db, stmt, filters)
+    rows = db.execute(_page_statement(stmt, cursor, limit)).all()
+    return {**_page(rows, limit), **page}
+
+RESUMO_PERIODOS = ('dia', 'semana', 'mes', 'ano', 'total')
+RESUMO_DIMENSOES = ('tipo', 'subtipo', 'status', 'fornecedor')
+
+
+def _bucket(dia, periodo: str, dialect: str):
+    """First day of the week (Monday) / month / year of `dia`."""
+    if periodo == 'dia':
+        return dia
+    if dialect == 'postgresql':
+        unit = {'semana': 'week', 'mes': 'month', 'ano': 'year'}[periodo]
+        return cast(func.date_trunc(unit, dia), Date)
+    if periodo == 'semana':
+        return func.date(dia, '-6 days', 'weekday 1')
+    return func.strftime('%Y-%m-01' if periodo == 'mes' else '%Y-01-01', dia)
+
+
+def _summary_statement(dialect: str, periodo: str, agrupar: str | None, tipo, subtipo, status, fornecedor, de, ate):
+    """Counts and valor totals from the daily rollup, per period and `agrupar` dimensions."""
+    R = models.ResumoDiario
+    if periodo not in RESUMO_PERIODOS:
+        raise HTTPException(status_code=422, detail=f"periodo inválido: {periodo}")
+    grupos = [g.strip() for g in (agrupar or '').split(',') if g.strip()]
+    for g in grupos:
+        if g not in RESUMO_DIMENSOES:
+            raise HTTPException(status_code=422, detail=f"agrupar inválido: {g}")
+    cols = [] if periodo == 'total' else [_bucket(R.dia, periodo, dialect).label('periodo')]
+    cols += [getattr(R, g) for g in grupos]
+    stmt = select(*cols, func.sum(R.quantidade).label('quantidade'), func.sum(R.valor_total).label('valor_total'))
+    if tipo:
+        stmt = stmt.where(R.tipo == _enum_filter(models.DocumentType, tipo).name)
+    if subtipo:
+        stmt = stmt.where(R.subtipo == _enum_filter(models.DocumentSubtipo, subtipo).name)
+    if status:
+        stmt = stmt.where(R.status == _enum_filter(models.DocumentStatus, status).name)
+    if fornecedor:
+        stmt = stmt.where(R.fornecedor.ilike(f'%{fornecedor}%'))
+    if de:
+        stmt = stmt.where(R.dia >= de)
+    if ate:
+        stmt = stmt.where(R.dia < ate)
+    if cols:
+        stmt = stmt.group_by(*cols).order_by(*cols)
+    return stmt, grupos
+
+
+def _summary(rows, periodo: str, grupos: list) -> dict:
+    items = []
+    for r in rows:
+        if not r.quantidade:
+            continue  # keys every documento has left
+        item = {'periodo': str(r.periodo)[:10]} if periodo != 'total' else {}
+        item.update({g: getattr(r, g) or None for g in grupos})
+        item.update(quantidade=int(r.quantidade), valor_total=float(r.valor_total or 0))
+        items.append(item)
+    return {
+        'periodo': periodo,
+        'agrupar': grupos,
+        'grupos': items,
+        'quantidade': sum(i['quantidade'] for i in items),
+        'valor_total': round(sum(i['valor_total'] for i in items), 2),
+    }
+
+
+@router.get("/resumo", response_model=schemas.Resumo)
+def resumo_documentos(
+    periodo: str = 'dia',
+    agrupar: str | None = None,
+    tipo: str | None = None,
+    subtipo: str | None = None,
+    status: str | None = None,
+    fornecedor: str | None = None,
+    de: date | None = None,
+    ate: date | None = None,
+    db: Session = Depends(get_db),
+):
+    """Number of documentos and sum of valor per `periodo` (dia/semana/mes/ano/total) and the
+    comma-separated `agrupar` dimensions (tipo, subtipo, status, fornecedor), read from the
+    daily rollup; `de`/`ate` are days (criado_em in LOCAL_TZ, `ate` exclusive)."""
+    stmt, grupos = _summary_statement(db.get_bind().dialect.name, periodo, agrupar,
+                                      tipo, subtipo, status, fornecedor, de, ate)
+    return _summary(db.execute(stmt).all(), periodo, grupos)
+
+
+def _encode_search_cursor(relevancia: float, doc_id) -> str:
+    raw = f'{relevancia!r}|{doc_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_search_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        relevancia, doc_id = raw.split('|')
+        return float(relevancia), UUID(doc_id)
+    except Exception:
+        raise HTTPException(status_code=422, detail="cursor inválido")
+
+
+def _search_statement(dialect: str, trgm: bool, q: str, cursor: str | None, limit: int):
+    q = q.strip()
+    if not q:
+        raise HTTPException(status_code=422, detail="busca vazia")
+    after = _decode_search_cursor(cursor) if cursor else None
+    return search.search_statement(q, dialect, trgm, after, limit)
+
+
+def _search_page(rows, limit: int) -> dict:
+    items = [{**_list_item(r), 'assunto': r.assunto, 'relevancia': r.relevancia} for r in rows[:limit]]
+    page = {'items': items}
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        page['next_cursor'] = _encode_search_cursor(last.relevancia, last.id)
+    return page
+
+
+@router.get("/busca", response_model=schemas.BuscaPage)
+def buscar_documentos(
+    q: str = Query(..., min_length=1, max_length=200),
+    cursor: str | None = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """Documentos whose e-mail (assunto/corpo) or fornecedor, CNPJ or numero_documento match `q`,
+    most relevant first. Accepts web-search syntax ("frase exata", -palavra, or) on Postgres.
+
+    Pass `next_cursor` back as `cursor` to get the next page.
+    """
+    stmt = _search_statement(db.get_bind().dialect.name, search.has_trgm(db), q, cursor, limit)
+    return _search_page(db.execute(stmt).all(), limit)
+
+
+def _anexo_out(a: models.Anexo) -> dict:
+    return {
+        'id': a.id,
+        'nome_arquivo': a.nome_arquivo,
+        'tipo': a.tipo,
+        'caminho_arquivo': a.caminho_arquivo,
+        'criado_em': a.criado_em,
+        'previews': {size: f'/documentos/anexos/{a.id}/preview?tamanho={size}' for size in PREVIEW_SIZES},
+    }
+
+
+def _serve_preview(request: Request, file_path: str, tamanho: str, formato: str) -> Response:
+    """Stream a cached preview with ETag/Last-Modified, answering 304 to conditional requests."""
+    if tamanho not in PREVIEW_SIZES or formato not in PREVIEW_FORMATS:
+        raise HTTPException(status_code=422, detail="tamanho/formato inválido")
+    if not file_path or not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    from app.services.preview import PREVIEW_SIZES as widths, render_preview
+    try:
+        path = render_preview(file_path, max_width=widths[tamanho], fmt=formato)
+    except Exception:
+        raise HTTPException(status_code=404, detail="Preview indisponível")
+
+    # cache file name = content hash + render params, so it is a strong validator
+    etag = '"' + os.path.splitext(os.path.basename(path))[0] + '"'
+    mtime = os.path.getmtime(path)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': formatdate(mtime, usegmt=True),
+        'Cache-Control': PREVIEW_CACHE_CONTROL,
+    }
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        if etag in [t.strip() for t in if_none_match.split(',')] or if_none_match.strip() == '*':
+            return Response(status_code=304, headers=headers)
+    elif request.headers.get('if-modified-since'):
+        try:
+            since = parsedate_to_datetime(request.headers['if-modified-since']).timestamp()
+            if int(mtime) <= since:
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+    return FileResponse(path, media_type=f'image/{formato}', headers=headers)
+
+
+def _anexo_path_statement(anexo_id: UUID):
+    return select(models.Anexo.caminho_arquivo).where(models.Anexo.id == anexo_id)
+
+
+def _thumbnail_path_statement(documento_id: UUID):
+    """Path of the document's first attachment."""
+    return (
+        select(models.Anexo.caminho_arquivo)
+        .join(models.DocumentoFinanceiro, models.DocumentoFinanceiro.email_id == models.Anexo.email_id)
+        .where(models.DocumentoFinanceiro.id == documento_id)
+        .order_by(models.Anexo.criado_em)
+        .limit(1)
+    )
+
+
+@router.get("/anexos/{anexo_id}/preview")
+def get_anexo_preview(anexo_id: UUID, request: Request, tamanho: str = 'medio', formato: str = 'png', db: Session = Depends(get_db)):
+    path = db.execute(_anexo_path_statement(anexo_id)).scalar()
+    if path is None:
+        raise HTTPException(status_code=404, detail="Anexo não encontrado")
+    return _serve_preview(request, path, tamanho, formato)
+
+
+@router.get("/{documento_id}/thumbnail")
+def get_documento_thumbnail(documento_id: UUID, request: Request, tamanho: str = 'thumb', formato: str = 'png', db: Session = Depends(get_db)):
+    """Preview of the document's first attachment (used by the inbox list)."""
+    path = db.execute(_thumbnail_path_statement(documento_id)).scalar()
+    if path is None:
+        raise HTTPException(status_code=404, detail="Documento sem anexos")
+    return _serve_preview(request, path, tamanho, formato)
+
+
+def _documento_statement(documento_id: UUID, *options):
+    D = models.DocumentoFinanceiro
+    return select(D).options(*options).where(D.id == documento_id)
+
+
+def _detail_statement(documento_id: UUID):
+    """Document with email and anexos in one SELECT, historicos in a second (selectin).
+
+    Joining both collections would return anexos x historicos rows.
+    """
+    D = models.DocumentoFinanceiro
+    return _documento_statement(
+        documento_id,
+        joinedload(D.email).joinedload(models.Email.anexos),
+        selectinload(D.historicos),
+    )
+
+
+def _confirm_statement(documento_id: UUID):
+    """Document and its sender, the documento row locked until the confirmation commits.
+
+    A second confirmation of the same documento waits here and then sees
+    FEITO, so the rollup and the supplier registry count it once.
+    """
+    D = models.DocumentoFinanceiro
+    return _documento_statement(documento_id, joinedload(D.email)).with_for_update(of=D)
+
+
+def _email_link_statement(documento_id: UUID):
+    D = models.DocumentoFinanceiro
+    return (
+        select(D.id, models.Email.link_email_original)
+        .outerjoin(models.Email, models.Email.id == D.email_id)
+        .where(D.id == documento_id)
+    )
+
+
+def _not_found(doc):
     if not doc:
         raise HTTPException(status_code=404, detail="Documento não encontrado")
+    return doc
+
+
+def _get_documento(db: Session, documento_id: UUID, *options) -> models.DocumentoFinanceiro:
+    return _not_found(db.execute(_documento_statement(documento_id, *options)).unique().scalars().first())
+
+
+def _detail_response(doc: models.DocumentoFinanceiro, anexos) -> Response:
+    # built from trusted ORM values: construct and serialize once instead of
+    # letting response_model validate the dict again
+    detail = schemas.DocumentoDetail.model_construct(
+        id=doc.id,
+        email_id=doc.email_id,
+        tipo=doc.tipo.value,
+        subtipo=doc.subtipo.value if doc.subtipo else None,
+        fornecedor=doc.fornecedor,
+        cnpj=doc.cnpj,
+        numero_documento=doc.numero_documento,
+        valor=float(doc.valor) if doc.valor is not None else None,
+        metadados=doc.metadados,
+        status=doc.status.value,
+        confirmado_em=doc.confirmado_em,
+        confirmado_por=doc.confirmado_por,
+        historicos=[
+            schemas.HistoricoOut.model_construct(id=h.id, evento=h.evento, usuario=h.usuario, data_hora=h.data_hora)
+            for h in doc.historicos
+        ],
+        anexos=[schemas.AnexoOut.model_construct(**_anexo_out(a)) for a in anexos],
+    )
+    return Response(content=detail.model_dump_json(), media_type='application/json')
+
+
+def _confirm(doc: models.DocumentoFinanceiro, usuario: str):
+    """Mark `doc` as FEITO (not committed: the caller commits it with the history event)."""
     if doc.status == models.DocumentStatus.FEITO:
         raise HTTPException(status_code=400, detail="Documento já está marcado como FEITO")
     doc.status = models.DocumentStatus.FEITO
@@ -72,15 +468,29 @@ def confirmar_documento(documento_id: str, usuario: str, db: Session = Depends(g
     except Exception:
         doc.confirmado_em = datetime.now(tz=timezone.utc)
     doc.confirmado_por = usuario
-    db.add(doc)
-    db.commit()
+
+
+@router.get("/{documento_id}", response_model=schemas.DocumentoDetail)
+def get_documento(documento_id: UUID, db: Session = Depends(get_db)):
+    """Document with its history and attachments, loaded in two SELECTs."""
+    doc = _not_found(db.execute(_detail_statement(documento_id)).unique().scalars().first())
+    # previews are served (and in lazy mode rendered) by the preview endpoints
+    return _detail_response(doc, doc.email.anexos if doc.email else [])
+
+@router.post("/{documento_id}/confirmar")
+def confirmar_documento(documento_id: UUID, usuario: str, db: Session = Depends(get_db)):
+    # the sender comes in the same SELECT: its domain is a key of the supplier registry
+    doc = _not_found(db.execute(_confirm_statement(documento_id)).unique().scalars().first())
+    before = rollup.snapshot(doc)
+    _confirm(doc, usuario)
+    change_feed.record(db, [doc.id], change_feed.CONFIRMADO)
+    rollup.apply(db, [(before, doc)])
+    supplier_registry.record(db, doc, doc.email.remetente if doc.email else None)
+    # log_event commits the status change together with its history, feed event, rollup and registry
     log_event(db, doc.id, "Marcar como FEITO", usuario)
     return {"status": "ok"}
 
 @router.get("/{documento_id}/email-original")
-def get_email_link(documento_id: str, db: Session = Depends(get_db)):
-    doc = db.query(models.DocumentoFinanceiro).filter(models.DocumentoFinanceiro.id == documento_id).first()
-    if not doc:
-        raise HTTPException(status_code=404, detail="Documento não encontrado")
-    email = db.query(models.Email).filter(models.Email.id == doc.email_id).first()
-    return {"link": email.link_email_original if email else None}
+def get_email_link(documento_id: UUID, db: Session = Depends(get_db)):
+    row = _not_found(db.execute(_email_link_statement(documento_id)).first())
+    return {"link": row.link_email_original}
@@ -0,0 +1,146 @@
+"""Async versions of the /documentos routes (DB_MODE=async).
+
+Same paths, statements and responses as app.api.documents, executed on an
+AsyncSession (asyncpg), so a slow query does not hold one of the threadpool's
+threads. Preview rendering is CPU-bound and still runs in the threadpool.
+"""
+from datetime import date, datetime
+from uuid import UUID
+
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from starlette.concurrency import run_in_threadpool
+
+from app import schemas
+from app.api import documents as sync
+from app.db.session import get_async_sessionmaker
+from app.services import change_feed, rollup, search, supplier_registry
+from app.services.history import log_event_async
+
+router = APIRouter()
+
+
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+
+async def _count_documentos(db, stmt, key: tuple) -> tuple:
+    hit = sync._cached_count(key)
+    if hit:
+        return hit
+    if not any(key) and db.get_bind().dialect.name == 'postgresql':
+        reltuples = (await db.execute(sync.RELTUPLES_SQL)).scalar()
+        if reltuples is not None and reltuples >= 0:
+            return sync._store_count(key, int(reltuples), True)
+    return sync._store_count(key, (await db.execute(sync._count_statement(stmt))).scalar(), False)
+
+
+@router.get("/", response_model=schemas.DocumentoPage)
+async def list_documentos(
+    tipo: str | None = None,
+    subtipo: str | None = None,
+    status: str | None = None,
+    fornecedor: str | None = None,
+    de: datetime | None = None,
+    ate: datetime | None = None,
+    transportadora: str | None = None,
+    ncm: str | None = None,
+    cnae: str | None = None,
+    cursor: str | None = None,
+    limit: int = Query(50, ge=1, le=500),
+    total: bool = False,
+    db=Depends(get_async_db),
+):
+    """Keyset-paginated list (newest first) with only the columns the inbox shows.
+
+    Pass `next_cursor` back as `cursor` to get the next page.
+    """
+    filters = (tipo, subtipo, status, fornecedor, de, ate, transportadora, ncm, cnae)
+    stmt = sync._list_statement(*filters)
+    page = {}
+    if total:
+        page['total'], page['total_estimado'] = await _count_documentos(db, stmt, filters)
+    rows = (await db.execute(sync._page_statement(stmt, cursor, limit))).all()
+    return {**sync._page(rows, limit), **page}
+
+
+@router.get("/resumo", response_model=schemas.Resumo)
+async def resumo_documentos(
+    periodo: str = 'dia',
+    agrupar: str | None = None,
+    tipo: str | None = None,
+    subtipo: str | None = None,
+    status: str | None = None,
+    fornecedor: str | None = None,
+    de: date | None = None,
+    ate: date | None = None,
+    db=Depends(get_async_db),
+):
+    """Number of documentos and sum of valor per period and dimensions, from the daily rollup."""
+    stmt, grupos = sync._summary_statement(db.get_bind().dialect.name, periodo, agrupar,
+                                           tipo, subtipo, status, fornecedor, de, ate)
+    return sync._summary((await db.execute(stmt)).all(), periodo, grupos)
+
+
+async def _has_trgm(db) -> bool:
+    bind = db.get_bind()
+    hit = search.cached_trgm(bind)
+    if hit is None:
+        hit = search.store_trgm(bind, (await db.execute(search.TRGM_SQL)).scalar())
+    return hit
+
+
+@router.get("/busca", response_model=schemas.BuscaPage)
+async def buscar_documentos(
+    q: str = Query(..., min_length=1, max_length=200),
+    cursor: str | None = None,
+    limit: int = Query(20, ge=1, le=100),
+    db=Depends(get_async_db),
+):
+    """Documentos matching `q` in the e-mail or the extracted fields, most relevant first."""
+    stmt = sync._search_statement(db.get_bind().dialect.name, await _has_trgm(db), q, cursor, limit)
+    return sync._search_page((await db.execute(stmt)).all(), limit)
+
+
+@router.get("/anexos/{anexo_id}/preview")
+async def get_anexo_preview(anexo_id: UUID, request: Request, tamanho: str = 'medio', formato: str = 'png', db=Depends(get_async_db)):
+    path = (await db.execute(sync._anexo_path_statement(anexo_id))).scalar()
+    if path is None:
+        raise HTTPException(status_code=404, detail="Anexo não encontrado")
+    return await run_in_threadpool(sync._serve_preview, request, path, tamanho, formato)
+
+
+@router.get("/{documento_id}/thumbnail")
+async def get_documento_thumbnail(documento_id: UUID, request: Request, tamanho: str = 'thumb', formato: str = 'png', db=Depends(get_async_db)):
+    """Preview of the document's first attachment (used by the inbox list)."""
+    path = (await db.execute(sync._thumbnail_path_statement(documento_id))).scalar()
+    if path is None:
+        raise HTTPException(status_code=404, detail="Documento sem anexos")
+    return await run_in_threadpool(sync._serve_preview, request, path, tamanho, formato)
+
+
+@router.get("/{documento_id}", response_model=schemas.DocumentoDetail)
+async def get_documento(documento_id: UUID, db=Depends(get_async_db)):
+    """Document with its history and attachments, loaded in two SELECTs."""
+    result = await db.execute(sync._detail_statement(documento_id))
+    doc = sync._not_found(result.unique().scalars().first())
+    return sync._detail_response(doc, doc.email.anexos if doc.email else [])
+
+
+@router.post("/{documento_id}/confirmar")
+async def confirmar_documento(documento_id: UUID, usuario: str, db=Depends(get_async_db)):
+    result = await db.execute(sync._confirm_statement(documento_id))
+    doc = sync._not_found(result.unique().scalars().first())
+    before = rollup.snapshot(doc)
+    sync._confirm(doc, usuario)
+    await change_feed.record_async(db, [doc.id], change_feed.CONFIRMADO)
+    await rollup.apply_async(db, [(before, doc)])
+    await supplier_registry.record_async(db, doc, doc.email.remetente if doc.email else None)
+    await log_event_async(db, doc.id, "Marcar como FEITO", usuario)
+    return {"status": "ok"}
+
+
+@router.get("/{documento_id}/email-original")
+async def get_email_link(documento_id: UUID, db=Depends(get_async_db)):
+    row = sync._not_found((await db.execute(sync._email_link_statement(documento_id))).first())
+    return {"link": row.link_email_original}
@@ -0,0 +1,83 @@
+"""GET /documentos/eventos: Server-Sent Events for the inbox (see services.change_feed).
+
+Each event is a documento created, reclassified or confirmed, with the same
+fields as a GET /documentos item:
+
+    id: 42
+    event: confirmado
+    data: {"id": "...", "tipo": "...", "status": "FEITO", ...}
+
+A client reconnecting with Last-Event-ID (EventSource does it by itself) or
+`?desde=<id>` first gets what it missed; when that is more than
+CHANGE_FEED_REPLAY_LIMIT events or already purged it gets a single
+`recarregar` event and should reload the list.
+"""
+import json
+
+from fastapi import APIRouter, Header, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.api.documents import _list_item
+from app.services import change_feed
+
+router = APIRouter()
+
+RECARREGAR = 'event: recarregar\ndata: {}\n\n'
+
+
+def _sse_message(row) -> str:
+    data = json.dumps(jsonable_encoder(_list_item(row)), ensure_ascii=False)
+    return f'id: {row.evento_id}\nevent: {row.evento}\ndata: {data}\n\n'
+
+
+FEED = change_feed.ChangeFeed(serialize=_sse_message)
+
+
+async def event_stream(feed: change_feed.ChangeFeed, desde: int | None, is_disconnected,
+                       heartbeat: float = change_feed.CHANGE_FEED_HEARTBEAT,
+                       replay_limit: int = change_feed.CHANGE_FEED_REPLAY_LIMIT):
+    """SSE messages for one client: the backlog after `desde`, then live events until it disconnects."""
+    await run_in_threadpool(feed.start)
+    # subscribe before reading the backlog, so nothing falls in between
+    sub = feed.subscribe()
+    try:
+        replayed = set()
+        if desde is not None:
+            backlog = await run_in_threadpool(feed.since, desde, replay_limit + 1)
+            oldest = await run_in_threadpool(feed.oldest_id)
+            if len(backlog) > replay_limit or (oldest is not None and desde < oldest - 1):
+                yield RECARREGAR
+                return
+            for event_id, message in backlog:
+                replayed.add(event_id)
+                yield message
+        # the comment line makes proxies and the browser open the stream now
+        yield ': ok\n\n'
+        while True:
+            events = await sub.get(heartbeat)
+            if events is None:
+                return  # fell behind: the client reconnects with Last-Event-ID
+            if not events:
+                if await is_disconnected():
+                    return
+                yield ': ping\n\n'
+                continue
+            for event_id, message in events:
+                if event_id not in replayed:
+                    yield message
+    finally:
+        feed.unsubscribe(sub)
+
+
+@router.get("/eventos")
+async def documentos_eventos(request: Request, desde: int | None = None,
+                             last_event_id: int | None = Header(None, alias='Last-Event-ID')):
+    """Live feed of created/reclassified/confirmed documentos (text/event-stream)."""
+    after = last_event_id if last_event_id is not None else desde
+    return StreamingResponse(
+        event_stream(FEED, after, request.is_disconnected),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
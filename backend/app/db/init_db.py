@@ -1,6 +1,80 @@
+"""Schema setup: `python -m app.db.init_db` brings the database to the latest revision.
+
+docker-compose runs it as the `migrate` step before the API and the
+scheduler start; the API also runs it at startup unless
+MIGRATE_ON_STARTUP=0.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import inspect, text
+
 from app.db.session import engine
 from app.db import models
 
+ALEMBIC_INI = os.path.join(os.path.dirname(__file__), '..', '..', 'alembic.ini')
+BASELINE_REVISION = '0001_baseline'
+MIGRATE_ON_STARTUP = os.environ.get('MIGRATE_ON_STARTUP', '1') != '0'
+# pg_advisory_lock key shared by every process that migrates
+MIGRATION_LOCK_KEY = 7_310_001
+MIGRATION_LOCK_POLL = 0.5  # seconds between tries while another process migrates
+
+
+@contextmanager
+def migration_lock(bind):
+    """Serialize migrations across processes (Postgres advisory lock; a no-op elsewhere)."""
+    if bind.dialect.name != 'postgresql':
+        yield
+        return
+    # own connection: the migration connection must stay outside any transaction.
+    # Polled, not a blocking pg_advisory_lock: CREATE INDEX CONCURRENTLY in the
+    # holder's migrations waits for every running statement, a lock wait included
+    with bind.connect() as conn:
+        while not conn.execute(text('SELECT pg_try_advisory_lock(:k)'), {'k': MIGRATION_LOCK_KEY}).scalar():
+            conn.commit()
+            time.sleep(MIGRATION_LOCK_POLL)
+        conn.commit()
+        try:
+            yield
+        finally:
+            conn.execute(text('SELECT pg_advisory_unlock(:k)'), {'k': MIGRATION_LOCK_KEY})
+            conn.commit()
+
+
+def create_tables(bind=None):
+    """Bring the schema to the latest Alembic revision.
+
+    Databases created by the old `create_all` (tables present, no
+    alembic_version) are stamped at the baseline first. Concurrent callers
+    (several API workers starting together) wait for each other on
+    migration_lock, so each revision runs once. Without alembic or its
+    config (e.g. a bare test environment) fall back to create_all.
+    `bind` defaults to the application engine.
+    """
+    bind = bind or engine
+    try:
+        from alembic import command
+        from alembic.config import Config
+    except ImportError:
+        models.Base.metadata.create_all(bind=bind)
+        return
+    if not os.path.exists(ALEMBIC_INI):
+        models.Base.metadata.create_all(bind=bind)
+        return
+
+    cfg = Config(ALEMBIC_INI)
+    cfg.attributes['configure_logger'] = False
+    with migration_lock(bind):
+        tables = set(inspect(bind).get_table_names())
+        # alembic must own the transactions on this connection: the index
+        # migration steps out of them to build indexes CONCURRENTLY
+        with bind.connect() as conn:
+            cfg.attributes['connection'] = conn
+            if 'emails' in tables and 'alembic_version' not in tables:
+                command.stamp(cfg, BASELINE_REVISION)
+            command.upgrade(cfg, 'head')
+
 
-def create_tables():
-    models.Base.metadata.create_all(bind=engine)
+if __name__ == '__main__':
+    create_tables()
@@ -0,0 +1,86 @@
+"""baseline: schema created by create_all before migrations existed
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2024-06-01 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '0001_baseline'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+document_type = sa.Enum('DOCUMENTO_FORNECEDOR', 'ENTRADA_INTERNA', 'OUTROS', name='documenttype')
+document_status = sa.Enum('RECEBIDO', 'CLASSIFICADO', 'PENDENTE', 'FEITO', 'REVISAO', name='documentstatus')
+document_subtipo = sa.Enum('REQUISICAO_COMPRA', 'NF_PRODUTO', 'NF_SERVICO', 'NF_FRETE', 'NF_MATERIAL_INTERNO', name='documentsubtipo')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'emails',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('message_id', sa.String(), nullable=False),
+        sa.Column('remetente', sa.String(), nullable=False),
+        sa.Column('assunto', sa.String(), nullable=True),
+        sa.Column('corpo', sa.Text(), nullable=True),
+        sa.Column('data_hora_email', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('link_email_original', sa.String(), nullable=True),
+        sa.Column('criado_em', sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index('ix_emails_message_id', 'emails', ['message_id'], unique=True)
+
+    op.create_table(
+        'documentos_financeiros',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('email_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('emails.id'), nullable=False),
+        sa.Column('tipo', document_type, nullable=False),
+        sa.Column('fornecedor', sa.String(), nullable=True),
+        sa.Column('cnpj', sa.String(), nullable=True),
+        sa.Column('numero_documento', sa.String(), nullable=True),
+        sa.Column('valor', sa.Numeric(12, 2), nullable=True),
+        sa.Column('status', document_status, nullable=True),
+        sa.Column('subtipo', document_subtipo, nullable=True),
+        sa.Column('metadados', sa.String(), nullable=True),
+        sa.Column('confirmado_em', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('confirmado_por', sa.String(), nullable=True),
+    )
+
+    op.create_table(
+        'anexos',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('email_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('emails.id'), nullable=False),
+        sa.Column('nome_arquivo', sa.String(), nullable=False),
+        sa.Column('tipo', sa.String(), nullable=False),
+        sa.Column('caminho_arquivo', sa.String(), nullable=False),
+        sa.Column('preview_imagem', sa.Text(), nullable=True),
+        sa.Column('criado_em', sa.DateTime(timezone=True), nullable=True),
+    )
+
+    op.create_table(
+        'historicos',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('documento_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('documentos_financeiros.id'), nullable=False),
+        sa.Column('evento', sa.String(), nullable=False),
+        sa.Column('usuario', sa.String(), nullable=True),
+        sa.Column('data_hora', sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('historicos')
+    op.drop_table('anexos')
+    op.drop_table('documentos_financeiros')
+    op.drop_index('ix_emails_message_id', table_name='emails')
+    op.drop_table('emails')
+    document_subtipo.drop(op.get_bind(), checkfirst=True)
+    document_status.drop(op.get_bind(), checkfirst=True)
+    document_type.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,50 @@
+"""sync_cursors table and documentos_financeiros.criado_em
+
+Revision ID: 0002_sync_cursors_criado_em
+Revises: 0001_baseline
+Create Date: 2024-06-01 00:00:01
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '0002_sync_cursors_criado_em'
+down_revision: Union[str, Sequence[str], None] = '0001_baseline'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # databases created by create_all may already have these (offline --sql: assume not)
+    inspector = None if op.get_context().as_sql else sa.inspect(op.get_bind())
+    if inspector is None or not inspector.has_table('sync_cursors'):
+        op.create_table(
+            'sync_cursors',
+            sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column('mailbox', sa.String(), nullable=False),
+            sa.Column('folder', sa.String(), nullable=False),
+            sa.Column('cursor', sa.Text(), nullable=True),
+            sa.Column('atualizado_em', sa.DateTime(timezone=True), nullable=True),
+            sa.UniqueConstraint('mailbox', 'folder'),
+        )
+
+    columns = {c['name'] for c in inspector.get_columns('documentos_financeiros')} if inspector else set()
+    if 'criado_em' not in columns:
+        op.add_column('documentos_financeiros', sa.Column('criado_em', sa.DateTime(timezone=True), nullable=True))
+        # backfill from the e-mail ingestion time
+        op.execute(
+            "UPDATE documentos_financeiros d SET criado_em = COALESCE(e.criado_em, now()) "
+            "FROM emails e WHERE e.id = d.email_id"
+        )
+        op.alter_column('documentos_financeiros', 'criado_em', nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('documentos_financeiros', 'criado_em')
+    op.drop_table('sync_cursors')
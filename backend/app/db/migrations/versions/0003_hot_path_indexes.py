@@ -0,0 +1,53 @@
+"""indexes for the hot document/history lookups
+
+- documentos: keyset list (criado_em, id), filtered by status or tipo, and a
+  partial index for the PENDENTE/REVISAO review queues
+- documentos.email_id / anexos.email_id for the detail and email-link joins
+- historicos (documento_id, data_hora) for list_history
+
+Indexes are built CONCURRENTLY so the migration does not lock large tables.
+
+Revision ID: 0003_hot_path_indexes
+Revises: 0002_sync_cursors_criado_em
+Create Date: 2024-06-01 00:00:02
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0003_hot_path_indexes'
+down_revision: Union[str, Sequence[str], None] = '0002_sync_cursors_criado_em'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ('ix_documentos_criado_em_id', 'documentos_financeiros', ['criado_em', 'id'], None),
+    ('ix_documentos_status_criado_em', 'documentos_financeiros', ['status', 'criado_em', 'id'], None),
+    ('ix_documentos_tipo_criado_em', 'documentos_financeiros', ['tipo', 'criado_em', 'id'], None),
+    ('ix_documentos_fila_revisao', 'documentos_financeiros', ['criado_em', 'id'], "status IN ('PENDENTE', 'REVISAO')"),
+    ('ix_documentos_email_id', 'documentos_financeiros', ['email_id'], None),
+    ('ix_anexos_email_id', 'anexos', ['email_id'], None),
+    ('ix_historicos_documento_data_hora', 'historicos', ['documento_id', 'data_hora'], None),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(
+                name, table, columns,
+                postgresql_where=sa.text(where) if where else None,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
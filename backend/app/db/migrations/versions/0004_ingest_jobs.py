@@ -0,0 +1,58 @@
+"""durable ingestion queue: ingest_jobs and ingest_dead_letters
+
+Revision ID: 0004_ingest_jobs
+Revises: 0003_hot_path_indexes
+Create Date: 2024-06-01 00:00:03
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '0004_ingest_jobs'
+down_revision: Union[str, Sequence[str], None] = '0003_hot_path_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'ingest_jobs',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('message_id', sa.String(), nullable=False, unique=True),
+        sa.Column('mailbox', sa.String(), nullable=False),
+        sa.Column('etapa', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('tentativas', sa.Integer(), nullable=False),
+        sa.Column('proxima_tentativa_em', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column('bloqueado_por', sa.String(), nullable=True),
+        sa.Column('bloqueado_em', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('ultimo_erro', sa.Text(), nullable=True),
+        sa.Column('criado_em', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index('ix_ingest_jobs_fila', 'ingest_jobs', ['proxima_tentativa_em'], postgresql_where=sa.text("status = 'PENDENTE'"))
+    op.create_index('ix_ingest_jobs_lease', 'ingest_jobs', ['bloqueado_em'], postgresql_where=sa.text("status = 'PROCESSANDO'"))
+    op.create_table(
+        'ingest_dead_letters',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('message_id', sa.String(), nullable=False, unique=True),
+        sa.Column('mailbox', sa.String(), nullable=False),
+        sa.Column('etapa', sa.String(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('tentativas', sa.Integer(), nullable=False),
+        sa.Column('erro', sa.Text(), nullable=True),
+        sa.Column('criado_em', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('ingest_dead_letters')
+    op.drop_index('ix_ingest_jobs_lease', table_name='ingest_jobs')
+    op.drop_index('ix_ingest_jobs_fila', table_name='ingest_jobs')
+    op.drop_table('ingest_jobs')
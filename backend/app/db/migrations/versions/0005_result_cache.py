@@ -0,0 +1,34 @@
+"""shared tier of the classification/extraction result cache
+
+Revision ID: 0005_result_cache
+Revises: 0004_ingest_jobs
+Create Date: 2024-06-01 00:00:04
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0005_result_cache'
+down_revision: Union[str, Sequence[str], None] = '0004_ingest_jobs'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'result_cache',
+        sa.Column('chave', sa.String(64), primary_key=True),
+        sa.Column('tipo', sa.String(), nullable=False),
+        sa.Column('versao', sa.String(), nullable=False),
+        sa.Column('resultado', sa.Text(), nullable=False),
+        sa.Column('criado_em', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('result_cache')
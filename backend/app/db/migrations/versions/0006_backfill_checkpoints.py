@@ -0,0 +1,37 @@
+"""checkpoints of the reclassification backfill
+
+Revision ID: 0006_backfill_checkpoints
+Revises: 0005_result_cache
+Create Date: 2024-06-01 00:00:05
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '0006_backfill_checkpoints'
+down_revision: Union[str, Sequence[str], None] = '0005_result_cache'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'backfill_checkpoints',
+        sa.Column('nome', sa.String(), primary_key=True),
+        sa.Column('ultimo_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('processados', sa.Integer(), nullable=False),
+        sa.Column('alterados', sa.Integer(), nullable=False),
+        sa.Column('iniciado_em', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column('atualizado_em', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('concluido_em', sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('backfill_checkpoints')
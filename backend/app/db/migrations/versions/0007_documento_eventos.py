@@ -0,0 +1,35 @@
+"""change feed of documentos
+
+Revision ID: 0007_documento_eventos
+Revises: 0006_backfill_checkpoints
+Create Date: 2024-06-01 00:00:06
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '0007_documento_eventos'
+down_revision: Union[str, Sequence[str], None] = '0006_backfill_checkpoints'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'documento_eventos',
+        sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column('documento_id', postgresql.UUID(as_uuid=True),
+                  sa.ForeignKey('documentos_financeiros.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('tipo', sa.String(), nullable=False),
+        sa.Column('criado_em', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('documento_eventos')
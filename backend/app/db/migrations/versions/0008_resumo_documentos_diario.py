@@ -0,0 +1,53 @@
+"""daily rollup of documentos
+
+Revision ID: 0008_resumo_documentos_diario
+Revises: 0007_documento_eventos
+Create Date: 2024-06-01 00:00:07
+
+The table is filled from the existing documentos (same keys as
+app.services.rollup: the day of criado_em in LOCAL_TZ), so the first
+confirmation of an old documento finds its row to decrement.
+`python -m app.scripts.rebuild_rollups` recomputes it later if needed.
+"""
+import os
+from typing import Sequence, Union
+from zoneinfo import ZoneInfo
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0008_resumo_documentos_diario'
+down_revision: Union[str, Sequence[str], None] = '0007_documento_eventos'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'resumo_documentos_diario',
+        sa.Column('dia', sa.Date(), primary_key=True),
+        sa.Column('tipo', sa.String(), primary_key=True),
+        sa.Column('subtipo', sa.String(), primary_key=True),
+        sa.Column('status', sa.String(), primary_key=True),
+        sa.Column('fornecedor', sa.String(), primary_key=True),
+        sa.Column('quantidade', sa.BigInteger(), nullable=False),
+        sa.Column('valor_total', sa.Numeric(16, 2), nullable=False),
+    )
+    tz = os.environ.get('LOCAL_TZ', 'UTC')
+    try:
+        ZoneInfo(tz)
+    except Exception:
+        tz = 'UTC'  # rollup.day falls back the same way
+    op.execute(sa.text(
+        "INSERT INTO resumo_documentos_diario (dia, tipo, subtipo, status, fornecedor, quantidade, valor_total) "
+        "SELECT (criado_em AT TIME ZONE :tz)::date, tipo::text, COALESCE(subtipo::text, ''), "
+        "COALESCE(status::text, ''), COALESCE(fornecedor, ''), count(*), COALESCE(sum(valor), 0) "
+        "FROM documentos_financeiros GROUP BY 1, 2, 3, 4, 5"
+    ).bindparams(tz=tz))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('resumo_documentos_diario')
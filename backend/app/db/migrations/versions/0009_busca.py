@@ -0,0 +1,91 @@
+"""full-text and trigram search
+
+- `pt_busca` text search configuration: Portuguese stemming, plus unaccent
+  when the extension is available
+- emails.busca (assunto weight A, corpo B) and documentos_financeiros.busca
+  (fornecedor, numero_documento, cnpj) as generated tsvector columns, so every
+  INSERT/UPDATE keeps them current, with GIN indexes
+- with pg_trgm, GIN trigram indexes on fornecedor, numero_documento and the
+  digits of cnpj for fuzzy and substring matches
+
+Adding a stored generated column rewrites the table; the indexes are then
+built CONCURRENTLY. Postgres only: other databases keep the ILIKE fallback of
+services.search.
+
+Revision ID: 0009_busca
+Revises: 0008_resumo_documentos_diario
+Create Date: 2024-06-01 00:00:08
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0009_busca'
+down_revision: Union[str, Sequence[str], None] = '0008_resumo_documentos_diario'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+EMAILS_BUSCA = (
+    "setweight(to_tsvector('pt_busca', coalesce(assunto, '')), 'A') || "
+    "setweight(to_tsvector('pt_busca', coalesce(corpo, '')), 'B')"
+)
+DOCUMENTOS_BUSCA = (
+    "to_tsvector('pt_busca', coalesce(fornecedor, '') || ' ' || coalesce(numero_documento, '') || ' ' || "
+    "coalesce(cnpj, '') || ' ' || regexp_replace(coalesce(cnpj, ''), '[^0-9]', '', 'g'))"
+)
+TRGM_INDEXES = [
+    ('ix_documentos_fornecedor_trgm', 'fornecedor'),
+    ('ix_documentos_numero_trgm', 'numero_documento'),
+    ('ix_documentos_cnpj_trgm', "(regexp_replace(coalesce(cnpj, ''), '[^0-9]', '', 'g'))"),
+]
+
+
+def _available(bind) -> set:
+    if op.get_context().as_sql:
+        # offline --sql: no database to ask; the script assumes both are installable
+        return {'pg_trgm', 'unaccent'}
+    rows = bind.execute(sa.text(
+        "SELECT name FROM pg_available_extensions WHERE name IN ('unaccent', 'pg_trgm')"
+    ))
+    return {r[0] for r in rows}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    extensions = _available(bind)
+    for name in sorted(extensions):
+        op.execute(f'CREATE EXTENSION IF NOT EXISTS {name}')
+    op.execute('CREATE TEXT SEARCH CONFIGURATION pt_busca (COPY = pg_catalog.portuguese)')
+    if 'unaccent' in extensions:
+        op.execute('ALTER TEXT SEARCH CONFIGURATION pt_busca '
+                   'ALTER MAPPING FOR hword, hword_part, word WITH unaccent, portuguese_stem')
+    op.execute(f'ALTER TABLE emails ADD COLUMN busca tsvector GENERATED ALWAYS AS ({EMAILS_BUSCA}) STORED')
+    op.execute(f'ALTER TABLE documentos_financeiros ADD COLUMN busca tsvector GENERATED ALWAYS AS ({DOCUMENTOS_BUSCA}) STORED')
+    with op.get_context().autocommit_block():
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_emails_busca ON emails USING gin (busca)')
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_documentos_busca ON documentos_financeiros USING gin (busca)')
+        if 'pg_trgm' in extensions:
+            for name, column in TRGM_INDEXES:
+                op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} '
+                           f'ON documentos_financeiros USING gin ({column} gin_trgm_ops)')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    with op.get_context().autocommit_block():
+        for name, _ in reversed(TRGM_INDEXES):
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_documentos_busca')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_emails_busca')
+    op.execute('ALTER TABLE documentos_financeiros DROP COLUMN IF EXISTS busca')
+    op.execute('ALTER TABLE emails DROP COLUMN IF EXISTS busca')
+    op.execute('DROP TEXT SEARCH CONFIGURATION IF EXISTS pt_busca')
@@ -0,0 +1,114 @@
+"""metadados as JSONB, indexed, and the itens line-item table
+
+- documentos_financeiros.metadados: json.dumps() text -> jsonb (Postgres;
+  other databases keep the text, which the JSON type reads as before)
+- GIN (jsonb_path_ops) index for containment (`metadados @> '{...}'`) and
+  expression indexes on the keys the list filters by (transportadora, ncm,
+  cnae), with criado_em/id so a filtered page is read in order
+- itens: one row per entry of metadados['itens'] (descricao, quantidade,
+  valor, ncm), filled from the documentos already stored
+
+Changing the column type rewrites the table; the indexes are then built
+CONCURRENTLY.
+
+Revision ID: 0010_metadados_jsonb
+Revises: 0009_busca
+Create Date: 2024-06-01 00:00:09
+
+"""
+import json
+from decimal import Decimal, InvalidOperation
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '0010_metadados_jsonb'
+down_revision: Union[str, Sequence[str], None] = '0009_busca'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+KEY_INDEXES = [
+    ('ix_documentos_transportadora', 'transportadora'),
+    ('ix_documentos_ncm', 'ncm'),
+    ('ix_documentos_cnae', 'cnae'),
+]
+
+NUMBER = "'^-?[0-9]+(\\.[0-9]+)?$'"
+FILL_ITENS_PG = f"""
+INSERT INTO itens (documento_id, posicao, descricao, quantidade, valor, ncm)
+SELECT d.id, i.posicao, i.item->>'descricao',
+       CASE WHEN i.item->>'quantidade' ~ {NUMBER} THEN (i.item->>'quantidade')::numeric END,
+       CASE WHEN i.item->>'valor' ~ {NUMBER} THEN (i.item->>'valor')::numeric END,
+       i.item->>'ncm'
+FROM documentos_financeiros d
+CROSS JOIN LATERAL jsonb_array_elements(d.metadados->'itens') WITH ORDINALITY AS i(item, posicao)
+WHERE jsonb_typeof(d.metadados->'itens') = 'array' AND jsonb_typeof(i.item) = 'object'
+"""
+
+
+def _number(value):
+    try:
+        return Decimal(str(value)) if value is not None else None
+    except InvalidOperation:
+        return None
+
+
+def _fill_itens(bind):
+    rows = bind.execute(sa.text(
+        "SELECT id, metadados FROM documentos_financeiros WHERE metadados LIKE '%\"itens\"%'"
+    ))
+    itens = []
+    for doc_id, metadados in rows:
+        for posicao, item in enumerate(json.loads(metadados).get('itens') or [], start=1):
+            if isinstance(item, dict):
+                itens.append({'documento_id': doc_id, 'posicao': posicao, 'descricao': item.get('descricao'),
+                              'quantidade': _number(item.get('quantidade')), 'valor': _number(item.get('valor')),
+                              'ncm': item.get('ncm')})
+    if itens:
+        bind.execute(sa.text(
+            'INSERT INTO itens (documento_id, posicao, descricao, quantidade, valor, ncm) '
+            'VALUES (:documento_id, :posicao, :descricao, :quantidade, :valor, :ncm)'
+        ), itens)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    op.create_table(
+        'itens',
+        sa.Column('documento_id', postgresql.UUID(as_uuid=True),
+                  sa.ForeignKey('documentos_financeiros.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('posicao', sa.Integer(), primary_key=True),
+        sa.Column('descricao', sa.Text(), nullable=True),
+        sa.Column('quantidade', sa.Numeric(14, 4), nullable=True),
+        sa.Column('valor', sa.Numeric(12, 2), nullable=True),
+        sa.Column('ncm', sa.String(), nullable=True),
+    )
+    op.create_index('ix_itens_ncm', 'itens', ['ncm'])
+    if bind.dialect.name != 'postgresql':
+        _fill_itens(bind)
+        return
+    op.execute("ALTER TABLE documentos_financeiros ALTER COLUMN metadados TYPE jsonb "
+               "USING NULLIF(metadados, '')::jsonb")
+    op.execute(FILL_ITENS_PG)
+    with op.get_context().autocommit_block():
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_documentos_metadados '
+                   'ON documentos_financeiros USING gin (metadados jsonb_path_ops)')
+        for name, key in KEY_INDEXES:
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} '
+                       f"ON documentos_financeiros ((metadados->>'{key}'), criado_em, id)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, _ in reversed(KEY_INDEXES):
+                op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_documentos_metadados')
+        op.execute('ALTER TABLE documentos_financeiros ALTER COLUMN metadados TYPE varchar USING metadados::text')
+    op.drop_table('itens')
@@ -0,0 +1,36 @@
+"""supplier registry: confirmed subtipos per cnpj and sender domain
+
+Revision ID: 0011_registro_fornecedores
+Revises: 0010_metadados_jsonb
+Create Date: 2024-06-01 00:00:10
+
+The table starts empty: fill it with `python -m app.scripts.rebuild_supplier_registry`.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0011_registro_fornecedores'
+down_revision: Union[str, Sequence[str], None] = '0010_metadados_jsonb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'registro_fornecedores',
+        sa.Column('tipo_chave', sa.String(), primary_key=True),
+        sa.Column('chave', sa.String(), primary_key=True),
+        sa.Column('subtipo', sa.String(), primary_key=True),
+        sa.Column('quantidade', sa.BigInteger(), nullable=False),
+        sa.Column('fornecedor', sa.String(), nullable=True),
+        sa.Column('atualizado_em', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('registro_fornecedores')
@@ -0,0 +1,48 @@
+"""clear legacy base64 previews from anexos.preview_imagem
+
+Before previews were served as cached image files, preview_imagem held the
+base64 PNG itself; it now holds the path of the rendered preview, which only
+marks the anexo as rendered (the API renders or reuses the cache by content
+hash). The old values are cleared in batches: the preview endpoints render
+on first request, or reuse the cache when the same file was already
+rendered.
+
+Revision ID: 0012_limpa_previews_base64
+Revises: 0011_registro_fornecedores
+Create Date: 2024-06-01 00:00:11
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0012_limpa_previews_base64'
+down_revision: Union[str, Sequence[str], None] = '0011_registro_fornecedores'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH = 1000
+# every base64-encoded PNG starts with the encoded signature \x89PNG\r\n\x1a\n
+LEGACY = "preview_imagem LIKE 'iVBORw0KGgo%'"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_context().as_sql:
+        op.execute(f'UPDATE anexos SET preview_imagem = NULL WHERE {LEGACY}')
+        return
+    bind = op.get_bind()
+    # each batch commits on its own, so ingestion is not blocked behind one long UPDATE
+    with op.get_context().autocommit_block():
+        while bind.execute(sa.text(
+            f'UPDATE anexos SET preview_imagem = NULL WHERE id IN (SELECT id FROM anexos WHERE {LEGACY} LIMIT {BATCH})'
+        )).rowcount:
+            pass
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # the base64 images are not restored; the preview endpoints render them again
+    pass
@@ -3,15 +3,23 @@ import uuid
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 from sqlalchemy import (
+    BigInteger,
     Column,
+    Date,
+    Integer,
+    JSON,
     String,
     Text,
     DateTime,
     ForeignKey,
     Enum,
     Numeric,
+    UniqueConstraint,
+    Index,
+    func,
+    text,
 )
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -56,6 +64,14 @@ class Email(Base):
 
 class DocumentoFinanceiro(Base):
     __tablename__ = "documentos_financeiros"
+    # access paths of the list/queue/detail endpoints (migration 0003_hot_path_indexes)
+    __table_args__ = (
+        Index("ix_documentos_criado_em_id", "criado_em", "id"),
+        Index("ix_documentos_status_criado_em", "status", "criado_em", "id"),
+        Index("ix_documentos_tipo_criado_em", "tipo", "criado_em", "id"),
+        Index("ix_documentos_fila_revisao", "criado_em", "id", postgresql_where=text("status IN ('PENDENTE', 'REVISAO')")),
+        Index("ix_documentos_email_id", "email_id"),
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     email_id = Column(UUID(as_uuid=True), ForeignKey("emails.id"), nullable=False)
     tipo = Column(Enum(DocumentType), nullable=False)
@@ -65,27 +81,47 @@ class DocumentoFinanceiro(Base):
     valor = Column(Numeric(12, 2), nullable=True)
     status = Column(Enum(DocumentStatus), default=DocumentStatus.RECEBIDO)
     subtipo = Column(Enum(DocumentSubtipo), nullable=True)
-    metadados = Column(String, nullable=True)  # JSON serialized string for extra extraction
+    # extra extracted fields; JSONB on Postgres, indexed by migration 0010_metadados_jsonb
+    metadados = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)
     confirmado_em = Column(DateTime(timezone=True), nullable=True)
     confirmado_por = Column(String, nullable=True)
+    criado_em = Column(DateTime(timezone=True), default=now_utc, nullable=False)  # keyset sort key (with id)
 
     email = relationship("Email", back_populates="documentos")
-    historicos = relationship("Historico", back_populates="documento")
+    historicos = relationship("Historico", back_populates="documento", order_by="Historico.data_hora.desc()")
+    itens = relationship("ItemDocumento", order_by="ItemDocumento.posicao", passive_deletes=True)
+
+class ItemDocumento(Base):
+    """Line item of a documento (NF_PRODUTO), one row per entry of metadados['itens'].
+
+    Written together with metadados by the ingestion and the backfill, so
+    items can be filtered and aggregated without reading the JSON.
+    """
+    __tablename__ = "itens"
+    __table_args__ = (Index("ix_itens_ncm", "ncm"),)
+    documento_id = Column(UUID(as_uuid=True), ForeignKey("documentos_financeiros.id", ondelete="CASCADE"), primary_key=True)
+    posicao = Column(Integer, primary_key=True)  # order in the documento, from 1
+    descricao = Column(Text, nullable=True)
+    quantidade = Column(Numeric(14, 4), nullable=True)
+    valor = Column(Numeric(12, 2), nullable=True)
+    ncm = Column(String, nullable=True)
 
 class Anexo(Base):
     __tablename__ = "anexos"
+    __table_args__ = (Index("ix_anexos_email_id", "email_id"),)
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     email_id = Column(UUID(as_uuid=True), ForeignKey("emails.id"), nullable=False)
     nome_arquivo = Column(String, nullable=False)
     tipo = Column(String, nullable=False)
     caminho_arquivo = Column(String, nullable=False)
-    preview_imagem = Column(Text, nullable=True)  # base64 or path
+    preview_imagem = Column(Text, nullable=True)  # path of the rendered preview: marks the anexo as rendered (0012 cleared base64 values)
     criado_em = Column(DateTime(timezone=True), default=now_utc)
 
     email = relationship("Email", back_populates="anexos")
 
 class Historico(Base):
     __tablename__ = "historicos"
+    __table_args__ = (Index("ix_historicos_documento_data_hora", "documento_id", "data_hora"),)
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     documento_id = Column(UUID(as_uuid=True), ForeignKey("documentos_financeiros.id"), nullable=False)
     evento = Column(String, nullable=False)
@@ -93,3 +129,120 @@ class Historico(Base):
     data_hora = Column(DateTime(timezone=True), default=now_utc)
 
     documento = relationship("DocumentoFinanceiro", back_populates="historicos")
+
+class SyncCursor(Base):
+    """Incremental sync position (Graph nextLink/deltaLink) per mailbox and folder."""
+    __tablename__ = "sync_cursors"
+    __table_args__ = (UniqueConstraint("mailbox", "folder"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    mailbox = Column(String, nullable=False)
+    folder = Column(String, nullable=False)
+    cursor = Column(Text, nullable=True)
+    atualizado_em = Column(DateTime(timezone=True), default=now_utc, onupdate=now_utc)
+
+class IngestJob(Base):
+    """One message waiting in the durable ingestion queue (see services.ingest_queue).
+
+    `etapa` is the next stage to run and `payload` the message as left by the
+    previous stage, so a job resumes where it stopped. The row is deleted in
+    the same transaction that stores the e-mail and its documento.
+    """
+    __tablename__ = "ingest_jobs"
+    __table_args__ = (
+        Index("ix_ingest_jobs_fila", "proxima_tentativa_em", postgresql_where=text("status = 'PENDENTE'")),
+        Index("ix_ingest_jobs_lease", "bloqueado_em", postgresql_where=text("status = 'PROCESSANDO'")),
+    )
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    message_id = Column(String, unique=True, nullable=False)
+    mailbox = Column(String, nullable=False)
+    etapa = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="PENDENTE")  # PENDENTE | PROCESSANDO
+    payload = Column(Text, nullable=False)  # JSON
+    tentativas = Column(Integer, nullable=False, default=0)
+    proxima_tentativa_em = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    bloqueado_por = Column(String, nullable=True)  # worker holding the lease
+    bloqueado_em = Column(DateTime(timezone=True), nullable=True)
+    ultimo_erro = Column(Text, nullable=True)
+    criado_em = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class IngestDeadLetter(Base):
+    """Jobs that exhausted their retries; kept for inspection and manual requeue."""
+    __tablename__ = "ingest_dead_letters"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    message_id = Column(String, unique=True, nullable=False)
+    mailbox = Column(String, nullable=False)
+    etapa = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    tentativas = Column(Integer, nullable=False)
+    erro = Column(Text, nullable=True)
+    criado_em = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class ResultCacheEntry(Base):
+    """Shared tier of the classification/extraction cache (see services.result_cache).
+
+    `chave` already hashes `versao`, so entries of old rules are never read;
+    `versao` is kept to purge them.
+    """
+    __tablename__ = "result_cache"
+    chave = Column(String(64), primary_key=True)
+    tipo = Column(String, nullable=False)  # classificacao | extracao
+    versao = Column(String, nullable=False)
+    resultado = Column(Text, nullable=False)  # JSON
+    criado_em = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class BackfillCheckpoint(Base):
+    """Progress of a reclassification backfill run (see services.backfill).
+
+    Documentos are visited in id order; `ultimo_id` is saved in the same
+    transaction as each chunk's updates, so a rerun resumes after it.
+    """
+    __tablename__ = "backfill_checkpoints"
+    nome = Column(String, primary_key=True)
+    ultimo_id = Column(UUID(as_uuid=True), nullable=True)
+    processados = Column(Integer, nullable=False, default=0)
+    alterados = Column(Integer, nullable=False, default=0)
+    iniciado_em = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    atualizado_em = Column(DateTime(timezone=True), nullable=True)
+    concluido_em = Column(DateTime(timezone=True), nullable=True)
+
+class DocumentoEvento(Base):
+    """Change feed of documentos (see services.change_feed).
+
+    One row per documento created, reclassified or confirmed, written in the
+    same transaction as the change; `id` orders the feed and is the SSE event id.
+    """
+    __tablename__ = "documento_eventos"
+    __table_args__ = {"sqlite_autoincrement": True}  # ids are never reused after a purge
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    documento_id = Column(UUID(as_uuid=True), ForeignKey("documentos_financeiros.id", ondelete="CASCADE"), nullable=False)
+    tipo = Column(String, nullable=False)  # criado | classificado | confirmado
+    criado_em = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class ResumoDiario(Base):
+    """Daily rollup of documentos for GET /documentos/resumo (see services.rollup).
+
+    Kept up to date by the writers, in the same transaction as each change;
+    NULL subtipo/status/fornecedor are stored as ''.
+    """
+    __tablename__ = "resumo_documentos_diario"
+    dia = Column(Date, primary_key=True)  # criado_em in LOCAL_TZ
+    tipo = Column(String, primary_key=True)
+    subtipo = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)
+    fornecedor = Column(String, primary_key=True)
+    quantidade = Column(BigInteger, nullable=False, default=0)
+    valor_total = Column(Numeric(16, 2), nullable=False, default=0)
+
+class RegistroFornecedor(Base):
+    """Confirmed subtipos per supplier key (see services.supplier_registry).
+
+    `tipo_chave` is 'cnpj' (digits only) or 'dominio' (sender domain); one row
+    per key and subtipo, counted up by every confirmation.
+    """
+    __tablename__ = "registro_fornecedores"
+    tipo_chave = Column(String, primary_key=True)
+    chave = Column(String, primary_key=True)
+    subtipo = Column(String, primary_key=True)
+    quantidade = Column(BigInteger, nullable=False, default=0)
+    fornecedor = Column(String, nullable=True)  # last name confirmed under this key
+    atualizado_em = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
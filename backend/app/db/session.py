@@ -1,10 +1,74 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql+psycopg2://postgres:postgres@db:5432/postgres")
 
-engine = create_engine(DATABASE_URL)
+# sync (default) or async: which engine/routers the API uses (see app.main)
+DB_MODE = os.environ.get("DB_MODE", "sync")
+# async driver URL; derived from DATABASE_URL when not set
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL")
+
+# connection pool, per engine (and so per worker process)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))  # seconds waiting for a free connection
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1") not in ("0", "false", "False")
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", "0"))  # 0 = no limit
+
+
+def engine_options(url: str, is_async: bool = False) -> dict:
+    """create_engine keyword arguments for `url` from the DB_* settings."""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        return {}
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if DB_STATEMENT_TIMEOUT_MS and url.get_backend_name() == "postgresql":
+        if is_async:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+def async_url(url: str) -> str:
+    """DATABASE_URL with its driver swapped for the asyncio one (asyncpg / aiosqlite)."""
+    url = make_url(url)
+    driver = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}.get(url.get_backend_name())
+    return url.set(drivername=f"{url.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+_async_engine = None
+_async_sessionmaker = None
+
+
+def get_async_sessionmaker():
+    """Sessionmaker bound to the asyncio engine, created on first use (needs asyncpg)."""
+    global _async_engine, _async_sessionmaker
+    if _async_sessionmaker is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        url = ASYNC_DATABASE_URL or async_url(DATABASE_URL)
+        _async_engine = create_async_engine(url, **engine_options(url, is_async=True))
+        _async_sessionmaker = async_sessionmaker(_async_engine, autoflush=False, expire_on_commit=False)
+    return _async_sessionmaker
+
+
+async def dispose_async_engine():
+    global _async_engine, _async_sessionmaker
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    _async_engine = _async_sessionmaker = None
+
 from app.db import models  # noqa: F401
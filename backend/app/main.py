@@ -1,16 +1,30 @@
 import os
 from fastapi import FastAPI
-from app.api import documents
+from app.api import documents, events
 from app.db import init_db
+from app.db.session import DB_MODE, dispose_async_engine
 
 app = FastAPI(title="Auto Email Classifier - Finance")
 
-app.include_router(documents.router, prefix="/documentos", tags=["documentos"])
+# before the document routes, or /documentos/{documento_id} would take "eventos"
+app.include_router(events.router, prefix="/documentos", tags=["documentos"])
+
+if DB_MODE == "async":
+    from app.api import documents_async
+    app.include_router(documents_async.router, prefix="/documentos", tags=["documentos"])
+else:
+    app.include_router(documents.router, prefix="/documentos", tags=["documentos"])
 
 @app.on_event("startup")
 def startup_event():
-    # Initialize DB (create tables)
-    init_db.create_tables()
+    # Initialize DB (create tables); deployments migrate in a step of their own
+    if init_db.MIGRATE_ON_STARTUP:
+        init_db.create_tables()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    events.FEED.stop()
+    await dispose_async_engine()
 
 @app.get("/")
 def read_root():
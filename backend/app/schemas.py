@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional, List
 from uuid import UUID
 
@@ -10,8 +10,9 @@ class AnexoOut(BaseModel):
     nome_arquivo: str
     tipo: str
     caminho_arquivo: str
-    preview_imagem: Optional[str]
     criado_em: datetime
+    # preview image URLs by size (thumb/medio/grande), see GET /documentos/anexos/{id}/preview
+    previews: Optional[dict[str, str]] = None
 
     model_config = MODEL_CONFIG
 
@@ -38,6 +39,50 @@ class DocumentoOut(BaseModel):
 
     model_config = MODEL_CONFIG
 
+class DocumentoResumo(BaseModel):
+    """Columns shown by the inbox list."""
+    id: UUID
+    tipo: str
+    subtipo: Optional[str] = None
+    fornecedor: Optional[str]
+    numero_documento: Optional[str]
+    valor: Optional[float]
+    status: str
+    confirmado_em: Optional[datetime]
+    criado_em: datetime
+
+class DocumentoPage(BaseModel):
+    items: List[DocumentoResumo]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+    total_estimado: bool = False
+
+class DocumentoBusca(DocumentoResumo):
+    """A hit of GET /documentos/busca; higher relevancia ranks first."""
+    assunto: Optional[str] = None
+    relevancia: float
+
+class BuscaPage(BaseModel):
+    items: List[DocumentoBusca]
+    next_cursor: Optional[str] = None
+
+class ResumoGrupo(BaseModel):
+    """One bucket of GET /documentos/resumo; dimensions not in `agrupar` are null."""
+    periodo: Optional[date] = None
+    tipo: Optional[str] = None
+    subtipo: Optional[str] = None
+    status: Optional[str] = None
+    fornecedor: Optional[str] = None
+    quantidade: int
+    valor_total: float
+
+class Resumo(BaseModel):
+    periodo: str
+    agrupar: List[str]
+    grupos: List[ResumoGrupo]
+    quantidade: int
+    valor_total: float
+
 class DocumentoDetail(DocumentoOut):
     email_id: UUID
     historicos: List[HistoricoOut] | None = None
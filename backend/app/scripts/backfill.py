@@ -0,0 +1,44 @@
+"""Reclassifica e reextrai documentos já gravados (ver app/services/backfill.py).
+
+Só documentos que ninguém tratou (não confirmados, fora de FEITO/REVISAO) são
+revistos, e só os que mudaram são gravados, com um evento no histórico. O
+progresso fica em `backfill_checkpoints` (por `--nome`): se o comando cair,
+rodá-lo de novo continua de onde parou.
+
+Uso:
+  python -m app.scripts.backfill --simular              # não grava nada; mostra a matriz atual x novo
+  python -m app.scripts.backfill                        # grava, retomando do último checkpoint
+  python -m app.scripts.backfill --nome ajuste-frete --reiniciar --processos 8 --lote 1000
+"""
+import argparse
+
+from app.services.backfill import BACKFILL_CHUNK_SIZE, BACKFILL_PROCESSES, format_matrix, run_backfill
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--simular', action='store_true', help='não grava; só compara')
+    parser.add_argument('--nome', default='padrao', help='nome do checkpoint')
+    parser.add_argument('--reiniciar', action='store_true', help='ignora o checkpoint salvo')
+    parser.add_argument('--lote', type=int, default=BACKFILL_CHUNK_SIZE, help='documentos por leitura/gravação')
+    parser.add_argument('--processos', type=int, default=BACKFILL_PROCESSES)
+    parser.add_argument('--limite', type=int, default=None, help='para depois de N documentos')
+    args = parser.parse_args(argv)
+
+    def progress(totals):
+        print(f"processados={totals['processados']} alterados={totals['alterados']}", flush=True)
+
+    totals = run_backfill(nome=args.nome, chunk_size=args.lote, processes=args.processos, dry_run=args.simular,
+                          reiniciar=args.reiniciar, limite=args.limite, on_chunk=progress)
+    print()
+    print('Simulação (nada foi gravado)' if args.simular else 'Concluído')
+    print(f"Documentos: {totals['processados']}  alterados: {totals['alterados']}  "
+          f"reclassificados: {totals['reclassificados']}")
+    if totals['campos']:
+        print('Campos alterados:', ', '.join(f'{k}={v}' for k, v in totals['campos'].most_common()))
+    print()
+    print(format_matrix(totals['matriz']))
+
+
+if __name__ == '__main__':
+    main()
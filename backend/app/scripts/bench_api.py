@@ -0,0 +1,109 @@
+"""Teste de carga da API: modo síncrono vs. assíncrono (DB_MODE).
+
+Sobe o backend com uvicorn uma vez por modo (DB_MODE=sync e DB_MODE=async),
+dispara requisições concorrentes contra a lista (`GET /documentos/`) e o
+detalhe (`GET /documentos/{id}`) e imprime p50/p99 de latência e vazão.
+Usa o banco de DATABASE_URL (precisa de documentos; rode antes o ingestor ou
+o seed) e as configurações de pool DB_POOL_* do ambiente.
+
+Uso:
+  docker-compose exec backend python -m app.scripts.bench_api
+  python -m app.scripts.bench_api --requests 2000 --concurrency 64
+  python -m app.scripts.bench_api --modes async --port 8100
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def _wait_ready(base: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base + '/', timeout=1).ok:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'servidor não respondeu em {base}')
+
+
+def _percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run_load(base: str, path: str, total: int, concurrency: int) -> dict:
+    """Fire `total` GETs at `path` with `concurrency` client threads."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+
+    def _one(_):
+        start = time.perf_counter()
+        r = session.get(base + path)
+        return time.perf_counter() - start, r.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(_one, range(total)))
+    elapsed = time.perf_counter() - start
+    latencies = [t for t, _ in results]
+    return {
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+        'media_ms': statistics.mean(latencies) * 1000,
+        'req_s': total / elapsed,
+        'erros': sum(status != 200 for _, status in results),
+    }
+
+
+def bench_mode(mode: str, port: int, total: int, concurrency: int, workers: int) -> dict:
+    env = dict(os.environ, DB_MODE=mode)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning', '--no-access-log'],
+        env=env,
+    )
+    base = f'http://127.0.0.1:{port}'
+    try:
+        _wait_ready(base)
+        page = requests.get(base + '/documentos/', params={'limit': 1}).json()
+        if not page['items']:
+            raise RuntimeError('nenhum documento no banco: rode a ingestão ou o seed antes')
+        doc_id = page['items'][0]['id']
+        # warm-up: fill the connection pools
+        run_load(base, '/documentos/?limit=50', concurrency, concurrency)
+        return {
+            'lista': run_load(base, '/documentos/?limit=50', total, concurrency),
+            'detalhe': run_load(base, f'/documentos/{doc_id}', total, concurrency),
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000, help='requisições por rota e modo')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=1, help='processos uvicorn')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--modes', default='sync,async')
+    args = parser.parse_args(argv)
+
+    print(f'{args.requests} requisições por rota, concorrência {args.concurrency}, {args.workers} worker(s)')
+    for mode in args.modes.split(','):
+        for route, r in bench_mode(mode, args.port, args.requests, args.concurrency, args.workers).items():
+            print(f'{mode:>5} {route:>7}: p50 {r["p50_ms"]:6.1f} ms  p99 {r["p99_ms"]:6.1f} ms  '
+                  f'{r["req_s"]:7.0f} req/s  erros {r["erros"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Micro-benchmark do matcher de palavras-chave do classificador.
+
+Mede o custo por e-mail do matcher compilado (uma passada sobre o texto) contra
+o scan ingênuo (`k in texto` para cada palavra-chave) à medida que a tabela de
+regras cresce. O custo do matcher deve ficar praticamente constante.
+
+Uso:
+  python -m app.scripts.bench_classifier
+"""
+import random
+import string
+import timeit
+
+from app.services import advanced_classifier as ac
+
+SAMPLE = (
+    "Prezados, segue em anexo a Nota Fiscal 12345 referente ao frete da carga. "
+    "Fornecedor: Transp Ltda CNPJ 12.345.678/0001-90 Valor Total: R$ 1.234,56. "
+    "NCM 01012100 Quantidade: 10 Valor unitario: 1,00. Qualquer dúvida estamos à disposição."
+)
+
+
+def _random_keywords(n: int, seed: int = 42) -> list[str]:
+    rnd = random.Random(seed)
+    return [''.join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(5, 14))) for _ in range(n)]
+
+
+def _naive(text: str, rules: dict) -> set:
+    t = text.lower()
+    return {rule for rule, kws in rules.items() if any(k in t for k in kws)}
+
+
+def main(sizes=(0, 100, 1000, 5000), number: int = 2000):
+    print(f"{'keywords':>9} {'compilado (us)':>15} {'ingenuo (us)':>13}")
+    for extra in sizes:
+        rules = dict(ac.KEYWORD_RULES)
+        if extra:
+            rules['extra'] = _random_keywords(extra)
+        matcher = ac._RuleMatcher(rules)
+        n_kw = sum(len(v) for v in rules.values())
+        text = ac._norm(SAMPLE)
+        compiled = timeit.timeit(lambda: matcher.match(text), number=number) / number * 1e6
+        naive = timeit.timeit(lambda: _naive(text, rules), number=number) / number * 1e6
+        print(f"{n_kw:>9} {compiled:>15.1f} {naive:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
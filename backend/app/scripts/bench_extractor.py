@@ -0,0 +1,89 @@
+"""Benchmark do extrator de campos (tabela de regras compilada vs. regex antigas).
+
+Compara `extract_financial_data` com a implementação anterior (um `re.search`
+por campo e o `findall` de itens com backtracking) em e-mails típicos, textos
+longos e entradas adversárias. Nas adversárias o regex antigo é quadrático (muitos
+"Item" sem "Quantidade") ou cúbico (longas sequências de espaços depois de
+"Item:"); acima de `--limite-antigo` caracteres ele não é executado.
+
+Uso:
+  python -m app.scripts.bench_extractor [--numero 20] [--limite-antigo 10000]
+"""
+import argparse
+import re
+import time
+
+from app.services.extractor import extract_financial_data
+
+SAMPLE = (
+    "Prezados, segue em anexo a Nota Fiscal 12345 referente a compra de materiais.\n"
+    "Fornecedor: Parafusos Paulista Ltda CNPJ 12.345.678/0001-90\n"
+    "Valor Total: R$ 1.234,56\nNCM 73181500\n"
+    "Item: Parafuso sextavado Quantidade: 10 Valor unitario: 1,00\n"
+    "Produto: Arruela lisa Quantidade: 25 Valor unitario: 0,10\n"
+)
+
+
+def _antigo(t: str, subtipo: str) -> dict:
+    result = {}
+    fornecedor = re.search(r'Fornecedor[:\s]*[:\-]? *(.+)', t, re.IGNORECASE)
+    cnpj = re.search(r'([0-9]{2}\.?[0-9]{3}\.?[0-9]{3}/[0-9]{4}-[0-9]{2})', t)
+    numero = re.search(r'Nota Fiscal\s*[:#]?\s*([0-9\-\/]+)', t, re.IGNORECASE)
+    valor = re.search(r'Valor(?: Total)?[:\s]*R?\$?\s*([0-9.,]+)', t, re.IGNORECASE)
+    if fornecedor:
+        result['fornecedor'] = fornecedor.group(1).strip()
+    if cnpj:
+        result['cnpj'] = cnpj.group(1)
+    if numero:
+        result['numero_documento'] = numero.group(1)
+    if valor:
+        result['valor'] = valor.group(1).replace('.', '').replace(',', '.')
+    if subtipo == 'NF_PRODUTO':
+        ncm = re.search(r'NCM[:\s]*([0-9]{2,8})', t, re.IGNORECASE)
+        itens = re.findall(r'(?:Item|Produto)[:\s]*([A-Za-z0-9\s\-_,]+)\s+Quantidade[:\s]*([0-9]+)', t, re.IGNORECASE)
+        if ncm:
+            result['ncm'] = ncm.group(1)
+        if itens:
+            result['itens'] = [{'descricao': i[0].strip(), 'quantidade': int(i[1])} for i in itens]
+    return result
+
+
+def _casos():
+    # (nome, texto, adversario)
+    yield 'e-mail tipico', SAMPLE, False
+    yield 'e-mail longo (x500)', SAMPLE * 500, False
+    yield 'texto sem campos (400 KB)', 'lorem ipsum dolor sit amet ' * 15000, False
+    for n in (400, 2000, 100_000):
+        yield f'"Item " x{n} sem quantidade', 'Item ' * n, True
+    for n in (250, 500, 1000, 100_000):
+        yield f'espacos apos "Item:" ({n})', 'Item: ' + ' ' * n + 'x', True
+
+
+def _tempo(fn, numero: int) -> float:
+    start = time.perf_counter()
+    for _ in range(numero):
+        fn()
+    return (time.perf_counter() - start) / numero * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--numero', type=int, default=20, help='repetições por caso')
+    parser.add_argument('--limite-antigo', type=int, default=10000,
+                        help='tamanho máximo de entrada adversária para o regex antigo')
+    args = parser.parse_args()
+
+    print(f"{'caso':<32} {'chars':>8} {'regras (ms)':>12} {'antigo (ms)':>12}")
+    for nome, texto, adversario in _casos():
+        novo = _tempo(lambda: extract_financial_data(texto, [], 'DOCUMENTO_FORNECEDOR', 'NF_PRODUTO'), args.numero)
+        if adversario and len(texto) > args.limite_antigo:
+            antigo = '-'
+        else:
+            esperado = _antigo(texto, 'NF_PRODUTO')
+            assert extract_financial_data(texto, [], 'DOCUMENTO_FORNECEDOR', 'NF_PRODUTO') == esperado, nome
+            antigo = f'{_tempo(lambda: _antigo(texto, "NF_PRODUTO"), max(1, args.numero // 10)):.2f}'
+        print(f'{nome:<32} {len(texto):>8} {novo:>12.2f} {antigo:>12}')
+
+
+if __name__ == '__main__':
+    main()
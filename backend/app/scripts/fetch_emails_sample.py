@@ -5,9 +5,11 @@ Uso:
   - No ambiente local: `python -m app.scripts.fetch_emails_sample`
   - No container: `docker-compose exec backend python -m app.scripts.fetch_emails_sample`
 
-OBS: o coletor atual é um stub. Este script demonstra como invocar a função e onde colocar as credenciais.
+Com IMAP, as mensagens novas são gravadas no banco (sync incremental por UID, ver
+`app/services/email_collector.py`); `--watch` continua esperando e-mails novos via IDLE.
 """
 import os
+import sys
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,14 +18,17 @@ IMAP_HOST = os.environ.get('IMAP_HOST')
 IMAP_USER = os.environ.get('IMAP_USER')
 IMAP_PASS = os.environ.get('IMAP_PASS')
 IMAP_FOLDER = os.environ.get('IMAP_FOLDER', 'INBOX')
+IMAP_PORT = int(os.environ['IMAP_PORT']) if os.environ.get('IMAP_PORT') else None
+IMAP_USE_SSL = os.environ.get('IMAP_USE_SSL', 'true').lower() not in ('0', 'false', 'no')
 
 OUTLOOK_TENANT_ID = os.environ.get('OUTLOOK_TENANT_ID')
 OUTLOOK_CLIENT_ID = os.environ.get('OUTLOOK_CLIENT_ID')
 OUTLOOK_CLIENT_SECRET = os.environ.get('OUTLOOK_CLIENT_SECRET')
 OUTLOOK_USER = os.environ.get('OUTLOOK_USER')
 OUTLOOK_FOLDER = os.environ.get('OUTLOOK_FOLDER', 'Inbox')
+GRAPH_MAX_WORKERS = int(os.environ.get('GRAPH_MAX_WORKERS', '8'))
 
-from app.services.email_collector import fetch_emails
+from app.services.email_collector import ImapCollector, ingest_imap
 from app.services.outlook_collector import fetch_outlook_emails
 
 
@@ -32,7 +37,7 @@ def main():
     if OUTLOOK_TENANT_ID and OUTLOOK_CLIENT_ID and OUTLOOK_CLIENT_SECRET and OUTLOOK_USER:
         print(f'Conectando via Microsoft Graph para {OUTLOOK_USER} (tenant {OUTLOOK_TENANT_ID})...')
         try:
-            msgs = fetch_outlook_emails(OUTLOOK_TENANT_ID, OUTLOOK_CLIENT_ID, OUTLOOK_CLIENT_SECRET, OUTLOOK_USER, folder=OUTLOOK_FOLDER)
+            msgs = fetch_outlook_emails(OUTLOOK_TENANT_ID, OUTLOOK_CLIENT_ID, OUTLOOK_CLIENT_SECRET, OUTLOOK_USER, folder=OUTLOOK_FOLDER, max_workers=GRAPH_MAX_WORKERS)
             print('fetch_outlook_emails retornou:', len(msgs), 'mensagens')
             for m in msgs[:5]:
                 print('- ', m['message_id'], m['assunto'], 'attach:', len(m['attachments']))
@@ -40,7 +45,7 @@ def main():
             # If we have configuration for ingesting, run EmailIngestor
             from app.services.email_ingestor import EmailIngestor
             try:
-                ingestor = EmailIngestor(OUTLOOK_TENANT_ID, OUTLOOK_CLIENT_ID, OUTLOOK_CLIENT_SECRET, OUTLOOK_USER, folder=OUTLOOK_FOLDER)
+                ingestor = EmailIngestor(OUTLOOK_TENANT_ID, OUTLOOK_CLIENT_ID, OUTLOOK_CLIENT_SECRET, OUTLOOK_USER, folder=OUTLOOK_FOLDER, max_workers=GRAPH_MAX_WORKERS)
                 docs = ingestor.ingest(top=20)
                 print('Ingested', len(docs), 'document(s)')
             except Exception as e:
@@ -56,13 +61,14 @@ def main():
         return
 
     print(f'Conectando a IMAP {IMAP_HOST} como {IMAP_USER} (pasta {IMAP_FOLDER})...')
-    # Chama o stub; implemente a persistência no coletor para produção
     try:
-        result = fetch_emails(IMAP_HOST, IMAP_USER, IMAP_PASS, IMAP_FOLDER)
-        print('fetch_emails retornou:', result)
+        with ImapCollector(IMAP_HOST, IMAP_USER, IMAP_PASS, folder=IMAP_FOLDER, port=IMAP_PORT, ssl=IMAP_USE_SSL) as collector:
+            result = ingest_imap(collector, watch='--watch' in sys.argv)
+        print('ingest_imap retornou:', result)
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
-        print('Erro ao executar fetch_emails:', e)
-
+        print('Erro ao executar ingest_imap:', e)
 
 if __name__ == '__main__':
     main()
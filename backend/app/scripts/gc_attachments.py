@@ -0,0 +1,37 @@
+"""Remove blobs do armazenamento de anexos que nenhum Anexo referencia.
+
+Blobs de mensagens ainda na fila de ingestão (`ingest_jobs`) ou em
+`ingest_dead_letters`, já baixados mas sem Anexo gravado, são mantidos.
+
+Também apaga do cache compartilhado de resultados (RESULT_CACHE_TIER) as
+entradas de versões de regras que não estão mais em uso, e os eventos do feed
+do inbox (`documento_eventos`) mais antigos que CHANGE_FEED_RETENTION_DAYS.
+
+Uso:
+  python -m app.scripts.gc_attachments            # remove blobs órfãos com mais de 1h
+  python -m app.scripts.gc_attachments 0          # sem período de carência
+"""
+import sys
+
+from app.db import models
+from app.db.session import SessionLocal
+from app.services import change_feed, ingest_queue, result_cache
+from app.services.attachment_store import collect_garbage
+
+
+def main(min_age: float = 3600):
+    db = SessionLocal()
+    try:
+        referenced = {p for (p,) in db.query(models.Anexo.caminho_arquivo).distinct()}
+        referenced |= ingest_queue.attachment_paths(db)
+        print('Eventos do feed removidos:', change_feed.purge(db))
+    finally:
+        db.close()
+    removed = collect_garbage(referenced, min_age=min_age)
+    print('Blobs removidos:', removed)
+    if result_cache.CACHE.tier:
+        print('Resultados em cache obsoletos removidos:', result_cache.purge_stale())
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 3600)
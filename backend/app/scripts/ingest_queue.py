@@ -0,0 +1,72 @@
+"""Fila durável de ingestão (tabela `ingest_jobs`, ver app/services/ingest_queue.py).
+
+Uso:
+  python -m app.scripts.ingest_queue enfileirar --top 200     # lista a pasta e enfileira as novas
+  python -m app.scripts.ingest_queue worker --lote 10         # processa a fila até Ctrl+C
+  python -m app.scripts.ingest_queue status
+  python -m app.scripts.ingest_queue reprocessar [message_id ...]   # devolve mortas à fila
+
+Vários workers (em uma ou mais máquinas) podem rodar ao mesmo tempo; se um
+deles cair, outro retoma o job da etapa salva quando o lease expira.
+Credenciais do Graph vêm de OUTLOOK_TENANT_ID/CLIENT_ID/CLIENT_SECRET/USER.
+"""
+import argparse
+import json
+import os
+import signal
+import threading
+
+from app.db.session import SessionLocal
+from app.services import result_cache
+from app.services.ingest_queue import (
+    INGEST_LEASE_SECONDS,
+    IngestWorker,
+    enqueue_outlook,
+    outlook_fetch,
+    queue_status,
+    requeue_dead_letters,
+)
+
+
+def _credentials():
+    return os.environ['OUTLOOK_TENANT_ID'], os.environ['OUTLOOK_CLIENT_ID'], os.environ['OUTLOOK_CLIENT_SECRET']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='comando', required=True)
+    p = sub.add_parser('enfileirar')
+    p.add_argument('--caixa', default=os.environ.get('OUTLOOK_USER'))
+    p.add_argument('--pasta', default=os.environ.get('OUTLOOK_FOLDER', 'Inbox'))
+    p.add_argument('--top', type=int, default=50)
+    p = sub.add_parser('worker')
+    p.add_argument('--lote', type=int, default=10)
+    p.add_argument('--lease', type=float, default=INGEST_LEASE_SECONDS)
+    p.add_argument('--espera', type=float, default=5.0, help='segundos entre consultas com a fila vazia')
+    sub.add_parser('status')
+    p = sub.add_parser('reprocessar')
+    p.add_argument('message_ids', nargs='*')
+    args = parser.parse_args(argv)
+
+    if args.comando == 'enfileirar':
+        print('Jobs enfileirados:', enqueue_outlook(*_credentials(), args.caixa, folder=args.pasta, top=args.top))
+    elif args.comando == 'worker':
+        worker = IngestWorker(outlook_fetch(*_credentials()), batch_size=args.lote, lease=args.lease)
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        print('Worker', worker.worker_id)
+        try:
+            worker.run(stop, idle_sleep=args.espera)
+        except KeyboardInterrupt:
+            pass
+        print('Cache de resultados:', json.dumps(result_cache.stats(), ensure_ascii=False))
+    elif args.comando == 'status':
+        with SessionLocal() as db:
+            print(json.dumps(queue_status(db), indent=2, ensure_ascii=False))
+    else:
+        with SessionLocal() as db:
+            print('Jobs devolvidos à fila:', requeue_dead_letters(db, args.message_ids or None))
+
+
+if __name__ == '__main__':
+    main()
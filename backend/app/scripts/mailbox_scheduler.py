@@ -0,0 +1,79 @@
+"""Serviço que mantém várias caixas do Outlook sincronizadas (delta query).
+
+Cada caixa tem seu próprio intervalo, que encurta quando chegam e-mails e
+alonga quando a caixa está parada (ver app/services/mailbox_scheduler.py).
+As métricas ficam em http://0.0.0.0:<porta>/metrics (formato Prometheus) e
+/status (JSON), com o atraso (lag) de cada caixa.
+
+Caixas: arquivo JSON (`--caixas`, ou SCHEDULER_MAILBOXES_FILE) com uma lista
+de objetos {"user_email", "folder", "tenant_id", "client_id", "client_secret",
+"min_interval", "max_interval", "concurrency"}, ou SCHEDULER_MAILBOXES com
+e-mails separados por vírgula (credenciais OUTLOOK_*).
+
+Uso:
+  python -m app.scripts.mailbox_scheduler --caixas caixas.json --porta 9108
+"""
+import argparse
+import json
+import os
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.services.mailbox_scheduler import (
+    SCHEDULER_MAX_CONCURRENT,
+    MailboxScheduler,
+    load_mailboxes,
+    prometheus_metrics,
+)
+
+
+def serve_metrics(scheduler: MailboxScheduler, port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = prometheus_metrics(scheduler.metrics()).encode(), 'text/plain; version=0.0.4'
+            elif self.path == '/status':
+                body, content_type = json.dumps(scheduler.metrics(), ensure_ascii=False).encode(), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--caixas', default=os.environ.get('SCHEDULER_MAILBOXES_FILE'))
+    parser.add_argument('--porta', type=int, default=int(os.environ.get('SCHEDULER_METRICS_PORT', '9108')))
+    parser.add_argument('--max-concorrentes', type=int, default=SCHEDULER_MAX_CONCURRENT)
+    args = parser.parse_args(argv)
+
+    mailboxes = load_mailboxes(args.caixas, os.environ.get('SCHEDULER_MAILBOXES') or os.environ.get('OUTLOOK_USER'))
+    if not mailboxes:
+        parser.error('nenhuma caixa configurada (--caixas ou SCHEDULER_MAILBOXES)')
+    scheduler = MailboxScheduler(mailboxes, max_concurrent=args.max_concorrentes)
+    server = serve_metrics(scheduler, args.porta)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    print(f'{len(mailboxes)} caixas; métricas em http://0.0.0.0:{args.porta}/metrics')
+    try:
+        scheduler.run(stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+"""Recalcula o resumo diário (`resumo_documentos_diario`) a partir dos documentos.
+
+O resumo é mantido incrementalmente pela ingestão, pela confirmação e pelo
+backfill, e a migração 0008 o preenche com os documentos existentes; este
+script só é necessário para corrigi-lo (por exemplo, após apagar documentos à
+mão ou mudar LOCAL_TZ). Durante
+a execução, no Postgres, as gravações no resumo esperam o fim do recálculo.
+
+Uso:
+  python -m app.scripts.rebuild_rollups
+"""
+from app.db.session import SessionLocal
+from app.services.rollup import rebuild
+
+
+def main():
+    with SessionLocal() as db:
+        print('Linhas do resumo:', rebuild(db))
+
+
+if __name__ == '__main__':
+    main()
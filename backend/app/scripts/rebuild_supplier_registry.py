@@ -0,0 +1,21 @@
+"""Recalcula o registro de fornecedores (`registro_fornecedores`) a partir dos documentos confirmados.
+
+O registro é mantido incrementalmente pela confirmação de documentos; este
+script só é necessário para preenchê-lo depois da migração 0011 ou para
+corrigi-lo. Os processos que classificam e-mails recarregam o registro em
+segundo plano (REGISTRO_REFRESH_INTERVAL).
+
+Uso:
+  python -m app.scripts.rebuild_supplier_registry
+"""
+from app.db.session import SessionLocal
+from app.services.supplier_registry import rebuild
+
+
+def main():
+    with SessionLocal() as db:
+        print('Linhas do registro:', rebuild(db))
+
+
+if __name__ == '__main__':
+    main()
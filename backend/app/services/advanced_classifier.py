@@ -1,5 +1,28 @@
 import re
-from typing import List
+from typing import Dict, FrozenSet, List
+
+# Bump when the scoring below changes: cached classifications (see
+# result_cache) are keyed by it together with the tables.
+CLASSIFIER_VERSION = 1
+
+# Keyword tables. Every rule is matched as a plain (lowercase) substring of the
+# normalized text, exactly like the old per-keyword `in` checks.
+KEYWORD_RULES: Dict[str, List[str]] = {
+    'requisicao': ['requisição de compra', 'requisicao de compra', 'rc', 'pedido interno', 'pedido de compra', 'solicitação de compra', 'solicitacao de compra'],
+    'frete': ['frete', 'transporte', 'ct-e', 'conhecimento de transporte', 'cte', 'carga'],
+    'cte': ['ct-e', 'cte', 'conhecimento de transporte'],
+    'transportadora': ['transportadora'],
+    'servico': ['serviço', 'prestação de serviço', 'prestacao de servico', 'mão de obra', 'mao de obra'],
+    'iss': ['iss', 'issqn', 'nfse', 'nfs-e', 'nfs'],
+    'ncm': ['ncm'],
+    'produto': ['produto', 'mercadoria', 'item', 'itens'],
+    'quantidade': ['quantidade', 'qtd', 'valor unitario', 'valor unitário'],
+    'material': ['material de consumo', 'manutenção', 'manutencao', 'uso interno', 'consumo'],
+    'material_dica': ['manutenção', 'limpeza', 'ti', 'tecnico', 'manutencao'],
+}
+
+# Pseudo-rule for an 8 digit NCM code (same as re.search(r'\b[0-9]{8}\b', t))
+NCM_CODE_RULE = 'ncm_codigo'
 
 # Helper utilities
 
@@ -7,88 +30,171 @@ def _norm(text: str) -> str:
     return (text or '').lower()
 
 
-def _has_any(text: str, keywords: List[str]) -> bool:
-    t = _norm(text)
-    return any(k.lower() in t for k in keywords)
-
-
 def _filename_has_any(name: str, keywords: List[str]) -> bool:
     return any(k.lower() in (name or '').lower() for k in keywords)
 
 
-def is_requisicao_compra(text: str, remetente: str, attachments: List[dict]) -> float:
-    t = _norm(text)
+def _is_internal_sender(remetente: str) -> bool:
+    return bool(remetente) and ('@' in remetente) and remetente.endswith('@empresa.com')
+
+
+def _has_xml(attachments: List[dict]) -> bool:
+    return any(a.get('nome_arquivo','').lower().endswith('.xml') for a in attachments or [])
+
+
+def _has_cte_xml(attachments: List[dict]) -> bool:
+    for a in attachments or []:
+        name = a.get('nome_arquivo','').lower()
+        if name.endswith('.xml') and ('cte' in name or 'conhecimento' in name or 'ct-e' in name):
+            return True
+    return False
+
+
+def _has_nfe_xml(attachments: List[dict]) -> bool:
+    for a in attachments or []:
+        name = a.get('nome_arquivo','').lower()
+        if name.endswith('.xml') and ('nfe' in name or 'nf-e' in name or 'nota fiscal' in name):
+            return True
+    return False
+
+
+def _trie_pattern(words: List[str]) -> str:
+    """Build a prefix-factored alternation (a trie as a regex) for `words`.
+
+    The regex engine walks it like a trie, so the work per text position is
+    bounded by the keyword length instead of the number of keywords. Optional
+    suffixes are greedy, so the longest keyword starting at a position wins.
+    """
+    trie: dict = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    def _emit(node: dict) -> str:
+        terminal = '' in node
+        branches = [re.escape(ch) + _emit(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if terminal:
+            return '(?:' + body + ')?'
+        return body
+
+    return _emit(trie)
+
+
+class _RuleMatcher:
+    """Finds every rule hit of KEYWORD_RULES (plus the NCM code check) in one pass."""
+
+    def __init__(self, rules: Dict[str, List[str]]):
+        keywords = sorted({k.lower() for kws in rules.values() for k in kws})
+        # A zero-width lookahead matches at every position, capturing the longest
+        # keyword starting there; shorter keywords are recovered via `_implied`.
+        # The second branch is the NCM code check, captured as an empty string.
+        self._pattern = re.compile(
+            '(?=(' + _trie_pattern(keywords) + ')|[0-9](?<!\\w[0-9])[0-9]{7}(?!\\w))'
+        )
+        rules_of = {k: set() for k in keywords}
+        for rule, kws in rules.items():
+            for k in kws:
+                rules_of[k.lower()].add(rule)
+        # keyword -> all rules hit when that keyword is present (any keyword
+        # contained in it is necessarily present too)
+        self._implied = {
+            k: frozenset(r for other in keywords if other in k for r in rules_of[other])
+            for k in keywords
+        }
+        self._ncm = frozenset([NCM_CODE_RULE])
+
+    def match(self, text: str) -> FrozenSet[str]:
+        hits = set()
+        for kw in set(self._pattern.findall(text)):
+            hits |= self._implied[kw] if kw else self._ncm
+        return frozenset(hits)
+
+
+_MATCHER = _RuleMatcher(KEYWORD_RULES)
+
+
+def match_rules(text: str) -> FrozenSet[str]:
+    """Return the names of all KEYWORD_RULES (and NCM_CODE_RULE) present in `text`."""
+    return _MATCHER.match(_norm(text))
+
+
+def is_requisicao_compra(text: str, remetente: str, attachments: List[dict], hits: FrozenSet[str] | None = None) -> float:
+    if hits is None:
+        hits = match_rules(text)
     score = 0.0
-    keywords = ['requisição de compra', 'requisicao de compra', 'rc', 'pedido interno', 'pedido de compra', 'solicitação de compra', 'solicitacao de compra']
-    if _has_any(t, keywords):
+    if 'requisicao' in hits:
         score += 0.8
     # remetente internal heuristic (contains company domain) - basic: if no '@' or contains 'empresa' keyword
-    if remetente and ('@' in remetente) and remetente.endswith('@empresa.com'):
+    if _is_internal_sender(remetente):
         score += 0.1
     # absence of xml fiscal increases chance (weak)
-    if not any(a.get('nome_arquivo','').lower().endswith('.xml') for a in attachments):
+    if not _has_xml(attachments):
         score += 0.05
     return min(score, 0.99)
 
 
-def is_nf_frete(text: str, attachments: List[dict]) -> float:
-    t = _norm(text)
+def is_nf_frete(text: str, attachments: List[dict], hits: FrozenSet[str] | None = None) -> float:
+    if hits is None:
+        hits = match_rules(text)
     score = 0.0
-    keywords = ['frete', 'transporte', 'ct-e', 'ct-e', 'conhecimento de transporte', 'cte', 'carga']
-    if _has_any(t, keywords):
+    if 'frete' in hits:
         score += 0.6    # explicit CT-e mention in text gives high confidence
-    if 'ct-e' in t or 'cte' in t or 'conhecimento de transporte' in t:
+    if 'cte' in hits:
         score = max(score, 0.9)    # XML CT-e detection
-    for a in attachments or []:
-        name = a.get('nome_arquivo','').lower()
-        if name.endswith('.xml') and ('cte' in name or 'conhecimento' in name or 'ct-e' in name):
-            score = max(score, 0.95)
+    if _has_cte_xml(attachments):
+        score = max(score, 0.95)
     # transportadora as remetente (heuristic: 'transportadora' word)
-    if _has_any(t, ['transportadora']):
+    if 'transportadora' in hits:
         score += 0.2
     return min(score, 0.99)
 
 
-def is_nf_servico(text: str, attachments: List[dict]) -> float:
-    t = _norm(text)
+def is_nf_servico(text: str, attachments: List[dict], hits: FrozenSet[str] | None = None) -> float:
+    if hits is None:
+        hits = match_rules(text)
     score = 0.0
-    if _has_any(t, ['serviço', 'prestação de serviço', 'prestacao de servico', 'mão de obra', 'mao de obra']):
+    if 'servico' in hits:
         score += 0.7
     # presence of 'ISS' or 'issqn' or 'NFS-e'
-    if _has_any(t, ['iss', 'issqn', 'nfse', 'nfs-e', 'nfs']):
+    if 'iss' in hits:
         score = max(score, 0.9)
     # absence of NCM (product code) supports service
-    if 'ncm' not in t:
+    if 'ncm' not in hits:
         score += 0.05
     return min(score, 0.99)
 
 
-def is_nf_produto(text: str, attachments: List[dict]) -> float:
-    t = _norm(text)
+def is_nf_produto(text: str, attachments: List[dict], hits: FrozenSet[str] | None = None) -> float:
+    if hits is None:
+        hits = match_rules(text)
     score = 0.0
-    if _has_any(t, ['produto', 'mercadoria', 'item', 'itens']):
+    if 'produto' in hits:
         score += 0.4
     # NCM detection (8 digits or 'ncm')
-    if re.search(r'\b[0-9]{8}\b', t) or 'ncm' in t:
+    if NCM_CODE_RULE in hits or 'ncm' in hits:
         score += 0.5
     # quantity / valor unitario
-    if _has_any(t, ['quantidade', 'qtd', 'valor unitario', 'valor unitário']):
+    if 'quantidade' in hits:
         score += 0.2
     # XML NF-e detection
-    for a in attachments or []:
-        name = a.get('nome_arquivo','').lower()
-        if name.endswith('.xml') and ('nfe' in name or 'nf-e' in name or 'nota fiscal' in name):
-            score = max(score, 0.95)
+    if _has_nfe_xml(attachments):
+        score = max(score, 0.95)
     return min(score, 0.99)
 
 
-def is_nf_material_interno(text: str, remetente: str, attachments: List[dict]) -> float:
-    t = _norm(text)
+def is_nf_material_interno(text: str, remetente: str, attachments: List[dict], hits: FrozenSet[str] | None = None) -> float:
+    if hits is None:
+        hits = match_rules(text)
     score = 0.0
-    if _has_any(t, ['material de consumo', 'manutenção', 'manutencao', 'uso interno', 'consumo']):
+    if 'material' in hits:
         score += 0.7
     # Check for supplier hints (maintenance, limpeza, ti)
-    if _has_any(t, ['manutenção', 'limpeza', 'ti', 'tecnico', 'manutencao']):
+    if 'material_dica' in hits:
         score += 0.15
     return min(score, 0.95)
 
@@ -100,29 +206,31 @@ def classify_email(text: str, attachments: List[dict] | None = None, remetente:
     """
     attachments = attachments or []
     t = _norm(text)
+    # single pass over the text feeds every scorer below
+    hits = match_rules(t)
 
     # 1) Requisição de Compra (ENTRADA_INTERNA / REQUISICAO_COMPRA)
-    req_score = is_requisicao_compra(t, remetente or '', attachments)
+    req_score = is_requisicao_compra(t, remetente or '', attachments, hits)
     if req_score >= 0.6:
         return {'tipo': 'ENTRADA_INTERNA', 'subtipo': 'REQUISICAO_COMPRA', 'confidence': round(req_score, 2)}
 
     # 2) NF Frete (high priority)
-    frete_score = is_nf_frete(t, attachments)
+    frete_score = is_nf_frete(t, attachments, hits)
     if frete_score >= 0.8:
         return {'tipo': 'DOCUMENTO_FORNECEDOR', 'subtipo': 'NF_FRETE', 'confidence': round(frete_score, 2)}
 
     # 3) NF Serviço
-    serv_score = is_nf_servico(t, attachments)
+    serv_score = is_nf_servico(t, attachments, hits)
     if serv_score >= 0.8:
         return {'tipo': 'DOCUMENTO_FORNECEDOR', 'subtipo': 'NF_SERVICO', 'confidence': round(serv_score, 2)}
 
     # 4) NF Produto
-    prod_score = is_nf_produto(t, attachments)
+    prod_score = is_nf_produto(t, attachments, hits)
     if prod_score >= 0.8:
         return {'tipo': 'DOCUMENTO_FORNECEDOR', 'subtipo': 'NF_PRODUTO', 'confidence': round(prod_score, 2)}
 
     # 5) NF Material Interno
-    mat_score = is_nf_material_interno(t, remetente or '', attachments)
+    mat_score = is_nf_material_interno(t, remetente or '', attachments, hits)
     if mat_score >= 0.8:
         return {'tipo': 'DOCUMENTO_FORNECEDOR', 'subtipo': 'NF_MATERIAL_INTERNO', 'confidence': round(mat_score, 2)}
 
@@ -137,3 +245,37 @@ def classify_email(text: str, attachments: List[dict] | None = None, remetente:
 
     tipo, subtipo, score = best
     return {'tipo': tipo, 'subtipo': subtipo, 'confidence': round(score, 2)}
+
+
+# Batch scoring support (see app.services.batch_classifier)
+
+# Column order of the feature vector returned by extract_features
+FEATURES = [
+    'requisicao', 'remetente_interno', 'sem_xml',
+    'frete', 'cte', 'cte_xml', 'transportadora',
+    'servico', 'iss', 'ncm',
+    'produto', NCM_CODE_RULE, 'quantidade', 'nfe_xml',
+    'material', 'material_dica',
+]
+
+# (tipo, subtipo, threshold) in the priority order used by classify_email
+SUBTYPE_PRIORITY = [
+    ('ENTRADA_INTERNA', 'REQUISICAO_COMPRA', 0.6),
+    ('DOCUMENTO_FORNECEDOR', 'NF_FRETE', 0.8),
+    ('DOCUMENTO_FORNECEDOR', 'NF_SERVICO', 0.8),
+    ('DOCUMENTO_FORNECEDOR', 'NF_PRODUTO', 0.8),
+    ('DOCUMENTO_FORNECEDOR', 'NF_MATERIAL_INTERNO', 0.8),
+]
+
+
+def extract_features(text: str, attachments: List[dict] | None = None, remetente: str | None = None) -> List[bool]:
+    """Boolean feature vector (ordered as FEATURES) consumed by the batch scorer."""
+    attachments = attachments or []
+    hits = match_rules(text)
+    extra = {
+        'remetente_interno': _is_internal_sender(remetente or ''),
+        'sem_xml': not _has_xml(attachments),
+        'cte_xml': _has_cte_xml(attachments),
+        'nfe_xml': _has_nfe_xml(attachments),
+    }
+    return [extra[f] if f in extra else (f in hits) for f in FEATURES]
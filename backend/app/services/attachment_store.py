@@ -0,0 +1,130 @@
+"""Content-addressed attachment storage.
+
+Blobs live in `STORAGE_DIR/blobs/<h[:2]>/<h[2:4]>/<sha256><ext>`: the same PDF/XML
+resent in several e-mails is stored once and every `Anexo.caminho_arquivo`
+points at the shared blob. Content is written through a temp file while it is
+hashed, so a full decoded copy is never held in memory. The original extension
+is kept because previews and extraction dispatch on it.
+"""
+import base64
+import hashlib
+import os
+import tempfile
+import time
+from typing import Iterable, Set
+
+STORAGE_DIR = os.environ.get('STORAGE_DIR', '/data/storage')
+
+# base64 characters decoded per chunk (multiple of 4)
+B64_CHUNK = 64 * 1024
+
+
+def blob_dir() -> str:
+    return os.path.join(STORAGE_DIR, 'blobs')
+
+
+def blob_path(digest: str, ext: str = '') -> str:
+    return os.path.join(blob_dir(), digest[:2], digest[2:4], digest + ext)
+
+
+def file_digest(file_path: str) -> str:
+    """sha256 of a file; blobs of this store are already named after it."""
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    if len(name) == 64 and all(c in '0123456789abcdef' for c in name):
+        return name
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _ext(filename: str) -> str:
+    return os.path.splitext(filename or '')[1].lower()
+
+
+def store_stream(chunks: Iterable[bytes], filename: str) -> str:
+    """Write `chunks` to the store and return the blob path (deduplicated by sha256)."""
+    root = blob_dir()
+    os.makedirs(root, exist_ok=True)
+    h = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=root, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                h.update(chunk)
+                f.write(chunk)
+        path = blob_path(h.hexdigest(), _ext(filename))
+        try:
+            # reused blob: a fresh mtime puts it back in collect_garbage's grace window
+            # until the Anexo row of this ingestion is committed
+            os.utime(path)
+            os.unlink(tmp)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+        return path
+    except Exception:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def _iter_b64(content_b64: str) -> Iterable[bytes]:
+    # Graph contentBytes has no line breaks, so fixed 4-aligned slices decode independently
+    chunk_size = B64_CHUNK
+    for i in range(0, len(content_b64), chunk_size):
+        yield base64.b64decode(content_b64[i:i + chunk_size])
+
+
+def store_b64(content_b64: str, filename: str) -> str:
+    """Decode base64 content chunk by chunk straight into the store."""
+    return store_stream(_iter_b64(content_b64 or ''), filename)
+
+
+def collect_garbage(referenced: Set[str], min_age: float = 3600) -> int:
+    """Delete blobs (and their previews and extracted text) that no Anexo references.
+
+    Blobs written or reused less than `min_age` seconds ago (mtime) are kept:
+    they may belong to an ingestion that has not committed its Anexo rows yet.
+    Returns the number of blobs removed.
+    """
+    root = blob_dir()
+    referenced = {os.path.abspath(p) for p in referenced if p}
+    cutoff = time.time() - min_age
+    removed = 0
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            path = os.path.abspath(os.path.join(dirpath, name))
+            if name.startswith('.tmp-'):
+                # leftover of an interrupted write
+                if os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+                continue
+            if path in referenced or os.path.getmtime(path) > cutoff:
+                continue
+            os.unlink(path)
+            _remove_cached_previews(os.path.splitext(name)[0])
+            _remove_cached_texts(os.path.splitext(name)[0])
+            removed += 1
+    return removed
+
+
+def _remove_cached_previews(digest: str):
+    # previews are cached by content hash (see preview.preview_cache_path)
+    preview_dir = os.path.join(STORAGE_DIR, 'previews', digest[:2])
+    if not os.path.isdir(preview_dir):
+        return
+    for name in os.listdir(preview_dir):
+        if name.startswith(digest + '-'):
+            os.unlink(os.path.join(preview_dir, name))
+
+
+def _remove_cached_texts(digest: str):
+    # extracted text is cached by content hash (see attachment_text.cache_path)
+    text_dir = os.path.join(STORAGE_DIR, 'textos', digest[:2])
+    if not os.path.isdir(text_dir):
+        return
+    for name in os.listdir(text_dir):
+        if name.startswith(digest + '.'):
+            os.unlink(os.path.join(text_dir, name))
@@ -0,0 +1,235 @@
+"""Text and fiscal data read from attachments, cached by content hash.
+
+- NF-e, CT-e and NFS-e (ABRASF and national layout) XML are read with
+  `iterparse`: each element is cleared once its value is taken, so memory
+  stays flat whatever the number of `det` items. The fields come out in the
+  extractor's vocabulary (fornecedor, cnpj, numero_documento, valor, ...).
+- PDF text is pulled with pdfplumber one page at a time (each page's parsed
+  objects are released before the next), up to ATTACHMENT_TEXT_MAX_PAGES.
+
+Results are stored under STORAGE_DIR/textos/<sha256>.v<PARSER_VERSION>.json
+and memoized per process, so re-classification and re-extraction of the
+same file (in any e-mail, any worker) never parse it again. Bump
+PARSER_VERSION when the parsing changes to invalidate the cache.
+"""
+import json
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from typing import Iterator, List
+
+from app.services import attachment_store
+
+PARSER_VERSION = 1
+ATTACHMENT_TEXT_MAX_PAGES = int(os.environ.get('ATTACHMENT_TEXT_MAX_PAGES', '50'))
+ATTACHMENT_TEXT_MAX_CHARS = int(os.environ.get('ATTACHMENT_TEXT_MAX_CHARS', '200000'))
+ATTACHMENT_TEXT_MEMO_SIZE = 512
+
+# element that opens each document kind -> kind
+_DOCUMENT_ROOTS = {'infNFe': 'NFE', 'infCte': 'CTE', 'InfNfse': 'NFSE', 'infNFSe': 'NFSE'}
+
+# path suffix (local tag names) -> field; the first value found wins
+_XML_FIELDS = {
+    'NFE': {
+        ('emit', 'xNome'): 'fornecedor',
+        ('emit', 'CNPJ'): 'cnpj',
+        ('ide', 'nNF'): 'numero_documento',
+        ('ICMSTot', 'vNF'): 'valor',
+        ('prod', 'NCM'): 'ncm',
+    },
+    'CTE': {
+        ('emit', 'xNome'): 'fornecedor',
+        ('emit', 'CNPJ'): 'cnpj',
+        ('ide', 'nCT'): 'numero_documento',
+        ('vPrest', 'vTPrest'): 'valor',
+        ('ide', 'xMunIni'): 'origem',
+        ('ide', 'xMunFim'): 'destino',
+    },
+    'NFSE': {
+        # ABRASF
+        ('PrestadorServico', 'RazaoSocial'): 'fornecedor',
+        ('IdentificacaoPrestador', 'Cnpj'): 'cnpj',
+        ('IdentificacaoPrestador', 'CpfCnpj', 'Cnpj'): 'cnpj',
+        ('InfNfse', 'Numero'): 'numero_documento',
+        ('Valores', 'ValorServicos'): 'valor',
+        ('Valores', 'ValorIss'): 'iss',
+        ('Servico', 'CodigoCnae'): 'cnae',
+        # national layout
+        ('emit', 'xNome'): 'fornecedor',
+        ('emit', 'CNPJ'): 'cnpj',
+        ('infNFSe', 'nNFSe'): 'numero_documento',
+        ('valores', 'vLiq'): 'valor',
+        ('valores', 'vISSQN'): 'iss',
+    },
+}
+
+# NF-e item (det/prod) fields
+_ITEM_FIELDS = {'xProd': 'descricao', 'qCom': 'quantidade', 'vProd': 'valor', 'NCM': 'ncm'}
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _format_cnpj(value: str) -> str:
+    digits = re.sub(r'\D', '', value)
+    if len(digits) != 14:
+        return value
+    return f'{digits[:2]}.{digits[2:5]}.{digits[5:8]}/{digits[8:12]}-{digits[12:]}'
+
+
+def _quantity(value: str):
+    try:
+        q = float(value)
+    except ValueError:
+        return value
+    return int(q) if q.is_integer() else q
+
+
+def parse_fiscal_xml(path: str) -> dict:
+    """Fields of an NF-e/CT-e/NFS-e XML (empty dict for other XML)."""
+    kind = None
+    rules = {}
+    data = {}
+    itens = []
+    item = None
+    stack = []
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        tag = _local(elem.tag)
+        if event == 'start':
+            stack.append(tag)
+            if kind is None and tag in _DOCUMENT_ROOTS:
+                kind = _DOCUMENT_ROOTS[tag]
+                rules = _XML_FIELDS[kind]
+                key = re.sub(r'\D', '', elem.get('Id') or '')
+                if len(key) == 44:
+                    data['chave_acesso'] = key
+            elif kind == 'NFE' and tag == 'det':
+                item = {}
+            continue
+        path_tags = tuple(stack)
+        text = (elem.text or '').strip()
+        if kind and text:
+            for suffix, field in rules.items():
+                if field not in data and path_tags[-len(suffix):] == suffix:
+                    data[field] = text
+            if item is not None and len(path_tags) >= 2 and path_tags[-2] == 'prod' and tag in _ITEM_FIELDS:
+                item[_ITEM_FIELDS[tag]] = _quantity(text) if tag == 'qCom' else text
+        if item is not None and tag == 'det':
+            itens.append(item)
+            item = None
+        stack.pop()
+        elem.clear()
+    if not kind:
+        return {}
+    data['documento_fiscal'] = kind
+    if 'cnpj' in data:
+        data['cnpj'] = _format_cnpj(data['cnpj'])
+    if kind == 'CTE' and 'fornecedor' in data:
+        data['transportadora'] = data['fornecedor']
+    if itens:
+        data['itens'] = itens
+    return data
+
+
+def iter_pdf_text(path: str, max_pages: int = ATTACHMENT_TEXT_MAX_PAGES) -> Iterator[str]:
+    """Text of each PDF page, one page in memory at a time."""
+    import pdfplumber
+
+    # `pages` keeps pdfplumber from building Page objects past the limit
+    with pdfplumber.open(path, pages=range(1, max_pages + 1)) as pdf:
+        for page in pdf.pages:
+            try:
+                yield page.extract_text() or ''
+            finally:
+                # drop the page's parsed layout objects before the next page
+                page.close()
+
+
+def _pdf_text(path: str) -> str:
+    parts, size = [], 0
+    for text in iter_pdf_text(path):
+        parts.append(text)
+        size += len(text)
+        if size >= ATTACHMENT_TEXT_MAX_CHARS:
+            break
+    return '\n'.join(parts)[:ATTACHMENT_TEXT_MAX_CHARS]
+
+
+def _parse(path: str) -> dict:
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext == '.xml':
+            return {'texto': '', 'dados': parse_fiscal_xml(path)}
+        if ext == '.pdf':
+            return {'texto': _pdf_text(path), 'dados': {}}
+    except Exception as e:
+        # a corrupt file fails the same way every time: cache the failure too
+        return {'texto': '', 'dados': {}, 'erro': f'{type(e).__name__}: {e}'}
+    return {'texto': '', 'dados': {}}
+
+
+def cache_path(digest: str) -> str:
+    return os.path.join(attachment_store.STORAGE_DIR, 'textos', digest[:2], f'{digest}.v{PARSER_VERSION}.json')
+
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+stats = {'memo': 0, 'disco': 0, 'parse': 0}
+
+
+def _remember(digest: str, result: dict):
+    with _memo_lock:
+        _memo[digest] = result
+        _memo.move_to_end(digest)
+        while len(_memo) > ATTACHMENT_TEXT_MEMO_SIZE:
+            _memo.popitem(last=False)
+
+
+def read_attachment(path: str) -> dict:
+    """{'texto', 'dados'[, 'erro']} of one attachment file, from cache when possible."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in ('.xml', '.pdf') or not os.path.exists(path):
+        return {'texto': '', 'dados': {}}
+    digest = attachment_store.file_digest(path)
+    with _memo_lock:
+        if digest in _memo:
+            stats['memo'] += 1
+            _memo.move_to_end(digest)
+            return _memo[digest]
+    out = cache_path(digest)
+    try:
+        with open(out, encoding='utf-8') as f:
+            result = json.load(f)
+        stats['disco'] += 1
+    except (OSError, ValueError):
+        result = _parse(path)
+        stats['parse'] += 1
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        tmp = f'{out}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp, out)
+    _remember(digest, result)
+    return result
+
+
+def read_attachments(attachments: List[dict]) -> dict:
+    """Merged text and fiscal data of the attachments of one e-mail.
+
+    XML data comes first (the first fiscal XML wins per field); PDF texts are
+    joined in attachment order.
+    """
+    textos, dados = [], {}
+    for a in attachments or []:
+        path = a.get('caminho_arquivo')
+        if not path:
+            continue
+        result = read_attachment(path)
+        if result['texto']:
+            textos.append(result['texto'])
+        for key, value in result['dados'].items():
+            dados.setdefault(key, value)
+    return {'texto': '\n'.join(textos), 'dados': dados}
@@ -0,0 +1,250 @@
+"""Re-run classification and extraction over stored documentos.
+
+After a change to the classifier thresholds, the extraction rules or
+DocumentSubtipo, documentos nobody has handled yet (never confirmed, not
+FEITO or REVISAO) are streamed in id order through a server-side cursor
+(`yield_per`), analysed in a process pool and compared with what is stored.
+Only documentos whose labels or fields changed are written: one executemany
+UPDATE by primary key, one historico row and one change feed event
+('classificado') per changed documento, plus the rollup deltas and the itens
+rows of re-extracted documentos, in the same transaction as the run's
+checkpoint (`backfill_checkpoints`), so an interrupted run resumes after the
+last committed chunk. Before writing, the chunk's rows are locked (SELECT ...
+FOR UPDATE) and compared as they are then: a documento confirmed or sent to
+review while its chunk was being analysed is skipped, and the rollup deltas
+start from the locked values.
+
+A dry run writes nothing and reports the same counts, including the
+confusion matrix of stored x new labels.
+"""
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from typing import Callable, Dict, List
+
+from sqlalchemy import delete, func, insert, or_, select, update
+
+from app.db import models
+from app.db.session import SessionLocal
+from app.services import change_feed, rollup, supplier_registry
+from app.services.email_ingestor import _classification_status, _document_fields, _item_rows
+from app.services.result_cache import classify_email, extract_financial_data
+
+BACKFILL_CHUNK_SIZE = int(os.environ.get('BACKFILL_CHUNK_SIZE') or 500)
+BACKFILL_PROCESSES = int(os.environ.get('BACKFILL_PROCESSES') or os.cpu_count() or 1)
+
+# statuses set by people: never overwritten
+PRESERVED_STATUS = (models.DocumentStatus.FEITO, models.DocumentStatus.REVISAO)
+FIELDS = ('tipo', 'subtipo', 'status', 'fornecedor', 'cnpj', 'numero_documento', 'valor', 'metadados')
+
+
+def label(tipo, subtipo) -> str:
+    """Subtipo name, or the tipo for documentos without one."""
+    value = subtipo if subtipo is not None else tipo
+    return getattr(value, 'name', value) or '-'
+
+
+# runs in worker processes: module-level so it can be pickled
+
+def analyse(items: List[dict]) -> List[dict]:
+    out = []
+    for item in items:
+        corpo = item['corpo'] or ''
+        c = classify_email(corpo, item['anexos'], item['remetente'] or '')
+        out.append({'classificacao': c, 'dados': extract_financial_data(corpo, item['anexos'], c.get('tipo'), c.get('subtipo'))})
+    return out
+
+
+def new_values(analysis: dict) -> dict:
+    """DocumentoFinanceiro columns for one analysis result (same mapping as ingestion)."""
+    c = analysis['classificacao']
+    fields = _document_fields(analysis['dados'])
+    valor = fields.get('valor')
+    return {
+        'tipo': models.DocumentType[c['tipo']],
+        'subtipo': models.DocumentSubtipo[c['subtipo']] if c.get('subtipo') else None,
+        'status': _classification_status(c.get('confidence', 0)),
+        'fornecedor': fields.get('fornecedor'),
+        'cnpj': fields.get('cnpj'),
+        'numero_documento': fields.get('numero_documento'),
+        'valor': Decimal(str(valor)).quantize(Decimal('0.01')) if valor is not None else None,
+        'metadados': fields.get('metadados'),
+    }
+
+
+def changed_fields(old: dict, new: dict) -> List[str]:
+    changed = []
+    for field in FIELDS:
+        a, b = old.get(field), new.get(field)
+        if field == 'valor' and a is not None and b is not None:
+            a, b = Decimal(a).quantize(Decimal('0.01')), Decimal(b).quantize(Decimal('0.01'))
+        if a != b:
+            changed.append(field)
+    return changed
+
+
+def _event(old: dict, new: dict, changed: List[str], confidence) -> str:
+    parts = []
+    if 'tipo' in changed or 'subtipo' in changed:
+        parts.append(f"Reclassificado: {label(old['tipo'], old['subtipo'])} -> {label(new['tipo'], new['subtipo'])} (conf={confidence})")
+    elif 'status' in changed:
+        parts.append(f"Status: {label(old['status'], None)} -> {new['status'].name} (conf={confidence})")
+    campos = [f for f in changed if f not in ('tipo', 'subtipo', 'status')]
+    if campos:
+        parts.append('Dados reextraídos: ' + ', '.join(campos))
+    return 'Backfill - ' + '; '.join(parts)
+
+
+def _load_anexos(db, email_ids) -> Dict:
+    A = models.Anexo
+    rows = db.execute(
+        select(A.email_id, A.nome_arquivo, A.caminho_arquivo)
+        .where(A.email_id.in_(email_ids))
+        .order_by(A.email_id, A.criado_em, A.nome_arquivo)
+    )
+    anexos = {}
+    for email_id, nome, caminho in rows:
+        anexos.setdefault(email_id, []).append({'nome_arquivo': nome, 'caminho_arquivo': caminho})
+    return anexos
+
+
+def _pending():
+    D = models.DocumentoFinanceiro
+    return (D.confirmado_em.is_(None), or_(D.status.is_(None), D.status.not_in(PRESERVED_STATUS)))
+
+
+def _lock(db, ids) -> Dict:
+    """Current values of the documentos in `ids` still open to the backfill, locked FOR UPDATE."""
+    D = models.DocumentoFinanceiro
+    rows = db.execute(
+        select(D.id, *(getattr(D, f) for f in FIELDS), D.criado_em)
+        .where(D.id.in_(ids), *_pending())
+        .order_by(D.id)
+        .with_for_update()
+    )
+    return {r.id: r for r in rows}
+
+
+def _checkpoint(db, nome: str, reiniciar: bool) -> models.BackfillCheckpoint:
+    cp = db.get(models.BackfillCheckpoint, nome)
+    if cp is None:
+        cp = models.BackfillCheckpoint(nome=nome, processados=0, alterados=0)
+        db.add(cp)
+    elif reiniciar or cp.concluido_em is not None:
+        # a finished run is not resumed: the same name starts over
+        cp.ultimo_id, cp.processados, cp.alterados = None, 0, 0
+        cp.iniciado_em, cp.concluido_em = func.now(), None
+    db.commit()
+    db.refresh(cp)
+    return cp
+
+
+def run_backfill(session_factory=SessionLocal, nome: str = 'padrao', chunk_size: int = BACKFILL_CHUNK_SIZE,
+                 processes: int = BACKFILL_PROCESSES, dry_run: bool = False, reiniciar: bool = False,
+                 limite: int | None = None, on_chunk: Callable[[dict], None] | None = None) -> dict:
+    """Reclassify and re-extract documentos; returns counts and the label confusion matrix.
+
+    `limite` stops after that many documentos (the checkpoint keeps the
+    position); `on_chunk(totals)` is called after each committed chunk.
+    """
+    D, E = models.DocumentoFinanceiro, models.Email
+    totals = {'processados': 0, 'alterados': 0, 'reclassificados': 0, 'campos': Counter(), 'matriz': Counter()}
+    pool = None
+    if processes > 1:
+        pool = ProcessPoolExecutor(max_workers=processes, initializer=supplier_registry.init_worker,
+                                   initargs=(supplier_registry.REGISTRY.snapshot(),))
+    with session_factory() as read, session_factory() as write:
+        after = None
+        if not dry_run:
+            cp = _checkpoint(write, nome, reiniciar)
+            after = cp.ultimo_id
+        stmt = (
+            select(D.id, D.email_id, D.tipo, D.subtipo, D.status, D.fornecedor, D.cnpj, D.numero_documento,
+                   D.valor, D.metadados, D.criado_em, E.corpo, E.remetente)
+            .join(E, E.id == D.email_id)
+            .where(*_pending())
+            .order_by(D.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        if after is not None:
+            stmt = stmt.where(D.id > after)
+        try:
+            for rows in read.execute(stmt).partitions():
+                if limite is not None:
+                    rows = rows[:max(limite - totals['processados'], 0)]
+                    if not rows:
+                        break
+                anexos = _load_anexos(write, {r.email_id for r in rows})
+                items = [{'corpo': r.corpo, 'remetente': r.remetente, 'anexos': anexos.get(r.email_id, [])} for r in rows]
+                if pool is None:
+                    results = analyse(items)
+                else:
+                    step = max(1, -(-len(items) // processes))
+                    results = [a for part in pool.map(analyse, [items[i:i + step] for i in range(0, len(items), step)]) for a in part]
+
+                # compare with the rows as they are now, locked until the commit: a documento
+                # confirmed or sent to review while the chunk was analysed is left alone
+                current = {r.id: r for r in rows} if dry_run else _lock(write, [r.id for r in rows])
+                updates, events, changes, reextracted, item_rows = [], [], [], [], []
+                for row, analysis in zip(rows, results):
+                    row = current.get(row.id)
+                    if row is None:
+                        continue
+                    old = {f: getattr(row, f) for f in FIELDS}
+                    new = new_values(analysis)
+                    old_label, new_label = label(old['tipo'], old['subtipo']), label(new['tipo'], new['subtipo'])
+                    totals['matriz'][(old_label, new_label)] += 1
+                    changed = changed_fields(old, new)
+                    if not changed:
+                        continue
+                    totals['alterados'] += 1
+                    totals['reclassificados'] += old_label != new_label
+                    totals['campos'].update(changed)
+                    updates.append({'id': row.id, **new})
+                    if 'metadados' in changed:
+                        reextracted.append(row.id)
+                        item_rows += _item_rows(row.id, new['metadados'])
+                    changes.append((row, {**new, 'criado_em': row.criado_em}))
+                    events.append({'documento_id': row.id, 'evento': _event(old, new, changed, analysis['classificacao'].get('confidence'))})
+                totals['processados'] += len(rows)
+
+                if not dry_run:
+                    if updates:
+                        write.execute(update(D), updates)
+                        if reextracted:
+                            # the itens rows follow metadados['itens']
+                            write.execute(delete(models.ItemDocumento).where(models.ItemDocumento.documento_id.in_(reextracted)))
+                        if item_rows:
+                            write.execute(insert(models.ItemDocumento), item_rows)
+                        write.execute(insert(models.Historico), events)
+                        change_feed.record(write, [u['id'] for u in updates], change_feed.CLASSIFICADO)
+                        rollup.apply(write, changes)
+                    cp.ultimo_id = rows[-1].id
+                    cp.processados += len(rows)
+                    cp.alterados += len(updates)
+                    cp.atualizado_em = func.now()
+                    write.commit()
+                if on_chunk:
+                    on_chunk(totals)
+            else:
+                if not dry_run:
+                    cp.concluido_em = func.now()
+                    write.commit()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+    return totals
+
+
+def format_matrix(matrix: Counter) -> str:
+    """Confusion matrix (stored labels in rows, new labels in columns) as a text table."""
+    olds = sorted({o for o, _ in matrix})
+    news = sorted({n for _, n in matrix})
+    if not olds:
+        return '(nenhum documento)'
+    width = max(len(x) for x in olds + news + ['atual \\ novo']) + 1
+    lines = ['atual \\ novo'.ljust(width) + ''.join(n.rjust(width) for n in news)]
+    for o in olds:
+        lines.append(o.ljust(width) + ''.join(str(matrix.get((o, n), 0)).rjust(width) for n in news))
+    return '\n'.join(lines)
@@ -0,0 +1,112 @@
+"""Batch classification: score many e-mails at once.
+
+Keyword hits for every e-mail go into a (documents x FEATURES) boolean matrix
+and the five subtype scores plus the priority thresholds of
+`advanced_classifier.classify_email` are applied as array operations. The
+float operations mirror the single-email scorers step by step, so results are
+identical to calling `classify_email` in a loop.
+
+NumPy is optional: without it the batch falls back to the per-email loop.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Sequence
+
+from app.services import advanced_classifier as ac
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is listed in requirements.txt
+    np = None
+
+_COL = {name: i for i, name in enumerate(ac.FEATURES)}
+_THRESHOLDS = [thr for _, _, thr in ac.SUBTYPE_PRIORITY]
+
+
+def _unpack(item) -> tuple:
+    """Accept {'text','attachments','remetente'} dicts or (text, attachments, remetente) tuples."""
+    if isinstance(item, dict):
+        return item.get('text'), item.get('attachments') or [], item.get('remetente')
+    text, attachments, remetente = (tuple(item) + (None, None))[:3]
+    return text, attachments or [], remetente
+
+
+def feature_matrix(batch: Sequence) -> 'np.ndarray':
+    """Build the boolean (documents x FEATURES) matrix for `batch`."""
+    rows = [ac.extract_features(*_unpack(item)) for item in batch]
+    return np.array(rows, dtype=bool).reshape(len(rows), len(ac.FEATURES))
+
+
+def score_matrix(features: 'np.ndarray') -> 'np.ndarray':
+    """Return the (documents x 5) score matrix, columns ordered as SUBTYPE_PRIORITY."""
+    f = {name: features[:, i] for name, i in _COL.items()}
+
+    def add(score, cond, value):
+        return score + np.where(cond, value, 0.0)
+
+    def at_least(score, cond, value):
+        return np.where(cond, np.maximum(score, value), score)
+
+    zero = np.zeros(features.shape[0])
+
+    req = add(zero, f['requisicao'], 0.8)
+    req = add(req, f['remetente_interno'], 0.1)
+    req = add(req, f['sem_xml'], 0.05)
+
+    frete = add(zero, f['frete'], 0.6)
+    frete = at_least(frete, f['cte'], 0.9)
+    frete = at_least(frete, f['cte_xml'], 0.95)
+    frete = add(frete, f['transportadora'], 0.2)
+
+    serv = add(zero, f['servico'], 0.7)
+    serv = at_least(serv, f['iss'], 0.9)
+    serv = add(serv, ~f['ncm'], 0.05)
+
+    prod = add(zero, f['produto'], 0.4)
+    prod = add(prod, f[ac.NCM_CODE_RULE] | f['ncm'], 0.5)
+    prod = add(prod, f['quantidade'], 0.2)
+    prod = at_least(prod, f['nfe_xml'], 0.95)
+
+    mat = add(zero, f['material'], 0.7)
+    mat = add(mat, f['material_dica'], 0.15)
+
+    return np.column_stack([
+        np.minimum(req, 0.99),
+        np.minimum(frete, 0.99),
+        np.minimum(serv, 0.99),
+        np.minimum(prod, 0.99),
+        np.minimum(mat, 0.95),
+    ])
+
+
+def _classify_chunk(batch: Sequence) -> List[dict]:
+    if not batch:
+        return []
+    scores = score_matrix(feature_matrix(batch))
+    passed = scores >= np.array(_THRESHOLDS)
+    # first subtype (in priority order) over its threshold, else the best score
+    choice = np.where(passed.any(axis=1), passed.argmax(axis=1), scores.argmax(axis=1))
+    out = []
+    for row, col in zip(scores.tolist(), choice.tolist()):
+        tipo, subtipo, _ = ac.SUBTYPE_PRIORITY[col]
+        out.append({'tipo': tipo, 'subtipo': subtipo, 'confidence': round(row[col], 2)})
+    return out
+
+
+def classify_batch(batch: Iterable, processes: int | None = None, chunk_size: int = 5000) -> List[dict]:
+    """Classify every item of `batch`, returning results in input order.
+
+    With `processes` > 1 and a batch larger than `chunk_size`, chunks are scored
+    in a process pool.
+    """
+    batch = list(batch)
+    if np is None:
+        return [ac.classify_email(*_unpack(item)) for item in batch]
+    if not processes or processes <= 1 or len(batch) <= chunk_size:
+        return _classify_chunk(batch)
+
+    chunks = [batch[i:i + chunk_size] for i in range(0, len(batch), chunk_size)]
+    results: List[dict] = []
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for part in pool.map(_classify_chunk, chunks):
+            results.extend(part)
+    return results
@@ -0,0 +1,324 @@
+"""Change feed of documentos for the inbox (GET /documentos/eventos, SSE).
+
+Writers call `record` inside the transaction that creates, reclassifies or
+confirms documentos: it adds one documento_eventos row per documento and, on
+Postgres, a NOTIFY on CHANGE_FEED_CHANNEL that is delivered at commit. The
+row id is the SSE event id, so a client reconnecting with Last-Event-ID gets
+what it missed from the table.
+
+Each API process runs one ChangeFeed: a thread that LISTENs on the channel
+(other databases, or a failed LISTEN, fall back to polling every
+CHANGE_FEED_POLL_INTERVAL seconds), reads new events with one query per
+wakeup and hands them to every subscriber's in-memory buffer. A connected
+reviewer therefore costs a buffer, not a query. A subscriber that falls
+CHANGE_FEED_BUFFER events behind is dropped; its EventSource reconnects and
+resumes from the table.
+
+Event ids come from a sequence, so a transaction may commit an id lower than
+one already delivered (a backfill chunk or a bulk page takes hundreds of ids
+and commits after writers that took later ones). Every id skipped below the
+newest delivered one is kept as a gap, and each wakeup also reads the gaps
+back; a gap that has not appeared after CHANGE_FEED_GAP_TIMEOUT seconds was
+rolled back and is forgotten.
+"""
+import asyncio
+import os
+import select as select_module
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, List, Tuple
+
+from sqlalchemy import delete, func, insert, select, text
+
+from app.db import models
+from app.db.session import SessionLocal
+
+CHANGE_FEED_CHANNEL = 'documentos'
+CHANGE_FEED_POLL_INTERVAL = float(os.environ.get('CHANGE_FEED_POLL_INTERVAL') or 2)
+CHANGE_FEED_HEARTBEAT = float(os.environ.get('CHANGE_FEED_HEARTBEAT') or 15)
+CHANGE_FEED_BUFFER = int(os.environ.get('CHANGE_FEED_BUFFER') or 1000)
+CHANGE_FEED_REPLAY_LIMIT = int(os.environ.get('CHANGE_FEED_REPLAY_LIMIT') or 1000)
+CHANGE_FEED_GAP_TIMEOUT = float(os.environ.get('CHANGE_FEED_GAP_TIMEOUT') or 600)
+CHANGE_FEED_RETENTION_DAYS = float(os.environ.get('CHANGE_FEED_RETENTION_DAYS') or 7)
+
+CRIADO = 'criado'
+CLASSIFICADO = 'classificado'
+CONFIRMADO = 'confirmado'
+
+_NOTIFY = text('SELECT pg_notify(:canal, NULL)')
+# most gaps tracked at once (a sequence moved by hand would otherwise open millions)
+MAX_GAPS = 100_000
+
+
+def _rows(documento_ids: Iterable, tipo: str) -> List[dict]:
+    return [{'documento_id': i, 'tipo': tipo} for i in documento_ids]
+
+
+def record(db, documento_ids: Iterable, tipo: str):
+    """Add feed events for `documento_ids` to the current transaction (the caller commits)."""
+    rows = _rows(documento_ids, tipo)
+    if not rows:
+        return
+    db.execute(insert(models.DocumentoEvento), rows)
+    if db.get_bind().dialect.name == 'postgresql':
+        db.execute(_NOTIFY, {'canal': CHANGE_FEED_CHANNEL})
+
+
+async def record_async(db, documento_ids: Iterable, tipo: str):
+    """record for an AsyncSession."""
+    rows = _rows(documento_ids, tipo)
+    if not rows:
+        return
+    await db.execute(insert(models.DocumentoEvento), rows)
+    if db.get_bind().dialect.name == 'postgresql':
+        await db.execute(_NOTIFY, {'canal': CHANGE_FEED_CHANNEL})
+
+
+def purge(db, dias: float = CHANGE_FEED_RETENTION_DAYS) -> int:
+    """Delete events older than `dias` days; clients further behind get 'recarregar'."""
+    E = models.DocumentoEvento
+    cutoff = datetime.now(tz=timezone.utc) - timedelta(days=dias)
+    removed = db.execute(delete(E).where(E.criado_em < cutoff)).rowcount
+    db.commit()
+    return removed
+
+
+def events_statement(ids=None, after: int | None = None, limit: int | None = None):
+    """Events joined with the inbox columns of their documento (current values), in id order."""
+    E, D = models.DocumentoEvento, models.DocumentoFinanceiro
+    stmt = (
+        select(
+            E.id.label('evento_id'), E.tipo.label('evento'),
+            D.id, D.tipo, D.subtipo, D.fornecedor, D.numero_documento, D.valor,
+            D.status, D.confirmado_em, D.criado_em,
+        )
+        .join(D, D.id == E.documento_id)
+        .order_by(E.id)
+    )
+    if ids is not None:
+        stmt = stmt.where(E.id.in_(ids))
+    if after is not None:
+        stmt = stmt.where(E.id > after)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+class Subscriber:
+    """Buffer of one connected client; filled from the feed thread, read on its event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, size: int):
+        self.loop = loop
+        self.size = size
+        self.buffer = deque()
+        self.ready = asyncio.Event()
+        self.dropped = False
+
+    def push(self, events: list):
+        # runs on self.loop
+        if len(self.buffer) + len(events) > self.size:
+            self.dropped = True
+            self.buffer.clear()
+        else:
+            self.buffer.extend(events)
+        self.ready.set()
+
+    async def get(self, timeout: float) -> list | None:
+        """Pending (id, message) pairs; [] after `timeout` seconds idle, None once dropped."""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self.ready.clear()
+        if self.dropped:
+            return None
+        events = list(self.buffer)
+        self.buffer.clear()
+        return events
+
+
+class ChangeFeed:
+    """Per-process fan-out of documento_eventos to SSE subscribers.
+
+    `serialize(row)` turns an events_statement row into the message sent to
+    clients; it runs once per event, whatever the number of subscribers.
+    """
+
+    def __init__(self, session_factory=SessionLocal, serialize: Callable = None,
+                 poll_interval: float = CHANGE_FEED_POLL_INTERVAL, buffer: int = CHANGE_FEED_BUFFER,
+                 gap_timeout: float = CHANGE_FEED_GAP_TIMEOUT):
+        self.session_factory = session_factory
+        self.serialize = serialize or (lambda row: row._asdict())
+        self.poll_interval = poll_interval
+        self.buffer = buffer
+        self.gap_timeout = gap_timeout
+        self.last_id = None
+        self.listening = False
+        self.error = None
+        self._gaps = {}  # id skipped below last_id -> time.monotonic() it was first missed
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # reads
+
+    def _open_gaps(self, after: int, upto: int, seen, now: float):
+        # ids in (after, upto) not read yet: taken by transactions that have not committed
+        for i in range(max(after, upto - MAX_GAPS) + 1, upto):
+            if i not in seen:
+                self._gaps.setdefault(i, now)
+
+    def _skip_existing(self):
+        # start at the newest event; missing ids among the last `buffer` may still commit
+        E = models.DocumentoEvento
+        latest = self.latest_id()
+        floor = max(latest - self.buffer, 0)
+        with self.session_factory() as db:
+            recent = set(db.scalars(select(E.id).where(E.id > floor)))
+        with self._lock:
+            self.last_id, self._gaps = latest, {}
+            self._open_gaps(floor, latest, recent, time.monotonic())
+
+    def latest_id(self) -> int:
+        with self.session_factory() as db:
+            return db.scalar(select(func.max(models.DocumentoEvento.id))) or 0
+
+    def oldest_id(self) -> int | None:
+        with self.session_factory() as db:
+            return db.scalar(select(func.min(models.DocumentoEvento.id)))
+
+    def since(self, after: int, limit: int = CHANGE_FEED_REPLAY_LIMIT) -> List[Tuple[int, object]]:
+        """Up to `limit` (id, message) pairs after event `after` (for Last-Event-ID)."""
+        with self.session_factory() as db:
+            rows = db.execute(events_statement(after=after, limit=limit)).all()
+        return [(r.evento_id, self.serialize(r)) for r in rows]
+
+    def poll(self) -> int:
+        """Hand events not delivered yet to every subscriber; returns how many."""
+        E = models.DocumentoEvento
+        now = time.monotonic()
+        with self._lock:
+            last = self.last_id or 0
+            self._gaps = {i: t for i, t in self._gaps.items() if now - t < self.gap_timeout}
+            gaps = set(self._gaps)
+        with self.session_factory() as db:
+            # one range read from the oldest open gap: gaps are recent, so the range is short
+            ids = db.scalars(select(E.id).where(E.id >= min(gaps, default=last + 1)).order_by(E.id)).all()
+            new = [i for i in ids if i > last or i in gaps]
+            rows = db.execute(events_statement(ids=new)).all() if new else []
+        events = [(r.evento_id, self.serialize(r)) for r in rows]
+        with self._lock:
+            if new:
+                # an event of a deleted documento has no row: it still closes its gap
+                for i in new:
+                    self._gaps.pop(i, None)
+                if new[-1] > last:
+                    self._open_gaps(last, new[-1], set(new), now)
+                    self.last_id = new[-1]
+            if events:
+                for sub in list(self._subscribers):
+                    try:
+                        sub.loop.call_soon_threadsafe(sub.push, events)
+                    except RuntimeError:  # its event loop is gone
+                        self._subscribers.discard(sub)
+        return len(events)
+
+    # subscribers
+
+    def subscribe(self) -> Subscriber:
+        """Register a client on the running event loop (call start() first)."""
+        sub = Subscriber(asyncio.get_running_loop(), self.buffer)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def position(self) -> int:
+        with self._lock:
+            return self.last_id or 0
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    # thread
+
+    def start(self):
+        """Start the listener thread once; the feed begins at the newest event."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+        if self.last_id is None:
+            self._skip_existing()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def wake(self):
+        """Poll now (for writes made by this process on databases without NOTIFY)."""
+        self._wake.set()
+
+    def _bind(self):
+        return self.session_factory.kw.get('bind')
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                bind = self._bind()
+                if bind is not None and bind.dialect.name == 'postgresql' and bind.dialect.driver == 'psycopg2':
+                    self._listen(bind)
+                else:
+                    self._poll_forever()
+            except Exception as e:
+                self.error = f'{type(e).__name__}: {e}'
+                self._stop.wait(self.poll_interval)
+
+    def _poll_forever(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            self.poll()
+
+    def _listen(self, engine):
+        conn = engine.raw_connection()
+        try:
+            pg = conn.driver_connection
+            pg.autocommit = True
+            with pg.cursor() as cur:
+                cur.execute(f'LISTEN {CHANGE_FEED_CHANNEL}')
+            self.listening, self.error = True, None
+            # anything committed before LISTEN
+            self.poll()
+            next_poll = time.monotonic() + self.poll_interval
+            while not self._stop.is_set():
+                # short waits so stop() and wake() are seen; polling every
+                # poll_interval anyway means a missed NOTIFY only costs latency
+                ready, _, _ = select_module.select([pg], [], [], min(0.5, self.poll_interval))
+                if ready:
+                    pg.poll()
+                    pg.notifies.clear()
+                if ready or self._wake.is_set() or time.monotonic() >= next_poll:
+                    self._wake.clear()
+                    self.poll()
+                    next_poll = time.monotonic() + self.poll_interval
+        finally:
+            self.listening = False
+            # autocommit + LISTEN: do not hand this connection back to the pool
+            conn.invalidate()
+            conn.close()
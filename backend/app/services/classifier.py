@@ -1,3 +1,4 @@
+from app.services import supplier_registry
 from app.services.advanced_classifier import classify_email as advanced_classify
 
 
@@ -5,7 +6,31 @@ def classify_email(text: str, attachments: list[dict] | None = None, remetente:
     """Wrapper to keep backward compatibility. Calls the advanced classifier which returns
     {'tipo','subtipo','confidence'}. For backwards compatibility with older callers that expect
     only tipo/confidence, we still provide these keys.
+
+    Known suppliers are answered by the supplier registry (with 'fonte': 'registro')
+    before the keyword scorers run.
     """
+    prior = supplier_registry.prior(text, remetente)
+    if prior is not None:
+        return prior
     res = advanced_classify(text, attachments or [], remetente)
     return res
 
+
+
+def classify_emails(batch, processes: int | None = None) -> list[dict]:
+    """Classify a batch of e-mails at once (vectorized scoring).
+
+    Each item is a dict with 'text', 'attachments' and 'remetente' keys (or a
+    tuple with the same arguments as classify_email). Results come back in input
+    order and match classify_email exactly. Use `processes` to spread very large
+    batches across cores.
+    """
+    from app.services.batch_classifier import _unpack, classify_batch
+    batch = list(batch)  # read twice: priors first, then the items without one
+    priors = []
+    for item in batch:
+        text, _, remetente = _unpack(item)
+        priors.append(supplier_registry.prior(text, remetente))
+    scored = iter(classify_batch([item for item, p in zip(batch, priors) if p is None], processes=processes))
+    return [p if p is not None else next(scored) for p in priors]
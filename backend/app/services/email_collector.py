@@ -1,22 +1,400 @@
-"""Stub for email fetcher. Connects via IMAP or other APIs to fetch new emails.
-Stores metadata, body and saves attachments to disk and DB.
+"""Coletor IMAP incremental (alternativa ao Microsoft Graph).
+
+- Sincroniza por UID: a marca d'água `UIDVALIDITY:último UID` é salva por caixa/pasta em
+  `sync_cursors`; se o servidor trocar o UIDVALIDITY a pasta é relida do início (a
+  idempotência por `message_id` evita duplicatas)
+- Busca em lotes de UIDs (`IMAP_FETCH_CHUNK`): primeiro ENVELOPE/INTERNALDATE/BODYSTRUCTURE,
+  depois só o início do texto (para o preview) e, apenas das mensagens novas, as partes
+  que são anexos
+- Anexos são baixados em fatias (`BODY.PEEK[parte]<início.tamanho>`), decodificados
+  (base64/quoted-printable) aos poucos e gravados direto no `attachment_store`: a
+  mensagem inteira nunca fica em memória
+- `ImapCollector.watch` usa IMAP IDLE para pegar e-mails novos assim que chegam (ou
+  consulta periódica, se o servidor não suportar IDLE)
+- As mensagens têm o mesmo formato das do `outlook_collector`
+  ({message_id, remetente, assunto, corpo_preview, data_hora_email, webLink, attachments})
+- Usa `BODY.PEEK`, então as mensagens continuam não lidas
 """
+import base64
+import binascii
+import html
 import os
+import re
+import threading
+from email.header import decode_header, make_header
+from typing import Callable, Iterable, Iterator, List, Set, Tuple
+from urllib.parse import unquote
+
 from imapclient import IMAPClient
-from email import message_from_bytes
-
-# TODO: Implement IMAP connection, search for unseen messages, parse and persist
-
-def fetch_emails(imap_host: str, username: str, password: str, folder: str = 'INBOX'):
-    # This is a stubbed example. For production use, add robust error handling, throttling, and idempotency.
-    with IMAPClient(imap_host) as server:
-        server.login(username, password)
-        server.select_folder(folder)
-        messages = server.search(['UNSEEN'])
-        for uid, data in server.fetch(messages, ['RFC822']).items():
-            msg = message_from_bytes(data[b'RFC822'])
-            # parse message_id, from, subject, body, attachments
-            # save to DB and filesystem
-            print('Found message', uid)
-
-    return []
+
+from app.services import attachment_store
+
+IMAP_FETCH_CHUNK = int(os.environ.get('IMAP_FETCH_CHUNK', '50'))            # UIDs per FETCH
+IMAP_PART_CHUNK = int(os.environ.get('IMAP_PART_CHUNK', str(1024 * 1024)))  # bytes per attachment slice
+IMAP_IDLE_TIMEOUT = float(os.environ.get('IMAP_IDLE_TIMEOUT', '300'))       # re-issue IDLE (RFC 2177: < 29 min)
+PREVIEW_BYTES = 4096
+PREVIEW_CHARS = 255
+
+
+def _text(value) -> str | None:
+    """Decode an IMAP string (bytes, possibly RFC 2047 encoded) to str."""
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
+
+
+def _params(values) -> dict:
+    if not isinstance(values, (list, tuple)):
+        return {}
+    pairs = zip(values[::2], values[1::2])
+    return {_text(k).lower(): _text(v) for k, v in pairs}
+
+
+def _filename(params: dict, disposition_params: dict) -> str | None:
+    for source in (disposition_params, params):
+        for key in ('filename', 'name'):
+            if source.get(key):
+                return source[key]
+        # RFC 2231 (charset''percent-encoded), single segment
+        for key in ('filename*', 'name*'):
+            if source.get(key):
+                charset, _, encoded = source[key].partition("''")
+                return unquote(encoded or charset, encoding=charset if encoded else 'utf-8', errors='replace')
+    return None
+
+
+def parse_bodystructure(body, section: str = '') -> List[dict]:
+    """Flatten a BODYSTRUCTURE into leaf parts.
+
+    Each part is {section, type, encoding, size, charset, filename, disposition};
+    `section` is the IMAP part number used in `BODY[<section>]`.
+    """
+    if body and isinstance(body[0], (list, tuple)):
+        # multipart: the children come first, then the subtype and extension data
+        parts = []
+        children = body[0] if isinstance(body[0][0], (list, tuple)) else [
+            child for child in body if isinstance(child, (list, tuple))
+        ]
+        for i, child in enumerate(children, 1):
+            parts += parse_bodystructure(child, f'{section}.{i}' if section else str(i))
+        return parts
+    ctype = f'{_text(body[0])}/{_text(body[1])}'.lower()
+    params = _params(body[2])
+    encoding = (_text(body[5]) or '7bit').lower()
+    # extension data follows the basic fields: text adds a line count,
+    # message/rfc822 an envelope, a body structure and a line count
+    if ctype.startswith('text/'):
+        ext = 8
+    elif ctype == 'message/rfc822':
+        ext = 10
+    else:
+        ext = 7
+    disposition, disposition_params = None, {}
+    if len(body) > ext + 1 and isinstance(body[ext + 1], (list, tuple)) and body[ext + 1]:
+        disposition = (_text(body[ext + 1][0]) or '').lower()
+        disposition_params = _params(body[ext + 1][1] if len(body[ext + 1]) > 1 else None)
+    filename = _filename(params, disposition_params)
+    if ctype == 'message/rfc822' and not filename:
+        filename = 'mensagem.eml'
+    return [{
+        'section': section or '1',
+        'type': ctype,
+        'encoding': encoding,
+        'size': body[6] if isinstance(body[6], int) else 0,
+        'charset': params.get('charset') or 'utf-8',
+        'filename': filename,
+        'disposition': disposition,
+    }]
+
+
+def _is_attachment(part: dict) -> bool:
+    return bool(part['filename']) or part['disposition'] == 'attachment'
+
+
+def _text_part(parts: List[dict]) -> dict | None:
+    texts = [p for p in parts if p['type'] in ('text/plain', 'text/html') and not _is_attachment(p)]
+    return next((p for p in texts if p['type'] == 'text/plain'), texts[0] if texts else None)
+
+
+def decode_stream(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """Decode a transfer-encoded part chunk by chunk (chunks may split lines anywhere)."""
+    encoding = (encoding or '7bit').lower()
+    if encoding == 'base64':
+        carry = b''
+        for chunk in chunks:
+            data = carry + re.sub(rb'[^A-Za-z0-9+/=]', b'', chunk)
+            cut = len(data) // 4 * 4
+            carry = data[cut:]
+            if cut:
+                yield base64.b64decode(data[:cut])
+        if carry.rstrip(b'='):
+            yield base64.b64decode(carry + b'=' * (-len(carry) % 4))
+    elif encoding == 'quoted-printable':
+        carry = b''
+        for chunk in chunks:
+            data = carry + chunk
+            cut = data.rfind(b'\n') + 1
+            carry = data[cut:]
+            if cut:
+                yield binascii.a2b_qp(data[:cut])
+        if carry:
+            yield binascii.a2b_qp(carry)
+    else:
+        yield from chunks
+
+
+def _preview(raw: bytes, part: dict) -> str:
+    data = b''.join(decode_stream([raw], part['encoding']))
+    try:
+        text = data.decode(part['charset'], 'replace')
+    except LookupError:
+        text = data.decode('utf-8', 'replace')
+    if part['type'] == 'text/html':
+        text = html.unescape(re.sub(r'<[^>]*>', ' ', re.sub(r'(?is)<(script|style).*?</\1>', ' ', text)))
+    return ' '.join(text.split())[:PREVIEW_CHARS]
+
+
+def _body_key(data: dict, section: str):
+    # the server answers BODY.PEEK[s]<o.n> as BODY[s]<o>
+    prefix = f'BODY[{section}]'.encode()
+    return next((v for k, v in data.items() if isinstance(k, bytes) and k.startswith(prefix)), None)
+
+
+def _address(addresses) -> str | None:
+    if not addresses:
+        return None
+    a = addresses[0]
+    if a.mailbox and a.host:
+        return f'{_text(a.mailbox)}@{_text(a.host)}'
+    return _text(a.mailbox)
+
+
+class ImapCollector:
+    """Incremental IMAP collector for one account and folder; see the module docstring.
+
+    Use as a context manager (or call connect/close). Not thread-safe: one
+    IMAP connection per collector.
+    """
+
+    def __init__(self, host: str, username: str, password: str, folder: str = 'INBOX', port: int | None = None,
+                 ssl: bool = True, chunk_size: int = IMAP_FETCH_CHUNK, part_chunk: int = IMAP_PART_CHUNK,
+                 timeout: float = 60):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.folder = folder
+        self.port = port
+        self.ssl = ssl
+        self.chunk_size = max(1, chunk_size)
+        self.part_chunk = max(1024, part_chunk)
+        self.timeout = timeout
+        self.client = None
+        self.uidvalidity = None
+
+    @property
+    def mailbox(self) -> str:
+        """Key of this account in sync_cursors."""
+        return f'imap://{self.username}@{self.host}'
+
+    def connect(self):
+        self.client = IMAPClient(self.host, port=self.port, ssl=self.ssl, timeout=self.timeout)
+        # keep INTERNALDATE timezone-aware
+        self.client.normalise_times = False
+        self.client.login(self.username, self.password)
+        self._select()
+        return self
+
+    def _select(self):
+        info = self.client.select_folder(self.folder, readonly=True)
+        self.uidvalidity = int(info[b'UIDVALIDITY'])
+
+    def close(self):
+        if self.client is not None:
+            try:
+                self.client.logout()
+            except Exception:
+                pass
+            self.client = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _stream_part(self, uid: int, part: dict) -> Iterator[bytes]:
+        offset = 0
+        while True:
+            data = self.client.fetch([uid], [f'BODY.PEEK[{part["section"]}]<{offset}.{self.part_chunk}>']).get(uid, {})
+            chunk = _body_key(data, part['section']) or b''
+            if chunk:
+                yield chunk
+            offset += len(chunk)
+            if len(chunk) < self.part_chunk:
+                return
+
+    def _save_attachment(self, uid: int, part: dict) -> dict:
+        name = part['filename'] or 'attachment'
+        path = attachment_store.store_stream(decode_stream(self._stream_part(uid, part), part['encoding']), name)
+        return {'nome_arquivo': name, 'caminho_arquivo': path}
+
+    def fetch(self, uids: List[int], known_ids: Callable[[List[str]], Set[str]] | None = None) -> List[dict]:
+        """Message dicts for `uids` (one chunk); attachments of known messages are not downloaded."""
+        if not uids:
+            return []
+        meta = self.client.fetch(uids, ['ENVELOPE', 'INTERNALDATE', 'BODYSTRUCTURE'])
+        items = []
+        for uid in sorted(meta):
+            data = meta[uid]
+            env = data.get(b'ENVELOPE')
+            message_id = _text(env.message_id) if env and env.message_id else None
+            items.append((uid, message_id or f'imap:{self.uidvalidity}:{uid}', env, data))
+        if known_ids and items:
+            known = known_ids([message_id for _, message_id, _, _ in items])
+            items = [item for item in items if item[1] not in known]
+
+        # one FETCH per distinct text section for the body previews
+        parts = {uid: parse_bodystructure(data[b'BODYSTRUCTURE']) for uid, _, _, data in items}
+        texts = {uid: _text_part(p) for uid, p in parts.items()}
+        by_section = {}
+        for uid, part in texts.items():
+            if part:
+                by_section.setdefault(part['section'], []).append(uid)
+        previews = {}
+        for section, section_uids in by_section.items():
+            for uid, data in self.client.fetch(section_uids, [f'BODY.PEEK[{section}]<0.{PREVIEW_BYTES}>']).items():
+                raw = _body_key(data, section)
+                if raw is not None:
+                    previews[uid] = _preview(raw, texts[uid])
+
+        messages = []
+        for uid, message_id, env, data in items:
+            received = data.get(b'INTERNALDATE')
+            messages.append({
+                'message_id': message_id,
+                'remetente': _address(env.from_) if env else None,
+                'assunto': _text(env.subject) if env else None,
+                'corpo_preview': previews.get(uid),
+                'data_hora_email': received.isoformat() if received else None,
+                'webLink': None,
+                'attachments': [self._save_attachment(uid, p) for p in parts[uid] if _is_attachment(p)],
+            })
+        return messages
+
+    def new_uids(self, last_uid: int = 0) -> List[int]:
+        # `UID n:*` always matches the newest message, even when its UID is below n
+        return sorted(uid for uid in self.client.search(['UID', f'{last_uid + 1}:*']) if uid > last_uid)
+
+    def sync(self, watermark: str | None = None, known_ids: Callable[[List[str]], Set[str]] | None = None
+             ) -> Iterator[Tuple[List[dict], str]]:
+        """Messages newer than `watermark` ('UIDVALIDITY:UID'), one chunk at a time.
+
+        Yields `(messages, watermark)`; the watermark covers the chunk and is
+        meant to be saved once the chunk is persisted. A watermark from another
+        UIDVALIDITY restarts from the first message.
+        """
+        last_uid = 0
+        if watermark:
+            validity, _, uid = watermark.partition(':')
+            if validity == str(self.uidvalidity):
+                last_uid = int(uid or 0)
+        uids = self.new_uids(last_uid)
+        for i in range(0, len(uids), self.chunk_size):
+            chunk = uids[i:i + self.chunk_size]
+            yield self.fetch(chunk, known_ids=known_ids), f'{self.uidvalidity}:{chunk[-1]}'
+
+    def wait(self, timeout: float = IMAP_IDLE_TIMEOUT, stop: threading.Event | None = None) -> bool:
+        """Block until the folder changes (IDLE) or `timeout`; True if new mail was announced."""
+        if b'IDLE' not in self.client.capabilities():
+            (stop or threading.Event()).wait(timeout)
+            return True
+        self.client.idle()
+        try:
+            # short checks so `stop` is honored while idling
+            remaining = timeout
+            while remaining > 0 and not (stop and stop.is_set()):
+                responses = self.client.idle_check(timeout=min(remaining, 1.0))
+                if any(r[1] in (b'EXISTS', b'RECENT') for r in responses if len(r) > 1):
+                    return True
+                remaining -= 1.0
+            return False
+        finally:
+            self.client.idle_done()
+
+    def watch(self, on_messages: Callable[[List[dict], str], None], watermark: str | None = None,
+              stop: threading.Event | None = None, known_ids: Callable[[List[str]], Set[str]] | None = None,
+              idle_timeout: float = IMAP_IDLE_TIMEOUT) -> str | None:
+        """Sync, then IDLE and sync again whenever mail arrives, until `stop` is set.
+
+        `on_messages(messages, watermark)` is called per chunk. Returns the last watermark.
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            for messages, watermark in self.sync(watermark, known_ids=known_ids):
+                on_messages(messages, watermark)
+            if not stop.is_set():
+                self.wait(idle_timeout, stop=stop)
+        return watermark
+
+
+def ingest_imap(collector: ImapCollector, session_factory=None, preview_mode: str | None = None,
+                watch: bool = False, stop: threading.Event | None = None) -> dict:
+    """Persist new messages of a connected collector; the watermark lives in sync_cursors.
+
+    With `watch`, keeps going (IDLE) until `stop` is set.
+    """
+    from sqlalchemy import select
+
+    from app.db import models
+    from app.db.session import SessionLocal
+    from app.services.email_ingestor import persist_messages_bulk
+    from app.services.preview_worker import PREVIEW_MODE
+
+    db = (session_factory or SessionLocal)()
+    totals = {'inserted': 0, 'skipped': 0, 'anexos': 0, 'historicos': 0, 'conhecidos': 0}
+
+    def known_ids(ids):
+        found = set(db.scalars(select(models.Email.message_id).where(models.Email.message_id.in_(ids))))
+        totals['conhecidos'] += len(found)
+        return found
+
+    try:
+        state = db.scalars(
+            select(models.SyncCursor)
+            .where(models.SyncCursor.mailbox == collector.mailbox, models.SyncCursor.folder == collector.folder)
+        ).first()
+        if state is None:
+            state = models.SyncCursor(mailbox=collector.mailbox, folder=collector.folder)
+
+        def persist(messages, watermark):
+            stats = persist_messages_bulk(db, messages, preview_mode=preview_mode or PREVIEW_MODE)
+            for key, value in stats.items():
+                totals[key] += value
+            state.cursor = watermark
+            db.add(state)
+            db.commit()
+
+        if watch:
+            collector.watch(persist, watermark=state.cursor, stop=stop, known_ids=known_ids)
+        else:
+            for messages, watermark in collector.sync(state.cursor, known_ids=known_ids):
+                persist(messages, watermark)
+        return totals
+    finally:
+        db.close()
+
+
+def fetch_emails(imap_host: str, username: str, password: str, folder: str = 'INBOX', port: int | None = None,
+                 ssl: bool = True, criteria=('UNSEEN',)) -> List[dict]:
+    """Messages matching `criteria` (default: unread), fetched in chunks; they stay unread."""
+    with ImapCollector(imap_host, username, password, folder=folder, port=port, ssl=ssl) as collector:
+        uids = sorted(collector.client.search(list(criteria)))
+        messages = []
+        for i in range(0, len(uids), collector.chunk_size):
+            messages += collector.fetch(uids[i:i + collector.chunk_size])
+        return messages
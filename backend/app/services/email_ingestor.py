@@ -1,12 +1,17 @@
 from typing import List
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
+from decimal import Decimal, InvalidOperation
 from zoneinfo import ZoneInfo
 import os
+import uuid
 
-from app.services.outlook_collector import fetch_outlook_emails
-from app.services.classifier import classify_email
-from app.services.extractor import extract_financial_data
-from app.services.preview import generate_preview
+from sqlalchemy import insert, select
+
+from app.services import change_feed, rollup
+from app.services.outlook_collector import fetch_outlook_emails, iter_outlook_delta
+from app.services.result_cache import classify_email, extract_financial_data
+from app.services.preview import prerender
+from app.services.preview_worker import PREVIEW_MODE, PreviewQueue
 from app.services.history import log_event
 from app.db.session import SessionLocal
 from app.db import models
@@ -30,124 +35,411 @@ def _local_now() -> datetime:
         return datetime.now(tz=timezone.utc)
 
 
+def _attachment_tipo(nome_arquivo: str) -> str:
+    return 'pdf' if (nome_arquivo or '').lower().endswith('.pdf') else 'imagem'
+
+
+def _classification_status(confidence: float) -> models.DocumentStatus:
+    return models.DocumentStatus.CLASSIFICADO if confidence >= 0.8 else models.DocumentStatus.PENDENTE
+
+
+def _document_fields(extracted: dict) -> dict:
+    """Map extractor output to DocumentoFinanceiro columns (extra keys go to metadados)."""
+    fields = {}
+    for key in ('fornecedor', 'cnpj', 'numero_documento'):
+        if extracted.get(key):
+            fields[key] = extracted.get(key)
+    if extracted.get('valor'):
+        try:
+            fields['valor'] = float(extracted.get('valor'))
+        except Exception:
+            pass
+    # save any extra fields into metadados (JSONB on Postgres)
+    extra_meta = {k:v for k,v in extracted.items() if k not in ['fornecedor','cnpj','numero_documento','valor']}
+    if extra_meta:
+        fields['metadados'] = extra_meta
+    return fields
+
+
+def _number(value):
+    try:
+        return Decimal(str(value)) if value is not None else None
+    except InvalidOperation:
+        return None
+
+
+def _item_rows(documento_id, metadados) -> List[dict]:
+    """Rows of the itens table for metadados['itens'] (line items of an NF_PRODUTO)."""
+    itens = (metadados or {}).get('itens')
+    if not isinstance(itens, list):
+        return []
+    return [
+        {'documento_id': documento_id, 'posicao': posicao, 'descricao': item.get('descricao'),
+         'quantidade': _number(item.get('quantidade')), 'valor': _number(item.get('valor')), 'ncm': item.get('ncm')}
+        for posicao, item in enumerate(itens, start=1) if isinstance(item, dict)
+    ]
+
+
+def _insert_new_emails(db, rows: List[dict]):
+    """INSERT ... ON CONFLICT (message_id) DO NOTHING RETURNING id, in the session's dialect."""
+    if db.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    stmt = (
+        dialect_insert(models.Email)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=[models.Email.message_id])
+        .returning(models.Email.id)
+    )
+    return set(db.scalars(stmt))
+
+
+def persist_messages_bulk(db, messages: List[dict], preview_mode: str = PREVIEW_MODE) -> dict:
+    """Set-based persistence for a page of messages.
+
+    Idempotency is checked for the whole page with one `message_id IN (...)`
+    query (plus ON CONFLICT DO NOTHING for concurrent ingestors); emails,
+    anexos, documentos and historicos are then inserted with one statement per
+    table inside a single transaction. Classification, extraction and inline
+    previews run before any row is written (the idempotency SELECT has already
+    begun the transaction, but holds no locks); with `preview_mode='pool'`
+    previews render in worker processes and are stored after the commit.
+
+    Messages prepared by the ingestion pipeline (see ingest_pipeline) already
+    carry 'classificacao', 'dados' and per-attachment 'preview_imagem' /
+    'preview_erro'; those are stored as they are instead of being recomputed.
+    """
+    ids = [m.get('message_id') for m in messages if m.get('message_id')]
+    existing = set()
+    if ids:
+        existing = set(db.scalars(select(models.Email.message_id).where(models.Email.message_id.in_(ids))))
+
+    email_rows, anexo_rows, doc_rows, item_rows, hist_rows = [], [], [], [], []
+    skipped = 0
+    queue = PreviewQueue() if preview_mode == 'pool' else None
+    seen = set(existing)
+    for m in messages:
+        message_id = m.get('message_id')
+        if not message_id or message_id in seen:
+            skipped += 1
+            continue
+        seen.add(message_id)
+
+        email_id = uuid.uuid4()
+        doc_id = uuid.uuid4()
+        corpo = m.get('corpo_preview') or ''
+        remetente = m.get('remetente') or ''
+        email_rows.append({
+            'id': email_id,
+            'message_id': message_id,
+            'remetente': remetente,
+            'assunto': m.get('assunto'),
+            'corpo': corpo,
+            'data_hora_email': _parse_graph_datetime(m.get('data_hora_email')),
+            'link_email_original': m.get('webLink'),
+        })
+        anexos = [
+            {
+                'id': uuid.uuid4(),
+                'email_id': email_id,
+                'nome_arquivo': a.get('nome_arquivo'),
+                'tipo': _attachment_tipo(a.get('nome_arquivo')),
+                'caminho_arquivo': a.get('caminho_arquivo'),
+                'preview_imagem': a.get('preview_imagem'),
+            }
+            for a in m.get('attachments', []) if a.get('caminho_arquivo')
+        ]
+        preview_erros = [a['preview_erro'] for a in m.get('attachments', []) if a.get('preview_erro')]
+        anexo_dicts = [{'nome_arquivo': x['nome_arquivo'], 'caminho_arquivo': x['caminho_arquivo']} for x in anexos]
+
+        classification = m.get('classificacao') or classify_email(corpo, anexo_dicts, remetente)
+        tipo = classification.get('tipo')
+        subtipo = classification.get('subtipo')
+        confidence = classification.get('confidence', 0)
+        extracted = m['dados'] if 'dados' in m else extract_financial_data(corpo, anexo_dicts, tipo, subtipo)
+        fields = _document_fields(extracted)
+        doc_rows.append({
+            'id': doc_id,
+            'email_id': email_id,
+            'tipo': models.DocumentType[tipo],
+            'subtipo': models.DocumentSubtipo[subtipo] if subtipo else None,
+            'status': _classification_status(confidence),
+            'fornecedor': fields.get('fornecedor'),
+            'cnpj': fields.get('cnpj'),
+            'numero_documento': fields.get('numero_documento'),
+            'valor': fields.get('valor'),
+            'metadados': fields.get('metadados'),
+            'criado_em': models.now_utc(),
+        })
+        item_rows.extend(_item_rows(doc_id, fields.get('metadados')))
+
+        eventos = [f'Email ingerido: {message_id}']
+        eventos += [f'Anexo salvo: {x["nome_arquivo"]}' for x in anexos]
+        eventos.append(f'Classificado como {tipo} (conf={confidence})')
+        if fields:
+            eventos.append('Dados extraídos e salvos')
+        for x in anexos:
+            if x['preview_imagem']:
+                eventos.append(f'Preview gerado para {x["nome_arquivo"]}')
+                continue
+            if queue is not None:
+                queue.submit(x['id'], doc_id, x['nome_arquivo'], x['caminho_arquivo'])
+                continue
+            if preview_mode != 'inline':
+                continue
+            try:
+                x['preview_imagem'] = prerender(x['caminho_arquivo'])
+                eventos.append(f'Preview gerado para {x["nome_arquivo"]}')
+            except Exception as e:
+                eventos.append(f'Erro ao gerar preview: {e}')
+        eventos += [f'Erro ao gerar preview: {e}' for e in preview_erros]
+        anexo_rows.extend(anexos)
+        # explicit, strictly increasing timestamps keep the per-document event order
+        base = datetime.now(tz=timezone.utc)
+        hist_rows.extend(
+            {'id': uuid.uuid4(), 'documento_id': doc_id, 'evento': ev, 'usuario': None, 'data_hora': base + timedelta(microseconds=i)}
+            for i, ev in enumerate(eventos)
+        )
+
+    inserted_ids = set()
+    try:
+        if email_rows:
+            inserted_ids = _insert_new_emails(db, email_rows)
+        # drop dependents of emails another ingestor inserted meanwhile
+        lost = {r['id'] for r in email_rows} - inserted_ids
+        if lost:
+            skipped += len(lost)
+            lost_docs = {d['id'] for d in doc_rows if d['email_id'] in lost}
+            anexo_rows = [r for r in anexo_rows if r['email_id'] not in lost]
+            doc_rows = [r for r in doc_rows if r['email_id'] not in lost]
+            item_rows = [r for r in item_rows if r['documento_id'] not in lost_docs]
+            hist_rows = [r for r in hist_rows if r['documento_id'] not in lost_docs]
+        if anexo_rows:
+            db.execute(insert(models.Anexo), anexo_rows)
+        if doc_rows:
+            db.execute(insert(models.DocumentoFinanceiro), doc_rows)
+        if item_rows:
+            db.execute(insert(models.ItemDocumento), item_rows)
+        if hist_rows:
+            db.execute(insert(models.Historico), hist_rows)
+        change_feed.record(db, [r['id'] for r in doc_rows], change_feed.CRIADO)
+        rollup.apply(db, [(None, r) for r in doc_rows])
+        db.commit()
+    except Exception:
+        db.rollback()
+        if queue is not None:
+            queue.cancel()
+        raise
+    if queue is not None:
+        # previews of emails lost to a concurrent ingestor have no row to update
+        queue.drain(db, only={r['id'] for r in anexo_rows})
+
+    return {
+        'inserted': len(inserted_ids),
+        'skipped': skipped,
+        'anexos': len(anexo_rows),
+        'historicos': len(hist_rows),
+    }
+
+
 class EmailIngestor:
-    def __init__(self, tenant_id: str, client_id: str, client_secret: str, user_email: str, folder: str = 'Inbox'):
+    def __init__(self, tenant_id: str, client_id: str, client_secret: str, user_email: str, folder: str = 'Inbox', max_workers: int = 1,
+                 preview_mode: str = PREVIEW_MODE, session=None, session_factory=SessionLocal):
         self.tenant_id = tenant_id
         self.client_id = client_id
         self.client_secret = client_secret
         self.user_email = user_email
         self.folder = folder
+        # > 1 enables the concurrent attachment download of outlook_collector
+        self.max_workers = max_workers
+        # pool | inline | lazy (see preview_worker)
+        self.preview_mode = preview_mode
+        # shared requests.Session (one connection pool per host) and database sessions
+        self.session = session
+        self.session_factory = session_factory
+
+    def _fetch(self, top: int) -> List[dict]:
+        return fetch_outlook_emails(self.tenant_id, self.client_id, self.client_secret, self.user_email, folder=self.folder, top=top, max_workers=self.max_workers,
+                                    session=self.session)
 
     def ingest(self, top: int = 50) -> List[models.Email]:
-        db = SessionLocal()
+        db = self.session_factory()
         try:
-            messages = fetch_outlook_emails(self.tenant_id, self.client_id, self.client_secret, self.user_email, folder=self.folder, top=top)
-            ingested = []
-            for m in messages:
-                message_id = m.get('message_id')
-                # Idempotency: skip if message_id exists
-                exists = db.query(models.Email).filter(models.Email.message_id == message_id).first()
-                if exists:
-                    # already ingested
-                    continue
+            return self.persist_messages(db, self._fetch(top))
+        finally:
+            db.close()
 
-                # parse datetime
-                dt = _parse_graph_datetime(m.get('data_hora_email'))
-
-                email = models.Email(
-                    message_id=message_id,
-                    remetente=m.get('remetente') or '',
-                    assunto=m.get('assunto'),
-                    corpo=m.get('corpo_preview') or '',
-                    data_hora_email=dt,
-                    link_email_original=m.get('webLink')
-                )
-                db.add(email)
-                db.commit()
-                db.refresh(email)
-
-                # persist anexos
-                anexos = []
-                for a in m.get('attachments', []):
-                    if a.get('caminho_arquivo'):
-                        tipo = 'pdf' if a.get('nome_arquivo','').lower().endswith('.pdf') else 'imagem'
-                        anexo = models.Anexo(
-                            email_id=email.id,
-                            nome_arquivo=a.get('nome_arquivo'),
-                            tipo=tipo,
-                            caminho_arquivo=a.get('caminho_arquivo')
-                        )
-                        db.add(anexo)
-                        db.commit()
-                        db.refresh(anexo)
-                        anexos.append(anexo)
-
-                # classification
-                classification = classify_email(email.corpo, [{'nome_arquivo': x.nome_arquivo, 'caminho_arquivo': x.caminho_arquivo} for x in anexos], email.remetente)
-                tipo = classification.get('tipo')
-                subtipo = classification.get('subtipo')
-                confidence = classification.get('confidence', 0)
-                status = models.DocumentStatus.CLASSIFICADO if confidence >= 0.8 else models.DocumentStatus.PENDENTE
-
-                doc = models.DocumentoFinanceiro(
-                    email_id=email.id,
-                    tipo=models.DocumentType[tipo],
-                    subtipo=models.DocumentSubtipo[subtipo] if subtipo else None,
-                    status=status
-                )
-                db.add(doc)
-                db.commit()
-                db.refresh(doc)
-
-                # now that we have a documento_id, record ingestion and attachments in history
-                log_event(db, doc.id, f'Email ingerido: {message_id}', usuario=None)
-                for an in anexos:
-                    log_event(db, doc.id, f'Anexo salvo: {an.nome_arquivo}', usuario=None)
-
-                log_event(db, doc.id, f'Classificado como {tipo} (conf={confidence})', usuario=None)
-
-                # extraction
-                extracted = extract_financial_data(email.corpo, [{'nome_arquivo': x.nome_arquivo, 'caminho_arquivo': x.caminho_arquivo} for x in anexos], tipo, doc.subtipo.name if doc.subtipo else None)
-                changed = False
-                if extracted.get('fornecedor'):
-                    doc.fornecedor = extracted.get('fornecedor')
-                    changed = True
-                if extracted.get('cnpj'):
-                    doc.cnpj = extracted.get('cnpj')
-                    changed = True
-                if extracted.get('numero_documento'):
-                    doc.numero_documento = extracted.get('numero_documento')
-                    changed = True
-                if extracted.get('valor'):
-                    try:
-                        doc.valor = float(extracted.get('valor'))
-                        changed = True
-                    except Exception:
-                        pass
-                # save any extra fields into metadados (JSON string)
-                extra_meta = {k:v for k,v in extracted.items() if k not in ['fornecedor','cnpj','numero_documento','valor']}
-                if extra_meta:
-                    import json
-                    doc.metadados = json.dumps(extra_meta)
-                    changed = True
-                if changed:
-                    db.add(doc)
+    def ingest_bulk(self, top: int = 50) -> dict:
+        """Bulk mode of ingest: one idempotency query and one transaction per page.
+
+        Returns {'inserted', 'skipped', 'anexos', 'historicos'} counts.
+        """
+        db = self.session_factory()
+        try:
+            return persist_messages_bulk(db, self._fetch(top), preview_mode=self.preview_mode)
+        finally:
+            db.close()
+
+    def ingest_pipeline(self, top: int = 50, report=None, **options) -> dict:
+        """Pipelined ingest: downloads, classification, extraction, previews and
+        persistence of different messages overlap (see ingest_pipeline).
+
+        Returns the bulk counts plus 'erros' and per-stage 'stats'.
+        """
+        from app.services.ingest_pipeline import run_ingest_pipeline
+        options.setdefault('io_workers', max(self.max_workers, 1))
+        options.setdefault('session_factory', self.session_factory)
+        return run_ingest_pipeline(
+            self.tenant_id, self.client_id, self.client_secret, self.user_email, folder=self.folder, top=top,
+            preview_mode=self.preview_mode, report=report, **options,
+        )
+
+    def ingest_incremental(self, page_size: int = 50) -> dict:
+        """Delta sync: only new messages are downloaded and persisted (bulk path).
+
+        The Graph cursor is stored per mailbox/folder after every persisted page,
+        so an interrupted round resumes from the last page on the next run.
+        'ultimo_recebido' is the newest receivedDateTime among the new messages.
+        """
+        db = self.session_factory()
+        totals = {'inserted': 0, 'skipped': 0, 'anexos': 0, 'historicos': 0, 'conhecidos': 0}
+
+        def known_ids(ids):
+            found = set(db.scalars(select(models.Email.message_id).where(models.Email.message_id.in_(ids))))
+            totals['conhecidos'] += len(found)
+            return found
+
+        try:
+            state = (
+                db.query(models.SyncCursor)
+                .filter(models.SyncCursor.mailbox == self.user_email, models.SyncCursor.folder == self.folder)
+                .first()
+            )
+            if state is None:
+                state = models.SyncCursor(mailbox=self.user_email, folder=self.folder)
+            pages = iter_outlook_delta(
+                self.tenant_id, self.client_id, self.client_secret, self.user_email, folder=self.folder,
+                cursor=state.cursor, page_size=page_size, known_ids=known_ids, max_workers=self.max_workers,
+                session=self.session,
+            )
+            for messages, cursor in pages:
+                stats = persist_messages_bulk(db, messages, preview_mode=self.preview_mode)
+                for key, value in stats.items():
+                    totals[key] += value
+                recebidas = [m['data_hora_email'] for m in messages if m.get('data_hora_email')]
+                if recebidas:
+                    totals['ultimo_recebido'] = max(recebidas + [totals.get('ultimo_recebido') or ''])
+                if cursor:
+                    state.cursor = cursor
+                    db.add(state)
                     db.commit()
-                    log_event(db, doc.id, 'Dados extraídos e salvos', usuario=None)
-
-                # generate previews for anexos and attach to Anexo.preview_imagem
-                for a in anexos:
-                    path = a.caminho_arquivo
-                    try:
-                        preview_b64 = generate_preview(path)
-                        a.preview_imagem = preview_b64
-                        db.add(a)
-                        db.commit()
-                        log_event(db, doc.id, f'Preview gerado para {a.nome_arquivo}', usuario=None)
-                    except Exception as e:
-                        log_event(db, doc.id, f'Erro ao gerar preview: {e}', usuario=None)
-
-                ingested.append(doc)
-            return ingested
+            return totals
         finally:
             db.close()
+
+    def persist_messages(self, db, messages: List[dict]) -> List[models.DocumentoFinanceiro]:
+        """Per-row persistence path (one commit per object)."""
+        ingested = []
+        queue = PreviewQueue() if self.preview_mode == 'pool' else None
+        for m in messages:
+            message_id = m.get('message_id')
+            # Idempotency: skip if message_id exists
+            exists = db.query(models.Email).filter(models.Email.message_id == message_id).first()
+            if exists:
+                # already ingested
+                continue
+
+            # parse datetime
+            dt = _parse_graph_datetime(m.get('data_hora_email'))
+
+            email = models.Email(
+                message_id=message_id,
+                remetente=m.get('remetente') or '',
+                assunto=m.get('assunto'),
+                corpo=m.get('corpo_preview') or '',
+                data_hora_email=dt,
+                link_email_original=m.get('webLink')
+            )
+            db.add(email)
+            db.commit()
+            db.refresh(email)
+
+            # persist anexos
+            anexos = []
+            for a in m.get('attachments', []):
+                if a.get('caminho_arquivo'):
+                    tipo = _attachment_tipo(a.get('nome_arquivo'))
+                    anexo = models.Anexo(
+                        email_id=email.id,
+                        nome_arquivo=a.get('nome_arquivo'),
+                        tipo=tipo,
+                        caminho_arquivo=a.get('caminho_arquivo')
+                    )
+                    db.add(anexo)
+                    db.commit()
+                    db.refresh(anexo)
+                    anexos.append(anexo)
+
+            # classification
+            classification = classify_email(email.corpo, [{'nome_arquivo': x.nome_arquivo, 'caminho_arquivo': x.caminho_arquivo} for x in anexos], email.remetente)
+            tipo = classification.get('tipo')
+            subtipo = classification.get('subtipo')
+            confidence = classification.get('confidence', 0)
+            status = _classification_status(confidence)
+
+            doc = models.DocumentoFinanceiro(
+                email_id=email.id,
+                tipo=models.DocumentType[tipo],
+                subtipo=models.DocumentSubtipo[subtipo] if subtipo else None,
+                status=status
+            )
+            db.add(doc)
+            db.commit()
+            db.refresh(doc)
+
+            # now that we have a documento_id, record ingestion and attachments in history
+            log_event(db, doc.id, f'Email ingerido: {message_id}', usuario=None)
+            for an in anexos:
+                log_event(db, doc.id, f'Anexo salvo: {an.nome_arquivo}', usuario=None)
+
+            log_event(db, doc.id, f'Classificado como {tipo} (conf={confidence})', usuario=None)
+
+            # extraction
+            extracted = extract_financial_data(email.corpo, [{'nome_arquivo': x.nome_arquivo, 'caminho_arquivo': x.caminho_arquivo} for x in anexos], tipo, doc.subtipo.name if doc.subtipo else None)
+            fields = _document_fields(extracted)
+            for key, value in fields.items():
+                setattr(doc, key, value)
+            itens = _item_rows(doc.id, fields.get('metadados'))
+            if itens:
+                db.execute(insert(models.ItemDocumento), itens)
+            # the inbox sees the documento once it has its extracted fields
+            change_feed.record(db, [doc.id], change_feed.CRIADO)
+            rollup.apply(db, [(None, doc)])
+            if fields:
+                db.add(doc)
+                db.commit()
+                log_event(db, doc.id, 'Dados extraídos e salvos', usuario=None)
+            else:
+                db.commit()
+
+            # generate previews for anexos and attach to Anexo.preview_imagem
+            for a in anexos:
+                if queue is not None:
+                    queue.submit(a.id, doc.id, a.nome_arquivo, a.caminho_arquivo)
+                    continue
+                if self.preview_mode != 'inline':
+                    continue
+                path = a.caminho_arquivo
+                try:
+                    a.preview_imagem = prerender(path)
+                    db.add(a)
+                    db.commit()
+                    log_event(db, doc.id, f'Preview gerado para {a.nome_arquivo}', usuario=None)
+                except Exception as e:
+                    log_event(db, doc.id, f'Erro ao gerar preview: {e}', usuario=None)
+
+            ingested.append(doc)
+        if queue is not None:
+            queue.drain(db)
+        return ingested
@@ -1,59 +1,304 @@
-import re
+"""Field extraction from e-mail text, driven by a declarative rule table.
+
+EXTRACTION_RULES lists one rule per field; it is compiled once into a
+_RuleSet. Rules anchored on a keyword are looked up with `str.find` in a
+lowercase copy of the text: absent keywords skip the rule and present ones
+start its regex at the first occurrence, so most fields cost one anchored
+match instead of a case-insensitive scan of the whole text. The `itens`
+rule is a linear-time scanner instead of the old backtracking regex (which
+went cubic on long runs of whitespace).
+
+Set EXTRACTION_RULES_FILE to a JSON list in the same shape to replace the
+table; the file is re-read when it changes (checked at most every
+EXTRACTION_RULES_CHECK_INTERVAL seconds), so running workers pick up new
+rules without a restart. A file that fails to load keeps the previous rules.
+"""
+import bisect
+import hashlib
 import json
+import os
+import re
+import threading
+import time
+from typing import List
+
+EXTRACTION_RULES_FILE = os.environ.get('EXTRACTION_RULES_FILE', '')
+EXTRACTION_RULES_CHECK_INTERVAL = float(os.environ.get('EXTRACTION_RULES_CHECK_INTERVAL') or 5)
+# text beyond this many characters is not searched
+EXTRACTION_MAX_CHARS = int(os.environ.get('EXTRACTION_MAX_CHARS') or 500000)
+# rules loaded from a file only look this far past each anchor occurrence
+EXTRACTION_RULE_WINDOW = int(os.environ.get('EXTRACTION_RULE_WINDOW') or 2000)
+
+# Rule keys:
+#   campo      result key
+#   regex      pattern; group 1 is the value (case-insensitive unless ignorar_caixa is false)
+#   ancora     lowercase literal(s) every match starts with (enables the prefilter)
+#   subtipos   only run for these subtypes (default: always)
+#   conversao  'texto' (strip) | 'decimal' (1.234,56 -> 1234.56) | absent (raw group)
+#   extrator   named extractor instead of a regex ('itens')
+#   constante  fixed value set whenever the subtype matches
+#   janela     max characters searched past each anchor occurrence
+EXTRACTION_RULES: List[dict] = [
+    # common fields
+    {'campo': 'fornecedor', 'regex': r'Fornecedor[:\s]*[:\-]? *(.+)', 'ancora': 'fornecedor', 'conversao': 'texto'},
+    {'campo': 'cnpj', 'regex': r'([0-9]{2}\.?[0-9]{3}\.?[0-9]{3}/[0-9]{4}-[0-9]{2})', 'ignorar_caixa': False},
+    {'campo': 'numero_documento', 'regex': r'Nota Fiscal\s*[:#]?\s*([0-9\-\/]+)', 'ancora': 'nota fiscal'},
+    {'campo': 'valor', 'regex': r'Valor(?: Total)?[:\s]*R?\$?\s*([0-9.,]+)', 'ancora': 'valor', 'conversao': 'decimal'},
+    # NF_FRETE: transportadora, origem, destino (heuristic)
+    {'campo': 'transportadora', 'regex': r'Transportadora[:\s]*(.+)', 'ancora': 'transportadora', 'subtipos': ['NF_FRETE'], 'conversao': 'texto'},
+    {'campo': 'origem', 'regex': r'Origem[:\s]*(.+)', 'ancora': 'origem', 'subtipos': ['NF_FRETE'], 'conversao': 'texto'},
+    {'campo': 'destino', 'regex': r'Destino[:\s]*(.+)', 'ancora': 'destino', 'subtipos': ['NF_FRETE'], 'conversao': 'texto'},
+    # NF_SERVICO
+    {'campo': 'iss', 'regex': r'ISS[:\s]*([0-9.,]+)', 'ancora': 'iss', 'subtipos': ['NF_SERVICO']},
+    {'campo': 'cnae', 'regex': r'CNAE[:\s]*([0-9\-]+)', 'ancora': 'cnae', 'subtipos': ['NF_SERVICO']},
+    # NF_PRODUTO
+    {'campo': 'ncm', 'regex': r'NCM[:\s]*([0-9]{2,8})', 'ancora': 'ncm', 'subtipos': ['NF_PRODUTO']},
+    {'campo': 'itens', 'extrator': 'itens', 'ancora': ['item', 'produto'], 'subtipos': ['NF_PRODUTO']},
+    # NF_MATERIAL_INTERNO: mark as internal usage
+    {'campo': 'material_interno', 'constante': True, 'subtipos': ['NF_MATERIAL_INTERNO']},
+]
+
+_CONVERSIONS = {
+    None: lambda v: v,
+    'texto': lambda v: v.strip(),
+    'decimal': lambda v: v.replace('.', '').replace(',', '.'),
+}
+
+# Pieces of the old `(?:Item|Produto)[:\s]*([A-Za-z0-9\s\-_,]+)\s+Quantidade[:\s]*([0-9]+)`
+# findall, which _find_items reproduces without backtracking. The run class
+# spells out what re.IGNORECASE added to [A-Za-z] (İ ı ſ and the Kelvin sign)
+# so it can be matched case-sensitively, which is much faster.
+_ITEM_START = re.compile(r'(Item|Produto)[:\s]*', re.IGNORECASE)
+_ITEM_RUN = re.compile('[A-Za-z0-9\\s\\-_,\u0130\u0131\u017f\u212a]*')
+_ITEM_QTY = re.compile(r'(?<=\s)Quantidade[:\s]*([0-9]+)', re.IGNORECASE)
+
+
+def _occurrences(low: str, word: str, pos: int, endpos: int):
+    i = low.find(word, pos, endpos)
+    while i >= 0:
+        yield i
+        i = low.find(word, i + 1, endpos)
+
+
+def _find_items(t: str, low: str, pos: int, endpos: int):
+    """Same matches as the old itens regex, in O(n log n).
+
+    The description run is greedy, so for each `Item`/`Produto` the old regex
+    took the *last* `Quantidade N` reachable inside the run of description
+    characters. Every quantity clause is found once up front and picked by
+    bisection; run ends are shared by all starts inside the same run.
+    Keywords are located with `str.find` on the lowercase copy and only then
+    matched, since case-insensitive regex scanning is the slow part.
+    """
+    qty = []
+    last = -1
+    for i in _occurrences(low, 'quantidade', pos, endpos):
+        if i < last:
+            continue
+        m = _ITEM_QTY.match(t, i, endpos)
+        if m:
+            qty.append((i, m.end(), m.group(1)))
+            last = m.end()
+    if not qty:
+        return None
+    starts = [q[0] for q in qty]
+    keywords = sorted([*_occurrences(low, 'item', pos, endpos), *_occurrences(low, 'produto', pos, endpos)])
+    items = []
+    run_start = run_end = -1
+    for k in keywords:
+        if k < pos:
+            continue
+        m = _ITEM_START.match(t, k, endpos)
+        s = m.end()
+        if not run_start <= s < run_end:
+            run_start, run_end = s, _ITEM_RUN.match(t, s, endpos).end()
+        # last clause whose preceding whitespace still lies inside the run,
+        # leaving at least one description character
+        i = bisect.bisect_right(starts, run_end + 1) - 1
+        found = qty[i] if i >= 0 and starts[i] >= s + 2 else None
+        if found is None:
+            # `[:\s]*` gives back whitespace: "Item:  Quantidade 5" matches with
+            # an empty description
+            i = bisect.bisect_left(starts, s)
+            after_colon = max(t.rfind(':', m.end(1), s) + 1, m.end(1))
+            if i < len(qty) and starts[i] == s and s - after_colon >= 2:
+                found = qty[i]
+                s = starts[i] - 1
+        if found is None:
+            continue
+        items.append({'descricao': t[s:found[0] - 1].strip(), 'quantidade': int(found[2])})
+        pos = found[1]
+    return items or None
+
+
+_EXTRACTORS = {'itens': _find_items}
+
+
+# the only characters whose lower() is not one character, or that re.IGNORECASE
+# matches to an ASCII letter lower() does not produce
+_CASE_FOLD = str.maketrans({'\u0130': 'i', '\u0131': 'i', '\u017f': 's'})
+
+
+def _fold(text: str) -> str:
+    """Lowercase copy of `text`, index-aligned with it, for anchor lookups."""
+    if '\u0130' in text or '\u0131' in text or '\u017f' in text:
+        text = text.translate(_CASE_FOLD)
+    return text.lower()
+
+
+def _first(low: str, anchors: List[str], pos: int, endpos: int) -> int:
+    found = [i for i in (low.find(a, pos, endpos) for a in anchors) if i >= 0]
+    return min(found) if found else -1
+
+
+class _Rule:
+    def __init__(self, spec: dict, window: int | None):
+        self.field = spec['campo']
+        subtypes = spec.get('subtipos')
+        self.subtypes = frozenset(subtypes) if subtypes else None
+        anchors = spec.get('ancora') or []
+        self.anchors = [anchors.lower()] if isinstance(anchors, str) else [a.lower() for a in anchors]
+        self.constant = spec.get('constante')
+        self.convert = _CONVERSIONS[spec.get('conversao')]
+        self.window = spec.get('janela', window) if self.anchors else None
+        self.extractor = _EXTRACTORS[spec['extrator']] if 'extrator' in spec else None
+        self.pattern = None
+        if 'regex' in spec:
+            self.pattern = re.compile(spec['regex'], re.IGNORECASE if spec.get('ignorar_caixa', True) else 0)
+        elif self.extractor is None and self.constant is None:
+            raise ValueError(f"regra '{self.field}' sem regex, extrator ou constante")
+
+    def find(self, t: str, low: str, pos: int, endpos: int):
+        if self.extractor is not None:
+            return self.extractor(t, low, pos, endpos)
+        if not self.window:
+            m = self.pattern.search(t, pos, endpos)
+            return self.convert(m.group(1)) if m else None
+        # guard for rules we did not write: each attempt sees at most `window` chars
+        while pos >= 0:
+            m = self.pattern.match(t, pos, min(pos + self.window, endpos))
+            if m:
+                return self.convert(m.group(1))
+            pos = _first(low, self.anchors, pos + 1, endpos)
+        return None
+
+
+class _RuleSet:
+    """A compiled rule table; `version` changes whenever the table does."""
+
+    def __init__(self, rules: List[dict], window: int | None = None):
+        self.version = hashlib.sha1(json.dumps(rules, sort_keys=True).encode()).hexdigest()[:12]
+        self.rules = [_Rule(spec, window) for spec in rules]
+
+    def extract(self, text: str, subtipo: str | None = None) -> dict:
+        result = {}
+        endpos = min(len(text), EXTRACTION_MAX_CHARS)
+        low = None
+        for rule in self.rules:
+            if rule.subtypes is not None and subtipo not in rule.subtypes:
+                continue
+            if rule.constant is not None:
+                result[rule.field] = rule.constant
+                continue
+            pos = 0
+            if rule.anchors:
+                # a match starts with the anchor: skip the rule when the anchor
+                # is absent, otherwise start at its first occurrence
+                if low is None:
+                    low = _fold(text[:endpos])
+                pos = _first(low, rule.anchors, 0, endpos)
+                if pos < 0:
+                    continue
+            value = rule.find(text, low, pos, endpos)
+            if value is not None:
+                result[rule.field] = value
+        return result
+
+
+class _RulesHolder:
+    """The current _RuleSet, re-read from EXTRACTION_RULES_FILE when it changes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ruleset = _RuleSet(EXTRACTION_RULES)
+        self.source = ''  # requested file
+        self.path = None  # file the current rules came from
+        self.stamp = None
+        self.checked_at = 0.0
+        self.error = None
+
+    def get(self) -> _RuleSet:
+        path = EXTRACTION_RULES_FILE
+        now = time.monotonic()
+        if path == self.source and now - self.checked_at < EXTRACTION_RULES_CHECK_INTERVAL:
+            return self.ruleset
+        with self._lock:
+            self.checked_at = now
+            self._refresh(path)
+            return self.ruleset
+
+    def _refresh(self, path: str):
+        self.source = path
+        if not path:
+            if self.path:
+                self.ruleset, self.path, self.stamp, self.error = _RuleSet(EXTRACTION_RULES), None, None, None
+            return
+        try:
+            st = os.stat(path)
+            stamp = (st.st_mtime_ns, st.st_size)
+            if path == self.path and stamp == self.stamp:
+                return
+            with open(path, encoding='utf-8') as f:
+                ruleset = _RuleSet(json.load(f), window=EXTRACTION_RULE_WINDOW)
+        except (OSError, ValueError, KeyError, TypeError, re.error) as e:
+            # keep serving the previous rules; retried at the next check
+            self.error = f'{path}: {type(e).__name__}: {e}'
+            return
+        self.ruleset, self.path, self.stamp, self.error = ruleset, path, stamp, None
+
+    def reload(self, path: str | None = None) -> _RuleSet:
+        with self._lock:
+            self.stamp = None
+            self.checked_at = time.monotonic()
+            self._refresh(EXTRACTION_RULES_FILE if path is None else path)
+            return self.ruleset
+
+
+_RULES = _RulesHolder()
+
+
+def reload_rules(path: str | None = None) -> str:
+    """Re-read the rules file now (default EXTRACTION_RULES_FILE); returns the rules version."""
+    return _RULES.reload(path).version
+
+
+def rules_info() -> dict:
+    """Version and source of the rules in use, and the last load error."""
+    ruleset = _RULES.get()
+    return {'versao': ruleset.version, 'arquivo': _RULES.path, 'erro': _RULES.error}
+
+
+def rules_version() -> str:
+    return _RULES.get().version
 
-# Enhanced extraction that adapts based on subtype
 
 def extract_financial_data(text: str, attachments: list[dict] | None = None, tipo: str = 'OUTROS', subtipo: str | None = None) -> dict:
-    result = {}
+    """Fields from the e-mail text and its attachments.
+
+    PDF attachment text is searched after the e-mail text; fiscal XML
+    (NF-e/CT-e/NFS-e) fields override the regex matches. Attachments are
+    parsed once per file content (see attachment_text).
+    """
     t = text or ''
     attachments = attachments or []
+    anexos = {'texto': '', 'dados': {}}
+    if any(a.get('caminho_arquivo') for a in attachments):
+        from app.services.attachment_text import read_attachments
+        anexos = read_attachments(attachments)
+        if anexos['texto']:
+            t = f'{t}\n{anexos["texto"]}'
 
-    # Common fields
-    fornecedor = re.search(r'Fornecedor[:\s]*[:\-]? *(.+)', t, re.IGNORECASE)
-    cnpj = re.search(r'([0-9]{2}\.?[0-9]{3}\.?[0-9]{3}/[0-9]{4}-[0-9]{2})', t)
-    numero = re.search(r'Nota Fiscal\s*[:#]?\s*([0-9\-\/]+)', t, re.IGNORECASE)
-    valor = re.search(r'Valor(?: Total)?[:\s]*R?\$?\s*([0-9.,]+)', t, re.IGNORECASE)
-    if fornecedor:
-        result['fornecedor'] = fornecedor.group(1).strip()
-    if cnpj:
-        result['cnpj'] = cnpj.group(1)
-    if numero:
-        result['numero_documento'] = numero.group(1)
-    if valor:
-        result['valor'] = valor.group(1).replace('.', '').replace(',', '.')
-
-    # Subtype-specific extraction
-    if subtipo == 'NF_FRETE':
-        # transportadora, origem, destino (heuristic)
-        transportadora = re.search(r'Transportadora[:\s]*(.+)', t, re.IGNORECASE)
-        origem = re.search(r'Origem[:\s]*(.+)', t, re.IGNORECASE)
-        destino = re.search(r'Destino[:\s]*(.+)', t, re.IGNORECASE)
-        if transportadora:
-            result['transportadora'] = transportadora.group(1).strip()
-        if origem:
-            result['origem'] = origem.group(1).strip()
-        if destino:
-            result['destino'] = destino.group(1).strip()
-
-    if subtipo == 'NF_SERVICO':
-        iss = re.search(r'ISS[:\s]*([0-9.,]+)', t, re.IGNORECASE)
-        cnae = re.search(r'CNAE[:\s]*([0-9\-]+)', t, re.IGNORECASE)
-        if iss:
-            result['iss'] = iss.group(1)
-        if cnae:
-            result['cnae'] = cnae.group(1)
-
-    if subtipo == 'NF_PRODUTO':
-        ncm = re.search(r'NCM[:\s]*([0-9]{2,8})', t, re.IGNORECASE)
-        itens = re.findall(r'(?:Item|Produto)[:\s]*([A-Za-z0-9\s\-_,]+)\s+Quantidade[:\s]*([0-9]+)', t, re.IGNORECASE)
-        if ncm:
-            result['ncm'] = ncm.group(1)
-        if itens:
-            result['itens'] = [{'descricao': i[0].strip(), 'quantidade': int(i[1])} for i in itens]
-
-    if subtipo == 'NF_MATERIAL_INTERNO':
-        # mark as internal usage
-        result['material_interno'] = True
-
+    result = _RULES.get().extract(t, subtipo)
+    # the fiscal XML is the document itself: it beats anything matched in text
+    result.update(anexos['dados'])
     return result
-
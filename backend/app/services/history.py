@@ -16,3 +16,21 @@ def log_event(db, documento_id, evento, usuario=None):
 def list_history(db, documento_id):
     from app.db import models
     return db.query(models.Historico).filter(models.Historico.documento_id == documento_id).order_by(models.Historico.data_hora.desc()).all()
+
+
+async def log_event_async(db, documento_id, evento, usuario=None):
+    """log_event for an AsyncSession."""
+    if not documento_id:
+        return
+    from app.db import models
+    db.add(models.Historico(documento_id=documento_id, evento=evento, usuario=usuario))
+    await db.commit()
+
+
+async def list_history_async(db, documento_id):
+    from sqlalchemy import select
+    from app.db import models
+    result = await db.execute(
+        select(models.Historico).where(models.Historico.documento_id == documento_id).order_by(models.Historico.data_hora.desc())
+    )
+    return result.scalars().all()
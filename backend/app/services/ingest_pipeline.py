@@ -0,0 +1,120 @@
+"""Ingestion as a staged pipeline (see app.services.pipeline).
+
+    listagem (source) -> anexos (threads) -> classificar (processes)
+      -> extrair (processes) -> preview (processes) -> persistir (thread, batches)
+
+The source lists the folder once and drops messages already stored (one
+`IN` query); attachment downloads, classification, extraction and preview
+rendering of different messages then overlap, and `persistir` writes
+batches through persist_messages_bulk. Queues are bounded, so a slow
+database or renderer throttles the downloads instead of piling messages up
+in memory.
+"""
+import os
+from typing import Callable, List
+
+from sqlalchemy import select
+
+from app.db import models
+from app.db.session import SessionLocal
+from app.services import outlook_collector, supplier_registry
+from app.services.email_ingestor import persist_messages_bulk
+from app.services.pipeline import PIPELINE_QUEUE_SIZE, Pipeline, Stage
+from app.services.preview import prerender
+from app.services.result_cache import classify_email, extract_financial_data
+
+PIPELINE_CPU_WORKERS = int(os.environ.get('PIPELINE_CPU_WORKERS') or os.cpu_count() or 1)
+PIPELINE_BATCH_SIZE = int(os.environ.get('PIPELINE_BATCH_SIZE', '50'))
+
+
+def _anexo_dicts(m: dict) -> List[dict]:
+    return [
+        {'nome_arquivo': a['nome_arquivo'], 'caminho_arquivo': a['caminho_arquivo']}
+        for a in m.get('attachments', []) if a.get('caminho_arquivo')
+    ]
+
+
+# CPU stages run in worker processes: module-level so they can be pickled
+
+def classificar(m: dict) -> dict:
+    m['classificacao'] = classify_email(m.get('corpo_preview') or '', _anexo_dicts(m), m.get('remetente') or '')
+    return m
+
+
+def extrair(m: dict) -> dict:
+    c = m['classificacao']
+    m['dados'] = extract_financial_data(m.get('corpo_preview') or '', _anexo_dicts(m), c.get('tipo'), c.get('subtipo'))
+    return m
+
+
+def gerar_previews(m: dict) -> dict:
+    for a in m.get('attachments', []):
+        if not a.get('caminho_arquivo'):
+            continue
+        try:
+            a['preview_imagem'] = prerender(a['caminho_arquivo'])
+        except Exception as e:
+            a['preview_erro'] = str(e)
+    return m
+
+
+def build_pipeline(fetch: Callable[[dict], dict], persist: Callable[[List[dict]], dict], io_workers: int = 8,
+                   cpu_workers: int = PIPELINE_CPU_WORKERS, batch_size: int = PIPELINE_BATCH_SIZE,
+                   previews: bool = True, queue_size: int = PIPELINE_QUEUE_SIZE) -> Pipeline:
+    """Ingestion stages around `fetch(graph_message) -> message` and `persist(batch) -> counts`."""
+    stages = [
+        Stage('anexos', fetch, workers=io_workers),
+        Stage('classificar', classificar, workers=cpu_workers, kind='process',
+              initializer=supplier_registry.init_worker, initargs=(supplier_registry.REGISTRY.snapshot(),)),
+        Stage('extrair', extrair, workers=cpu_workers, kind='process'),
+    ]
+    if previews:
+        stages.append(Stage('preview', gerar_previews, workers=cpu_workers, kind='process'))
+    stages.append(Stage('persistir', persist, batch_size=batch_size))
+    return Pipeline(stages, queue_size=queue_size)
+
+
+def run_ingest_pipeline(tenant_id: str, client_id: str, client_secret: str, user_email: str, folder: str = 'Inbox',
+                        top: int = 50, io_workers: int = outlook_collector.GRAPH_MAX_WORKERS,
+                        cpu_workers: int = PIPELINE_CPU_WORKERS, batch_size: int = PIPELINE_BATCH_SIZE,
+                        preview_mode: str = 'pool', session_factory=SessionLocal,
+                        report: Callable | None = None, report_every: float = 5.0) -> dict:
+    """Ingest the latest `top` messages of a folder through the pipeline.
+
+    Previews render in the pipeline unless `preview_mode` is 'lazy'. Returns
+    the summed persist counts plus 'erros' (items dropped by a failing stage)
+    and the final pipeline 'stats'.
+    """
+    session = outlook_collector.make_session(max_per_host=max(io_workers, 1))
+    try:
+        token, values = outlook_collector.list_outlook_messages(
+            tenant_id, client_id, client_secret, user_email, folder=folder, top=top, session=session,
+        )
+        ids = [m.get('id') for m in values if m.get('id')]
+        with session_factory() as db:
+            known = set(db.scalars(select(models.Email.message_id).where(models.Email.message_id.in_(ids)))) if ids else set()
+
+        def fetch(m):
+            return outlook_collector.fetch_message(token, user_email, m, session=session)
+
+        def persist(batch):
+            with session_factory() as db:
+                # previews (if any) were rendered upstream; missing ones render on first view
+                return persist_messages_bulk(db, batch, preview_mode='lazy')
+
+        pipeline = build_pipeline(
+            fetch, persist, io_workers=io_workers, cpu_workers=cpu_workers, batch_size=batch_size,
+            previews=preview_mode != 'lazy',
+        )
+        source = (m for m in values if m.get('id') and m['id'] not in known)
+        results = pipeline.run(source, report=report, report_every=report_every)
+    finally:
+        session.close()
+
+    totals = {'inserted': 0, 'skipped': len(values) - len(ids) + len(known), 'anexos': 0, 'historicos': 0}
+    for counts in results:
+        for key in totals:
+            totals[key] += counts[key]
+    totals['erros'] = len(pipeline.errors)
+    totals['stats'] = pipeline.stats()
+    return totals
@@ -0,0 +1,309 @@
+"""Durable ingestion queue on Postgres.
+
+Each message to ingest is a row in `ingest_jobs` with the next stage to run
+(`etapa`) and the message as left by the previous stage (`payload`):
+
+    anexos  -> download the attachments (Graph)
+    analise -> classify, extract and render previews
+    gravar  -> store e-mail, anexos, documento and history, delete the job
+
+Workers claim jobs with `SELECT ... FOR UPDATE SKIP LOCKED`, so any number of
+them, on any number of nodes, share the queue without taking the same job.
+A claimed job carries a lease (`bloqueado_por`/`bloqueado_em`): the stage
+output is checkpointed after every stage, and if the worker dies the lease
+expires and another worker resumes from the saved stage. The last stage
+deletes the job in the same transaction that inserts the e-mail, so a message
+is never left half-ingested nor ingested twice. Failures are retried with
+exponential backoff; after INGEST_MAX_TENTATIVAS the job moves to
+`ingest_dead_letters`.
+"""
+import json
+import os
+import socket
+import threading
+import traceback
+import uuid
+from datetime import timedelta
+from typing import Callable, List, Set
+
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.db import models
+from app.db.session import SessionLocal
+from app.services import outlook_collector
+from app.services.email_ingestor import persist_messages_bulk
+from app.services.ingest_pipeline import classificar, extrair, gerar_previews
+from app.services.preview_worker import PREVIEW_MODE
+
+INGEST_MAX_TENTATIVAS = int(os.environ.get('INGEST_MAX_TENTATIVAS', '5'))
+INGEST_RETRY_BACKOFF = float(os.environ.get('INGEST_RETRY_BACKOFF', '30'))  # seconds, doubled per attempt
+INGEST_RETRY_BACKOFF_MAX = float(os.environ.get('INGEST_RETRY_BACKOFF_MAX', '3600'))
+INGEST_LEASE_SECONDS = float(os.environ.get('INGEST_LEASE_SECONDS', '300'))
+
+PENDENTE = 'PENDENTE'
+PROCESSANDO = 'PROCESSANDO'
+ETAPAS = ('anexos', 'analise', 'gravar')
+
+
+def retry_delay(tentativas: int, base: float = INGEST_RETRY_BACKOFF, maximo: float = INGEST_RETRY_BACKOFF_MAX) -> float:
+    return min(base * 2 ** max(tentativas - 1, 0), maximo)
+
+
+def enqueue_messages(db, mailbox: str, graph_messages: List[dict]) -> int:
+    """Queue Graph messages (metadata only) not yet stored, queued or dead. Returns jobs added."""
+    by_id = {m['id']: m for m in graph_messages if m.get('id')}
+    if not by_id:
+        return 0
+    ids = list(by_id)
+    known = set(db.scalars(select(models.Email.message_id).where(models.Email.message_id.in_(ids))))
+    known |= set(db.scalars(select(models.IngestDeadLetter.message_id).where(models.IngestDeadLetter.message_id.in_(ids))))
+    rows = [
+        {
+            'id': uuid.uuid4(),
+            'message_id': message_id,
+            'mailbox': mailbox,
+            'etapa': ETAPAS[0],
+            'status': PENDENTE,
+            'payload': json.dumps({'graph': m}),
+            'tentativas': 0,
+        }
+        for message_id, m in by_id.items() if message_id not in known
+    ]
+    if not rows:
+        return 0
+    stmt = (
+        pg_insert(models.IngestJob)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=[models.IngestJob.message_id])
+        .returning(models.IngestJob.id)
+    )
+    added = len(db.scalars(stmt).all())
+    db.commit()
+    return added
+
+
+def enqueue_outlook(tenant_id: str, client_id: str, client_secret: str, mailbox: str, folder: str = 'Inbox', top: int = 50,
+                    session_factory=SessionLocal) -> int:
+    """List the latest `top` messages of a folder (no attachment download) and queue the new ones."""
+    _, values = outlook_collector.list_outlook_messages(tenant_id, client_id, client_secret, mailbox, folder=folder, top=top)
+    with session_factory() as db:
+        return enqueue_messages(db, mailbox, values)
+
+
+def outlook_fetch(tenant_id: str, client_id: str, client_secret: str) -> Callable[[str, dict], dict]:
+    """`fetch` for IngestWorker over Graph: pooled session, token from the shared TOKEN_CACHE."""
+    session = outlook_collector.make_session()
+
+    def fetch(mailbox: str, graph_message: dict) -> dict:
+        token = outlook_collector._get_token(tenant_id, client_id, client_secret, session=session)
+        return outlook_collector.fetch_message(token, mailbox, graph_message, session=session)
+
+    return fetch
+
+
+def claim_jobs(db, worker_id: str, limit: int = 10, lease: float = INGEST_LEASE_SECONDS,
+               max_tentativas: int = INGEST_MAX_TENTATIVAS) -> List[dict]:
+    """Lease up to `limit` due jobs (pending, or whose lease expired) to `worker_id`.
+
+    A job reclaimed from an expired lease counts as a failed attempt, so a
+    message that keeps crashing its worker ends in the dead-letter table.
+    Returns plain dicts (id, message_id, mailbox, etapa, payload, tentativas).
+    """
+    J = models.IngestJob
+    now = func.now()
+    stmt = (
+        select(J)
+        .where(or_(
+            and_(J.status == PENDENTE, J.proxima_tentativa_em <= now),
+            and_(J.status == PROCESSANDO, J.bloqueado_em < now - timedelta(seconds=lease)),
+        ))
+        .order_by(J.proxima_tentativa_em)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    claimed = []
+    for job in db.scalars(stmt).all():
+        if job.status == PROCESSANDO:
+            job.tentativas += 1
+            job.ultimo_erro = f'lease expirado ({job.bloqueado_por})'
+            if job.tentativas >= max_tentativas:
+                _dead_letter(db, job, job.etapa, job.payload, job.ultimo_erro)
+                continue
+        job.status = PROCESSANDO
+        job.bloqueado_por = worker_id
+        job.bloqueado_em = now
+        claimed.append({
+            'id': job.id, 'message_id': job.message_id, 'mailbox': job.mailbox,
+            'etapa': job.etapa, 'payload': job.payload, 'tentativas': job.tentativas,
+        })
+    db.commit()
+    return claimed
+
+
+def _dead_letter(db, job: models.IngestJob, etapa: str, payload: str, erro: str):
+    db.execute(
+        pg_insert(models.IngestDeadLetter)
+        .values(id=uuid.uuid4(), message_id=job.message_id, mailbox=job.mailbox, etapa=etapa,
+                payload=payload, tentativas=job.tentativas, erro=erro)
+        .on_conflict_do_nothing(index_elements=[models.IngestDeadLetter.message_id])
+    )
+    db.delete(job)
+
+
+def _owned(job_id, worker_id):
+    J = models.IngestJob
+    return and_(J.id == job_id, J.bloqueado_por == worker_id, J.status == PROCESSANDO)
+
+
+def fail_job(db, job: dict, worker_id: str, etapa: str, payload: str, erro: str,
+             max_tentativas: int = INGEST_MAX_TENTATIVAS) -> bool:
+    """Schedule a retry with backoff, or dead-letter the job. Returns True if dead-lettered."""
+    row = db.scalars(
+        select(models.IngestJob).where(_owned(job['id'], worker_id)).with_for_update()
+    ).first()
+    if row is None:
+        # lease lost: the job belongs to another worker now
+        db.rollback()
+        return False
+    row.tentativas += 1
+    row.etapa, row.payload, row.ultimo_erro = etapa, payload, erro
+    if row.tentativas >= max_tentativas:
+        _dead_letter(db, row, etapa, payload, erro)
+        db.commit()
+        return True
+    row.status = PENDENTE
+    row.bloqueado_por = row.bloqueado_em = None
+    row.proxima_tentativa_em = func.now() + timedelta(seconds=retry_delay(row.tentativas))
+    db.commit()
+    return False
+
+
+def requeue_dead_letters(db, message_ids: List[str] | None = None) -> int:
+    """Move dead letters (all, or `message_ids`) back to the queue at the stage they failed."""
+    D = models.IngestDeadLetter
+    stmt = select(D)
+    if message_ids:
+        stmt = stmt.where(D.message_id.in_(message_ids))
+    dead = db.scalars(stmt.with_for_update()).all()
+    if not dead:
+        return 0
+    db.execute(insert(models.IngestJob), [
+        {'id': uuid.uuid4(), 'message_id': d.message_id, 'mailbox': d.mailbox, 'etapa': d.etapa,
+         'status': PENDENTE, 'payload': d.payload, 'tentativas': 0}
+        for d in dead
+    ])
+    db.execute(delete(D).where(D.id.in_([d.id for d in dead])))
+    db.commit()
+    return len(dead)
+
+
+def attachment_paths(db) -> Set[str]:
+    """Blob paths held by queued and dead-lettered messages past the 'anexos' stage.
+
+    Their Anexo rows do not exist yet (a job can wait hours in backoff, a dead
+    letter until it is requeued), so the attachment GC must keep these blobs.
+    """
+    paths = set()
+    for model in (models.IngestJob, models.IngestDeadLetter):
+        rows = db.execute(
+            select(model.payload).where(model.etapa != ETAPAS[0]).execution_options(yield_per=500)
+        )
+        for (payload,) in rows:
+            mensagem = json.loads(payload).get('mensagem') or {}
+            paths.update(a['caminho_arquivo'] for a in mensagem.get('attachments', []) if a.get('caminho_arquivo'))
+    return paths
+
+
+def queue_status(db) -> dict:
+    J = models.IngestJob
+    por_etapa = {
+        f'{status}:{etapa}': n
+        for status, etapa, n in db.execute(select(J.status, J.etapa, func.count()).group_by(J.status, J.etapa))
+    }
+    mais_antigo = db.scalar(select(func.min(J.criado_em)))
+    return {
+        'jobs': por_etapa,
+        'mortos': db.scalar(select(func.count()).select_from(models.IngestDeadLetter)),
+        'mais_antigo': mais_antigo.isoformat() if mais_antigo else None,
+    }
+
+
+class IngestWorker:
+    """Claims and runs queue jobs.
+
+    `fetch(mailbox, graph_message) -> message` downloads the attachments (see
+    outlook_collector.fetch_message); previews render in the 'analise' stage
+    unless PREVIEW_MODE is 'lazy'.
+    """
+
+    def __init__(self, fetch: Callable[[str, dict], dict], session_factory=SessionLocal, worker_id: str | None = None,
+                 batch_size: int = 10, lease: float = INGEST_LEASE_SECONDS, max_tentativas: int = INGEST_MAX_TENTATIVAS,
+                 previews: bool = PREVIEW_MODE != 'lazy'):
+        self.fetch = fetch
+        self.session_factory = session_factory
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self.batch_size = batch_size
+        self.lease = lease
+        self.max_tentativas = max_tentativas
+        self.previews = previews
+
+    def _run_stage(self, etapa: str, mailbox: str, payload: dict) -> dict:
+        if etapa == 'anexos':
+            return {'mensagem': self.fetch(mailbox, payload['graph'])}
+        m = extrair(classificar(payload['mensagem']))
+        if self.previews:
+            m = gerar_previews(m)
+        return {'mensagem': m}
+
+    def process(self, db, job: dict) -> str:
+        """Run the remaining stages of a claimed job. Returns 'ok', 'erro', 'morto' or 'perdido'."""
+        J = models.IngestJob
+        etapa, payload = job['etapa'], job['payload']
+        try:
+            while etapa != 'gravar':
+                data = self._run_stage(etapa, job['mailbox'], json.loads(payload))
+                etapa, payload = ETAPAS[ETAPAS.index(etapa) + 1], json.dumps(data)
+                # checkpoint (and renew the lease) only while we still hold the job
+                saved = db.execute(
+                    update(J).where(_owned(job['id'], self.worker_id))
+                    .values(etapa=etapa, payload=payload, bloqueado_em=func.now())
+                ).rowcount
+                db.commit()
+                if not saved:
+                    return 'perdido'
+            # the job disappears in the same transaction that stores the message
+            if not db.execute(delete(J).where(_owned(job['id'], self.worker_id))).rowcount:
+                db.rollback()
+                return 'perdido'
+            persist_messages_bulk(db, [json.loads(payload)['mensagem']], preview_mode='lazy')
+            return 'ok'
+        except Exception as e:
+            db.rollback()
+            erro = f'{type(e).__name__}: {e}\n{traceback.format_exc(limit=5)}'
+            dead = fail_job(db, job, self.worker_id, etapa, payload, erro, max_tentativas=self.max_tentativas)
+            return 'morto' if dead else 'erro'
+
+    def run_once(self) -> dict:
+        """Process up to `batch_size` jobs. Returns counts per outcome.
+
+        Jobs are claimed one at a time, right before they run: a job leased
+        with a batch could wait behind slow ones past its lease, be reclaimed
+        by another worker and be charged a failed attempt.
+        """
+        counts = {'ok': 0, 'erro': 0, 'morto': 0, 'perdido': 0}
+        with self.session_factory() as db:
+            for _ in range(self.batch_size):
+                jobs = claim_jobs(db, self.worker_id, limit=1, lease=self.lease, max_tentativas=self.max_tentativas)
+                if not jobs:
+                    break
+                counts[self.process(db, jobs[0])] += 1
+        return counts
+
+    def run(self, stop: threading.Event | None = None, idle_sleep: float = 5.0):
+        """Process jobs until `stop` is set, sleeping `idle_sleep` seconds when the queue is empty."""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            counts = self.run_once()
+            if not any(counts.values()):
+                stop.wait(idle_sleep)
@@ -0,0 +1,264 @@
+"""Scheduler that keeps many mailboxes in sync (Graph delta query).
+
+Every mailbox has its own polling interval, adapted to its traffic: a poll
+that brings new mail resets it to `min_interval`, an idle (or failing) poll
+doubles it up to `max_interval`. Due mailboxes are taken in due-time order
+and each one has at most one poll in flight, so a busy mailbox cannot starve
+the others; at most `max_concurrent` polls run at once, each downloading up
+to `concurrency` attachments in parallel.
+
+All polls share one `requests.Session` (a bounded connection pool per host)
+and the process-wide token cache of outlook_collector, so the mailboxes of
+one Azure app use a single token until it expires.
+
+`metrics()` reports, per mailbox, how stale it is (`lag_s`: time since the
+last successful poll), the delay between receiving and storing its newest
+message (`ingest_lag_s`) and how late the last poll started (`atraso_s`).
+"""
+import heapq
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, List
+
+import requests
+
+from app.db.session import SessionLocal
+from app.services import outlook_collector, result_cache
+
+SCHEDULER_MAX_CONCURRENT = int(os.environ.get('SCHEDULER_MAX_CONCURRENT', '4'))
+SCHEDULER_MIN_INTERVAL = float(os.environ.get('SCHEDULER_MIN_INTERVAL', '30'))    # seconds
+SCHEDULER_MAX_INTERVAL = float(os.environ.get('SCHEDULER_MAX_INTERVAL', '600'))
+SCHEDULER_MAILBOX_WORKERS = int(os.environ.get('SCHEDULER_MAILBOX_WORKERS', '2'))  # attachment downloads per mailbox
+
+
+class Mailbox:
+    """One mailbox/folder to poll. Credentials default to the OUTLOOK_* settings."""
+
+    def __init__(self, user_email: str, folder: str = 'Inbox', tenant_id: str | None = None, client_id: str | None = None,
+                 client_secret: str | None = None, min_interval: float = SCHEDULER_MIN_INTERVAL,
+                 max_interval: float = SCHEDULER_MAX_INTERVAL, concurrency: int = SCHEDULER_MAILBOX_WORKERS,
+                 page_size: int = 50):
+        self.user_email = user_email
+        self.folder = folder
+        self.tenant_id = tenant_id or os.environ.get('OUTLOOK_TENANT_ID')
+        self.client_id = client_id or os.environ.get('OUTLOOK_CLIENT_ID')
+        self.client_secret = client_secret or os.environ.get('OUTLOOK_CLIENT_SECRET')
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.concurrency = max(1, concurrency)
+        self.page_size = page_size
+
+    @property
+    def key(self) -> str:
+        return f'{self.user_email}/{self.folder}'
+
+
+def load_mailboxes(path: str | None = None, emails: str | None = None) -> List[Mailbox]:
+    """Mailboxes from a JSON file (list of Mailbox keyword arguments) or a comma-separated e-mail list."""
+    if path:
+        with open(path, encoding='utf-8') as f:
+            return [Mailbox(**entry) for entry in json.load(f)]
+    return [Mailbox(e.strip()) for e in (emails or '').split(',') if e.strip()]
+
+
+class _MailboxState:
+    def __init__(self, mailbox: Mailbox):
+        self.mailbox = mailbox
+        self.interval = mailbox.min_interval
+        self.polls = 0
+        self.errors = 0
+        self.inserted = 0
+        self.last_poll = None          # wall clock of the last finished poll
+        self.last_success = None
+        self.last_error = None
+        self.last_duration = 0.0
+        self.schedule_delay = 0.0
+        self.ingest_lag = None
+
+
+def _parse_received(value: str) -> float | None:
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+class MailboxScheduler:
+    """Polls `mailboxes` until stopped; see the module docstring.
+
+    `poll(mailbox, session) -> counts` defaults to an incremental ingest
+    (EmailIngestor.ingest_incremental) and must return at least 'inserted'.
+    """
+
+    def __init__(self, mailboxes: List[Mailbox], poll: Callable[[Mailbox, requests.Session], dict] | None = None,
+                 max_concurrent: int = SCHEDULER_MAX_CONCURRENT, session: requests.Session | None = None,
+                 session_factory=SessionLocal, clock: Callable[[], float] = time.monotonic):
+        keys = [m.key for m in mailboxes]
+        if len(set(keys)) != len(keys):
+            raise ValueError('mailbox/folder listed twice')
+        self.states = {m.key: _MailboxState(m) for m in mailboxes}
+        self.max_concurrent = max(1, max_concurrent)
+        # one pool per host, sized for every poll downloading at once
+        self.session = session or outlook_collector.make_session(
+            max_per_host=self.max_concurrent * max((m.concurrency for m in mailboxes), default=1),
+        )
+        self.session_factory = session_factory
+        self.poll = poll or self._ingest
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = set()
+        self._heap = [(clock(), i, m.key) for i, m in enumerate(mailboxes)]
+        self._seq = len(mailboxes)
+        heapq.heapify(self._heap)
+        self._stop = None
+        self._thread = None
+
+    def _ingest(self, mailbox: Mailbox, session: requests.Session) -> dict:
+        from app.services.email_ingestor import EmailIngestor
+        ingestor = EmailIngestor(
+            mailbox.tenant_id, mailbox.client_id, mailbox.client_secret, mailbox.user_email, folder=mailbox.folder,
+            max_workers=mailbox.concurrency, preview_mode='lazy', session=session, session_factory=self.session_factory,
+        )
+        return ingestor.ingest_incremental(page_size=mailbox.page_size)
+
+    def _next_interval(self, state: _MailboxState, novas: bool) -> float:
+        m = state.mailbox
+        if novas:
+            return m.min_interval
+        return min(max(state.interval, m.min_interval) * 2, m.max_interval)
+
+    def _run_poll(self, key: str):
+        state = self.states[key]
+        mailbox = state.mailbox
+        start = self.clock()
+        novas = False
+        try:
+            counts = self.poll(mailbox, self.session)
+            novas = counts.get('inserted', 0) > 0
+            now = time.time()
+            with self._lock:
+                state.inserted += counts.get('inserted', 0)
+                state.last_success = now
+                state.last_error = None
+                recebido = _parse_received(counts.get('ultimo_recebido'))
+                if novas and recebido is not None:
+                    state.ingest_lag = max(now - recebido, 0.0)
+        except Exception as e:
+            if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code == 401:
+                outlook_collector.invalidate_token(mailbox.tenant_id, mailbox.client_id, mailbox.client_secret)
+            with self._lock:
+                state.errors += 1
+                state.last_error = f'{type(e).__name__}: {e}'
+        finally:
+            with self._lock:
+                state.polls += 1
+                state.last_poll = time.time()
+                state.last_duration = self.clock() - start
+                state.interval = self._next_interval(state, novas)
+                heapq.heappush(self._heap, (self.clock() + state.interval, self._seq, key))
+                self._seq += 1
+                self._running.discard(key)
+            self._wake.set()
+
+    def _dispatch(self, pool: ThreadPoolExecutor) -> float | None:
+        """Start the due polls that fit; returns seconds until the next one is due."""
+        with self._lock:
+            now = self.clock()
+            while self._heap and self._heap[0][0] <= now and len(self._running) < self.max_concurrent:
+                due, _, key = heapq.heappop(self._heap)
+                self.states[key].schedule_delay = now - due
+                self._running.add(key)
+                pool.submit(self._run_poll, key)
+            if len(self._running) >= self.max_concurrent or not self._heap:
+                return None
+            return max(self._heap[0][0] - now, 0.0)
+
+    def run(self, stop: threading.Event | None = None):
+        """Poll until `stop` is set; polls in flight finish before returning."""
+        stop = stop or threading.Event()
+        with ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix='mailbox') as pool:
+            while not stop.is_set():
+                wait = self._dispatch(pool)
+                # woken by a finished poll (free slot, new due time) or by stop()
+                self._wake.wait(timeout=wait if wait is not None else 1.0)
+                self._wake.clear()
+
+    def start(self) -> threading.Event:
+        """Run in a background thread; set the returned event to stop."""
+        stop = threading.Event()
+        self._stop = stop
+        self._thread = threading.Thread(target=self.run, args=(stop,), name='mailbox-scheduler', daemon=True)
+        self._thread.start()
+        return stop
+
+    def stop(self, timeout: float | None = None):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def metrics(self) -> dict:
+        now = time.time()
+        with self._lock:
+            mailboxes = {}
+            for key, s in self.states.items():
+                mailboxes[key] = {
+                    'polls': s.polls,
+                    'erros': s.errors,
+                    'inseridos': s.inserted,
+                    'intervalo_s': s.interval,
+                    'lag_s': now - s.last_success if s.last_success else None,
+                    'ingest_lag_s': s.ingest_lag,
+                    'atraso_s': s.schedule_delay,
+                    'duracao_s': s.last_duration,
+                    'em_andamento': key in self._running,
+                    'ultimo_erro': s.last_error,
+                }
+            return {
+                'caixas': mailboxes,
+                'em_andamento': len(self._running),
+                'tokens_solicitados': outlook_collector.TOKEN_CACHE.requests,
+                'cache_resultados': result_cache.stats(),
+            }
+
+
+def prometheus_metrics(metrics: dict) -> str:
+    """`MailboxScheduler.metrics()` in the Prometheus text format."""
+    series = [
+        ('mailbox_polls_total', 'counter', 'polls', 'Polls finished'),
+        ('mailbox_poll_errors_total', 'counter', 'erros', 'Polls that failed'),
+        ('mailbox_messages_inserted_total', 'counter', 'inseridos', 'Messages stored'),
+        ('mailbox_poll_interval_seconds', 'gauge', 'intervalo_s', 'Current polling interval'),
+        ('mailbox_lag_seconds', 'gauge', 'lag_s', 'Seconds since the last successful poll'),
+        ('mailbox_ingest_lag_seconds', 'gauge', 'ingest_lag_s', 'Received-to-stored delay of the newest message'),
+        ('mailbox_schedule_delay_seconds', 'gauge', 'atraso_s', 'How late the last poll started'),
+        ('mailbox_poll_duration_seconds', 'gauge', 'duracao_s', 'Duration of the last poll'),
+    ]
+    lines = []
+    for name, kind, field, help_text in series:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        for key, m in metrics['caixas'].items():
+            if m[field] is not None:
+                mailbox, folder = key.rsplit('/', 1)
+                lines.append(f'{name}{{mailbox="{mailbox}",folder="{folder}"}} {float(m[field]):g}')
+    lines += [
+        '# HELP mailbox_polls_in_flight Polls running now', '# TYPE mailbox_polls_in_flight gauge',
+        f'mailbox_polls_in_flight {metrics["em_andamento"]}',
+        '# HELP graph_token_requests_total Token requests sent to Azure AD', '# TYPE graph_token_requests_total counter',
+        f'graph_token_requests_total {metrics["tokens_solicitados"]}',
+        '# HELP result_cache_lookups_total Classification/extraction cache lookups by tier that answered',
+        '# TYPE result_cache_lookups_total counter',
+    ]
+    cache = metrics.get('cache_resultados', {})
+    for kind, c in cache.items():
+        for tier in ('memoria', 'compartilhado', 'calculado'):
+            lines.append(f'result_cache_lookups_total{{kind="{kind}",tier="{tier}"}} {c[tier]}')
+    lines += ['# HELP result_cache_hit_ratio Share of lookups served from cache', '# TYPE result_cache_hit_ratio gauge']
+    for kind, c in cache.items():
+        if c['taxa_acerto'] is not None:
+            lines.append(f'result_cache_hit_ratio{{kind="{kind}"}} {c["taxa_acerto"]:g}')
+    return '\n'.join(lines) + '\n'
@@ -4,27 +4,122 @@ MVP behavior:
 - Usa OAuth2 client_credentials para obter token (app registra no Azure AD)
 - Lê mensagens de `/users/{user_email}/mailFolders/{folder}/messages`
 - Busca metadados: id, subject, from, bodyPreview, receivedDateTime, webLink
-- Baixa attachments (fileAttachment) e salva no STORAGE_DIR
+- Baixa attachments (fileAttachment) e salva no STORAGE_DIR (armazenamento por hash, ver `attachment_store`)
 - Retorna lista de mensagens com anexos resumidos
 
 Notas de segurança/produção:
 - Para acessar caixas de outros usuários é necessário conceder permissão Application (Mail.Read)
 - Para acessar a caixa do próprio usuário via delegated flow, use OAuth2 código/Device flow
-- Este módulo é um MVP: adicionar paginação, delta sync, retries e tratamento de erros
+- Modo concorrente (`max_workers` > 1): anexos de várias mensagens são baixados em paralelo
+  por um pool de threads sobre uma `requests.Session` compartilhada (pool de conexões por host,
+  retry com backoff)
+- Tokens ficam em cache por processo (`TOKEN_CACHE`) até `expires_in` (menos `GRAPH_TOKEN_SKEW`),
+  compartilhados por todas as caixas da mesma app
+- Sync incremental (`iter_outlook_delta`): delta query do Graph, segue `@odata.nextLink` até o fim
+  e devolve o cursor (nextLink/deltaLink) a ser persistido por caixa/pasta; um cursor expirado
+  (410 Gone) recomeça uma rodada completa
+- Este módulo é um MVP: adicionar tratamento de erros
+
+`GRAPH_BASE_URL` / `GRAPH_TOKEN_URL` permitem apontar para um servidor Graph local (testes).
 """
 import os
-import base64
+import threading
+import time
 import requests
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Set, Tuple
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app.services import attachment_store
 
-TOKEN_URL = "https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
-GRAPH_BASE = "https://graph.microsoft.com/v1.0"
+TOKEN_URL = os.environ.get('GRAPH_TOKEN_URL', "https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token")
+GRAPH_BASE = os.environ.get('GRAPH_BASE_URL', "https://graph.microsoft.com/v1.0")
 
 STORAGE_DIR = os.environ.get('STORAGE_DIR', '/data/storage')
 os.makedirs(STORAGE_DIR, exist_ok=True)
 
+# Concurrent collector settings
+GRAPH_MAX_WORKERS = int(os.environ.get('GRAPH_MAX_WORKERS', '8'))   # in-flight attachment requests
+GRAPH_MAX_PER_HOST = int(os.environ.get('GRAPH_MAX_PER_HOST', '8'))  # pooled connections per host
+GRAPH_RETRIES = int(os.environ.get('GRAPH_RETRIES', '3'))
+GRAPH_BACKOFF = float(os.environ.get('GRAPH_BACKOFF', '0.5'))        # seconds, exponential
+GRAPH_TOKEN_SKEW = float(os.environ.get('GRAPH_TOKEN_SKEW', '60'))   # renew tokens this long before they expire
+
+
+def make_session(max_per_host: int = GRAPH_MAX_PER_HOST, retries: int = GRAPH_RETRIES, backoff: float = GRAPH_BACKOFF) -> requests.Session:
+    """Session with a bounded connection pool per host and retry/backoff on throttling and 5xx.
+
+    `pool_block=True` makes extra threads wait for a free connection, so at most
+    `max_per_host` requests are in flight against the same host.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'POST']),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_per_host, pool_block=True, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class TokenCache:
+    """Access tokens kept until their `expires_in` (minus `skew` seconds).
+
+    Thread-safe; concurrent callers missing the same key wait for a single
+    token request instead of each asking for their own.
+    """
+
+    def __init__(self, skew: float = GRAPH_TOKEN_SKEW, clock: Callable[[], float] = time.monotonic):
+        self.skew = skew
+        self.clock = clock
+        self._tokens = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.requests = 0
 
-def _get_token(tenant_id: str, client_id: str, client_secret: str) -> str:
+    def _valid(self, key):
+        entry = self._tokens.get(key)
+        if entry and entry[1] > self.clock():
+            return entry[0]
+        return None
+
+    def get(self, key, fetch: Callable[[], Tuple[str, float]]) -> str:
+        """Cached token for `key`, or `fetch() -> (token, expires_in)` when missing or expired."""
+        token = self._valid(key)
+        if token:
+            return token
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            token = self._valid(key)
+            if token:
+                return token
+            token, expires_in = fetch()
+            self.requests += 1
+            self._tokens[key] = (token, self.clock() + max(float(expires_in) - self.skew, 0))
+            return token
+
+    def invalidate(self, key):
+        self._tokens.pop(key, None)
+
+    def clear(self):
+        self._tokens.clear()
+
+
+TOKEN_CACHE = TokenCache()
+
+
+def _token_key(tenant_id: str, client_id: str, client_secret: str) -> tuple:
+    return TOKEN_URL.format(tenant_id=tenant_id), client_id, client_secret
+
+
+def _get_token(tenant_id: str, client_id: str, client_secret: str, session: requests.Session | None = None,
+               cache: TokenCache | None = TOKEN_CACHE) -> str:
     url = TOKEN_URL.format(tenant_id=tenant_id)
     data = {
         'grant_type': 'client_credentials',
@@ -32,33 +127,36 @@ def _get_token(tenant_id: str, client_id: str, client_secret: str) -> str:
         'client_secret': client_secret,
         'scope': 'https://graph.microsoft.com/.default'
     }
-    r = requests.post(url, data=data, timeout=10)
-    r.raise_for_status()
-    return r.json()['access_token']
 
+    def fetch():
+        r = (session or requests).post(url, data=data, timeout=10)
+        r.raise_for_status()
+        body = r.json()
+        # Azure AD tokens last about an hour; without expires_in, treat as single use
+        return body['access_token'], body.get('expires_in', 0)
+
+    if cache is None:
+        return fetch()[0]
+    return cache.get(_token_key(tenant_id, client_id, client_secret), fetch)
 
-def _save_attachment_bytes(user: str, message_id: str, filename: str, content_bytes: bytes) -> str:
-    user_dir = os.path.join(STORAGE_DIR, user.replace('@', '_'))
-    os.makedirs(user_dir, exist_ok=True)
-    safe_name = f"{message_id}_{filename}"
-    path = os.path.join(user_dir, safe_name)
-    with open(path, 'wb') as f:
-        f.write(content_bytes)
-    return path
 
+def invalidate_token(tenant_id: str, client_id: str, client_secret: str, cache: TokenCache = TOKEN_CACHE):
+    """Drop a cached token (e.g. after a 401), so the next call requests a new one."""
+    cache.invalidate(_token_key(tenant_id, client_id, client_secret))
 
-def _fetch_attachments(token: str, user: str, message_id: str) -> List[dict]:
+
+def _fetch_attachments(token: str, user: str, message_id: str, session: requests.Session | None = None) -> List[dict]:
     url = f"{GRAPH_BASE}/users/{user}/messages/{message_id}/attachments"
     headers = {'Authorization': f'Bearer {token}'}
-    r = requests.get(url, headers=headers, timeout=10)
+    r = (session or requests).get(url, headers=headers, timeout=10)
     r.raise_for_status()
     out = []
     for item in r.json().get('value', []):
         # fileAttachment case
         if item.get('@odata.type') == '#microsoft.graph.fileAttachment' or item.get('contentBytes'):
             filename = item.get('name') or 'attachment'
-            content_bytes = base64.b64decode(item.get('contentBytes') or '')
-            path = _save_attachment_bytes(user, message_id, filename, content_bytes)
+            # content-addressed and decoded in chunks (see attachment_store)
+            path = attachment_store.store_b64(item.get('contentBytes') or '', filename)
             out.append({'nome_arquivo': filename, 'caminho_arquivo': path})
         else:
             # other types (reference, itemAttachment) - store metadata only
@@ -66,38 +164,108 @@ def _fetch_attachments(token: str, user: str, message_id: str) -> List[dict]:
     return out
 
 
-def fetch_outlook_emails(tenant_id: str, client_id: str, client_secret: str, user_email: str, folder: str = 'Inbox', top: int = 20) -> List[dict]:
+SELECT_FIELDS = 'id,subject,from,bodyPreview,receivedDateTime,webLink'
+
+
+def _to_message(m: dict, attachments: List[dict]) -> dict:
+    return {
+        'message_id': m.get('id'),
+        'remetente': (m.get('from') or {}).get('emailAddress', {}).get('address'),
+        'assunto': m.get('subject'),
+        'corpo_preview': m.get('bodyPreview'),
+        'data_hora_email': m.get('receivedDateTime'),
+        'webLink': m.get('webLink'),
+        'attachments': attachments,
+    }
+
+
+def _fetch_many_attachments(token: str, user: str, ids: List[str], session: requests.Session, max_workers: int = 1) -> List[List[dict]]:
+    if max_workers > 1 and len(ids) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(lambda mid: _fetch_attachments(token, user, mid, session=session), ids))
+    return [_fetch_attachments(token, user, mid, session=session) for mid in ids]
+
+
+def list_outlook_messages(tenant_id: str, client_id: str, client_secret: str, user_email: str, folder: str = 'Inbox', top: int = 20,
+                          session: requests.Session | None = None) -> Tuple[str, List[dict]]:
+    """Latest message metadata (Graph JSON, no attachments) and the token to fetch them.
+
+    Used by the ingestion pipeline, which downloads attachments in its own stage
+    (see `fetch_message`).
+    """
+    session = session or requests
+    token = _get_token(tenant_id, client_id, client_secret, session=session)
+    url = f"{GRAPH_BASE}/users/{user_email}/mailFolders/{folder}/messages?$select={SELECT_FIELDS}&$top={top}"
+    r = session.get(url, headers={'Authorization': f'Bearer {token}'}, timeout=10)
+    r.raise_for_status()
+    return token, r.json().get('value', [])
+
+
+def fetch_message(token: str, user_email: str, m: dict, session: requests.Session | None = None) -> dict:
+    """Message dict (as returned by fetch_outlook_emails) for Graph message `m`, attachments saved."""
+    return _to_message(m, _fetch_attachments(token, user_email, m.get('id'), session=session))
+
+
+def fetch_outlook_emails(tenant_id: str, client_id: str, client_secret: str, user_email: str, folder: str = 'Inbox', top: int = 20,
+                         max_workers: int = 1, session: requests.Session | None = None) -> List[dict]:
     """Fetch latest messages from a user mailbox.
 
+    With `max_workers` > 1 the attachment lists of all messages are fetched in
+    parallel (bounded by `max_workers` and the session's per-host pool).
     Returns list of dicts: {message_id, remetente, assunto, corpo_preview, data_hora_email, webLink, attachments: [...]}
     """
-    token = _get_token(tenant_id, client_id, client_secret)
-    # select fields we need
-    select = 'id,subject,from,bodyPreview,receivedDateTime,webLink'
-    url = f"{GRAPH_BASE}/users/{user_email}/mailFolders/{folder}/messages?$select={select}&$top={top}"
-    headers = {'Authorization': f'Bearer {token}'}
-    r = requests.get(url, headers=headers, timeout=10)
-    r.raise_for_status()
+    own_session = session is None
+    session = session or make_session(max_per_host=max(max_workers, 1))
+    try:
+        token, values = list_outlook_messages(tenant_id, client_id, client_secret, user_email, folder=folder, top=top, session=session)
+        attachments = _fetch_many_attachments(token, user_email, [m.get('id') for m in values], session, max_workers)
+    finally:
+        if own_session:
+            session.close()
 
-    messages = []
-    for m in r.json().get('value', []):
-        message_id = m.get('id')
-        remetente = (m.get('from') or {}).get('emailAddress', {}).get('address')
-        assunto = m.get('subject')
-        corpo_preview = m.get('bodyPreview')
-        data_hora_email = m.get('receivedDateTime')
-        webLink = m.get('webLink')
-
-        attachments = _fetch_attachments(token, user_email, message_id)
-
-        messages.append({
-            'message_id': message_id,
-            'remetente': remetente,
-            'assunto': assunto,
-            'corpo_preview': corpo_preview,
-            'data_hora_email': data_hora_email,
-            'webLink': webLink,
-            'attachments': attachments,
-        })
-
-    return messages
+    return [_to_message(m, atts) for m, atts in zip(values, attachments)]
+
+
+def iter_outlook_delta(tenant_id: str, client_id: str, client_secret: str, user_email: str, folder: str = 'Inbox',
+                       cursor: str | None = None, page_size: int = 50, known_ids: Callable[[List[str]], Set[str]] | None = None,
+                       max_workers: int = 1, session: requests.Session | None = None) -> Iterator[Tuple[List[dict], str | None]]:
+    """Incremental sync of a mail folder via Graph delta query.
+
+    Starts from `cursor` (a nextLink/deltaLink saved from a previous run) or a
+    fresh delta round, and follows `@odata.nextLink` to the end. Yields one
+    `(messages, cursor)` pair per page, where `cursor` is the link to resume
+    from once that page is persisted (the final page carries the deltaLink for
+    the next run). Removed items are ignored, and messages for which
+    `known_ids(ids)` says they are already stored are dropped before any
+    attachment is downloaded, so each poll only transfers new messages.
+
+    Graph answers 410 Gone when the sync state behind a cursor has expired
+    (syncStateNotFound / resyncRequired); the round then restarts from a fresh
+    delta query, whose pages replace the stored cursor, and `known_ids` keeps
+    the messages already stored from being downloaded again.
+    """
+    own_session = session is None
+    session = session or make_session(max_per_host=max(max_workers, 1))
+    try:
+        token = _get_token(tenant_id, client_id, client_secret, session=session)
+        headers = {'Authorization': f'Bearer {token}', 'Prefer': f'odata.maxpagesize={page_size}'}
+        fresh = f"{GRAPH_BASE}/users/{user_email}/mailFolders/{folder}/messages/delta?$select={SELECT_FIELDS}"
+        url = cursor or fresh
+        restarted = cursor is None
+        while url:
+            r = session.get(url, headers=headers, timeout=30)
+            if r.status_code == 410 and not restarted:
+                url, restarted = fresh, True
+                continue
+            r.raise_for_status()
+            body = r.json()
+            values = [m for m in body.get('value', []) if '@removed' not in m and m.get('id')]
+            if values and known_ids:
+                known = known_ids([m['id'] for m in values])
+                values = [m for m in values if m['id'] not in known]
+            attachments = _fetch_many_attachments(token, user_email, [m['id'] for m in values], session, max_workers)
+            url = body.get('@odata.nextLink')
+            yield [_to_message(m, atts) for m, atts in zip(values, attachments)], url or body.get('@odata.deltaLink')
+    finally:
+        if own_session:
+            session.close()
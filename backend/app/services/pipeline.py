@@ -0,0 +1,250 @@
+"""Staged pipeline engine.
+
+A `Pipeline` chains `Stage`s through bounded queues. Every stage has its own
+workers: I/O-bound stages (network, disk, database) run on threads, CPU-bound
+stages on a process pool, so downloads, parsing and rendering of different
+items overlap instead of adding up. When a stage falls behind, its input
+queue fills and `put` blocks the stage before it, all the way back to the
+source: at most `queue_size + workers` items wait or run per stage, whatever
+the size of the input.
+
+Failures are per item: the exception is recorded in `Pipeline.errors` and the
+item is dropped; a stage returning None filters the item out.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, List
+
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', '64'))
+
+_DONE = object()
+
+
+class Stage:
+    """One step of a pipeline.
+
+    `fn(item)` returns the item for the next stage (or None to drop it). With
+    `batch_size` > 1, `fn` receives a list of up to `batch_size` items, waiting
+    at most `batch_wait` seconds to fill it. `kind='process'` runs `fn` in a
+    pool of `workers` processes (`fn` and items must be picklable), each set up
+    by `initializer(*initargs)` when given.
+    """
+
+    def __init__(self, name: str, fn: Callable, workers: int = 1, kind: str = 'thread',
+                 queue_size: int | None = None, batch_size: int = 1, batch_wait: float = 0.5,
+                 initializer: Callable | None = None, initargs: tuple = ()):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f'invalid stage kind: {kind}')
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.kind = kind
+        self.queue_size = queue_size
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.initializer = initializer
+        self.initargs = initargs
+
+
+class _StageState:
+    def __init__(self, stage: Stage, queue_size: int):
+        self.stage = stage
+        self.input = queue.Queue(maxsize=stage.queue_size or queue_size)
+        self.lock = threading.Lock()
+        self.alive = stage.workers
+        self.processed = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.depth = 0
+        self.queue_max = 0
+        self.pool = None
+
+    def put(self, item):
+        self.input.put(item)
+        with self.lock:
+            self.depth += 1
+            self.queue_max = max(self.queue_max, self.depth)
+
+    def get(self, timeout: float | None = None):
+        item = self.input.get(timeout=timeout)
+        if item is not _DONE:
+            with self.lock:
+                self.depth -= 1
+        return item
+
+
+class Pipeline:
+    """Runs items from a source through `stages`; see the module docstring."""
+
+    def __init__(self, stages: List[Stage], queue_size: int = PIPELINE_QUEUE_SIZE):
+        if not stages:
+            raise ValueError('pipeline needs at least one stage')
+        self.stages = stages
+        self.queue_size = queue_size
+        self.errors = []
+        self._states = []
+        self._started = None
+        self._finished = None
+        self._source_count = 0
+
+    def run(self, source: Iterable, sink: Callable | None = None, report: Callable | None = None,
+            report_every: float = 5.0) -> list:
+        """Feed `source` through the stages and block until everything is processed.
+
+        Outputs of the last stage go to `sink(output)` when given, otherwise they
+        are returned as a list. `report(stats)` is called every `report_every`
+        seconds while running and once at the end.
+        """
+        self._states = [_StageState(s, self.queue_size) for s in self.stages]
+        self.errors = []
+        self._source_count = 0
+        self._started, self._finished = time.monotonic(), None
+        results = []
+        emit = sink or results.append
+        emit_lock = threading.Lock()
+
+        for state in self._states:
+            if state.stage.kind == 'process':
+                state.pool = ProcessPoolExecutor(max_workers=state.stage.workers, initializer=state.stage.initializer,
+                                                 initargs=state.stage.initargs)
+        threads = []
+        for i, state in enumerate(self._states):
+            downstream = self._states[i + 1] if i + 1 < len(self._states) else None
+            for n in range(state.stage.workers):
+                t = threading.Thread(
+                    target=self._worker, args=(state, downstream, emit, emit_lock),
+                    name=f'pipeline-{state.stage.name}-{n}', daemon=True,
+                )
+                t.start()
+                threads.append(t)
+
+        stop_reporting = threading.Event()
+        reporter = None
+        if report is not None:
+            def _report_loop():
+                while not stop_reporting.wait(report_every):
+                    report(self.stats())
+            reporter = threading.Thread(target=_report_loop, daemon=True)
+            reporter.start()
+
+        try:
+            first = self._states[0]
+            try:
+                for item in source:
+                    self._source_count += 1
+                    first.put(item)
+            finally:
+                first.input.put(_DONE)
+                # also when the source raised: items already queued finish before
+                # the pools shut down and run() returns or re-raises
+                for t in threads:
+                    t.join()
+        finally:
+            stop_reporting.set()
+            for state in self._states:
+                if state.pool is not None:
+                    state.pool.shutdown(wait=True)
+            self._finished = time.monotonic()
+        if reporter is not None:
+            reporter.join()
+            report(self.stats())
+        return results
+
+    def _next_batch(self, state: _StageState):
+        """Block for one item, then collect up to batch_size within batch_wait. Returns (items, done)."""
+        item = state.get()
+        if item is _DONE:
+            return [], True
+        items = [item]
+        deadline = time.monotonic() + state.stage.batch_wait
+        while len(items) < state.stage.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = state.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _DONE:
+                return items, True
+            items.append(item)
+        return items, False
+
+    def _worker(self, state: _StageState, downstream: _StageState | None, emit, emit_lock):
+        stage = state.stage
+        done = False
+        while not done:
+            if stage.batch_size > 1:
+                items, done = self._next_batch(state)
+                work = [items] if items else []
+            else:
+                item = state.get()
+                done = item is _DONE
+                work = [] if done else [item]
+            for payload in work:
+                start = time.perf_counter()
+                try:
+                    if state.pool is not None:
+                        out = state.pool.submit(stage.fn, payload).result()
+                    else:
+                        out = stage.fn(payload)
+                except Exception as e:
+                    with state.lock:
+                        state.errors += 1
+                        state.busy += time.perf_counter() - start
+                    self.errors.append((stage.name, payload, e))
+                    continue
+                with state.lock:
+                    state.processed += len(payload) if stage.batch_size > 1 else 1
+                    state.busy += time.perf_counter() - start
+                if out is None:
+                    continue
+                if downstream is not None:
+                    downstream.put(out)
+                    continue
+                try:
+                    with emit_lock:
+                        emit(out)
+                except Exception as e:
+                    self.errors.append((stage.name, out, e))
+        # let the sibling workers see the end too; the last one closes the next stage
+        state.input.put(_DONE)
+        with state.lock:
+            state.alive -= 1
+            last = state.alive == 0
+        if last and downstream is not None:
+            downstream.input.put(_DONE)
+
+    def stats(self) -> dict:
+        """Per-stage counters: processed items, errors, throughput (items/s since start),
+        busy seconds summed over workers, current and peak queue depth."""
+        end = self._finished or time.monotonic()
+        elapsed = max(end - (self._started or end), 1e-9)
+        stages = {}
+        for state in self._states:
+            with state.lock:
+                stages[state.stage.name] = {
+                    'workers': state.stage.workers,
+                    'kind': state.stage.kind,
+                    'processed': state.processed,
+                    'errors': state.errors,
+                    'throughput': state.processed / elapsed,
+                    'busy_s': state.busy,
+                    'queue': state.depth,
+                    'queue_max': state.queue_max,
+                }
+        return {'elapsed_s': elapsed, 'source': self._source_count, 'stages': stages}
+
+
+def format_stats(stats: dict) -> str:
+    """Human-readable table of `Pipeline.stats()`."""
+    lines = [f'{stats["source"]} itens em {stats["elapsed_s"]:.2f}s']
+    for name, s in stats['stages'].items():
+        lines.append(
+            f'  {name:<12} {s["kind"]:<7} x{s["workers"]:<3} {s["processed"]:>7} ok {s["errors"]:>4} erros '
+            f'{s["throughput"]:8.1f}/s  ocupado {s["busy_s"]:7.2f}s  fila {s["queue"]:>4} (máx {s["queue_max"]})'
+        )
+    return '\n'.join(lines)
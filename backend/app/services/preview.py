@@ -1,31 +1,88 @@
 import os
 import base64
+import tempfile
 from PIL import Image
 import pdfplumber
 
+from app.services.attachment_store import file_digest as _file_digest
+
 STORAGE_DIR = os.environ.get('STORAGE_DIR', '/data/storage')
 
 os.makedirs(STORAGE_DIR, exist_ok=True)
 
+PDF_RESOLUTION = 150
+
+# Named preview widths served by the API (inbox thumbnails, detail page)
+PREVIEW_SIZES = {'thumb': 240, 'medio': 800, 'grande': 1200}
+PREVIEW_FORMATS = {'png': 'PNG', 'webp': 'WEBP'}
+# Sizes the UI requests (inbox thumbnail, detail page): rendered ahead of the first view
+PRERENDERED_SIZES = ('thumb', 'medio')
+
+
+class PreviewError(Exception):
+    """The file could not be rendered; remembered by content hash, so it is not retried."""
+
+
+def preview_cache_path(file_path: str, max_width: int = 1200, resolution: int = PDF_RESOLUTION, fmt: str = 'png') -> str:
+    """Cache location of the preview of `file_path`, keyed by content hash and render parameters."""
+    digest = _file_digest(file_path)
+    return os.path.join(STORAGE_DIR, 'previews', digest[:2], f'{digest}-{max_width}-{resolution}.{fmt}')
+
+
+def render_preview(file_path: str, max_width: int = 1200, resolution: int = PDF_RESOLUTION, fmt: str = 'png') -> str:
+    """Render (or reuse from cache) the preview (PNG or WebP) of a PDF or image and return its path."""
+    out_path = preview_cache_path(file_path, max_width, resolution, fmt)
+    pil_format = PREVIEW_FORMATS[fmt]
+    if os.path.exists(out_path):
+        return out_path
+    failed_path = out_path + '.erro'
+    if os.path.exists(failed_path):
+        with open(failed_path, encoding='utf-8') as f:
+            raise PreviewError(f.read())
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    # one temp file per call: threads of the same process render the same file too
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(out_path), prefix='.tmp-', suffix=f'.{fmt}')
+    os.close(fd)
+    try:
+        if file_path.lower().endswith('.pdf'):
+            with pdfplumber.open(file_path) as pdf:
+                page = pdf.pages[0]
+                img = page.to_image(resolution=resolution)
+                pil = img.original
+                pil.thumbnail((max_width, max_width))
+                pil.save(tmp_path, format=pil_format)
+        else:
+            with Image.open(file_path) as im:
+                im.thumbnail((max_width, max_width))
+                im.save(tmp_path, format=pil_format)
+        # atomic publish: concurrent workers rendering the same file never see a partial PNG
+        os.replace(tmp_path, out_path)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        # another writer published it first
+        if os.path.exists(out_path):
+            return out_path
+        # errors with an errno (disk full, permissions) are the environment's, not the file's
+        if getattr(e, 'errno', None) is None and not isinstance(e, MemoryError):
+            with open(failed_path, 'w', encoding='utf-8') as f:
+                f.write(f'{type(e).__name__}: {e}')
+        raise
+    return out_path
+
+
+def prerender(file_path: str) -> str:
+    """Render the PRERENDERED_SIZES previews of `file_path`; returns the path of the largest."""
+    paths = [render_preview(file_path, max_width=PREVIEW_SIZES[size]) for size in PRERENDERED_SIZES]
+    return paths[-1]
+
 
 def generate_preview(file_path: str, max_width: int = 1200) -> str:
     """Generate a preview image (PNG) for a PDF or image and return base64 string of the preview.
-    Stores preview next to file as <file>.preview.png
+    The PNG is cached under STORAGE_DIR/previews, so the same file is rendered only once.
+    Ingestion stores render_preview paths instead; this is kept for scripts/back-compat.
     """
-    out_path = file_path + '.preview.png'
-
-    if file_path.lower().endswith('.pdf'):
-        with pdfplumber.open(file_path) as pdf:
-            page = pdf.pages[0]
-            img = page.to_image(resolution=150)
-            pil = img.original
-            pil.thumbnail((max_width, max_width))
-            pil.save(out_path, format='PNG')
-    else:
-        with Image.open(file_path) as im:
-            im.thumbnail((max_width, max_width))
-            im.save(out_path, format='PNG')
-
+    out_path = render_preview(file_path, max_width)
     with open(out_path, 'rb') as f:
         data = base64.b64encode(f.read()).decode('utf-8')
     return data
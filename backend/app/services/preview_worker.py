@@ -0,0 +1,111 @@
+"""Preview rendering stage, decoupled from ingestion.
+
+`PREVIEW_MODE` selects how the ingestor produces attachment previews:
+- `pool` (default): rendering is enqueued to a process pool while the
+  ingestor keeps persisting; results are written back in one commit at the end.
+  The pool is created on first use and shared by every page and batch of the
+  process (shut down at exit)
+- `inline`: render synchronously during ingestion (old behaviour)
+- `lazy`: do not render at ingestion; the preview endpoints render each size
+  on its first request
+
+Rendering itself is cached by file hash (see preview.render_preview), so the
+same file is never rendered twice whatever the mode. Ingestion renders the
+sizes the UI asks for (preview.PRERENDERED_SIZES), so the first view is
+served from the cache.
+"""
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.db import models
+
+PREVIEW_MODE = os.environ.get('PREVIEW_MODE', 'pool')
+PREVIEW_WORKERS = int(os.environ.get('PREVIEW_WORKERS', '2'))
+
+
+def _generate(path: str) -> str:
+    # Anexo.preview_imagem keeps a file reference; the API streams the image
+    from app.services.preview import prerender
+    return prerender(path)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def preview_pool(reset: bool = False) -> ProcessPoolExecutor:
+    """Process pool shared by every PreviewQueue of this process (a forked child gets its own)."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if reset or _pool is None or _pool_pid != os.getpid():
+            if _pool is not None and _pool_pid == os.getpid():
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool, _pool_pid = ProcessPoolExecutor(max_workers=PREVIEW_WORKERS), os.getpid()
+        return _pool
+
+
+@atexit.register
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+class PreviewQueue:
+    """Previews of one page or batch, rendered in the shared pool; `drain` stores them on the Anexo rows."""
+
+    def __init__(self):
+        self._pending = []
+
+    def submit(self, anexo_id, documento_id, nome_arquivo: str, path: str):
+        try:
+            future = preview_pool().submit(_generate, path)
+        except BrokenProcessPool:
+            # a worker died (OOM on a huge PDF): start a new pool
+            future = preview_pool(reset=True).submit(_generate, path)
+        self._pending.append((anexo_id, documento_id, nome_arquivo, future))
+
+    def drain(self, db, only=None) -> int:
+        """Wait for every submitted preview, then persist them (single commit).
+
+        Rendering is awaited before the first statement, so `db` holds no
+        connection while workers run. `only` restricts the write-back to a set
+        of anexo ids. Returns previews stored.
+        """
+        results = []
+        try:
+            for anexo_id, documento_id, nome_arquivo, future in self._pending:
+                if only is not None and anexo_id not in only:
+                    future.cancel()
+                    continue
+                try:
+                    results.append((anexo_id, documento_id, nome_arquivo, future.result(), None))
+                except Exception as e:
+                    results.append((anexo_id, documento_id, nome_arquivo, None, e))
+        finally:
+            self._pending = []
+        stored = 0
+        for anexo_id, documento_id, nome_arquivo, preview_path, error in results:
+            if error is not None:
+                db.add(models.Historico(documento_id=documento_id, evento=f'Erro ao gerar preview: {error}'))
+                continue
+            db.query(models.Anexo).filter(models.Anexo.id == anexo_id).update(
+                {models.Anexo.preview_imagem: preview_path}, synchronize_session=False
+            )
+            db.add(models.Historico(documento_id=documento_id, evento=f'Preview gerado para {nome_arquivo}'))
+            stored += 1
+        if results:
+            db.commit()
+        return stored
+
+    def cancel(self):
+        for *_, future in self._pending:
+            future.cancel()
+        self._pending = []
+
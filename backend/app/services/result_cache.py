@@ -0,0 +1,247 @@
+"""Memoized classify_email / extract_financial_data.
+
+Supplier templates repeat: the same body, attachment names and sender come
+back every month, and re-runs over history repeat all of it. Results are
+keyed by a fingerprint of what each function actually reads, plus the
+version of its rules:
+
+- classification: the lowercased text (the classifier lowercases first), the
+  sorted, lowercased attachment names and the sender, under CLASSIFIER_VERSION
+  and a hash of KEYWORD_RULES / SUBTYPE_PRIORITY;
+- extraction: the text, the subtype (`tipo` is not read by the extractor) and
+  the content digest and extension of each XML/PDF attachment, in order,
+  under the extractor rules version (which follows a hot-reloaded rules file)
+  and attachment_text.PARSER_VERSION.
+
+A rules change therefore changes every key: old entries are never read
+again, and purge_stale drops them from the shared tier. Answers of the
+supplier registry are not cached: they follow the registry as it is reloaded,
+and only the keyword classification of other senders is memoized.
+
+Tiers: a per-process LRU of RESULT_CACHE_SIZE entries and, optionally, a
+tier shared by workers (RESULT_CACHE_TIER=disco under STORAGE_DIR/resultados,
+or postgres in the result_cache table) read on LRU misses. A failing shared
+tier only costs a recomputation. stats() reports lookups per tier and the
+hit ratio.
+"""
+import copy
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Callable, List
+
+from app.services import advanced_classifier, attachment_store, attachment_text, extractor, supplier_registry
+
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE') or 4096)
+RESULT_CACHE_TIER = os.environ.get('RESULT_CACHE_TIER', '')  # '' | disco | postgres
+
+CLASSIFICATION = 'classificacao'
+EXTRACTION = 'extracao'
+
+
+def _hash(value) -> str:
+    return hashlib.sha256(json.dumps(value, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# the keyword tables are compiled at import, so they cannot change at runtime
+_CLASSIFIER_VERSION = _hash([
+    advanced_classifier.CLASSIFIER_VERSION,
+    advanced_classifier.KEYWORD_RULES,
+    advanced_classifier.SUBTYPE_PRIORITY,
+])[:12]
+
+
+def classifier_version() -> str:
+    return _CLASSIFIER_VERSION
+
+
+def extractor_version() -> str:
+    return f'{extractor.rules_version()}.{attachment_text.PARSER_VERSION}'
+
+
+def classification_fingerprint(text: str, attachments: List[dict] | None, remetente: str | None) -> list:
+    names = sorted({(a.get('nome_arquivo') or '').lower() for a in attachments or []})
+    return [(text or '').lower(), names, remetente or '']
+
+
+def extraction_fingerprint(text: str, attachments: List[dict] | None, subtipo: str | None) -> list:
+    files = []
+    for a in attachments or []:
+        path = a.get('caminho_arquivo')
+        ext = os.path.splitext(path or '')[1].lower()
+        if ext not in ('.xml', '.pdf'):
+            continue  # attachment_text reads nothing else
+        # blobs are named after their digest, so this is usually free
+        files.append([attachment_store.file_digest(path) if os.path.exists(path) else '', ext])
+    return [text or '', subtipo, files]
+
+
+def _new_counters() -> dict:
+    return {'memoria': 0, 'compartilhado': 0, 'calculado': 0, 'erros': 0}
+
+
+class ResultCache:
+    """Per-process LRU in front of an optional shared tier ('disco' or 'postgres')."""
+
+    def __init__(self, size: int = RESULT_CACHE_SIZE, tier: str = RESULT_CACHE_TIER, session_factory=None):
+        if tier not in ('', 'disco', 'postgres'):
+            raise ValueError(f'RESULT_CACHE_TIER inválido: {tier!r}')
+        self.size = size
+        self.tier = tier
+        self.session_factory = session_factory
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {CLASSIFICATION: _new_counters(), EXTRACTION: _new_counters()}
+
+    def _count(self, kind: str, field: str):
+        with self._lock:
+            self._counters[kind][field] += 1
+
+    def get_or_compute(self, kind: str, version: str, fingerprint, compute: Callable[[], dict]) -> dict:
+        key = _hash([kind, version, fingerprint])
+        with self._lock:
+            if key in self._memo:
+                self._counters[kind]['memoria'] += 1
+                self._memo.move_to_end(key)
+                return copy.deepcopy(self._memo[key])
+        result = self._shared_get(kind, version, key) if self.tier else None
+        if result is not None:
+            self._count(kind, 'compartilhado')
+        else:
+            result = compute()
+            self._count(kind, 'calculado')
+            if self.tier:
+                self._shared_put(kind, version, key, result)
+        with self._lock:
+            self._memo[key] = result
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.size:
+                self._memo.popitem(last=False)
+        # callers may change what they get back
+        return copy.deepcopy(result)
+
+    def classify_email(self, text: str, attachments: List[dict] | None = None, remetente: str | None = None) -> dict:
+        prior = supplier_registry.prior(text, remetente)
+        if prior is not None:
+            return prior
+        return self.get_or_compute(
+            CLASSIFICATION, classifier_version(), classification_fingerprint(text, attachments, remetente),
+            # the keyword scorers only: a registry answer here would be memoized
+            lambda: advanced_classifier.classify_email(text, attachments or [], remetente),
+        )
+
+    def extract_financial_data(self, text: str, attachments: List[dict] | None = None, tipo: str = 'OUTROS',
+                               subtipo: str | None = None) -> dict:
+        return self.get_or_compute(
+            EXTRACTION, extractor_version(), extraction_fingerprint(text, attachments, subtipo),
+            lambda: extractor.extract_financial_data(text, attachments, tipo, subtipo),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._memo.clear()
+
+    def stats(self) -> dict:
+        """Lookups per tier and hit ratio (None before the first lookup), per kind."""
+        with self._lock:
+            out = {}
+            for kind, c in self._counters.items():
+                total = c['memoria'] + c['compartilhado'] + c['calculado']
+                out[kind] = {**c, 'taxa_acerto': round((total - c['calculado']) / total, 4) if total else None}
+            return out
+
+    # shared tier
+
+    def _sessions(self):
+        if self.session_factory is None:
+            from app.db.session import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory
+
+    def _path(self, kind: str, version: str, key: str) -> str:
+        return os.path.join(attachment_store.STORAGE_DIR, 'resultados', kind, version, key[:2], f'{key}.json')
+
+    def _shared_get(self, kind: str, version: str, key: str) -> dict | None:
+        try:
+            if self.tier == 'disco':
+                try:
+                    with open(self._path(kind, version, key), encoding='utf-8') as f:
+                        return json.load(f)
+                except FileNotFoundError:
+                    return None
+            from app.db import models
+            with self._sessions()() as db:
+                row = db.get(models.ResultCacheEntry, key)
+                return json.loads(row.resultado) if row is not None else None
+        except Exception:
+            self._count(kind, 'erros')
+            return None
+
+    def _shared_put(self, kind: str, version: str, key: str, result: dict):
+        try:
+            if self.tier == 'disco':
+                out = self._path(kind, version, key)
+                os.makedirs(os.path.dirname(out), exist_ok=True)
+                tmp = f'{out}.{os.getpid()}.{threading.get_ident()}.tmp'
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(result, f, ensure_ascii=False)
+                os.replace(tmp, out)
+                return
+            from sqlalchemy.dialects.postgresql import insert
+            from app.db import models
+            with self._sessions()() as db:
+                db.execute(insert(models.ResultCacheEntry).values(
+                    chave=key, tipo=kind, versao=version, resultado=json.dumps(result, ensure_ascii=False),
+                ).on_conflict_do_nothing())
+                db.commit()
+        except Exception:
+            self._count(kind, 'erros')
+
+    def purge_stale(self) -> int:
+        """Drop shared entries of rule versions other than the current ones."""
+        current = {CLASSIFICATION: classifier_version(), EXTRACTION: extractor_version()}
+        removed = 0
+        if self.tier == 'disco':
+            for kind, version in current.items():
+                base = os.path.join(attachment_store.STORAGE_DIR, 'resultados', kind)
+                if not os.path.isdir(base):
+                    continue
+                for name in os.listdir(base):
+                    if name != version:
+                        shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+                        removed += 1
+        elif self.tier == 'postgres':
+            from sqlalchemy import delete
+            from app.db import models
+            with self._sessions()() as db:
+                for kind, version in current.items():
+                    removed += db.execute(delete(models.ResultCacheEntry).where(
+                        models.ResultCacheEntry.tipo == kind, models.ResultCacheEntry.versao != version,
+                    )).rowcount
+                db.commit()
+        return removed
+
+
+CACHE = ResultCache()
+
+
+def classify_email(text: str, attachments: List[dict] | None = None, remetente: str | None = None) -> dict:
+    """classifier.classify_email, memoized."""
+    return CACHE.classify_email(text, attachments, remetente)
+
+
+def extract_financial_data(text: str, attachments: List[dict] | None = None, tipo: str = 'OUTROS',
+                           subtipo: str | None = None) -> dict:
+    """extractor.extract_financial_data, memoized."""
+    return CACHE.extract_financial_data(text, attachments, tipo, subtipo)
+
+
+def stats() -> dict:
+    return CACHE.stats()
+
+
+def purge_stale() -> int:
+    return CACHE.purge_stale()
@@ -0,0 +1,125 @@
+"""Daily rollup of documentos (resumo_documentos_diario) for GET /documentos/resumo.
+
+One row per day (criado_em in LOCAL_TZ), tipo, subtipo, status and
+fornecedor, holding the number of documentos and the sum of valor. Writers
+hand what they changed to `apply` inside their own transaction: a documento
+takes -1/-valor from the key it had and adds +1/+valor to the key it has now.
+Deltas are summed per key and written with one INSERT ... ON CONFLICT DO
+UPDATE, keys sorted so concurrent writers lock rows in the same order.
+
+Nothing reads documentos_financeiros with a GROUP BY except migration 0008
+(the first fill) and `rebuild` (a repair).
+"""
+import os
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Iterable, List, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import delete, insert, select, text
+
+from app.db import models
+
+LOCAL_TZ = os.environ.get('LOCAL_TZ', 'UTC')
+
+KEY_FIELDS = ('dia', 'tipo', 'subtipo', 'status', 'fornecedor')
+FIELDS = ('tipo', 'subtipo', 'status', 'fornecedor', 'valor', 'criado_em')
+CENT = Decimal('0.01')
+
+
+def _get(doc, field):
+    return doc.get(field) if isinstance(doc, dict) else getattr(doc, field, None)
+
+
+def _name(value) -> str:
+    return getattr(value, 'name', value) or ''
+
+
+def day(criado_em: datetime | None) -> date:
+    """Rollup day of a documento: its criado_em in LOCAL_TZ (naive values are UTC)."""
+    if criado_em is None:
+        criado_em = datetime.now(tz=timezone.utc)
+    elif criado_em.tzinfo is None:
+        criado_em = criado_em.replace(tzinfo=timezone.utc)
+    try:
+        tz = ZoneInfo(LOCAL_TZ)
+    except Exception:
+        tz = timezone.utc
+    return criado_em.astimezone(tz).date()
+
+
+def key(doc) -> tuple:
+    return (day(_get(doc, 'criado_em')), _name(_get(doc, 'tipo')), _name(_get(doc, 'subtipo')),
+            _name(_get(doc, 'status')), _get(doc, 'fornecedor') or '')
+
+
+def snapshot(doc) -> dict:
+    """The fields of `doc` the rollup reads, before a change."""
+    return {f: _get(doc, f) for f in FIELDS}
+
+
+def deltas(changes: Iterable[Tuple[object, object]]) -> List[dict]:
+    """Rollup rows to add for (before, after) pairs; None means created/deleted."""
+    acc = {}
+    for before, after in changes:
+        for doc, sign in ((before, -1), (after, 1)):
+            if doc is None:
+                continue
+            k = key(doc)
+            quantidade, total = acc.get(k, (0, Decimal(0)))
+            valor = _get(doc, 'valor')
+            if valor is not None:
+                total += sign * Decimal(str(valor)).quantize(CENT)
+            acc[k] = (quantidade + sign, total)
+    return [
+        {**dict(zip(KEY_FIELDS, k)), 'quantidade': quantidade, 'valor_total': total}
+        for k, (quantidade, total) in sorted(acc.items())
+        if quantidade or total
+    ]
+
+
+def _upsert(dialect: str, rows: List[dict]):
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    R = models.ResumoDiario
+    stmt = dialect_insert(R).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[getattr(R, f) for f in KEY_FIELDS],
+        set_={
+            'quantidade': R.quantidade + stmt.excluded.quantidade,
+            'valor_total': R.valor_total + stmt.excluded.valor_total,
+        },
+    )
+
+
+def apply(db, changes: Iterable[Tuple[object, object]]):
+    """Add the deltas of `changes` to the current transaction (the caller commits)."""
+    rows = deltas(changes)
+    if rows:
+        db.execute(_upsert(db.get_bind().dialect.name, rows))
+
+
+async def apply_async(db, changes: Iterable[Tuple[object, object]]):
+    """apply for an AsyncSession."""
+    rows = deltas(changes)
+    if rows:
+        await db.execute(_upsert(db.get_bind().dialect.name, rows))
+
+
+def rebuild(db, chunk_size: int = 5000) -> int:
+    """Recompute the rollup from documentos_financeiros; returns the number of rows written."""
+    D, R = models.DocumentoFinanceiro, models.ResumoDiario
+    if db.get_bind().dialect.name == 'postgresql':
+        # writers wait at their upsert until this commits, so none is lost or counted twice
+        db.execute(text('LOCK TABLE resumo_documentos_diario IN EXCLUSIVE MODE'))
+    db.execute(delete(R))
+    docs = db.execute(
+        select(D.tipo, D.subtipo, D.status, D.fornecedor, D.valor, D.criado_em).execution_options(yield_per=chunk_size)
+    )
+    rows = deltas((None, d) for d in docs)
+    for i in range(0, len(rows), chunk_size):
+        db.execute(insert(R), rows[i:i + chunk_size])
+    db.commit()
+    return len(rows)
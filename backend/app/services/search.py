@@ -0,0 +1,133 @@
+"""Search over documentos: e-mail subject/body and extracted fields.
+
+On Postgres (migration 0009_busca) two generated tsvector columns, under the
+`pt_busca` configuration (Portuguese stemming, unaccent when installed), are
+computed by every INSERT/UPDATE, so ingestion and the backfill keep them
+current and their GIN indexes are updated incrementally:
+
+- emails.busca: assunto (weight A) and corpo (B);
+- documentos_financeiros.busca: fornecedor, numero_documento and cnpj (also
+  as bare digits).
+
+With pg_trgm, trigram GIN indexes on fornecedor, numero_documento and the
+digits of cnpj also serve fuzzy fornecedor matches (`%`) and substrings of
+numbers (ILIKE).
+
+Every index contributes candidates through its own branch of a UNION, each
+capped at BUSCA_MAX_CANDIDATOS rows so a very common word cannot make one
+query rank millions of rows; only the candidates are joined and ranked
+(ts_rank of both vectors plus trigram similarity of fornecedor).
+
+Other databases (SQLite in tests and development) fall back to ILIKE over
+the same columns, with relevancia 0.
+"""
+import os
+import re
+
+from sqlalchemy import Float, and_, cast, func, literal, literal_column, or_, select, text, union
+from sqlalchemy.dialects.postgresql import REGCONFIG, TSVECTOR
+
+from app.db import models
+
+BUSCA_MAX_CANDIDATOS = int(os.environ.get('BUSCA_MAX_CANDIDATOS') or 2000)
+TS_CONFIG = 'pt_busca'
+
+# generated columns (migration 0009), not mapped: they do not exist on SQLite
+EMAIL_BUSCA = literal_column('emails.busca', TSVECTOR)
+DOCUMENTO_BUSCA = literal_column('documentos_financeiros.busca', TSVECTOR)
+
+TRGM_SQL = text("SELECT count(*) FROM pg_extension WHERE extname = 'pg_trgm'")
+
+_trgm: dict = {}
+
+
+def cached_trgm(bind):
+    """Whether pg_trgm is installed, if already known for this database (None otherwise)."""
+    if bind.dialect.name != 'postgresql':
+        return False
+    return _trgm.get(str(bind.engine.url))
+
+
+def store_trgm(bind, count) -> bool:
+    _trgm[str(bind.engine.url)] = bool(count)
+    return bool(count)
+
+
+def has_trgm(db) -> bool:
+    bind = db.get_bind()
+    hit = cached_trgm(bind)
+    if hit is None:
+        hit = store_trgm(bind, db.execute(TRGM_SQL).scalar())
+    return hit
+
+
+def _contains(q: str) -> str:
+    """ILIKE pattern for `q` anywhere, its %, _ and \\ taken literally (used with escape='\\')."""
+    return '%' + re.sub(r'([\\%_])', r'\\\1', q) + '%'
+
+
+def _digits(value):
+    return func.regexp_replace(func.coalesce(value, ''), '[^0-9]', '', 'g')
+
+
+def _columns():
+    D, E = models.DocumentoFinanceiro, models.Email
+    return (D.id, D.tipo, D.subtipo, D.fornecedor, D.numero_documento, D.valor,
+            D.status, D.confirmado_em, D.criado_em, E.assunto)
+
+
+def _candidates(q: str, tsq, trgm: bool):
+    D, E = models.DocumentoFinanceiro, models.Email
+    n = BUSCA_MAX_CANDIDATOS
+    branches = [
+        select(D.id).join(E, E.id == D.email_id).where(EMAIL_BUSCA.op('@@')(tsq)).limit(n),
+        select(D.id).where(DOCUMENTO_BUSCA.op('@@')(tsq)).limit(n),
+    ]
+    # a trigram index narrows nothing down for fewer than 3 characters
+    if trgm and len(q) >= 3:
+        branches += [
+            select(D.id).where(D.fornecedor.op('%')(q)).limit(n),
+            select(D.id).where(D.fornecedor.ilike(_contains(q), escape='\\')).limit(n),
+            select(D.id).where(D.numero_documento.ilike(_contains(q), escape='\\')).limit(n),
+        ]
+        digits = re.sub(r'\D', '', q)
+        if len(digits) >= 3:
+            branches.append(select(D.id).where(_digits(D.cnpj).like(f'%{digits}%')).limit(n))
+    return union(*branches).subquery('candidatos')
+
+
+def search_statement(q: str, dialect: str, trgm: bool = False, after: tuple | None = None, limit: int = 50):
+    """Documentos matching `q`, best first, with their `relevancia`.
+
+    `after` is the (relevancia, id) of the last row of the previous page;
+    one extra row tells whether there is a next page.
+    """
+    D, E = models.DocumentoFinanceiro, models.Email
+    if dialect == 'postgresql':
+        tsq = func.websearch_to_tsquery(cast(literal(TS_CONFIG), REGCONFIG), q)
+        cand = _candidates(q, tsq, trgm)
+        rank = func.ts_rank(EMAIL_BUSCA, tsq) + 2 * func.ts_rank(DOCUMENTO_BUSCA, tsq)
+        if trgm:
+            rank = rank + func.similarity(func.coalesce(D.fornecedor, ''), q)
+        ranked = (
+            select(*_columns(), cast(rank, Float).label('relevancia'))
+            .select_from(cand)
+            .join(D, D.id == cand.c.id)
+            .join(E, E.id == D.email_id)
+        )
+    else:
+        like = _contains(q)
+        ranked = (
+            select(*_columns(), literal(0.0, Float).label('relevancia'))
+            .join(E, E.id == D.email_id)
+            .where(or_(*(c.ilike(like, escape='\\') for c in (E.assunto, E.corpo, D.fornecedor, D.numero_documento, D.cnpj))))
+        )
+    ranked = ranked.subquery('ranked')
+    stmt = select(ranked)
+    if after:
+        relevancia, doc_id = after
+        stmt = stmt.where(or_(
+            ranked.c.relevancia < relevancia,
+            and_(ranked.c.relevancia == relevancia, ranked.c.id > doc_id),
+        ))
+    return stmt.order_by(ranked.c.relevancia.desc(), ranked.c.id).limit(limit + 1)
@@ -0,0 +1,254 @@
+"""Registry of known suppliers: classification priors from confirmed documentos.
+
+Most finance mail comes from a known set of suppliers that always send the
+same kind of document (a transportadora sends NF_FRETE). Every confirmation
+adds the documento's subtipo to the counts of its keys in
+registro_fornecedores, in the same transaction:
+
+- ('cnpj', digits of the extracted cnpj);
+- ('dominio', domain of the sender), except public mail providers and the
+  company's own domain (REGISTRO_DOMINIOS_IGNORADOS).
+
+Each process keeps a dict {(tipo_chave, chave): (subtipo, proporcao)} of the
+keys decided by the counts: confirmed at least REGISTRO_MIN_CONFIRMADOS times,
+one subtipo in at least REGISTRO_MIN_PROPORCAO of them. The first lookup loads
+it and starts a thread that reloads it every REGISTRO_REFRESH_INTERVAL
+seconds. CPU worker pools that classify get the parent's table through
+`init_worker` instead, so every worker answers from the same table and none
+of them queries the database. `prior` checks the sender domain and then the
+first CNPJ of the text (the extractor's cnpj pattern) against it before the
+keyword scorers run; internal senders always go through the scorers, since
+their requisitions quote suppliers' CNPJs.
+"""
+import os
+import re
+import threading
+from typing import Iterable, List
+
+from sqlalchemy import delete, func, insert, select
+
+from app.db import models
+from app.services.advanced_classifier import _is_internal_sender
+
+REGISTRO_REFRESH_INTERVAL = float(os.environ.get('REGISTRO_REFRESH_INTERVAL') or 300)  # 0 = no background reload
+REGISTRO_MIN_CONFIRMADOS = int(os.environ.get('REGISTRO_MIN_CONFIRMADOS') or 3)
+REGISTRO_MIN_PROPORCAO = float(os.environ.get('REGISTRO_MIN_PROPORCAO') or 0.9)
+REGISTRO_DOMINIOS_IGNORADOS = frozenset(
+    d.strip().lower() for d in (
+        os.environ.get('REGISTRO_DOMINIOS_IGNORADOS')
+        or 'empresa.com,gmail.com,hotmail.com,outlook.com,live.com,yahoo.com,yahoo.com.br,uol.com.br,bol.com.br,icloud.com'
+    ).split(',') if d.strip()
+)
+
+CNPJ = 'cnpj'
+DOMINIO = 'dominio'
+_CNPJ_PATTERN = re.compile(r'[0-9]{2}\.?[0-9]{3}\.?[0-9]{3}/[0-9]{4}-[0-9]{2}')
+_TIPOS = {'REQUISICAO_COMPRA': 'ENTRADA_INTERNA'}
+
+
+def _name(value) -> str | None:
+    return getattr(value, 'name', value)
+
+
+def domain(remetente: str | None) -> str | None:
+    """Sender domain, or None for an ignored or missing one."""
+    if '@' not in (remetente or ''):
+        return None
+    d = remetente.rpartition('@')[2].strip().strip('>').lower()
+    return d if d and d not in REGISTRO_DOMINIOS_IGNORADOS else None
+
+
+def cnpj_digits(cnpj: str | None) -> str | None:
+    digits = re.sub(r'\D', '', cnpj or '')
+    return digits if len(digits) == 14 else None
+
+
+def keys(cnpj: str | None, remetente: str | None) -> List[tuple]:
+    out = []
+    if cnpj_digits(cnpj):
+        out.append((CNPJ, cnpj_digits(cnpj)))
+    if domain(remetente):
+        out.append((DOMINIO, domain(remetente)))
+    return out
+
+
+def _rows(docs: Iterable) -> List[dict]:
+    """Count rows for (subtipo, cnpj, fornecedor, remetente) tuples, keys sorted like rollup."""
+    acc = {}
+    for subtipo, cnpj, fornecedor, remetente in docs:
+        subtipo = _name(subtipo)
+        if not subtipo:
+            continue
+        for tipo_chave, chave in keys(cnpj, remetente):
+            k = (tipo_chave, chave, subtipo)
+            quantidade, nome = acc.get(k, (0, None))
+            acc[k] = (quantidade + 1, fornecedor or nome)
+    return [
+        {'tipo_chave': k[0], 'chave': k[1], 'subtipo': k[2], 'quantidade': quantidade, 'fornecedor': nome}
+        for k, (quantidade, nome) in sorted(acc.items())
+    ]
+
+
+def _upsert(dialect: str, rows: List[dict]):
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    R = models.RegistroFornecedor
+    stmt = dialect_insert(R).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[R.tipo_chave, R.chave, R.subtipo],
+        set_={
+            'quantidade': R.quantidade + stmt.excluded.quantidade,
+            'fornecedor': func.coalesce(stmt.excluded.fornecedor, R.fornecedor),
+            'atualizado_em': func.now(),
+        },
+    )
+
+
+def record(db, doc, remetente: str | None):
+    """Count a confirmed documento under its keys (the caller commits)."""
+    rows = _rows([(doc.subtipo, doc.cnpj, doc.fornecedor, remetente)])
+    if rows:
+        db.execute(_upsert(db.get_bind().dialect.name, rows))
+
+
+async def record_async(db, doc, remetente: str | None):
+    """record for an AsyncSession."""
+    rows = _rows([(doc.subtipo, doc.cnpj, doc.fornecedor, remetente)])
+    if rows:
+        await db.execute(_upsert(db.get_bind().dialect.name, rows))
+
+
+def rebuild(db, chunk_size: int = 5000) -> int:
+    """Recount the registry from all confirmed documentos; returns the number of rows written."""
+    D, E = models.DocumentoFinanceiro, models.Email
+    db.execute(delete(models.RegistroFornecedor))
+    docs = db.execute(
+        select(D.subtipo, D.cnpj, D.fornecedor, E.remetente)
+        .join(E, E.id == D.email_id)
+        .where(D.status == models.DocumentStatus.FEITO)
+        .order_by(D.confirmado_em)
+        .execution_options(yield_per=chunk_size)
+    )
+    rows = _rows(docs)
+    for i in range(0, len(rows), chunk_size):
+        db.execute(insert(models.RegistroFornecedor), rows[i:i + chunk_size])
+    db.commit()
+    return len(rows)
+
+
+class SupplierRegistry:
+    """In-memory lookup of decided keys, reloaded in the background."""
+
+    def __init__(self, session_factory=None, refresh_interval: float = REGISTRO_REFRESH_INTERVAL,
+                 min_confirmados: int = REGISTRO_MIN_CONFIRMADOS, min_proporcao: float = REGISTRO_MIN_PROPORCAO):
+        self.session_factory = session_factory
+        self.refresh_interval = refresh_interval
+        self.min_confirmados = min_confirmados
+        self.min_proporcao = min_proporcao
+        self._table = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def _sessions(self):
+        if self.session_factory is None:
+            from app.db.session import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory
+
+    def refresh(self) -> int:
+        """Reload the decided keys from the database; returns how many there are."""
+        R = models.RegistroFornecedor
+        totals = {}
+        with self._sessions()() as db:
+            for tipo_chave, chave, subtipo, quantidade in db.execute(select(R.tipo_chave, R.chave, R.subtipo, R.quantidade)):
+                total, best, best_n = totals.get((tipo_chave, chave), (0, None, 0))
+                if quantidade > best_n:
+                    best, best_n = subtipo, quantidade
+                totals[(tipo_chave, chave)] = (total + quantidade, best, best_n)
+        table = {
+            k: (best, best_n / total)
+            for k, (total, best, best_n) in totals.items()
+            if total >= self.min_confirmados and best_n / total >= self.min_proporcao
+        }
+        self._table = table  # swapped whole: readers never see a partial table
+        return len(table)
+
+    def _load(self):
+        try:
+            self.refresh()
+        except Exception:
+            pass  # no database or no table yet: classify without priors until the next round
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            self._load()
+
+    def start(self):
+        """Load the table now and reload it in a background thread."""
+        with self._lock:
+            # a forked process inherits the table but not the thread
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            # under the lock: concurrent first lookups wait for the table
+            self._load()
+            if self.refresh_interval <= 0:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='supplier-registry', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def install(self, table: dict):
+        """Use `table` in this process, with no reload thread."""
+        with self._lock:
+            self._table, self._pid = table, os.getpid()
+
+    def snapshot(self) -> dict:
+        """The table of this process (loaded first if needed), for `init_worker`."""
+        if self._pid != os.getpid():
+            self.start()
+        return self._table
+
+    def lookup(self, tipo_chave: str, chave: str | None):
+        return self._table.get((tipo_chave, chave)) if chave else None
+
+    def prior(self, text: str | None, remetente: str | None) -> dict | None:
+        """Classification of a known supplier, or None to run the keyword scorers."""
+        if self._pid != os.getpid():
+            self.start()
+        if not self._table or _is_internal_sender(remetente or ''):
+            return None
+        hit = self.lookup(DOMINIO, domain(remetente))
+        if hit is None:
+            m = _CNPJ_PATTERN.search(text or '')
+            hit = self.lookup(CNPJ, cnpj_digits(m.group(0))) if m else None
+        if hit is None:
+            return None
+        subtipo, proporcao = hit
+        return {'tipo': _TIPOS.get(subtipo, 'DOCUMENTO_FORNECEDOR'), 'subtipo': subtipo,
+                'confidence': round(min(proporcao, 0.99), 2), 'fonte': 'registro'}
+
+
+REGISTRY = SupplierRegistry()
+
+
+def prior(text: str | None, remetente: str | None) -> dict | None:
+    return REGISTRY.prior(text, remetente)
+
+
+def init_worker(table: dict):
+    """Process pool initializer: `initargs=(REGISTRY.snapshot(),)` in the parent."""
+    # forked children must not reuse the parent's pooled connections
+    from app.db.session import engine
+    engine.dispose(close=False)
+    REGISTRY.install(table)
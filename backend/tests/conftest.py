@@ -1,8 +1,374 @@
 import sys
 import os
+import base64
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # Ensure 'backend' folder is on sys.path so 'app' package imports resolve during tests
 TEST_DIR = os.path.dirname(__file__)
 BACKEND_DIR = os.path.abspath(os.path.join(TEST_DIR, '..'))
 if BACKEND_DIR not in sys.path:
     sys.path.insert(0, BACKEND_DIR)
+
+import pytest
+
+
+@pytest.fixture
+def db_session():
+    """SQLAlchemy session on an in-memory SQLite database with all tables created."""
+    pytest.importorskip('sqlalchemy')
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from app.db import models
+
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    models.Base.metadata.create_all(engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    db.info['sessionmaker'] = Session
+    try:
+        yield db
+    finally:
+        db.close()
+        engine.dispose()
+
+
+@pytest.fixture
+def client(db_session):
+    """FastAPI TestClient whose get_db dependency uses the SQLite test database."""
+    pytest.importorskip('fastapi')
+    pytest.importorskip('httpx')
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.api.documents import get_db
+
+    Session = db_session.info['sessionmaker']
+
+    def _get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = _get_db
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+
+@pytest.fixture
+def pg_engine():
+    """Engine on a real Postgres (TEST_DATABASE_URL), schema rebuilt by the Alembic migrations.
+
+    The public schema of that database is dropped: point it at a throwaway database.
+    """
+    url = os.environ.get('TEST_DATABASE_URL')
+    if not url:
+        pytest.skip('TEST_DATABASE_URL not set')
+    pytest.importorskip('alembic')
+    from sqlalchemy import create_engine, text
+    from app.db import init_db
+
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        conn.execute(text('DROP SCHEMA public CASCADE'))
+        conn.execute(text('CREATE SCHEMA public'))
+    init_db.create_tables(bind=engine)
+    try:
+        yield engine
+    finally:
+        engine.dispose()
+
+
+class FakeGraph(BaseHTTPRequestHandler):
+    """Local stand-in for the Graph API returning canned JSON."""
+
+    messages = [
+        {'id': f'm{i}', 'subject': f'NF {i}', 'from': {'emailAddress': {'address': 'f@ex.com'}},
+         'bodyPreview': 'Nota Fiscal', 'receivedDateTime': '2024-01-01T00:00:00Z', 'webLink': None}
+        for i in range(6)
+    ]
+    fail_once = {'m3'}
+    hits = []
+    tokens = []
+    expires_in = 3600
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        type(self).tokens.append(self.path)
+        self._json(200, {'access_token': 'tok', 'expires_in': self.expires_in})
+
+    def do_GET(self):
+        type(self).hits.append(self.path)
+        base = f'http://{self.headers["Host"]}'
+        if self.path.split('?')[0].endswith('/messages'):
+            return self._json(200, {'value': self.messages})
+        if '/messages/delta' in self.path or self.path.startswith('/delta'):
+            # round 1: two pages then a deltaLink; round 2 (token=1): only changes; then nothing new
+            if 'token=expired' in self.path:
+                return self._json(410, {'error': {'code': 'SyncStateNotFound', 'message': 'sync state expired'}})
+            if 'token=2' in self.path:
+                return self._json(200, {'value': [], '@odata.deltaLink': base + '/delta?token=2'})
+            if 'token=1' in self.path:
+                return self._json(200, {
+                    'value': [self.messages[0], {'id': 'm1', '@removed': {'reason': 'deleted'}},
+                              dict(self.messages[0], id='m9')],
+                    '@odata.deltaLink': base + '/delta?token=2',
+                })
+            if 'skip=1' in self.path:
+                return self._json(200, {'value': self.messages[3:], '@odata.deltaLink': base + '/messages/delta?token=1'})
+            return self._json(200, {'value': self.messages[:3], '@odata.nextLink': base + '/messages/delta?skip=1'})
+        message_id = self.path.split('/messages/')[1].split('/')[0]
+        if message_id in self.fail_once:
+            self.fail_once.discard(message_id)
+            return self._json(503, {'error': 'busy'})
+        content = base64.b64encode(f'pdf-{message_id}'.encode()).decode()
+        self._json(200, {'value': [
+            {'@odata.type': '#microsoft.graph.fileAttachment', 'name': f'{message_id}.pdf', 'contentBytes': content},
+            {'@odata.type': '#microsoft.graph.referenceAttachment', 'name': 'link'},
+        ]})
+
+
+@pytest.fixture
+def graph(monkeypatch, tmp_path):
+    """FakeGraph on a local port, with the collector and attachment store pointed at it."""
+    pytest.importorskip('requests')
+    from app.services import attachment_store, outlook_collector
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGraph)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    monkeypatch.setattr(outlook_collector, 'GRAPH_BASE', base)
+    monkeypatch.setattr(outlook_collector, 'TOKEN_URL', base + '/{tenant_id}/token')
+    monkeypatch.setattr(attachment_store, 'STORAGE_DIR', str(tmp_path))
+    FakeGraph.hits = []
+    FakeGraph.tokens = []
+    FakeGraph.fail_once = {'m3'}
+    yield server
+    server.shutdown()
+
+
+class FakeImap:
+    """Local IMAP4rev1 stand-in: one folder, UID FETCH/SEARCH, EXAMINE, IDLE.
+
+    Serves the messages appended to `messages` (raw RFC 822 bytes); every
+    command line received is recorded in `commands`.
+    """
+
+    def __init__(self, uidvalidity=1000):
+        import socketserver
+
+        self.uidvalidity = uidvalidity
+        self.messages = []  # (uid, email.message.Message, internaldate)
+        self.commands = []
+        self.next_uid = 1
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                fake._session(self)
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def add(self, raw: bytes, uid=None):
+        import email
+        from datetime import datetime, timezone
+
+        raw = raw.replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+        with self.lock:
+            uid = uid or self.next_uid
+            self.next_uid = uid + 1
+            self.messages.append((uid, email.message_from_bytes(raw), datetime(2024, 1, 2, 10, 0, tzinfo=timezone.utc)))
+        return uid
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # -- protocol ---------------------------------------------------------
+
+    @staticmethod
+    def _q(value):
+        if value is None:
+            return b'NIL'
+        if isinstance(value, str):
+            value = value.encode()
+        if any(c > 126 or c in b'\r\n"\\' for c in value):
+            return b'{%d}\r\n' % len(value) + value
+        return b'"' + value + b'"'
+
+    def _envelope(self, msg):
+        from email.utils import getaddresses
+
+        def addresses(header):
+            values = msg.get_all(header)
+            if not values:
+                return b'NIL'
+            out = []
+            for name, addr in getaddresses(values):
+                mailbox, _, host = addr.partition('@')
+                out.append(b'(' + b' '.join([self._q(name or None), b'NIL', self._q(mailbox), self._q(host)]) + b')')
+            return b'(' + b''.join(out) + b')'
+
+        fields = [self._q(msg['Date']), self._q(msg['Subject']), addresses('From'), addresses('From'),
+                  addresses('From'), addresses('To'), b'NIL', b'NIL', b'NIL', self._q(msg['Message-ID'])]
+        return b'(' + b' '.join(fields) + b')'
+
+    def _bodystructure(self, part):
+        if part.is_multipart():
+            return b'(' + b''.join(self._bodystructure(p) for p in part.get_payload()) + b' ' + self._q(part.get_content_subtype()) + b')'
+
+        def plist(params):
+            if not params:
+                return b'NIL'
+            return b'(' + b' '.join(self._q(k) + b' ' + self._q(v) for k, v in params) + b')'
+
+        body = part.get_payload().encode('latin-1')
+        fields = [self._q(part.get_content_maintype()), self._q(part.get_content_subtype()),
+                  plist((part.get_params() or [])[1:]), b'NIL', b'NIL',
+                  self._q(part.get('Content-Transfer-Encoding', '7bit')), b'%d' % len(body)]
+        if part.get_content_maintype() == 'text':
+            fields.append(b'%d' % body.count(b'\n'))
+        fields.append(b'NIL')
+        disposition = part.get_params(header='content-disposition')
+        fields.append(b'(' + self._q(disposition[0][0]) + b' ' + plist(disposition[1:]) + b')' if disposition else b'NIL')
+        return b'(' + b' '.join(fields) + b')'
+
+    @staticmethod
+    def _section(msg, section):
+        part = msg
+        for n in section.split('.'):
+            if part.is_multipart():
+                part = part.get_payload()[int(n) - 1]
+            elif n != '1':
+                raise KeyError(section)
+        return part.get_payload().encode('latin-1')
+
+    def _fetch_items(self, seq, uid, msg, internaldate, items):
+        import re
+
+        out = [b'UID %d' % uid]
+        for m in re.finditer(r'BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?|[A-Z0-9.]+', items):
+            token = m.group(0)
+            if m.group(1) is not None:
+                data = self._section(msg, m.group(1))
+                key = b'BODY[%s]' % m.group(1).encode()
+                if m.group(2):
+                    start = int(m.group(2))
+                    data = data[start:start + int(m.group(3))]
+                    key += b'<%d>' % start
+                out.append(key + b' {%d}\r\n' % len(data) + data)
+            elif token == 'ENVELOPE':
+                out.append(b'ENVELOPE ' + self._envelope(msg))
+            elif token == 'BODYSTRUCTURE':
+                out.append(b'BODYSTRUCTURE ' + self._bodystructure(msg))
+            elif token == 'INTERNALDATE':
+                out.append(b'INTERNALDATE "%s"' % internaldate.strftime('%d-%b-%Y %H:%M:%S +0000').encode())
+            elif token == 'RFC822.SIZE':
+                out.append(b'RFC822.SIZE %d' % len(msg.as_bytes()))
+        return b'* %d FETCH (' % seq + b' '.join(out) + b')\r\n'
+
+    def _uids(self, spec):
+        with self.lock:
+            uids = [uid for uid, _, _ in self.messages]
+        selected = set()
+        for piece in spec.split(','):
+            lo, _, hi = piece.partition(':')
+            top = max(uids, default=0)
+            lo = top if lo == '*' else int(lo)
+            hi = lo if not hi else (top if hi == '*' else int(hi))
+            lo, hi = min(lo, hi), max(lo, hi)
+            selected |= {u for u in uids if lo <= u <= hi}
+        return sorted(selected)
+
+    def _session(self, handler):
+        import select
+
+        def send(data):
+            handler.wfile.write(data)
+            handler.wfile.flush()
+
+        send(b'* OK FakeImap ready\r\n')
+        while True:
+            line = handler.rfile.readline()
+            if not line:
+                return
+            text = line.decode().rstrip('\r\n')
+            self.commands.append(text)
+            tag, _, rest = text.partition(' ')
+            command, _, args = rest.partition(' ')
+            command = command.upper()
+            if command == 'UID':
+                command, _, args = args.partition(' ')
+                command = 'UID ' + command.upper()
+            if command == 'CAPABILITY':
+                send(b'* CAPABILITY IMAP4rev1 IDLE\r\n')
+            elif command in ('SELECT', 'EXAMINE'):
+                with self.lock:
+                    exists = len(self.messages)
+                send(b'* %d EXISTS\r\n* OK [UIDVALIDITY %d] UIDs valid\r\n* OK [UIDNEXT %d] next\r\n'
+                     % (exists, self.uidvalidity, self.next_uid))
+            elif command == 'UID SEARCH':
+                spec = args.split()[-1]
+                if spec in ('ALL', 'UNSEEN'):
+                    # nothing is ever marked seen here (the collector only PEEKs)
+                    spec = '1:*'
+                send(b'* SEARCH ' + b' '.join(b'%d' % u for u in self._uids(spec)) + b'\r\n')
+            elif command == 'UID FETCH':
+                spec, _, items = args.partition(' ')
+                wanted = set(self._uids(spec))
+                with self.lock:
+                    messages = list(self.messages)
+                for seq, (uid, msg, internaldate) in enumerate(messages, 1):
+                    if uid in wanted:
+                        send(self._fetch_items(seq, uid, msg, internaldate, items))
+            elif command == 'IDLE':
+                send(b'+ idling\r\n')
+                with self.lock:
+                    announced = len(self.messages)
+                while True:
+                    with self.lock:
+                        exists = len(self.messages)
+                    if exists > announced:
+                        send(b'* %d EXISTS\r\n' % exists)
+                        announced = exists
+                    if select.select([handler.connection], [], [], 0.05)[0]:
+                        done = handler.rfile.readline()
+                        self.commands.append(done.decode().strip())
+                        break
+            elif command == 'LOGOUT':
+                send(b'* BYE\r\n' + tag.encode() + b' OK LOGOUT completed\r\n')
+                return
+            send(tag.encode() + b' OK ' + command.encode() + b' completed\r\n')
+
+
+@pytest.fixture
+def imap(monkeypatch, tmp_path):
+    """FakeImap on a local port, with the attachment store in a temp dir."""
+    pytest.importorskip('imapclient')
+    from app.services import attachment_store
+
+    monkeypatch.setattr(attachment_store, 'STORAGE_DIR', str(tmp_path))
+    server = FakeImap()
+    yield server
+    server.close()
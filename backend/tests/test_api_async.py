@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip('fastapi')
+pytest.importorskip('httpx')
+pytest.importorskip('aiosqlite')
+pytest.importorskip('greenlet')
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app.api import documents, documents_async
+from app.db import models
+from app.services import rollup
+
+
+@pytest.fixture
+def apps(tmp_path):
+    """Sync and async routers over the same SQLite file, plus a seeding session."""
+    documents._count_cache.clear()
+    path = tmp_path / 'db.sqlite'
+    engine = create_engine(f'sqlite:///{path}')
+    models.Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{path}', poolclass=NullPool)
+    AsyncSession = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    def _get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def _get_async_db():
+        async with AsyncSession() as db:
+            yield db
+
+    sync_app, async_app = FastAPI(), FastAPI()
+    sync_app.include_router(documents.router, prefix='/documentos')
+    sync_app.dependency_overrides[documents.get_db] = _get_db
+    async_app.include_router(documents_async.router, prefix='/documentos')
+    async_app.dependency_overrides[documents_async.get_async_db] = _get_async_db
+
+    # one portal (event loop) for the whole test: aiosqlite connections are loop-bound
+    with TestClient(sync_app) as sync_client, TestClient(async_app) as async_client:
+        yield Session(), sync_client, async_client, async_engine
+    engine.dispose()
+
+
+def _seed(db):
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    email = models.Email(message_id='m1', remetente='f@ex.com', link_email_original='https://outlook/x')
+    db.add(email)
+    db.flush()
+    db.add(models.Anexo(email_id=email.id, nome_arquivo='a.pdf', tipo='PDF', caminho_arquivo='/x/a.pdf'))
+    docs = [
+        models.DocumentoFinanceiro(
+            email_id=email.id, tipo=models.DocumentType.DOCUMENTO_FORNECEDOR,
+            status=models.DocumentStatus.PENDENTE if i % 2 else models.DocumentStatus.CLASSIFICADO,
+            fornecedor=f'Fornecedor {i}', valor=i, criado_em=base + timedelta(days=i),
+            metadados={'i': i},
+        )
+        for i in range(5)
+    ]
+    db.add_all(docs)
+    db.flush()
+    db.add_all(models.Historico(documento_id=d.id, evento='Documento recebido', data_hora=base) for d in docs)
+    db.commit()
+    return [d.id for d in docs]
+
+
+def test_async_routes_match_sync(apps):
+    db, sync_client, async_client, _ = apps
+    ids = _seed(db)
+    for url, params in [
+        ('/documentos/', {'limit': 2}),
+        ('/documentos/', {'status': 'PENDENTE', 'total': 'true'}),
+        (f'/documentos/{ids[0]}', {}),
+        (f'/documentos/{ids[0]}/email-original', {}),
+        ('/documentos/busca', {'q': 'fornecedor 3'}),
+    ]:
+        expected = sync_client.get(url, params=params)
+        got = async_client.get(url, params=params)
+        assert got.status_code == expected.status_code == 200
+        assert got.json() == expected.json()
+
+    page = async_client.get('/documentos/', params={'limit': 2}).json()
+    rest = async_client.get('/documentos/', params={'limit': 10, 'cursor': page['next_cursor']}).json()
+    assert len(page['items']) + len(rest['items']) == 5 and rest['next_cursor'] is None
+    assert async_client.get('/documentos/', params={'status': 'NADA'}).status_code == 422
+
+
+def test_async_detail_statements_and_confirm(apps):
+    db, _, async_client, async_engine = apps
+    doc_id = _seed(db)[0]
+    rollup.rebuild(db)
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)  # noqa: E731
+    event.listen(async_engine.sync_engine, 'before_cursor_execute', listener)
+    try:
+        assert len(async_client.get(f'/documentos/{doc_id}').json()['anexos']) == 1
+        assert len(statements) == 2, statements
+    finally:
+        event.remove(async_engine.sync_engine, 'before_cursor_execute', listener)
+
+    assert async_client.post(f'/documentos/{doc_id}/confirmar', params={'usuario': 'ana'}).json() == {'status': 'ok'}
+    assert async_client.post(f'/documentos/{doc_id}/confirmar', params={'usuario': 'ana'}).status_code == 400
+    detail = async_client.get(f'/documentos/{doc_id}').json()
+    assert detail['status'] == 'FEITO' and detail['confirmado_por'] == 'ana'
+    assert detail['historicos'][0]['evento'] == 'Marcar como FEITO'
+    resumo = async_client.get('/documentos/resumo', params={'periodo': 'total', 'agrupar': 'status'}).json()
+    assert [(g['status'], g['quantidade']) for g in resumo['grupos']] == [('CLASSIFICADO', 2), ('FEITO', 1), ('PENDENTE', 2)]
+    assert async_client.get('/documentos/00000000-0000-0000-0000-000000000000').status_code == 404
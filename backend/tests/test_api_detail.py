@@ -0,0 +1,93 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip('sqlalchemy')
+
+from sqlalchemy import event
+
+from app.db import models
+
+
+@contextmanager
+def count_statements(engine):
+    """Collect the SQL statements executed on `engine` inside the block."""
+    statements = []
+
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', _before)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', _before)
+
+
+def _documento(db, n_anexos, n_eventos):
+    email = models.Email(message_id=f'm-{n_anexos}-{n_eventos}', remetente='f@ex.com', link_email_original='https://outlook/x')
+    db.add(email)
+    db.flush()
+    doc = models.DocumentoFinanceiro(
+        email_id=email.id, tipo=models.DocumentType.DOCUMENTO_FORNECEDOR,
+        subtipo=models.DocumentSubtipo.NF_PRODUTO, valor=12.5, metadados={'ncm': ['12345678']},
+    )
+    db.add(doc)
+    db.flush()
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    db.add_all(
+        models.Anexo(email_id=email.id, nome_arquivo=f'{i}.pdf', tipo='PDF', caminho_arquivo=f'/x/{i}.pdf')
+        for i in range(n_anexos)
+    )
+    db.add_all(
+        models.Historico(documento_id=doc.id, evento=f'evento {i}', data_hora=base + timedelta(minutes=i))
+        for i in range(n_eventos)
+    )
+    db.commit()
+    return doc
+
+
+@pytest.mark.parametrize('n_anexos,n_eventos', [(0, 0), (1, 2), (4, 6)])
+def test_detail_is_two_statements(client, db_session, n_anexos, n_eventos):
+    doc_id = _documento(db_session, n_anexos, n_eventos).id
+
+    with count_statements(db_session.get_bind()) as statements:
+        r = client.get(f'/documentos/{doc_id}')
+    assert r.status_code == 200
+    # documento + email + anexos joined, historicos by documento id: rows do not multiply
+    assert len(statements) == 2, statements
+    assert 'historicos' not in statements[0] and 'anexos' not in statements[1]
+
+    body = r.json()
+    assert body['subtipo'] == 'NF_PRODUTO' and body['valor'] == 12.5
+    assert body['metadados'] == {'ncm': ['12345678']}
+    assert len(body['anexos']) == n_anexos
+    assert [h['evento'] for h in body['historicos']] == [f'evento {i}' for i in reversed(range(n_eventos))]
+    if n_anexos:
+        assert set(body['anexos'][0]['previews']) == {'thumb', 'medio', 'grande'}
+
+
+def test_email_link_and_confirm_statement_counts(client, db_session):
+    doc_id = _documento(db_session, 2, 1).id
+    engine = db_session.get_bind()
+
+    with count_statements(engine) as statements:
+        assert client.get(f'/documentos/{doc_id}/email-original').json() == {'link': 'https://outlook/x'}
+    assert len(statements) == 1
+
+    with count_statements(engine) as statements:
+        assert client.post(f'/documentos/{doc_id}/confirmar', params={'usuario': 'ana'}).json() == {'status': 'ok'}
+    # lookup (with the sender), feed event insert, rollup upsert, supplier registry upsert,
+    # status update, history insert
+    assert len(statements) == 6, statements
+    assert client.post(f'/documentos/{doc_id}/confirmar', params={'usuario': 'ana'}).status_code == 400
+
+    eventos = client.get(f'/documentos/{doc_id}').json()['historicos']
+    assert eventos[0]['evento'] == 'Marcar como FEITO' and eventos[0]['usuario'] == 'ana'
+
+
+def test_unknown_or_invalid_id(client):
+    assert client.get('/documentos/00000000-0000-0000-0000-000000000000').status_code == 404
+    assert client.get('/documentos/00000000-0000-0000-0000-000000000000/email-original').status_code == 404
+    assert client.get('/documentos/nao-e-uuid').status_code == 422
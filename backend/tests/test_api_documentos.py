@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.db import models
+
+
+@pytest.fixture
+def documentos(db_session):
+    email = models.Email(message_id='m1', remetente='f@ex.com')
+    db_session.add(email)
+    db_session.flush()
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    docs = []
+    for i in range(7):
+        doc = models.DocumentoFinanceiro(
+            email_id=email.id,
+            tipo=models.DocumentType.DOCUMENTO_FORNECEDOR if i % 2 else models.DocumentType.ENTRADA_INTERNA,
+            status=models.DocumentStatus.PENDENTE,
+            fornecedor=f'Fornecedor {i}',
+            valor=10 * i,
+            # two documents share a timestamp: the id breaks the tie
+            criado_em=base + timedelta(days=min(i, 5)),
+        )
+        docs.append(doc)
+    db_session.add_all(docs)
+    db_session.commit()
+    return docs
+
+
+def test_keyset_pagination_walks_all_rows_once(client, documentos):
+    seen, cursor = [], None
+    while True:
+        params = {'limit': 3}
+        if cursor:
+            params['cursor'] = cursor
+        page = client.get('/documentos/', params=params).json()
+        seen += [d['id'] for d in page['items']]
+        cursor = page.get('next_cursor')
+        if not cursor:
+            break
+    assert len(seen) == len(set(seen)) == 7
+    first = client.get('/documentos/', params={'limit': 1}).json()['items'][0]
+    assert set(first) == {'id', 'tipo', 'subtipo', 'fornecedor', 'numero_documento', 'valor', 'status', 'confirmado_em', 'criado_em'}
+    assert first['criado_em'].startswith('2024-01-06')
+
+
+def test_filters_and_total(client, documentos):
+    page = client.get('/documentos/', params={'tipo': 'DOCUMENTO_FORNECEDOR', 'total': 'true'}).json()
+    assert page['total'] == 3
+    assert {d['tipo'] for d in page['items']} == {'DOCUMENTO_FORNECEDOR'}
+    page = client.get('/documentos/', params={'fornecedor': 'fornecedor 2'}).json()
+    assert [d['fornecedor'] for d in page['items']] == ['Fornecedor 2']
+    page = client.get('/documentos/', params={'de': '2024-01-03T00:00:00+00:00', 'ate': '2024-01-05T00:00:00+00:00'}).json()
+    assert sorted(d['fornecedor'] for d in page['items']) == ['Fornecedor 2', 'Fornecedor 3']
+    assert client.get('/documentos/', params={'status': 'XYZ'}).status_code == 422
+    assert client.get('/documentos/', params={'cursor': '!!'}).status_code == 422
+
+
+def test_database_from_before_criado_em_is_upgraded(pg_engine):
+    """A create_all database without documentos.criado_em (nor alembic_version) gets it from its e-mails."""
+    from alembic import command
+    from alembic.config import Config
+    from sqlalchemy import inspect, text
+    from app.db import init_db
+
+    cfg = Config(init_db.ALEMBIC_INI)
+    cfg.attributes['configure_logger'] = False
+    with pg_engine.connect() as conn:
+        cfg.attributes['connection'] = conn
+        command.downgrade(cfg, init_db.BASELINE_REVISION)
+    recebido = datetime(2024, 3, 1, 12, tzinfo=timezone.utc)
+    with pg_engine.begin() as conn:
+        conn.execute(text('DROP TABLE alembic_version'))
+        email_id = conn.execute(text("INSERT INTO emails (id, message_id, remetente, criado_em) "
+                                     "VALUES (gen_random_uuid(), 'm1', 'f@ex.com', :t) RETURNING id"), {'t': recebido}).scalar()
+        conn.execute(text("INSERT INTO documentos_financeiros (id, email_id, tipo) "
+                          "VALUES (gen_random_uuid(), :e, 'OUTROS')"), {'e': email_id})
+    assert 'criado_em' not in {c['name'] for c in inspect(pg_engine).get_columns('documentos_financeiros')}
+
+    init_db.create_tables(bind=pg_engine)
+    with pg_engine.connect() as conn:
+        assert conn.execute(text('SELECT criado_em FROM documentos_financeiros')).scalar() == recebido
@@ -0,0 +1,71 @@
+import pytest
+
+pytest.importorskip('PIL')
+
+from PIL import Image
+
+from app.db import models
+from app.services import preview
+
+
+@pytest.fixture
+def documento(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(preview, 'STORAGE_DIR', str(tmp_path))
+    path = tmp_path / 'nf.png'
+    Image.new('RGB', (2000, 1000), 'red').save(path)
+    email = models.Email(message_id='m1', remetente='f@ex.com')
+    db_session.add(email)
+    db_session.flush()
+    anexo = models.Anexo(email_id=email.id, nome_arquivo='nf.png', tipo='imagem', caminho_arquivo=str(path))
+    doc = models.DocumentoFinanceiro(email_id=email.id, tipo=models.DocumentType.OUTROS)
+    db_session.add_all([anexo, doc])
+    db_session.commit()
+    return doc, anexo
+
+
+def test_preview_served_with_validators_and_sizes(client, documento):
+    _, anexo = documento
+    url = f'/documentos/anexos/{anexo.id}/preview'
+    r = client.get(url, params={'tamanho': 'thumb'})
+    assert r.status_code == 200
+    assert r.headers['content-type'] == 'image/png'
+    assert r.headers['etag'] and r.headers['last-modified']
+    big = client.get(url, params={'tamanho': 'grande'})
+    assert big.headers['etag'] != r.headers['etag']
+    assert len(big.content) > len(r.content)
+
+    assert client.get(url, params={'tamanho': 'thumb'}, headers={'If-None-Match': r.headers['etag']}).status_code == 304
+    assert client.get(url, params={'tamanho': 'thumb'}, headers={'If-Modified-Since': r.headers['last-modified']}).status_code == 304
+    assert client.get(url, params={'tamanho': 'enorme'}).status_code == 422
+
+
+def test_document_thumbnail_uses_first_attachment(client, documento):
+    doc, _ = documento
+    r = client.get(f'/documentos/{doc.id}/thumbnail', params={'formato': 'webp'})
+    assert r.status_code == 200
+    assert r.headers['content-type'] == 'image/webp'
+
+
+def test_migration_clears_base64_previews(pg_engine):
+    from alembic import command
+    from alembic.config import Config
+    from sqlalchemy import text
+    from app.db import init_db
+
+    cfg = Config(init_db.ALEMBIC_INI)
+    cfg.attributes['configure_logger'] = False
+    with pg_engine.connect() as conn:
+        cfg.attributes['connection'] = conn
+        command.downgrade(cfg, '0011_registro_fornecedores')
+    with pg_engine.begin() as conn:
+        email_id = conn.execute(text("INSERT INTO emails (id, message_id, remetente) "
+                                     "VALUES (gen_random_uuid(), 'm1', 'f@ex.com') RETURNING id")).scalar()
+        for nome, valor in [('old.png', 'iVBORw0KGgoAAAANSUhEUgAA'), ('new.png', '/data/storage/previews/ab/x.png')]:
+            conn.execute(text("INSERT INTO anexos (id, email_id, nome_arquivo, tipo, caminho_arquivo, preview_imagem) "
+                              "VALUES (gen_random_uuid(), :e, :n, 'imagem', :n, :v)"), {'e': email_id, 'n': nome, 'v': valor})
+    with pg_engine.connect() as conn:
+        cfg.attributes['connection'] = conn
+        command.upgrade(cfg, 'head')
+    with pg_engine.connect() as conn:
+        rows = dict(conn.execute(text('SELECT nome_arquivo, preview_imagem FROM anexos')).all())
+    assert rows == {'old.png': None, 'new.png': '/data/storage/previews/ab/x.png'}
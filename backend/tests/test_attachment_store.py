@@ -0,0 +1,48 @@
+import base64
+import os
+
+import pytest
+
+from app.services import attachment_store
+
+
+@pytest.fixture(autouse=True)
+def storage(monkeypatch, tmp_path):
+    monkeypatch.setattr(attachment_store, 'STORAGE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_identical_content_is_stored_once(monkeypatch):
+    monkeypatch.setattr(attachment_store, 'B64_CHUNK', 8)
+    data = b'%PDF-1.4 same invoice' * 10
+    a = attachment_store.store_b64(base64.b64encode(data).decode(), 'NF 1.PDF')
+    b = attachment_store.store_b64(base64.b64encode(data).decode(), 'reenvio.pdf')
+    assert a == b
+    assert a.endswith('.pdf')
+    with open(a, 'rb') as f:
+        assert f.read() == data
+    assert attachment_store.store_b64(base64.b64encode(b'other').decode(), 'x.pdf') != a
+
+
+def test_collect_garbage_keeps_referenced_blobs(storage):
+    keep = attachment_store.store_stream([b'keep'], 'a.xml')
+    drop = attachment_store.store_stream([b'drop'], 'b.xml')
+    digest = os.path.splitext(os.path.basename(drop))[0]
+    preview = storage / 'previews' / digest[:2] / f'{digest}-1200-150.png'
+    preview.parent.mkdir(parents=True)
+    preview.write_bytes(b'png')
+    assert attachment_store.collect_garbage({keep}, min_age=3600) == 0
+    assert attachment_store.collect_garbage({keep}, min_age=0) == 1
+    assert os.path.exists(keep)
+    assert not os.path.exists(drop)
+    assert not preview.exists()
+
+
+def test_reused_blob_is_not_collected_before_its_anexo_commits():
+    old = attachment_store.store_stream([b'resent invoice'], 'a.pdf')
+    an_hour_ago = os.path.getmtime(old) - 7200
+    os.utime(old, (an_hour_ago, an_hour_ago))
+    # an in-flight ingestion stores the same content again; its Anexo row is not committed yet
+    assert attachment_store.store_stream([b'resent invoice'], 'b.pdf') == old
+    assert attachment_store.collect_garbage(set(), min_age=3600) == 0
+    assert os.path.exists(old)
@@ -0,0 +1,136 @@
+import pytest
+
+from app.services import attachment_store, attachment_text
+from app.services.extractor import extract_financial_data
+
+NFE = """<?xml version="1.0" encoding="UTF-8"?>
+<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">
+  <NFe><infNFe Id="NFe35240112345678000190550010000012341000012345" versao="4.00">
+    <ide><nNF>1234</nNF><serie>1</serie></ide>
+    <emit><CNPJ>12345678000190</CNPJ><xNome>Parafusos Paulista Ltda</xNome></emit>
+    <dest><CNPJ>98765432000110</CNPJ><xNome>Cliente SA</xNome></dest>
+    {itens}
+    <total><ICMSTot><vProd>1500.00</vProd><vNF>1530.50</vNF></ICMSTot></total>
+  </infNFe></NFe>
+</nfeProc>"""
+DET = '<det nItem="{n}"><prod><xProd>Parafuso {n}</xProd><NCM>73181500</NCM><qCom>{n}.0000</qCom><vProd>10.00</vProd></prod></det>'
+
+CTE = """<cteProc xmlns="http://www.portalfiscal.inf.br/cte"><CTe><infCte Id="CTe35240111222333000144570010000000771000000770">
+  <ide><nCT>77</nCT><xMunIni>Campinas</xMunIni><xMunFim>Curitiba</xMunFim></ide>
+  <emit><CNPJ>11222333000144</CNPJ><xNome>Transportes Rápidos Ltda</xNome></emit>
+  <vPrest><vTPrest>850.00</vTPrest></vPrest>
+</infCte></CTe></cteProc>"""
+
+NFSE = """<CompNfse xmlns="http://www.abrasf.org.br/nfse.xsd"><Nfse><InfNfse>
+  <Numero>555</Numero>
+  <Servico><Valores><ValorServicos>2000.00</ValorServicos><ValorIss>100.00</ValorIss></Valores>
+    <CodigoCnae>6201501</CodigoCnae></Servico>
+  <PrestadorServico><IdentificacaoPrestador><CpfCnpj><Cnpj>55666777000188</Cnpj></CpfCnpj></IdentificacaoPrestador>
+    <RazaoSocial>Consultoria TI ME</RazaoSocial></PrestadorServico>
+  <TomadorServico><IdentificacaoTomador><CpfCnpj><Cnpj>98765432000110</Cnpj></CpfCnpj></IdentificacaoTomador></TomadorServico>
+</InfNfse></Nfse></CompNfse>"""
+
+
+def _pdf(pages):
+    """Minimal text PDF, one Helvetica text block per page."""
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None, '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for lines in pages:
+        ops = ' '.join(f'({line}) Tj 0 -14 Td' for line in lines)
+        stream = f'BT /F1 12 Tf 72 720 Td {ops} ET'
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream')
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                       f'/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>')
+        kids.append(f'{len(objects)} 0 R')
+    objects[1] = f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(kids)} >>'
+    out, offsets = b'%PDF-1.4\n', []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f'{i} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    out += b''.join(f'{o:010d} 00000 n \n'.encode() for o in offsets)
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+    return out
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(attachment_store, 'STORAGE_DIR', str(tmp_path))
+    monkeypatch.setattr(attachment_text, '_memo', type(attachment_text._memo)())
+    monkeypatch.setattr(attachment_text, 'stats', {'memo': 0, 'disco': 0, 'parse': 0})
+
+    def put(content, name):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        return attachment_store.store_stream([content], name)
+    return put
+
+
+def test_nfe_xml_is_parsed_streaming(store):
+    path = store(NFE.format(itens=''.join(DET.format(n=n) for n in range(1, 201))), 'nfe.xml')
+    data = attachment_text.parse_fiscal_xml(path)
+    assert data['documento_fiscal'] == 'NFE'
+    assert data['fornecedor'] == 'Parafusos Paulista Ltda'
+    assert data['cnpj'] == '12.345.678/0001-90'  # emitter, not the recipient
+    assert (data['numero_documento'], data['valor'], data['ncm']) == ('1234', '1530.50', '73181500')
+    assert data['chave_acesso'] == '35240112345678000190550010000012341000012345'
+    assert len(data['itens']) == 200
+    assert data['itens'][2] == {'descricao': 'Parafuso 3', 'ncm': '73181500', 'quantidade': 3, 'valor': '10.00'}
+
+
+def test_cte_and_nfse_xml(store):
+    cte = attachment_text.parse_fiscal_xml(store(CTE, 'cte.xml'))
+    assert cte['documento_fiscal'] == 'CTE'
+    assert (cte['transportadora'], cte['origem'], cte['destino'], cte['valor']) == (
+        'Transportes Rápidos Ltda', 'Campinas', 'Curitiba', '850.00')
+    nfse = attachment_text.parse_fiscal_xml(store(NFSE, 'nfse.xml'))
+    assert nfse['documento_fiscal'] == 'NFSE'
+    assert nfse['cnpj'] == '55.666.777/0001-88'  # provider, not the tomador
+    assert (nfse['fornecedor'], nfse['numero_documento'], nfse['valor'], nfse['iss'], nfse['cnae']) == (
+        'Consultoria TI ME', '555', '2000.00', '100.00', '6201501')
+    assert attachment_text.parse_fiscal_xml(store('<pedido><item/></pedido>', 'pedido.xml')) == {}
+
+
+def test_pdf_text_is_read_page_by_page(store, monkeypatch):
+    pytest.importorskip('pdfplumber')
+    path = store(_pdf([[f'Pagina {n}'] for n in range(1, 6)]), 'boleto.pdf')
+    assert [t.strip() for t in attachment_text.iter_pdf_text(path)] == [f'Pagina {n}' for n in range(1, 6)]
+    assert len(list(attachment_text.iter_pdf_text(path, max_pages=2))) == 2
+
+
+def test_results_are_cached_by_content(store):
+    pytest.importorskip('pdfplumber')
+    pdf = store(_pdf([['Fornecedor: Papelaria Central', 'Valor Total: R$ 1.234,56']]), 'nf.pdf')
+    first = attachment_text.read_attachment(pdf)
+    assert 'Papelaria Central' in first['texto']
+    # same bytes saved under another name/e-mail: no second parse
+    copy = store(open(pdf, 'rb').read(), 'copia.pdf')
+    assert attachment_text.read_attachment(copy) == first
+    assert attachment_text.stats == {'memo': 1, 'disco': 0, 'parse': 1}
+    # new process (empty memo): served from the disk cache
+    attachment_text._memo.clear()
+    assert attachment_text.read_attachment(pdf) == first
+    assert attachment_text.stats['disco'] == 1 and attachment_text.stats['parse'] == 1
+
+    broken = store('<nfeProc><NFe>', 'quebrado.xml')
+    assert 'erro' in attachment_text.read_attachment(broken)
+    attachment_text._memo.clear()
+    assert 'erro' in attachment_text.read_attachment(broken)
+    assert attachment_text.stats['parse'] == 2
+
+
+def test_extractor_reads_attachments(store):
+    pytest.importorskip('pdfplumber')
+    xml = store(CTE, 'cte.xml')
+    pdf = store(_pdf([['Fornecedor: Papelaria Central', 'Valor Total: R$ 1.234,56']]), 'nf.pdf')
+
+    res = extract_financial_data('Segue CT-e', [{'nome_arquivo': 'cte.xml', 'caminho_arquivo': xml}], 'DOCUMENTO_FORNECEDOR', 'NF_FRETE')
+    assert (res['fornecedor'], res['cnpj'], res['valor'], res['transportadora']) == (
+        'Transportes Rápidos Ltda', '11.222.333/0001-44', '850.00', 'Transportes Rápidos Ltda')
+
+    res = extract_financial_data('Segue a nota', [{'nome_arquivo': 'nf.pdf', 'caminho_arquivo': pdf}], 'DOCUMENTO_FORNECEDOR', None)
+    assert res['fornecedor'] == 'Papelaria Central' and res['valor'] == '1234.56'
+    # a value in the XML wins over one typed in the body
+    res = extract_financial_data('Valor: R$ 1,00', [{'nome_arquivo': 'cte.xml', 'caminho_arquivo': xml}], 'DOCUMENTO_FORNECEDOR', None)
+    assert res['valor'] == '850.00'
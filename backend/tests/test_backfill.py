@@ -0,0 +1,123 @@
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from app.db import models
+from app.services import backfill
+
+FRETE = 'Segue o CT-e do frete. Transportadora: Transp Ltda\nOrigem: SP\nDestino: RJ\nValor: R$ 500,00'
+SERVICO = 'Prestação de serviço - ISS: 50.00\nCNAE: 1234\nValor: R$ 1.000,00'
+
+
+@pytest.fixture
+def Session(pg_engine):
+    return sessionmaker(bind=pg_engine)
+
+
+def _add(db, n, corpo, **doc):
+    email = models.Email(message_id=f'<m{n}@ex.com>', remetente='nf@fornecedor.com', corpo=corpo)
+    db.add(email)
+    db.flush()
+    d = models.DocumentoFinanceiro(email_id=email.id, **doc)
+    db.add(d)
+    db.flush()
+    return d.id
+
+
+def _as_ingested(corpo):
+    return backfill.new_values(backfill.analyse([{'corpo': corpo, 'remetente': 'nf@fornecedor.com', 'anexos': []}])[0])
+
+
+def test_dry_run_then_backfill(Session):
+    with Session() as db:
+        # stored before a rules change: frete filed as produto, no fields
+        stale = _add(db, 1, FRETE, tipo=models.DocumentType.DOCUMENTO_FORNECEDOR,
+                     subtipo=models.DocumentSubtipo.NF_PRODUTO, status=models.DocumentStatus.PENDENTE)
+        current = _add(db, 2, SERVICO, **_as_ingested(SERVICO))
+        confirmed = _add(db, 3, FRETE, tipo=models.DocumentType.OUTROS, status=models.DocumentStatus.FEITO)
+        db.commit()
+
+    totals = backfill.run_backfill(Session, processes=1, dry_run=True)
+    assert totals['processados'] == 2 and totals['alterados'] == 1
+    assert totals['matriz'] == {('NF_PRODUTO', 'NF_FRETE'): 1, ('NF_SERVICO', 'NF_SERVICO'): 1}
+    assert 'NF_PRODUTO' in backfill.format_matrix(totals['matriz'])
+    with Session() as db:
+        assert db.scalar(select(func.count()).select_from(models.Historico)) == 0
+        assert db.get(models.DocumentoFinanceiro, stale).subtipo == models.DocumentSubtipo.NF_PRODUTO
+        assert db.get(models.BackfillCheckpoint, 'padrao') is None
+
+    totals = backfill.run_backfill(Session, processes=1)
+    assert totals['alterados'] == 1 and totals['campos']['subtipo'] == 1
+    with Session() as db:
+        doc = db.get(models.DocumentoFinanceiro, stale)
+        assert (doc.subtipo, doc.status, doc.valor) == (models.DocumentSubtipo.NF_FRETE, models.DocumentStatus.CLASSIFICADO, 500)
+        assert doc.metadados['transportadora'] == 'Transp Ltda'
+        [event] = db.scalars(select(models.Historico.evento).where(models.Historico.documento_id == stale)).all()
+        assert event.startswith('Backfill - Reclassificado: NF_PRODUTO -> NF_FRETE')
+        assert db.execute(select(models.DocumentoEvento.documento_id, models.DocumentoEvento.tipo)).all() == [(stale, 'classificado')]
+        # unchanged and confirmed documentos are not written
+        assert db.scalar(select(func.count()).select_from(models.Historico)) == 1
+        assert db.get(models.DocumentoFinanceiro, confirmed).tipo == models.DocumentType.OUTROS
+        assert db.get(models.DocumentoFinanceiro, current).status == models.DocumentStatus.CLASSIFICADO
+        assert db.get(models.BackfillCheckpoint, 'padrao').concluido_em is not None
+
+
+def test_resumes_from_checkpoint(Session):
+    with Session() as db:
+        ids = sorted(_add(db, n, FRETE, tipo=models.DocumentType.OUTROS, status=models.DocumentStatus.RECEBIDO) for n in range(7))
+        db.commit()
+
+    first = backfill.run_backfill(Session, nome='lote', chunk_size=2, processes=1, limite=3)
+    assert first['processados'] == 3
+    with Session() as db:
+        cp = db.get(models.BackfillCheckpoint, 'lote')
+        assert (cp.ultimo_id, cp.processados, cp.concluido_em) == (ids[2], 3, None)
+        assert db.get(models.DocumentoFinanceiro, ids[3]).tipo == models.DocumentType.OUTROS
+
+    # picks up after the checkpoint, spreading chunks over two processes
+    rest = backfill.run_backfill(Session, nome='lote', chunk_size=2, processes=2)
+    assert rest['processados'] == 4 and rest['alterados'] == 4
+    with Session() as db:
+        assert db.get(models.BackfillCheckpoint, 'lote').processados == 7
+        subtipos = db.scalars(select(models.DocumentoFinanceiro.subtipo)).all()
+        assert subtipos == [models.DocumentSubtipo.NF_FRETE] * 7
+        assert db.scalar(select(func.count()).select_from(models.Historico)) == 7
+
+    # a finished run starts over: nothing left to change
+    again = backfill.run_backfill(Session, nome='lote', processes=1)
+    assert (again['processados'], again['alterados']) == (7, 0)
+
+
+def test_documento_confirmed_mid_run_is_not_overwritten(Session, monkeypatch):
+    from app.services import rollup
+
+    with Session() as db:
+        ids = [_add(db, n, FRETE, tipo=models.DocumentType.DOCUMENTO_FORNECEDOR, subtipo=models.DocumentSubtipo.NF_PRODUTO,
+                    status=models.DocumentStatus.PENDENTE) for n in range(2)]
+        docs = db.scalars(select(models.DocumentoFinanceiro)).all()
+        rollup.apply(db, [(None, d) for d in docs])
+        db.commit()
+    analyse = backfill.analyse
+
+    def confirmed_meanwhile(items):
+        # someone confirms the first documento after the chunk was read, before it is written
+        with Session() as db:
+            doc = db.get(models.DocumentoFinanceiro, ids[0])
+            before = rollup.snapshot(doc)
+            doc.status, doc.confirmado_por, doc.confirmado_em = models.DocumentStatus.FEITO, 'ana', func.now()
+            rollup.apply(db, [(before, doc)])
+            db.commit()
+        return analyse(items)
+
+    monkeypatch.setattr(backfill, 'analyse', confirmed_meanwhile)
+    totals = backfill.run_backfill(Session, processes=1)
+    assert (totals['processados'], totals['alterados']) == (2, 1)
+    with Session() as db:
+        kept, changed = (db.get(models.DocumentoFinanceiro, i) for i in ids)
+        assert (kept.status, kept.subtipo) == (models.DocumentStatus.FEITO, models.DocumentSubtipo.NF_PRODUTO)
+        assert changed.subtipo == models.DocumentSubtipo.NF_FRETE
+        assert db.scalars(select(models.Historico.documento_id)).all() == [changed.id]
+        R = models.ResumoDiario
+        incremental = db.execute(select(R.status, R.subtipo, R.quantidade).where(R.quantidade != 0).order_by(R.status)).all()
+        rollup.rebuild(db)
+        assert db.execute(select(R.status, R.subtipo, R.quantidade).where(R.quantidade != 0).order_by(R.status)).all() == incremental
@@ -0,0 +1,208 @@
+import asyncio
+import time
+from uuid import UUID
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from app.api import events
+from app.db import models
+from app.services import change_feed
+from app.services.change_feed import ChangeFeed
+
+
+def _documento(Session, n, record=True):
+    with Session() as db:
+        email = models.Email(message_id=f'<m{n}@ex.com>', remetente='f@ex.com')
+        db.add(email)
+        db.flush()
+        doc = models.DocumentoFinanceiro(email_id=email.id, tipo=models.DocumentType.DOCUMENTO_FORNECEDOR,
+                                         status=models.DocumentStatus.CLASSIFICADO, valor=n)
+        db.add(doc)
+        db.flush()
+        if record:
+            change_feed.record(db, [doc.id], change_feed.CRIADO)
+        db.commit()
+        return str(doc.id)
+
+
+async def _next_event(stream, timeout=5):
+    """Next message of the stream, skipping comment lines."""
+    while True:
+        message = await asyncio.wait_for(stream.__anext__(), timeout)
+        if not message.startswith(':'):
+            return message
+
+
+async def _connected():
+    return False
+
+
+@pytest.fixture
+def Session(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "feed.sqlite"}')
+    models.Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine, autoflush=False)
+    engine.dispose()
+
+
+def test_confirm_records_an_event(client, db_session):
+    doc_id = _documento(db_session.info['sessionmaker'], 1, record=False)
+    assert client.post(f'/documentos/{doc_id}/confirmar', params={'usuario': 'ana'}).json() == {'status': 'ok'}
+    [(event_id, message)] = ChangeFeed(db_session.info['sessionmaker'], serialize=events._sse_message).since(0)
+    assert message.startswith(f'id: {event_id}\nevent: confirmado\ndata: ')
+    assert f'"id": "{doc_id}"' in message and '"status": "FEITO"' in message
+
+
+def test_live_events_resume_and_reload(Session):
+    feed = ChangeFeed(Session, serialize=events._sse_message, poll_interval=0.02)
+
+    async def scenario():
+        before = _documento(Session, 1)
+        stream = events.event_stream(feed, None, _connected, heartbeat=0.05)
+        assert await stream.__anext__() == ': ok\n\n'
+        # a second reviewer shares the same poll
+        other = events.event_stream(feed, None, _connected, heartbeat=0.05)
+        await other.__anext__()
+        assert feed.subscribers == 2
+
+        created = await asyncio.to_thread(_documento, Session, 2)
+        message = await _next_event(stream)
+        assert 'event: criado' in message and created in message and before not in message
+        assert created in await _next_event(other)
+        first_id = int(message.split('\n')[0][4:])
+        await other.aclose()
+        assert feed.subscribers == 1
+
+        # reconnecting with Last-Event-ID replays only what came after it
+        later = await asyncio.to_thread(_documento, Session, 3)
+        resumed = events.event_stream(feed, first_id, _connected, heartbeat=0.05)
+        assert later in await _next_event(resumed)
+        assert later in await _next_event(stream)
+        await resumed.aclose()
+
+        # too far behind: reload instead of replaying
+        behind = events.event_stream(feed, 0, _connected, replay_limit=1)
+        assert await behind.__anext__() == events.RECARREGAR
+        await stream.aclose()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        feed.stop()
+    assert feed.subscribers == 0
+
+
+def test_slow_subscriber_is_dropped(Session):
+    feed = ChangeFeed(Session, serialize=events._sse_message, poll_interval=60, buffer=2)
+
+    async def scenario():
+        stream = events.event_stream(feed, None, _connected, heartbeat=60)
+        await stream.__anext__()
+        for n in range(3):
+            _documento(Session, n)
+        assert await asyncio.to_thread(feed.poll) == 3
+        # the stream ends; EventSource reconnects with Last-Event-ID
+        with pytest.raises(StopAsyncIteration):
+            await _next_event(stream)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        feed.stop()
+
+
+def test_late_commit_of_a_lower_id_is_delivered(Session):
+    first, second = _documento(Session, 1, record=False), _documento(Session, 2, record=False)
+    feed = ChangeFeed(Session, poll_interval=60)
+    feed.start()
+    try:
+        with Session() as db:
+            db.add(models.DocumentoEvento(id=2, documento_id=UUID(second), tipo=change_feed.CRIADO))
+            db.commit()
+            assert feed.poll() == 1 and feed.last_id == 2
+            # id 1 was taken first but its transaction commits after id 2 was read
+            db.add(models.DocumentoEvento(id=1, documento_id=UUID(first), tipo=change_feed.CRIADO))
+            db.commit()
+        assert feed.poll() == 1 and feed.poll() == 0
+    finally:
+        feed.stop()
+
+
+def test_long_transaction_far_below_the_last_id_is_delivered(Session):
+    docs = [UUID(_documento(Session, n, record=False)) for n in range(2)]
+    feed = ChangeFeed(Session, poll_interval=60, gap_timeout=60)
+    feed.start()
+    try:
+        with Session() as db:
+            # a backfill chunk took ids 1..500; a confirmation took 501 and committed first
+            db.add(models.DocumentoEvento(id=501, documento_id=docs[1], tipo=change_feed.CONFIRMADO))
+            db.commit()
+            assert feed.poll() == 1
+            db.add_all(models.DocumentoEvento(id=i, documento_id=docs[0], tipo=change_feed.CLASSIFICADO) for i in range(1, 501))
+            db.commit()
+        assert feed.poll() == 500 and feed.poll() == 0
+        assert feed.last_id == 501 and not feed._gaps
+    finally:
+        feed.stop()
+
+
+def test_gap_of_a_rolled_back_id_is_forgotten(Session):
+    doc = UUID(_documento(Session, 1, record=False))
+    feed = ChangeFeed(Session, poll_interval=60, gap_timeout=0.2)
+    feed.start()
+    try:
+        with Session() as db:
+            db.add(models.DocumentoEvento(id=3, documento_id=doc, tipo=change_feed.CRIADO))
+            db.commit()
+        assert feed.poll() == 1 and set(feed._gaps) == {1, 2}
+        time.sleep(0.3)
+        assert feed.poll() == 0 and not feed._gaps
+    finally:
+        feed.stop()
+
+
+def test_endpoint_route_and_purge(client, db_session, monkeypatch):
+    Session = db_session.info['sessionmaker']
+    feed = ChangeFeed(Session, serialize=events._sse_message, poll_interval=60)
+    monkeypatch.setattr(events, 'FEED', feed)
+    _documento(Session, 1)
+    _documento(Session, 2)
+    with Session() as db:
+        assert change_feed.purge(db, dias=0) == 2
+    _documento(Session, 3)
+    try:
+        # events 1 and 2 were purged: a client that saw nothing yet must reload
+        response = client.get('/documentos/eventos', headers={'Last-Event-ID': '1'})
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/event-stream')
+        assert response.text == events.RECARREGAR
+    finally:
+        feed.stop()
+
+
+def test_listen_notify(pg_engine):
+    Session = sessionmaker(bind=pg_engine)
+    feed = ChangeFeed(Session, serialize=events._sse_message, poll_interval=30)
+
+    async def scenario():
+        stream = events.event_stream(feed, None, _connected, heartbeat=30)
+        await stream.__anext__()
+        deadline = time.monotonic() + 5
+        while not feed.listening and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        assert feed.listening
+        start = time.monotonic()
+        created = await asyncio.to_thread(_documento, Session, 1)
+        # delivered by NOTIFY, long before the 30 s poll
+        assert created in await _next_event(stream, timeout=5)
+        assert time.monotonic() - start < 5
+        await stream.aclose()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        feed.stop()
+    with Session() as db:
+        assert db.scalars(select(models.DocumentoEvento.tipo)).all() == ['criado']
@@ -39,3 +39,38 @@ def test_ambiguous_low_confidence():
     res = classify_email(text, [], 'unknown@ex.com')
     assert res['confidence'] < 0.8
     assert res['tipo'] in ['ENTRADA_INTERNA','DOCUMENTO_FORNECEDOR','OUTROS']
+
+
+def test_match_rules_finds_overlapping_keywords():
+    from app.services.advanced_classifier import match_rules
+    hits = match_rules("Segue NFS-e com ISSQN da PARCARGA")
+    # 'nfs-e'/'issqn' also imply 'nfs'/'iss'; 'rc' overlaps 'carga'
+    assert {'iss', 'requisicao', 'frete'} <= hits
+    assert 'ncm' not in hits
+
+
+def test_match_rules_ncm_code_boundaries():
+    from app.services.advanced_classifier import match_rules, NCM_CODE_RULE
+    assert NCM_CODE_RULE in match_rules("codigo 01012100.")
+    assert NCM_CODE_RULE not in match_rules("codigo 010121001")
+    assert NCM_CODE_RULE not in match_rules("codigo x01012100")
+
+
+def test_classify_emails_matches_single_email_in_order():
+    from app.services.classifier import classify_emails
+    batch = [
+        {'text': "Solicitação de compra RC-123", 'attachments': [], 'remetente': 'usuario@empresa.com'},
+        {'text': "Conhecimento de Transporte - CT-e", 'attachments': [{'nome_arquivo': 'doc1.xml'}], 'remetente': None},
+        {'text': "Prestação de serviço - ISS informado", 'attachments': [], 'remetente': 'prestador@servicos.com'},
+        ("NCM: 01012100\nItem: Parafuso Quantidade: 10", [{'nome_arquivo': 'nfe.xml'}], 'f@f.com'),
+        {'text': "Material de consumo para manutenção", 'attachments': [], 'remetente': None},
+        {'text': "Este é um email curto sem informações claras", 'attachments': [], 'remetente': 'unknown@ex.com'},
+    ]
+    expected = []
+    for item in batch:
+        if isinstance(item, dict):
+            expected.append(classify_email(item['text'], item['attachments'], item['remetente']))
+        else:
+            expected.append(classify_email(*item))
+    assert classify_emails(batch) == expected
+    assert classify_emails(item for item in batch) == expected
@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from email.message import EmailMessage
+
+import pytest
+
+pytest.importorskip('imapclient')
+
+from app.services.email_collector import ImapCollector, decode_stream, fetch_emails, ingest_imap
+
+
+def _raw(n, attachment=b'', subject='NF {n}', body='Segue a nota fiscal nº {n}.'):
+    msg = EmailMessage()
+    msg['From'] = 'Fornecedor <nf@fornecedor.com.br>'
+    msg['To'] = 'fin@ex.com'
+    msg['Subject'] = subject.format(n=n)
+    msg['Message-ID'] = f'<msg{n}@fornecedor.com.br>'
+    msg['Date'] = 'Tue, 02 Jan 2024 10:00:00 +0000'
+    msg.set_content(body.format(n=n), cte='quoted-printable')
+    if attachment:
+        msg.add_attachment(attachment, maintype='application', subtype='pdf', filename=f'nf-{n}.pdf')
+    return msg.as_bytes()
+
+
+def _collector(imap, **kw):
+    return ImapCollector('127.0.0.1', 'fin@ex.com', 'x', port=imap.port, ssl=False, **kw)
+
+
+def test_decode_stream_handles_any_chunking():
+    import base64
+    import binascii
+    payload = os.urandom(5000)
+    encoded = base64.encodebytes(payload)
+    for size in (1, 7, 77, 4096):
+        chunks = [encoded[i:i + size] for i in range(0, len(encoded), size)]
+        assert b''.join(decode_stream(chunks, 'base64')) == payload
+    text = 'Açúcar = R$ 1.000,00 ' * 40
+    qp = binascii.b2a_qp(text.encode('utf-8'))
+    chunks = [qp[i:i + 13] for i in range(0, len(qp), 13)]
+    assert b''.join(decode_stream(chunks, 'quoted-printable')).decode('utf-8') == text
+
+
+def test_sync_streams_attachments_in_slices(imap):
+    pdf = os.urandom(200_000)
+    imap.add(_raw(1, pdf))
+    imap.add(_raw(2))
+    with _collector(imap, chunk_size=1, part_chunk=64 * 1024) as collector:
+        pages = list(collector.sync())
+
+    assert [w for _, w in pages] == ['1000:1', '1000:2']
+    first, second = pages[0][0][0], pages[1][0][0]
+    assert first['message_id'] == '<msg1@fornecedor.com.br>'
+    assert first['remetente'] == 'nf@fornecedor.com.br' and first['assunto'] == 'NF 1'
+    assert first['corpo_preview'] == 'Segue a nota fiscal nº 1.'
+    assert first['data_hora_email'] == '2024-01-02T10:00:00+00:00'
+    [att] = first['attachments']
+    assert att['nome_arquivo'] == 'nf-1.pdf'
+    with open(att['caminho_arquivo'], 'rb') as f:
+        assert f.read() == pdf
+    assert second['attachments'] == []
+    # the attachment came in base64 slices of 64 KiB, never as a whole message
+    slices = [c for c in imap.commands if 'BODY.PEEK[2]<' in c]
+    assert len(slices) == 5
+    assert not any('RFC822' in c or 'BODY.PEEK[]' in c for c in imap.commands)
+
+
+def test_watermark_and_uidvalidity(imap):
+    for n in range(3):
+        imap.add(_raw(n))
+    with _collector(imap) as collector:
+        assert [w for _, w in collector.sync()] == ['1000:3']
+        imap.add(_raw(3))
+        pages = list(collector.sync('1000:3'))
+        assert [[m['message_id'] for m in msgs] for msgs, _ in pages] == [['<msg3@fornecedor.com.br>']]
+        assert list(collector.sync('1000:4')) == []
+
+    imap.uidvalidity = 2000
+    with _collector(imap) as collector:
+        # UIDs were renumbered: the old watermark no longer applies
+        pages = list(collector.sync('1000:4'))
+        assert sum(len(msgs) for msgs, _ in pages) == 4 and pages[-1][1] == '2000:4'
+
+
+def test_known_messages_skip_part_downloads(imap):
+    imap.add(_raw(1, b'%PDF-1'))
+    imap.add(_raw(2, b'%PDF-2'))
+    with _collector(imap) as collector:
+        [(msgs, _)] = list(collector.sync(known_ids=lambda ids: {'<msg1@fornecedor.com.br>'} & set(ids)))
+    assert [m['message_id'] for m in msgs] == ['<msg2@fornecedor.com.br>']
+    fetched = [c.split()[3] for c in imap.commands if 'BODY.PEEK[2]' in c]
+    assert fetched == ['2']
+
+
+def test_idle_picks_up_new_mail(imap):
+    imap.add(_raw(1))
+    seen = []
+    stop = threading.Event()
+
+    def on_messages(messages, watermark):
+        seen.extend(m['message_id'] for m in messages)
+        if len(seen) == 2:
+            stop.set()
+
+    with _collector(imap) as collector:
+        t = threading.Thread(target=collector.watch, args=(on_messages,), kwargs={'stop': stop, 'idle_timeout': 30})
+        t.start()
+        deadline = time.time() + 5
+        while 'IDLE' not in ' '.join(imap.commands) and time.time() < deadline:
+            time.sleep(0.02)
+        start = time.time()
+        imap.add(_raw(2))
+        t.join(timeout=10)
+    assert not t.is_alive()
+    assert seen == ['<msg1@fornecedor.com.br>', '<msg2@fornecedor.com.br>']
+    # pushed by IDLE, not by the 30 s timeout
+    assert time.time() - start < 5
+
+
+def test_fetch_emails_returns_unseen_messages(imap):
+    imap.add(_raw(1, b'%PDF'))
+    msgs = fetch_emails('127.0.0.1', 'fin@ex.com', 'x', port=imap.port, ssl=False)
+    assert [(m['assunto'], len(m['attachments'])) for m in msgs] == [('NF 1', 1)]
+
+
+def test_ingest_imap_persists_and_resumes(imap, pg_engine):
+    from sqlalchemy import func, select
+    from sqlalchemy.orm import sessionmaker
+    from app.db import models
+
+    Session = sessionmaker(bind=pg_engine)
+    for n in range(3):
+        imap.add(_raw(n, f'%PDF-{n}'.encode()))
+    with _collector(imap, chunk_size=2) as collector:
+        totals = ingest_imap(collector, session_factory=Session, preview_mode='lazy')
+        assert totals['inserted'] == 3 and totals['anexos'] == 3
+        imap.add(_raw(3))
+        again = ingest_imap(collector, session_factory=Session, preview_mode='lazy')
+        assert again['inserted'] == 1 and again['conhecidos'] == 0
+    with Session() as db:
+        assert db.scalar(select(func.count()).select_from(models.Email)) == 4
+        assert db.scalar(select(models.SyncCursor.cursor)) == '1000:4'
@@ -0,0 +1,49 @@
+import uuid
+
+from sqlalchemy import func, select
+
+from app.db import models
+from app.services import email_ingestor
+from app.services.email_ingestor import persist_messages_bulk
+
+NF_PRODUTO = "NCM: 73181500\nItem: Parafuso Quantidade: 10 Valor unitario: 1.00"
+
+
+def _message(n, corpo='Segue o CT-e do frete.\nValor: R$ 100,00'):
+    return {'message_id': f'<b{n}@ex.com>', 'remetente': 'nf@transp.com', 'assunto': f'Doc {n}',
+            'corpo_preview': corpo, 'data_hora_email': '2024-01-01T00:00:00Z', 'attachments': []}
+
+
+def _count(db, model):
+    return db.scalar(select(func.count()).select_from(model))
+
+
+def test_bulk_persists_each_message_once(db_session):
+    messages = [_message(1), _message(2, NF_PRODUTO), _message(1), {'assunto': 'sem id'}]
+    stats = persist_messages_bulk(db_session, messages, preview_mode='lazy')
+    assert (stats['inserted'], stats['skipped']) == (2, 2)
+    assert _count(db_session, models.DocumentoFinanceiro) == 2
+    assert _count(db_session, models.ItemDocumento) == 1
+    assert _count(db_session, models.DocumentoEvento) == 2
+    assert db_session.scalar(select(func.sum(models.ResumoDiario.quantidade))) == 2
+
+    again = persist_messages_bulk(db_session, messages + [_message(3)], preview_mode='lazy')
+    assert (again['inserted'], again['skipped']) == (1, 4)
+    assert _count(db_session, models.Email) == 3
+
+
+def test_email_inserted_by_another_ingestor_is_skipped(db_session, monkeypatch):
+    insert_new_emails = email_ingestor._insert_new_emails
+
+    def racing(db, rows):
+        # another ingestor commits <b1> between the idempotency SELECT and the INSERT
+        db.add(models.Email(id=uuid.uuid4(), message_id='<b1@ex.com>', remetente='outro@ex.com'))
+        db.flush()
+        return insert_new_emails(db, rows)
+
+    monkeypatch.setattr(email_ingestor, '_insert_new_emails', racing)
+    stats = persist_messages_bulk(db_session, [_message(1), _message(2)], preview_mode='lazy')
+    assert (stats['inserted'], stats['skipped']) == (1, 1)
+    [doc] = db_session.scalars(select(models.DocumentoFinanceiro)).all()
+    assert doc.email.message_id == '<b2@ex.com>'
+    assert db_session.scalar(select(func.sum(models.ResumoDiario.quantidade))) == 1
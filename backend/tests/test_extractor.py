@@ -28,3 +28,86 @@ def test_extract_material_interno():
     text = "Material de consumo: álcool" 
     res = extract_financial_data(text, [], 'DOCUMENTO_FORNECEDOR', 'NF_MATERIAL_INTERNO')
     assert res.get('material_interno') is True
+
+
+def test_rules_match_the_old_regexes():
+    import random
+    import re
+
+    def old(t, subtipo):
+        res = {}
+        for campo, rx, flags in (('fornecedor', r'Fornecedor[:\s]*[:\-]? *(.+)', re.I),
+                                 ('cnpj', r'([0-9]{2}\.?[0-9]{3}\.?[0-9]{3}/[0-9]{4}-[0-9]{2})', 0),
+                                 ('numero_documento', r'Nota Fiscal\s*[:#]?\s*([0-9\-\/]+)', re.I),
+                                 ('valor', r'Valor(?: Total)?[:\s]*R?\$?\s*([0-9.,]+)', re.I)):
+            m = re.search(rx, t, flags)
+            if m:
+                res[campo] = m.group(1).strip() if campo == 'fornecedor' else m.group(1)
+        if 'valor' in res:
+            res['valor'] = res['valor'].replace('.', '').replace(',', '.')
+        if subtipo == 'NF_PRODUTO':
+            ncm = re.search(r'NCM[:\s]*([0-9]{2,8})', t, re.I)
+            itens = re.findall(r'(?:Item|Produto)[:\s]*([A-Za-z0-9\s\-_,]+)\s+Quantidade[:\s]*([0-9]+)', t, re.I)
+            if ncm:
+                res['ncm'] = ncm.group(1)
+            if itens:
+                res['itens'] = [{'descricao': i[0].strip(), 'quantidade': int(i[1])} for i in itens]
+        return res
+
+    tokens = ['Item', 'produto', 'Quantidade', 'QUANTIDADE', ' ', '  ', ':', '\n', '\t', 'a', '12', '-', ',',
+              'Fornecedor', 'Nota Fiscal', '#', 'Valor Total', 'R$', '1.234,56', '12.345.678/0001-90', 'NCM',
+              'İtem', 'ſ']
+    rnd = random.Random(7)
+    for _ in range(5000):
+        t = ''.join(rnd.choice(tokens) for _ in range(rnd.randint(1, 20)))
+        assert extract_financial_data(t, [], 'DOCUMENTO_FORNECEDOR', 'NF_PRODUTO') == old(t, 'NF_PRODUTO'), repr(t)
+
+
+def test_adversarial_inputs_run_in_linear_time():
+    import time
+    inputs = [
+        'Item: ' + ' ' * 200_000 + 'x',  # the old itens regex: cubic in the whitespace run
+        'Item ' * 100_000,
+        ('Produto: caixa ' + ' ' * 40 + '\n') * 5000 + 'Quantidade: 1',
+        'Fornecedor' + ' ' * 100_000,
+    ]
+    for text in inputs:
+        start = time.perf_counter()
+        extract_financial_data(text, [], 'DOCUMENTO_FORNECEDOR', 'NF_PRODUTO')
+        assert time.perf_counter() - start < 1, text[:20]
+    long_text = 'lorem ipsum ' * 30_000 + '\nItem: Parafuso Quantidade: 10\nValor: R$ 9,90'
+    res = extract_financial_data(long_text, [], 'DOCUMENTO_FORNECEDOR', 'NF_PRODUTO')
+    assert res['itens'] == [{'descricao': 'Parafuso', 'quantidade': 10}] and res['valor'] == '9.90'
+
+
+def test_rules_file_is_hot_reloaded(tmp_path, monkeypatch):
+    import json
+    import os
+    from app.services import extractor
+
+    path = tmp_path / 'regras.json'
+    rules = [r for r in extractor.EXTRACTION_RULES if r['campo'] != 'valor']
+    rules.append({'campo': 'pedido', 'regex': r'Pedido\s*n?º?\s*([0-9]+)', 'ancora': 'pedido'})
+    path.write_text(json.dumps(rules))
+    monkeypatch.setattr(extractor, 'EXTRACTION_RULES_FILE', str(path))
+    monkeypatch.setattr(extractor, 'EXTRACTION_RULES_CHECK_INTERVAL', 0)
+    builtin = extractor._RuleSet(extractor.EXTRACTION_RULES).version
+    try:
+        text = 'Pedido nº 4521\nValor: R$ 10,00'
+        assert extract_financial_data(text) == {'pedido': '4521'}
+        assert extractor.rules_info()['arquivo'] == str(path) and extractor.rules_version() != builtin
+
+        # edited while running: picked up at the next call
+        rules[-1]['campo'] = 'numero_pedido'
+        path.write_text(json.dumps(rules, indent=1))
+        assert extract_financial_data(text) == {'numero_pedido': '4521'}
+
+        # a broken file keeps the rules that were working
+        path.write_text('[{"campo": "x", "regex": "(["}]')
+        os.utime(path, ns=(1, 1))
+        assert extract_financial_data(text) == {'numero_pedido': '4521'}
+        assert 'regras.json' in extractor.rules_info()['erro']
+    finally:
+        monkeypatch.setattr(extractor, 'EXTRACTION_RULES_FILE', '')
+        assert extractor.reload_rules() == builtin
+    assert extract_financial_data('Valor: R$ 10,00') == {'valor': '10.00'}
@@ -0,0 +1,215 @@
+import threading
+import time
+
+import pytest
+
+
+def _graph_message(i):
+    return {'id': f'q{i}', 'subject': f'NF {i}', 'from': {'emailAddress': {'address': 'f@ex.com'}},
+            'bodyPreview': 'Nota Fiscal', 'receivedDateTime': '2024-01-01T00:00:00Z', 'webLink': None}
+
+
+def _fake_fetch(calls, fail=()):
+    lock = threading.Lock()
+
+    def fetch(mailbox, m):
+        with lock:
+            calls.append(m['id'])
+        if m['id'] in fail:
+            raise RuntimeError('graph fora do ar')
+        return {'message_id': m['id'], 'assunto': m['subject'], 'remetente': 'f@ex.com',
+                'corpo_preview': m['bodyPreview'], 'data_recebimento': m['receivedDateTime'],
+                'web_link': None, 'attachments': []}
+
+    return fetch
+
+
+@pytest.fixture
+def Session(pg_engine):
+    from sqlalchemy.orm import sessionmaker
+    return sessionmaker(bind=pg_engine)
+
+
+def _count(Session, model):
+    from sqlalchemy import func, select
+    with Session() as db:
+        return db.scalar(select(func.count()).select_from(model))
+
+
+def test_enqueue_skips_known_messages(Session):
+    from app.db import models
+    from app.services.ingest_queue import enqueue_messages, queue_status
+
+    with Session() as db:
+        assert enqueue_messages(db, 'fin@ex.com', [_graph_message(i) for i in range(3)]) == 3
+        assert enqueue_messages(db, 'fin@ex.com', [_graph_message(i) for i in range(5)]) == 2
+        assert queue_status(db)['jobs'] == {'PENDENTE:anexos': 5}
+    assert _count(Session, models.IngestJob) == 5
+
+
+def test_concurrent_workers_ingest_each_message_once(Session):
+    from app.db import models
+    from app.services.ingest_queue import IngestWorker, enqueue_messages
+
+    with Session() as db:
+        enqueue_messages(db, 'fin@ex.com', [_graph_message(i) for i in range(40)])
+    calls = []
+    workers = [IngestWorker(_fake_fetch(calls), session_factory=Session, batch_size=3, previews=False) for _ in range(4)]
+    results = []
+
+    def drain(worker):
+        while True:
+            counts = worker.run_once()
+            results.append(counts)
+            if not any(counts.values()):
+                return
+
+    threads = [threading.Thread(target=drain, args=(w,)) for w in workers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(calls) == sorted(f'q{i}' for i in range(40))
+    assert sum(r['ok'] for r in results) == 40
+    assert _count(Session, models.IngestJob) == 0
+    assert _count(Session, models.Email) == 40
+    assert _count(Session, models.DocumentoFinanceiro) == 40
+
+
+def test_failures_back_off_then_dead_letter_and_requeue(Session):
+    from sqlalchemy import func, select, update
+    from app.db import models
+    from app.services.ingest_queue import IngestWorker, enqueue_messages, requeue_dead_letters
+
+    with Session() as db:
+        enqueue_messages(db, 'fin@ex.com', [_graph_message(1)])
+    calls = []
+    worker = IngestWorker(_fake_fetch(calls, fail={'q1'}), session_factory=Session, max_tentativas=2, previews=False)
+
+    assert worker.run_once()['erro'] == 1
+    with Session() as db:
+        job = db.scalars(select(models.IngestJob)).one()
+        assert job.status == 'PENDENTE' and job.tentativas == 1 and 'graph fora do ar' in job.ultimo_erro
+    # backing off: not due yet
+    assert not any(worker.run_once().values())
+
+    with Session() as db:
+        db.execute(update(models.IngestJob).values(proxima_tentativa_em=func.now()))
+        db.commit()
+    assert worker.run_once()['morto'] == 1
+    assert _count(Session, models.IngestJob) == 0
+    with Session() as db:
+        dead = db.scalars(select(models.IngestDeadLetter)).one()
+        assert (dead.message_id, dead.etapa, dead.tentativas) == ('q1', 'anexos', 2)
+        # a dead message is not queued again by the collector
+        assert enqueue_messages(db, 'fin@ex.com', [_graph_message(1)]) == 0
+        assert requeue_dead_letters(db) == 1
+
+    worker.fetch = _fake_fetch(calls)
+    assert worker.run_once()['ok'] == 1
+    assert _count(Session, models.IngestDeadLetter) == 0
+    assert _count(Session, models.Email) == 1
+
+
+def test_crashed_worker_is_resumed_from_its_checkpoint(Session):
+    from sqlalchemy import select
+    from app.db import models
+    from app.services.ingest_queue import IngestWorker, claim_jobs, enqueue_messages
+
+    with Session() as db:
+        enqueue_messages(db, 'fin@ex.com', [_graph_message(7)])
+    calls = []
+
+    class Crash(BaseException):
+        pass
+
+    crashing = IngestWorker(_fake_fetch(calls), session_factory=Session, lease=0.2, previews=False)
+    crashing._run_stage = lambda etapa, mailbox, payload, run=crashing._run_stage: (
+        run(etapa, mailbox, payload) if etapa == 'anexos' else (_ for _ in ()).throw(Crash()))
+    with pytest.raises(Crash):
+        crashing.run_once()
+    with Session() as db:
+        job = db.scalars(select(models.IngestJob)).one()
+        assert (job.status, job.etapa) == ('PROCESSANDO', 'analise')
+        # lease still held: nobody else can take it
+        assert claim_jobs(db, 'outro', lease=0.2) == []
+
+    time.sleep(0.3)
+    other = IngestWorker(_fake_fetch(calls), session_factory=Session, lease=0.2, previews=False)
+    assert other.run_once()['ok'] == 1
+    assert calls == ['q7']  # attachments were not downloaded again
+    with Session() as db:
+        assert db.scalar(select(models.Email.message_id)) == 'q7'
+        assert db.scalar(select(models.IngestJob)) is None
+
+
+def test_outlook_producer_and_fetch(graph, Session):
+    from app.db import models
+    from app.services.ingest_queue import IngestWorker, enqueue_outlook, outlook_fetch
+
+    assert enqueue_outlook('t', 'c', 's', 'fin@ex.com', top=6, session_factory=Session) == 6
+    worker = IngestWorker(outlook_fetch('t', 'c', 's'), session_factory=Session, batch_size=10, previews=False)
+    counts = worker.run_once()
+    # m3 answers 503 once; the collector session retries it
+    assert counts['ok'] == 6
+    assert _count(Session, models.Anexo) == 6
+
+
+def test_jobs_waiting_behind_a_slow_one_keep_their_lease(Session):
+    from sqlalchemy import select
+    from app.db import models
+    from app.services.ingest_queue import IngestWorker, claim_jobs, enqueue_messages
+
+    with Session() as db:
+        enqueue_messages(db, 'fin@ex.com', [_graph_message(1), _graph_message(2)])
+    calls, reclaimed = [], []
+    fetch = _fake_fetch(calls)
+
+    def slow_then_check(mailbox, m):
+        if not calls:
+            time.sleep(0.3)  # longer than the lease
+        else:
+            # another worker polls while the second job runs
+            with Session() as other:
+                reclaimed.extend(claim_jobs(other, 'outro', lease=0.2))
+        return fetch(mailbox, m)
+
+    worker = IngestWorker(slow_then_check, session_factory=Session, batch_size=2, lease=0.2, previews=False)
+    assert worker.run_once()['ok'] == 2
+    assert reclaimed == []
+    with Session() as db:
+        assert sorted(db.scalars(select(models.Email.message_id))) == ['q1', 'q2']
+
+
+def test_gc_keeps_blobs_of_queued_and_dead_messages(Session, monkeypatch, tmp_path):
+    import json
+    import os
+    import uuid
+    from app.db import models
+    from app.scripts import gc_attachments
+    from app.services import attachment_store
+    from app.services.ingest_queue import attachment_paths
+
+    monkeypatch.setattr(attachment_store, 'STORAGE_DIR', str(tmp_path))
+    monkeypatch.setattr(gc_attachments, 'SessionLocal', Session)
+    blobs = {n: attachment_store.store_stream([n.encode()], f'{n}.pdf') for n in ('fila', 'morto', 'orfao')}
+
+    def payload(n):
+        return json.dumps({'mensagem': {'message_id': n, 'attachments': [
+            {'nome_arquivo': f'{n}.pdf', 'caminho_arquivo': blobs[n]}, {'nome_arquivo': 'link', 'caminho_arquivo': None}]}})
+
+    with Session() as db:
+        # downloaded, no Anexo row yet: one job backing off at 'analise', one dead letter at 'gravar'
+        db.add(models.IngestJob(id=uuid.uuid4(), message_id='fila', mailbox='fin@ex.com', etapa='analise',
+                                status='PENDENTE', payload=payload('fila'), tentativas=1))
+        db.add(models.IngestDeadLetter(id=uuid.uuid4(), message_id='morto', mailbox='fin@ex.com', etapa='gravar',
+                                       payload=payload('morto'), tentativas=5))
+        db.add(models.IngestJob(id=uuid.uuid4(), message_id='novo', mailbox='fin@ex.com', etapa='anexos',
+                                status='PENDENTE', payload=json.dumps({'graph': _graph_message(3)}), tentativas=0))
+        db.commit()
+        assert attachment_paths(db) == {blobs['fila'], blobs['morto']}
+
+    gc_attachments.main(0)
+    assert os.path.exists(blobs['fila']) and os.path.exists(blobs['morto'])
+    assert not os.path.exists(blobs['orfao'])
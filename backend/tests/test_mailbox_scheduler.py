@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('requests')
+
+from app.services import outlook_collector
+from app.services.mailbox_scheduler import Mailbox, MailboxScheduler, prometheus_metrics
+from conftest import FakeGraph
+
+
+def test_token_cache_honors_expires_in_and_coalesces():
+    now = [0.0]
+    cache = outlook_collector.TokenCache(skew=60, clock=lambda: now[0])
+    issued = []
+
+    def fetch():
+        time.sleep(0.05)
+        issued.append(now[0])
+        return f'tok{len(issued)}', 3600
+
+    threads = [threading.Thread(target=cache.get, args=('app', fetch)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert issued == [0.0]
+
+    now[0] = 3500
+    assert cache.get('app', fetch) == 'tok1'
+    now[0] = 3541  # inside the skew window: renewed before it expires
+    assert cache.get('app', fetch) == 'tok2'
+    cache.invalidate('app')
+    assert cache.get('app', fetch) == 'tok3'
+
+
+def test_collector_reuses_token_across_calls(graph):
+    session = outlook_collector.make_session(backoff=0)
+    for _ in range(3):
+        outlook_collector.list_outlook_messages('t', 'c', 's', 'fin@ex.com', session=session)
+    assert len(FakeGraph.tokens) == 1
+
+    FakeGraph.expires_in = 0
+    try:
+        outlook_collector.invalidate_token('t', 'c', 's')
+        for _ in range(2):
+            outlook_collector.list_outlook_messages('t', 'c', 's', 'fin@ex.com', session=session)
+        assert len(FakeGraph.tokens) == 3
+    finally:
+        FakeGraph.expires_in = 3600
+
+
+def test_scheduler_adapts_intervals_and_limits_concurrency():
+    lock = threading.Lock()
+    in_flight = {}
+    peak = [0, 0]  # total in flight, same mailbox in flight
+
+    def poll(mailbox, session):
+        with lock:
+            in_flight[mailbox.key] = in_flight.get(mailbox.key, 0) + 1
+            peak[0] = max(peak[0], sum(in_flight.values()))
+            peak[1] = max(peak[1], in_flight[mailbox.key])
+        time.sleep(0.02)
+        with lock:
+            in_flight[mailbox.key] -= 1
+        if mailbox.user_email == 'falha@ex.com':
+            raise RuntimeError('graph fora do ar')
+        busy = mailbox.user_email == 'ocupada@ex.com'
+        return {'inserted': 1 if busy else 0, 'ultimo_recebido': '2024-01-01T00:00:00Z'}
+
+    mailboxes = [Mailbox(f'{name}@ex.com', min_interval=0.03, max_interval=0.24)
+                 for name in ('ocupada', 'parada', 'falha', 'outra')]
+    scheduler = MailboxScheduler(mailboxes, poll=poll, max_concurrent=2)
+    scheduler.start()
+    time.sleep(1.2)
+    scheduler.stop(timeout=5)
+
+    m = scheduler.metrics()['caixas']
+    busy, idle, failing = m['ocupada@ex.com/Inbox'], m['parada@ex.com/Inbox'], m['falha@ex.com/Inbox']
+    assert peak == [2, 1]
+    assert busy['polls'] > 2 * idle['polls'] and idle['polls'] >= 3
+    assert busy['intervalo_s'] == 0.03 and idle['intervalo_s'] == 0.24
+    assert failing['erros'] == failing['polls'] and 'fora do ar' in failing['ultimo_erro']
+    assert failing['lag_s'] is None and idle['lag_s'] < 1
+    assert busy['ingest_lag_s'] > 0 and idle['ingest_lag_s'] is None
+
+    text = prometheus_metrics(scheduler.metrics())
+    assert 'mailbox_polls_total{mailbox="ocupada@ex.com",folder="Inbox"}' in text
+    assert 'mailbox_lag_seconds{mailbox="falha@ex.com"' not in text
+    assert 'result_cache_lookups_total{kind="classificacao",tier="memoria"}' in text
+
+
+def test_scheduler_syncs_mailboxes_with_one_token(graph, pg_engine):
+    from sqlalchemy import func, select
+    from sqlalchemy.orm import sessionmaker
+    from app.db import models
+
+    Session = sessionmaker(bind=pg_engine)
+    mailboxes = [Mailbox(e, tenant_id='t', client_id='c', client_secret='s', min_interval=0.05, max_interval=0.2)
+                 for e in ('fin@ex.com', 'compras@ex.com')]
+    scheduler = MailboxScheduler(mailboxes, max_concurrent=2, session_factory=Session)
+    scheduler.start()
+    deadline = time.time() + 10
+    while time.time() < deadline and min(s['polls'] for s in scheduler.metrics()['caixas'].values()) < 3:
+        time.sleep(0.05)
+    scheduler.stop(timeout=10)
+
+    metrics = scheduler.metrics()
+    assert all(s['erros'] == 0 and s['polls'] >= 3 for s in metrics['caixas'].values()), metrics
+    # both mailboxes and every poll used the same token
+    assert len(FakeGraph.tokens) == 1
+    with Session() as db:
+        # first round: m0..m5; next rounds: only the new m9
+        assert db.scalar(select(func.count()).select_from(models.Email)) == 7
+        assert db.scalar(select(func.count()).select_from(models.SyncCursor)) == 2
+    assert sum(s['inseridos'] for s in metrics['caixas'].values()) == 7
@@ -0,0 +1,76 @@
+from decimal import Decimal
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import sessionmaker
+
+from app.db import models
+
+NF_PRODUTO = "NCM: 73181500\nItem: Parafuso Quantidade: 10 Valor unitario: 1.00"
+
+
+def _itens(db):
+    I = models.ItemDocumento
+    return db.execute(select(I.posicao, I.descricao, I.quantidade).order_by(I.documento_id, I.posicao)).all()
+
+
+def test_ingestion_stores_json_and_itens(client, db_session):
+    from app.services.email_ingestor import EmailIngestor
+
+    ingestor = EmailIngestor('t', 'c', 's', 'financeiro@ex.com', preview_mode='lazy')
+    [doc] = ingestor.persist_messages(db_session, [
+        {'message_id': '<p1@ex.com>', 'remetente': 'fornecedor@fornecedor.com', 'assunto': 'NF',
+         'corpo_preview': NF_PRODUTO, 'attachments': []},
+    ])
+    assert doc.subtipo == models.DocumentSubtipo.NF_PRODUTO
+    assert doc.metadados == {'ncm': '73181500', 'itens': [{'descricao': 'Parafuso', 'quantidade': 10}]}
+    assert _itens(db_session) == [(1, 'Parafuso', 10)]
+
+    assert client.get(f'/documentos/{doc.id}').json()['metadados'] == doc.metadados
+    assert [i['id'] for i in client.get('/documentos/', params={'ncm': '73181500'}).json()['items']] == [str(doc.id)]
+    assert client.get('/documentos/', params={'ncm': '01012100'}).json()['items'] == []
+    assert client.get('/documentos/', params={'transportadora': 'Transp Ltda'}).json()['items'] == []
+
+
+def _alembic(engine, action, revision):
+    from alembic import command
+    from alembic.config import Config
+    from app.db import init_db
+
+    cfg = Config(init_db.ALEMBIC_INI)
+    cfg.attributes['configure_logger'] = False
+    with engine.connect() as conn:
+        cfg.attributes['connection'] = conn
+        getattr(command, action)(cfg, revision)
+
+
+def test_migration_converts_text_and_backfill_keeps_itens(pg_engine):
+    from app.services import backfill
+
+    _alembic(pg_engine, 'downgrade', '0009_busca')
+    with pg_engine.begin() as conn:
+        assert conn.execute(text("SELECT data_type FROM information_schema.columns "
+                                 "WHERE table_name = 'documentos_financeiros' AND column_name = 'metadados'")).scalar() != 'jsonb'
+        email_id = conn.execute(text(
+            "INSERT INTO emails (id, message_id, remetente, corpo) "
+            "VALUES (gen_random_uuid(), 'm1', 'fornecedor@fornecedor.com', :corpo) RETURNING id"), {'corpo': NF_PRODUTO}).scalar()
+        conn.execute(text(
+            "INSERT INTO documentos_financeiros (id, email_id, tipo, subtipo, status, metadados, criado_em) "
+            "VALUES (gen_random_uuid(), :email_id, 'DOCUMENTO_FORNECEDOR', 'NF_PRODUTO', 'PENDENTE', :meta, now())"),
+            {'email_id': email_id, 'meta': '{"ncm": "73181500", "itens": [{"descricao": "Parafuso", "quantidade": 10}, '
+                                           '{"descricao": "XML", "quantidade": "1.5", "valor": "3.00", "ncm": "7318"}, "lixo"]}'})
+    _alembic(pg_engine, 'upgrade', 'head')
+
+    Session = sessionmaker(bind=pg_engine)
+    with Session() as db:
+        doc = db.scalars(select(models.DocumentoFinanceiro)).one()
+        assert doc.metadados['ncm'] == '73181500'
+        assert _itens(db) == [(1, 'Parafuso', 10), (2, 'XML', Decimal('1.5'))]
+        assert db.scalar(select(models.ItemDocumento.valor).where(models.ItemDocumento.ncm == '7318')) == Decimal('3.00')
+        # containment is served by the GIN index
+        assert db.scalar(select(models.DocumentoFinanceiro.id).where(
+            models.DocumentoFinanceiro.metadados.op('@>')(text("""'{"ncm": "73181500"}'::jsonb""")))) == doc.id
+
+    # re-extraction replaces the itens rows together with metadados
+    assert backfill.run_backfill(Session, processes=1)['campos']['metadados'] == 1
+    with Session() as db:
+        assert _itens(db) == [(1, 'Parafuso', 10)]
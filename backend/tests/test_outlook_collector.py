@@ -0,0 +1,82 @@
+import pytest
+
+pytest.importorskip('requests')
+
+from app.services import outlook_collector
+from conftest import FakeGraph
+
+
+def test_concurrent_fetch_matches_sequential_and_retries(graph):
+    session = outlook_collector.make_session(max_per_host=4, retries=2, backoff=0)
+    msgs = outlook_collector.fetch_outlook_emails('t', 'c', 's', 'fin@ex.com', top=6, max_workers=4, session=session)
+
+    assert [m['message_id'] for m in msgs] == [f'm{i}' for i in range(6)]
+    for m in msgs:
+        saved, ref = m['attachments']
+        assert ref['caminho_arquivo'] is None
+        with open(saved['caminho_arquivo'], 'rb') as f:
+            assert f.read() == f'pdf-{m["message_id"]}'.encode()
+    # m3 answered 503 once and was retried
+    assert sum('/messages/m3/' in p for p in FakeGraph.hits) == 2
+
+    sequential = outlook_collector.fetch_outlook_emails('t', 'c', 's', 'fin@ex.com', top=6)
+    assert sequential == msgs
+
+
+def test_delta_sync_follows_pages_and_skips_known(graph):
+    pages = list(outlook_collector.iter_outlook_delta('t', 'c', 's', 'fin@ex.com', page_size=3))
+    assert [[m['message_id'] for m in msgs] for msgs, _ in pages] == [['m0', 'm1', 'm2'], ['m3', 'm4', 'm5']]
+    assert pages[0][1].endswith('skip=1')
+    cursor = pages[-1][1]
+    assert cursor.endswith('token=1')
+
+    FakeGraph.hits = []
+    stored = {f'm{i}' for i in range(6)}
+    pages = list(outlook_collector.iter_outlook_delta(
+        't', 'c', 's', 'fin@ex.com', cursor=cursor, known_ids=lambda ids: stored & set(ids)))
+    assert [[m['message_id'] for m in msgs] for msgs, _ in pages] == [['m9']]
+    assert pages[0][1].endswith('token=2')
+    # attachments were only requested for the new message
+    assert [p for p in FakeGraph.hits if '/attachments' in p] == ['/users/fin@ex.com/messages/m9/attachments']
+
+
+def _ingestor(db_session):
+    from app.services.email_ingestor import EmailIngestor
+    return EmailIngestor('t', 'c', 's', 'fin@ex.com', preview_mode='lazy', session_factory=db_session.info['sessionmaker'])
+
+
+def _cursor(db_session):
+    from app.db import models
+    db_session.expire_all()
+    return db_session.query(models.SyncCursor).one().cursor
+
+
+def test_ingest_incremental_resumes_from_the_stored_cursor(graph, db_session):
+    ingestor = _ingestor(db_session)
+    first = ingestor.ingest_incremental(page_size=3)
+    assert (first['inserted'], first['conhecidos']) == (6, 0)
+    assert _cursor(db_session).endswith('token=1')
+
+    FakeGraph.hits = []
+    second = ingestor.ingest_incremental(page_size=3)
+    assert (second['inserted'], second['conhecidos']) == (1, 1)
+    assert [p for p in FakeGraph.hits if 'delta' in p] == ['/messages/delta?token=1']
+    assert _cursor(db_session).endswith('token=2')
+
+
+def test_expired_cursor_restarts_a_fresh_round(graph, db_session):
+    from app.db import models
+
+    ingestor = _ingestor(db_session)
+    ingestor.ingest_incremental(page_size=3)
+    state = db_session.query(models.SyncCursor).one()
+    state.cursor = state.cursor.replace('token=1', 'token=expired')
+    db_session.commit()
+
+    FakeGraph.hits = []
+    totals = ingestor.ingest_incremental(page_size=3)
+    # the fresh round lists every message again, but none is downloaded or stored twice
+    assert (totals['inserted'], totals['conhecidos']) == (0, 6)
+    assert not [p for p in FakeGraph.hits if '/attachments' in p]
+    assert _cursor(db_session).endswith('token=1')
+    assert db_session.query(models.Email).count() == 6
@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+from app.services.pipeline import Pipeline, Stage, format_stats
+
+
+def _slow(item, delay=0.05):
+    time.sleep(delay)
+    return item
+
+
+def _square(x):
+    return x * x
+
+
+def test_stages_overlap_and_report_stats():
+    stages = [Stage(name, _slow, workers=4) for name in ('rede', 'cpu', 'disco')]
+    pipeline = Pipeline(stages, queue_size=4)
+    start = time.perf_counter()
+    out = pipeline.run(range(24))
+    elapsed = time.perf_counter() - start
+
+    assert sorted(out) == list(range(24))
+    # sequential: 24 items x 3 stages x 50 ms = 3.6 s
+    assert elapsed < 1.5
+    stats = pipeline.stats()
+    assert stats['source'] == 24
+    assert [s['processed'] for s in stats['stages'].values()] == [24, 24, 24]
+    assert all(s['queue'] == 0 and s['queue_max'] <= 4 for s in stats['stages'].values())
+    assert 'rede' in format_stats(stats)
+
+
+def test_backpressure_bounds_items_in_flight():
+    produced, consumed = [0], [0]
+    in_flight = []
+    lock = threading.Lock()
+
+    def source():
+        for i in range(200):
+            with lock:
+                produced[0] += 1
+                in_flight.append(produced[0] - consumed[0])
+            yield i
+
+    def slow_sink(item):
+        time.sleep(0.002)
+        with lock:
+            consumed[0] += 1
+        return item
+
+    pipeline = Pipeline([Stage('rapido', lambda x: x, workers=2), Stage('lento', slow_sink)], queue_size=3)
+    assert len(pipeline.run(source())) == 200
+    # two queues of 3, two fast workers and one slow worker holding an item, + the one being produced
+    assert max(in_flight) <= 3 + 2 + 3 + 1 + 1
+
+
+def test_failures_are_per_item_and_none_filters():
+    def fragile(x):
+        if x == 3:
+            raise ValueError('boom')
+        return None if x % 2 else x
+
+    pipeline = Pipeline([Stage('fragil', fragile, workers=2)])
+    assert sorted(pipeline.run(range(8))) == [0, 2, 4, 6]
+    assert [(stage, item, str(e)) for stage, item, e in pipeline.errors] == [('fragil', 3, 'boom')]
+    assert pipeline.stats()['stages']['fragil']['errors'] == 1
+
+
+def test_process_stage_and_batches():
+    batches = []
+    pipeline = Pipeline([
+        Stage('quadrado', _square, workers=2, kind='process'),
+        Stage('lote', lambda batch: batches.append(batch) or len(batch), batch_size=4, batch_wait=1),
+    ])
+    assert sum(pipeline.run(range(10))) == 10
+    assert sorted(x for b in batches for x in b) == [x * x for x in range(10)]
+    assert all(len(b) <= 4 for b in batches)
+    assert pipeline.stats()['stages']['lote']['processed'] == 10
+
+
+def test_failing_source_finishes_queued_items_before_raising():
+    def source():
+        yield from range(6)
+        raise RuntimeError('graph paging failed')
+
+    written = []
+    pipeline = Pipeline([
+        Stage('quadrado', _square, workers=2, kind='process'),
+        Stage('persistir', lambda x: written.append(_slow(x)), batch_size=1),
+    ])
+    with pytest.raises(RuntimeError, match='graph paging failed'):
+        pipeline.run(source())
+    assert pipeline.errors == []
+    done = list(written)
+    time.sleep(0.2)
+    # nothing is still writing after run() raised
+    assert sorted(written) == sorted(done) == [x * x for x in range(6)]
+
+
+def test_ingest_pipeline_persists_graph_messages(graph, pg_engine, monkeypatch, tmp_path):
+    from sqlalchemy import func, select
+    from sqlalchemy.orm import sessionmaker
+
+    from app.db import models
+    from app.services import preview
+    from app.services.ingest_pipeline import run_ingest_pipeline
+
+    monkeypatch.setattr(preview, 'STORAGE_DIR', str(tmp_path))
+
+    Session = sessionmaker(bind=pg_engine)
+    reports = []
+    totals = run_ingest_pipeline(
+        't', 'c', 's', 'fin@ex.com', top=6, io_workers=3, cpu_workers=1, batch_size=4,
+        preview_mode='pool', session_factory=Session, report=reports.append,
+    )
+    assert totals['inserted'] == 6 and totals['erros'] == 0
+    assert totals['stats']['stages']['persistir']['processed'] == 6
+    assert reports and reports[-1]['source'] == 6
+    with Session() as db:
+        assert db.scalar(select(func.count()).select_from(models.DocumentoFinanceiro)) == 6
+        assert db.scalar(select(func.count()).select_from(models.Anexo)) == 6
+        # the fake attachments are not real PDFs: the preview stage records the failure
+        eventos = db.scalars(select(models.Historico.evento)).all()
+        assert sum(e.startswith('Erro ao gerar preview') for e in eventos) == 6
+
+    again = run_ingest_pipeline('t', 'c', 's', 'fin@ex.com', top=6, preview_mode='lazy', session_factory=Session)
+    assert again['inserted'] == 0 and again['skipped'] == 6
+    assert again['stats']['source'] == 0
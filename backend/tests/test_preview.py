@@ -0,0 +1,83 @@
+import pytest
+
+pytest.importorskip('PIL')
+pytest.importorskip('pdfplumber')
+
+from PIL import Image
+
+from app.services import preview
+
+
+@pytest.fixture(autouse=True)
+def storage(monkeypatch, tmp_path):
+    monkeypatch.setattr(preview, 'STORAGE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def _image(path, color):
+    Image.new('RGB', (2000, 1000), color).save(path)
+    return str(path)
+
+
+def test_preview_cached_by_content_and_params(storage):
+    a = _image(storage / 'a.png', 'red')
+    b = _image(storage / 'copy-of-a.png', 'red')
+    first = preview.render_preview(a)
+    assert preview.render_preview(b) == first
+    with Image.open(first) as im:
+        assert im.size == (1200, 600)
+    assert preview.render_preview(a, max_width=300) != first
+    assert preview.render_preview(_image(storage / 'c.png', 'blue')) != first
+
+
+def test_generate_preview_does_not_rerender(storage, monkeypatch):
+    path = _image(storage / 'a.png', 'red')
+    assert preview.generate_preview(path)
+    monkeypatch.setattr(preview.Image, 'open', lambda *a, **k: pytest.fail('rendered twice'))
+    assert preview.generate_preview(path)
+
+
+def test_ingestion_renders_the_sizes_the_ui_requests(storage, monkeypatch):
+    from app.services import preview_worker
+    path = _image(storage / 'a.png', 'red')
+    stored = preview_worker._generate(path)
+    monkeypatch.setattr(preview.Image, 'open', lambda *a, **k: pytest.fail('rendered on request'))
+    assert preview.render_preview(path, max_width=preview.PREVIEW_SIZES['thumb'])
+    assert preview.render_preview(path, max_width=preview.PREVIEW_SIZES['medio']) == stored
+
+
+def test_unreadable_file_is_not_rendered_again(storage, monkeypatch):
+    path = storage / 'corrupt.png'
+    path.write_bytes(b'not an image')
+    with pytest.raises(Exception):
+        preview.render_preview(str(path))
+    monkeypatch.setattr(preview.Image, 'open', lambda *a, **k: pytest.fail('rendered twice'))
+    with pytest.raises(preview.PreviewError, match='UnidentifiedImageError'):
+        preview.render_preview(str(path))
+
+
+def test_threads_rendering_the_same_file_all_get_the_preview(storage):
+    from concurrent.futures import ThreadPoolExecutor
+
+    paths = [_image(storage / f'{n}.png', (n, 0, 0)) for n in range(8)]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        out = list(pool.map(preview.render_preview, [p for p in paths for _ in range(4)]))
+    assert len(set(out)) == 8
+    assert not list(storage.glob('previews/*/.tmp-*'))
+
+
+def test_pool_mode_shares_one_pool_across_pages(storage, db_session):
+    from sqlalchemy import select
+    from app.db import models
+    from app.services import preview_worker
+    from app.services.email_ingestor import persist_messages_bulk
+
+    # workers are forked from here, with the monkeypatched STORAGE_DIR
+    pool = preview_worker.preview_pool(reset=True)
+    for n, color in enumerate(['red', 'blue']):
+        attachment = {'nome_arquivo': f'{n}.png', 'caminho_arquivo': _image(storage / f'{n}.png', color)}
+        message = {'message_id': f'<p{n}@ex.com>', 'remetente': 'f@ex.com', 'corpo_preview': 'NF', 'attachments': [attachment]}
+        assert persist_messages_bulk(db_session, [message], preview_mode='pool')['inserted'] == 1
+        assert preview_worker.preview_pool() is pool
+    previews = db_session.scalars(select(models.Anexo.preview_imagem)).all()
+    assert len(previews) == 2 and all(p and p.startswith(str(storage)) for p in previews)
@@ -0,0 +1,78 @@
+"""EXPLAIN regression test: the hot lookups must be served by the migration indexes.
+
+Runs only against a real Postgres (TEST_DATABASE_URL); seq scans are disabled so
+any query that lost its index shows up as a `Seq Scan` node in the plan.
+"""
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip('sqlalchemy')
+
+from sqlalchemy import insert, select, text
+from sqlalchemy.dialects import postgresql
+
+from app.db import models
+
+D = models.DocumentoFinanceiro
+
+
+def _seed(conn, n=300):
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    emails, docs, anexos, hist = [], [], [], []
+    statuses = list(models.DocumentStatus)
+    for i in range(n):
+        email_id, doc_id = uuid.uuid4(), uuid.uuid4()
+        emails.append({'id': email_id, 'message_id': f'plan-{i}', 'remetente': 'f@ex.com', 'assunto': f'NF {i}'})
+        docs.append({
+            'id': doc_id, 'email_id': email_id, 'tipo': models.DocumentType.DOCUMENTO_FORNECEDOR,
+            'status': statuses[i % len(statuses)], 'criado_em': base + timedelta(minutes=i),
+        })
+        anexos.append({'id': uuid.uuid4(), 'email_id': email_id, 'nome_arquivo': f'{i}.pdf', 'tipo': 'PDF',
+                       'caminho_arquivo': f'/data/{i}.pdf'})
+        hist += [{'id': uuid.uuid4(), 'documento_id': doc_id, 'evento': f'evento {j}',
+                  'data_hora': base + timedelta(minutes=i, seconds=j)} for j in range(3)]
+    conn.execute(insert(models.Email), emails)
+    conn.execute(insert(D), docs)
+    conn.execute(insert(models.Anexo), anexos)
+    conn.execute(insert(models.Historico), hist)
+    return docs[n // 2]
+
+
+def _plan(conn, stmt) -> str:
+    sql = stmt.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+    rows = conn.exec_driver_sql(f'EXPLAIN {sql}').all()
+    return '\n'.join(r[0] for r in rows)
+
+
+def test_hot_queries_use_indexes(pg_engine):
+    from app.api.documents import _list_statement, _page_statement, _summary_statement
+    from app.services.search import search_statement
+
+    with pg_engine.begin() as conn:
+        doc = _seed(conn)
+        conn.execute(text('ANALYZE'))
+        conn.execute(text('SET LOCAL enable_seqscan = off'))
+
+        page = select(D.id, D.criado_em).order_by(D.criado_em.desc(), D.id.desc()).limit(51)
+        queries = {
+            'lista': page,
+            'lista por status': page.where(D.status == models.DocumentStatus.PENDENTE),
+            'fila de revisão': page.where(D.status.in_([models.DocumentStatus.PENDENTE, models.DocumentStatus.REVISAO])),
+            'lista por tipo': page.where(D.tipo == models.DocumentType.DOCUMENTO_FORNECEDOR),
+            'histórico': select(models.Historico)
+            .where(models.Historico.documento_id == doc['id'])
+            .order_by(models.Historico.data_hora.desc()),
+            'documento por email': select(D).where(D.email_id == doc['email_id']),
+            'anexos por email': select(models.Anexo).where(models.Anexo.email_id == doc['email_id']),
+            'resumo por período': _summary_statement('postgresql', 'mes', 'tipo', None, None, None, None,
+                                                     date(2024, 1, 1), date(2024, 4, 1))[0],
+            'busca': search_statement('NF 150', 'postgresql'),
+            'CT-e por transportadora': _page_statement(
+                _list_statement(None, 'NF_FRETE', None, None, None, None, transportadora='Transp Ltda'), None, 50),
+            'documentos com o item': select(models.ItemDocumento.documento_id).where(models.ItemDocumento.ncm == '73181500'),
+        }
+        for name, stmt in queries.items():
+            plan = _plan(conn, stmt)
+            assert 'Seq Scan' not in plan, f'{name}:\n{plan}'
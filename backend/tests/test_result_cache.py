@@ -0,0 +1,118 @@
+import json
+
+import pytest
+
+from app.services import advanced_classifier, attachment_store, classifier, extractor, result_cache
+from app.services.result_cache import ResultCache
+
+CTE_BODY = 'Segue o CT-e do frete. Transportadora: Transp Ltda\nOrigem: SP\nDestino: RJ\nValor: R$ 500,00'
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(attachment_store, 'STORAGE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_repeated_templates_hit_the_memo(monkeypatch):
+    cache = ResultCache(size=2)
+    calls = []
+    real = advanced_classifier.classify_email
+    monkeypatch.setattr(advanced_classifier, 'classify_email', lambda *a: calls.append(a) or real(*a))
+
+    anexos = [{'nome_arquivo': 'CTe.XML'}, {'nome_arquivo': 'a.pdf'}]
+    first = cache.classify_email(CTE_BODY, anexos, 'nf@transp.com')
+    assert first == real(CTE_BODY, anexos, 'nf@transp.com')
+    # same content up to what the classifier normalizes away
+    assert cache.classify_email(CTE_BODY.upper(), anexos[::-1], 'nf@transp.com') == first
+    assert len(calls) == 1
+    cache.classify_email(CTE_BODY, [], 'nf@transp.com')
+    assert len(calls) == 2
+
+    # what callers do with the result does not leak into the cache
+    first['subtipo'] = None
+    assert cache.classify_email(CTE_BODY, anexos, 'nf@transp.com')['subtipo'] == 'NF_FRETE'
+
+    stats = cache.stats()[result_cache.CLASSIFICATION]
+    assert (stats['memoria'], stats['calculado']) == (2, 2) and stats['taxa_acerto'] == 0.5
+    assert cache.stats()[result_cache.EXTRACTION]['taxa_acerto'] is None
+
+
+def test_registry_answers_are_never_memoized(monkeypatch):
+    from app.services import supplier_registry
+
+    registro = {'tipo': 'DOCUMENTO_FORNECEDOR', 'subtipo': 'NF_PRODUTO', 'confidence': 0.99, 'fonte': 'registro'}
+    answers = [None, registro]
+    # the registry reloads between the cache's check and the computation
+    monkeypatch.setattr(supplier_registry, 'prior', lambda *a: answers.pop(0) if answers else None)
+    cache = ResultCache(size=2)
+    assert cache.classify_email(CTE_BODY, [], 'nf@transp.com')['subtipo'] == 'NF_FRETE'
+    answers.clear()
+    assert 'fonte' not in cache.classify_email(CTE_BODY, [], 'nf@transp.com')
+    assert cache.stats()[result_cache.CLASSIFICATION]['calculado'] == 1
+
+
+def test_extraction_is_invalidated_by_a_rules_change(tmp_path, monkeypatch):
+    cache = ResultCache()
+    text = 'Pedido nº 4521\nValor: R$ 10,00'
+    assert cache.extract_financial_data(text, [], 'DOCUMENTO_FORNECEDOR', None) == {'valor': '10.00'}
+    assert cache.extract_financial_data(text, [], 'ENTRADA_INTERNA', None) == {'valor': '10.00'}
+    assert cache.stats()[result_cache.EXTRACTION]['memoria'] == 1
+
+    path = tmp_path / 'regras.json'
+    path.write_text(json.dumps(extractor.EXTRACTION_RULES + [
+        {'campo': 'pedido', 'regex': r'Pedido\s*n?º?\s*([0-9]+)', 'ancora': 'pedido'}]))
+    monkeypatch.setattr(extractor, 'EXTRACTION_RULES_FILE', str(path))
+    monkeypatch.setattr(extractor, 'EXTRACTION_RULES_CHECK_INTERVAL', 0)
+    try:
+        assert cache.extract_financial_data(text, [], 'DOCUMENTO_FORNECEDOR', None) == {'valor': '10.00', 'pedido': '4521'}
+        assert cache.stats()[result_cache.EXTRACTION]['calculado'] == 2
+    finally:
+        monkeypatch.setattr(extractor, 'EXTRACTION_RULES_FILE', '')
+        extractor.reload_rules()
+
+
+def test_extraction_key_follows_attachment_content(storage):
+    cache = ResultCache()
+    xml = '<cteProc><CTe><infCte><emit><xNome>{}</xNome></emit></infCte></CTe></cteProc>'
+    a = attachment_store.store_stream([xml.format('Transp A').encode()], 'cte.xml')
+    b = attachment_store.store_stream([xml.format('Transp B').encode()], 'cte.xml')
+    res_a = cache.extract_financial_data('Segue', [{'nome_arquivo': 'cte.xml', 'caminho_arquivo': a}], None, 'NF_FRETE')
+    res_b = cache.extract_financial_data('Segue', [{'nome_arquivo': 'cte.xml', 'caminho_arquivo': b}], None, 'NF_FRETE')
+    assert (res_a['fornecedor'], res_b['fornecedor']) == ('Transp A', 'Transp B')
+    # a copy of the same file under another name and e-mail is a hit
+    cache.extract_financial_data('Segue', [{'nome_arquivo': 'outro.xml', 'caminho_arquivo': a}], None, 'NF_FRETE')
+    assert cache.stats()[result_cache.EXTRACTION]['memoria'] == 1
+
+
+def test_disk_tier_is_shared_and_purged(storage):
+    worker_a, worker_b = ResultCache(tier='disco'), ResultCache(tier='disco')
+    res = worker_a.classify_email(CTE_BODY, [], 'nf@transp.com')
+    assert worker_b.classify_email(CTE_BODY, [], 'nf@transp.com') == res
+    assert worker_b.stats()[result_cache.CLASSIFICATION]['compartilhado'] == 1
+
+    stale = storage / 'resultados' / result_cache.CLASSIFICATION / 'versao-antiga'
+    stale.mkdir()
+    assert worker_a.purge_stale() == 1 and not stale.exists()
+    assert ResultCache(tier='disco').classify_email(CTE_BODY, [], 'nf@transp.com') == res
+
+
+def test_postgres_tier(pg_engine):
+    from sqlalchemy import func, select
+    from sqlalchemy.orm import sessionmaker
+    from app.db import models
+
+    Session = sessionmaker(bind=pg_engine)
+    worker_a, worker_b = (ResultCache(tier='postgres', session_factory=Session) for _ in range(2))
+    res = worker_a.extract_financial_data(CTE_BODY, [], 'DOCUMENTO_FORNECEDOR', 'NF_FRETE')
+    worker_a.clear()
+    assert worker_a.extract_financial_data(CTE_BODY, [], 'DOCUMENTO_FORNECEDOR', 'NF_FRETE') == res
+    assert worker_b.extract_financial_data(CTE_BODY, [], 'DOCUMENTO_FORNECEDOR', 'NF_FRETE') == res
+    assert worker_b.stats()[result_cache.EXTRACTION]['compartilhado'] == 1
+
+    with Session() as db:
+        db.add(models.ResultCacheEntry(chave='0' * 64, tipo=result_cache.EXTRACTION, versao='antiga', resultado='{}'))
+        db.commit()
+    assert worker_a.purge_stale() == 1
+    with Session() as db:
+        assert db.scalar(select(func.count()).select_from(models.ResultCacheEntry)) == 1
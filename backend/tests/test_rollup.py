@@ -0,0 +1,194 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from app.db import models
+from app.services import rollup
+
+# (day, tipo, status, fornecedor, valor)
+DOCS = [
+    (1, models.DocumentType.DOCUMENTO_FORNECEDOR, models.DocumentStatus.PENDENTE, 'Acme', 100),
+    (1, models.DocumentType.DOCUMENTO_FORNECEDOR, models.DocumentStatus.PENDENTE, 'Acme', 50.5),
+    (2, models.DocumentType.DOCUMENTO_FORNECEDOR, models.DocumentStatus.CLASSIFICADO, 'Beta', 10),
+    (9, models.DocumentType.ENTRADA_INTERNA, models.DocumentStatus.CLASSIFICADO, None, None),
+    (40, models.DocumentType.DOCUMENTO_FORNECEDOR, models.DocumentStatus.PENDENTE, 'Acme', 1),
+]
+
+
+def _seed(db):
+    """Documentos written the way the ingestion does: rows and rollup deltas in one transaction."""
+    email = models.Email(message_id='m1', remetente='f@ex.com')
+    db.add(email)
+    db.flush()
+    docs = [
+        models.DocumentoFinanceiro(email_id=email.id, tipo=tipo, status=status, fornecedor=fornecedor, valor=valor,
+                                   criado_em=datetime(2024, 1, 1, 12, tzinfo=timezone.utc) + timedelta(days=day - 1))
+        for day, tipo, status, fornecedor, valor in DOCS
+    ]
+    db.add_all(docs)
+    db.flush()
+    rollup.apply(db, [(None, d) for d in docs])
+    db.commit()
+    return docs
+
+
+def _rows(db):
+    R = models.ResumoDiario
+    return db.execute(select(R.dia, R.tipo, R.subtipo, R.status, R.fornecedor, R.quantidade, R.valor_total)
+                      .where(R.quantidade != 0).order_by(R.dia, R.tipo, R.status, R.fornecedor)).all()
+
+
+def test_summary_buckets_and_filters(client, db_session):
+    _seed(db_session)
+    page = client.get('/documentos/resumo', params={'agrupar': 'fornecedor'}).json()
+    assert page['quantidade'] == 5 and page['valor_total'] == 161.5
+    assert page['grupos'][0] == {'periodo': '2024-01-01', 'tipo': None, 'subtipo': None, 'status': None,
+                                 'fornecedor': 'Acme', 'quantidade': 2, 'valor_total': 150.5}
+
+    semanas = client.get('/documentos/resumo', params={'periodo': 'semana'}).json()['grupos']
+    # 2024-01-01 is a Monday; 2024-01-09 falls in the next week
+    assert [(g['periodo'], g['quantidade']) for g in semanas] == [('2024-01-01', 3), ('2024-01-08', 1), ('2024-02-05', 1)]
+    meses = client.get('/documentos/resumo', params={'periodo': 'mes', 'agrupar': 'tipo,status'}).json()['grupos']
+    assert [(g['periodo'], g['tipo'], g['status'], g['quantidade']) for g in meses] == [
+        ('2024-01-01', 'DOCUMENTO_FORNECEDOR', 'CLASSIFICADO', 1),
+        ('2024-01-01', 'DOCUMENTO_FORNECEDOR', 'PENDENTE', 2),
+        ('2024-01-01', 'ENTRADA_INTERNA', 'CLASSIFICADO', 1),
+        ('2024-02-01', 'DOCUMENTO_FORNECEDOR', 'PENDENTE', 1),
+    ]
+
+    total = client.get('/documentos/resumo', params={
+        'periodo': 'total', 'tipo': 'DOCUMENTO_FORNECEDOR', 'de': '2024-01-02', 'ate': '2024-02-10'}).json()
+    assert total['grupos'] == [{'periodo': None, 'tipo': None, 'subtipo': None, 'status': None, 'fornecedor': None,
+                                'quantidade': 2, 'valor_total': 11.0}]
+    assert client.get('/documentos/resumo', params={'periodo': 'hora'}).status_code == 422
+    assert client.get('/documentos/resumo', params={'agrupar': 'valor'}).status_code == 422
+
+
+def test_confirm_moves_the_count_and_rebuild_agrees(client, db_session):
+    docs = _seed(db_session)
+    assert client.post(f'/documentos/{docs[0].id}/confirmar', params={'usuario': 'ana'}).status_code == 200
+    status = client.get('/documentos/resumo', params={'periodo': 'total', 'agrupar': 'status'}).json()['grupos']
+    assert {g['status']: (g['quantidade'], g['valor_total']) for g in status} == {
+        'CLASSIFICADO': (2, 10.0), 'FEITO': (1, 100.0), 'PENDENTE': (2, 51.5)}
+
+    incremental = _rows(db_session)
+    assert rollup.rebuild(db_session) == len(incremental)
+    assert _rows(db_session) == incremental
+
+
+def test_ingestion_and_backfill_keep_the_rollup(pg_engine):
+    from app.services import backfill
+    from app.services.email_ingestor import persist_messages_bulk
+
+    Session = sessionmaker(bind=pg_engine)
+    messages = [
+        {'message_id': f'<m{i}@ex.com>', 'remetente': 'nf@transp.com', 'assunto': 'CT-e',
+         'corpo_preview': f'Segue o CT-e do frete.\nValor: R$ {i}00,00',
+         'data_hora_email': '2024-01-01T00:00:00Z', 'attachments': []}
+        for i in range(1, 5)
+    ]
+    with Session() as db:
+        persist_messages_bulk(db, messages, preview_mode='lazy')
+        assert [(r.subtipo, r.quantidade, r.valor_total) for r in _rows(db)] == [('NF_FRETE', 4, 1000)]
+
+        # a stale label put back by hand: the backfill moves it between keys
+        D = models.DocumentoFinanceiro
+        doc = db.scalars(select(D).order_by(D.valor)).first()
+        before = rollup.snapshot(doc)
+        doc.subtipo = models.DocumentSubtipo.NF_PRODUTO
+        rollup.apply(db, [(before, doc)])
+        db.commit()
+        assert {r.subtipo for r in _rows(db)} == {'NF_FRETE', 'NF_PRODUTO'}
+
+    backfill.run_backfill(Session, processes=1)
+    with Session() as db:
+        incremental = _rows(db)
+        assert {r.subtipo for r in incremental} == {'NF_FRETE'} and sum(r.quantidade for r in incremental) == 4
+        rollup.rebuild(db)
+        assert _rows(db) == incremental
+
+
+@pytest.mark.parametrize('periodo', ['semana', 'mes', 'ano'])
+def test_postgres_buckets(pg_engine, periodo):
+    from app.api.documents import _summary, _summary_statement
+
+    Session = sessionmaker(bind=pg_engine)
+    with Session() as db:
+        _seed(db)
+        stmt, grupos = _summary_statement('postgresql', periodo, None, None, None, None, None, None, None)
+        grupos = _summary(db.execute(stmt).all(), periodo, grupos)['grupos']
+    expected = {
+        'semana': [('2024-01-01', 3), ('2024-01-08', 1), ('2024-02-05', 1)],
+        'mes': [('2024-01-01', 4), ('2024-02-01', 1)],
+        'ano': [('2024-01-01', 5)],
+    }[periodo]
+    assert [(g['periodo'], g['quantidade']) for g in grupos] == expected
+
+
+def test_concurrent_confirmations_count_once(pg_engine, monkeypatch):
+    import threading
+    import time
+    from fastapi import HTTPException
+    from app.api import documents
+    from app.services import supplier_registry
+
+    Session = sessionmaker(bind=pg_engine)
+    with Session() as db:
+        doc_id = _seed(db)[0].id
+    record = supplier_registry.record
+
+    def slow_record(db, doc, remetente):
+        record(db, doc, remetente)
+        time.sleep(0.3)  # the first confirmation is still open when the second one reads the row
+
+    monkeypatch.setattr(supplier_registry, 'record', slow_record)
+    outcomes = []
+
+    def confirm(usuario):
+        with Session() as db:
+            try:
+                outcomes.append(documents.confirmar_documento(doc_id, usuario, db)['status'])
+            except HTTPException as e:
+                outcomes.append(e.status_code)
+
+    threads = [threading.Thread(target=confirm, args=(u,)) for u in ('ana', 'bia')]
+    threads[0].start()
+    time.sleep(0.1)
+    threads[1].start()
+    for t in threads:
+        t.join()
+    assert sorted(outcomes, key=str) == [400, 'ok']
+    with Session() as db:
+        incremental = _rows(db)
+        assert sum(r.quantidade for r in incremental if r.status == 'FEITO') == 1
+        rollup.rebuild(db)
+        assert _rows(db) == incremental
+
+
+def test_migration_fills_the_rollup_from_existing_documentos(pg_engine, monkeypatch):
+    from alembic import command
+    from alembic.config import Config
+    from app.db import init_db
+
+    monkeypatch.setenv('LOCAL_TZ', 'America/Sao_Paulo')
+    monkeypatch.setattr(rollup, 'LOCAL_TZ', 'America/Sao_Paulo')
+    Session = sessionmaker(bind=pg_engine)
+    with Session() as db:
+        docs = _seed(db)
+        # 01:00 UTC is the previous day in LOCAL_TZ
+        docs[0].criado_em = datetime(2024, 1, 5, 1, tzinfo=timezone.utc)
+        db.commit()
+        rollup.rebuild(db)
+        expected = _rows(db)
+
+    cfg = Config(init_db.ALEMBIC_INI)
+    cfg.attributes['configure_logger'] = False
+    with pg_engine.connect() as conn:
+        cfg.attributes['connection'] = conn
+        command.downgrade(cfg, '0007_documento_eventos')
+        command.upgrade(cfg, 'head')
+    with Session() as db:
+        assert _rows(db) == expected
+        assert any(r.dia.day == 4 for r in expected)
@@ -0,0 +1,152 @@
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from app.db import models
+from app.services import search
+
+EMAILS = [
+    ('Fatura de frete de janeiro', 'Segue o CT-e do transporte.', 'Transportes Rápidos Ltda', 'CTE-1001', '12.345.678/0001-90'),
+    ('NF de produto', 'Nota fiscal das peças, sem frete.', 'Acme Peças', 'NF-2002', '98.765.432/0001-10'),
+    ('Boleto', 'Boleto referente aos fretes de fevereiro e março.', 'Transportes Rápidos Ltda', 'BOL-3003', None),
+    ('Reunião', 'Pauta da reunião de quinta.', None, None, None),
+]
+
+
+def _seed(db):
+    for i, (assunto, corpo, fornecedor, numero, cnpj) in enumerate(EMAILS):
+        email = models.Email(message_id=f'<b{i}@ex.com>', remetente='f@ex.com', assunto=assunto, corpo=corpo)
+        db.add(email)
+        db.flush()
+        db.add(models.DocumentoFinanceiro(
+            email_id=email.id, tipo=models.DocumentType.DOCUMENTO_FORNECEDOR, status=models.DocumentStatus.PENDENTE,
+            fornecedor=fornecedor, numero_documento=numero, cnpj=cnpj,
+            criado_em=datetime(2024, 1, 1 + i, tzinfo=timezone.utc)))
+    db.commit()
+
+
+def _numeros(page):
+    return [item['numero_documento'] for item in page['items']]
+
+
+def test_fallback_search_and_pagination(client, db_session):
+    _seed(db_session)
+    assert sorted(_numeros(client.get('/documentos/busca', params={'q': 'frete'}).json())) == ['BOL-3003', 'CTE-1001', 'NF-2002']
+    assert _numeros(client.get('/documentos/busca', params={'q': '98.765'}).json()) == ['NF-2002']
+    assert client.get('/documentos/busca', params={'q': 'inexistente'}).json() == {'items': [], 'next_cursor': None}
+    # LIKE wildcards in the query are plain characters
+    for q in ('%', '10_%', 'CTE_1001', '\\'):
+        assert client.get('/documentos/busca', params={'q': q}).json()['items'] == [], q
+
+    first = client.get('/documentos/busca', params={'q': 'Transportes', 'limit': 1}).json()
+    assert first['items'][0]['assunto'] and first['items'][0]['relevancia'] == 0
+    rest = client.get('/documentos/busca', params={'q': 'Transportes', 'cursor': first['next_cursor']}).json()
+    assert rest['next_cursor'] is None and len(set(_numeros(first) + _numeros(rest))) == 2
+
+    assert client.get('/documentos/busca', params={'q': ' '}).status_code == 422
+    assert client.get('/documentos/busca', params={'q': 'x', 'cursor': 'lixo'}).status_code == 422
+
+
+def test_migrations_render_offline(monkeypatch):
+    """`alembic upgrade head --sql` needs no database (extensions are assumed available)."""
+    import io
+    pytest.importorskip('alembic')
+    from alembic import command
+    from alembic.config import Config
+    from app.db import init_db, session
+
+    monkeypatch.setattr(session, 'DATABASE_URL', 'postgresql+psycopg2://offline@/offline')
+    out = io.StringIO()
+    cfg = Config(init_db.ALEMBIC_INI, output_buffer=out)
+    cfg.attributes['configure_logger'] = False
+    command.upgrade(cfg, 'head', sql=True)
+    script = out.getvalue()
+    assert 'CREATE EXTENSION IF NOT EXISTS pg_trgm' in script
+    assert 'CREATE TEXT SEARCH CONFIGURATION pt_busca' in script
+    assert 'ix_documentos_fornecedor_trgm' in script
+
+
+def _search(db, q, **kwargs):
+    from app.api.documents import _search_page, _search_statement
+
+    limit = kwargs.pop('limit', 20)
+    stmt = _search_statement('postgresql', search.has_trgm(db), q, kwargs.pop('cursor', None), limit)
+    return _search_page(db.execute(stmt).all(), limit)
+
+
+def test_postgres_ranking_stemming_and_pages(pg_engine):
+    Session = sessionmaker(bind=pg_engine)
+    with Session() as db:
+        _seed(db)
+        # stemming: "fretes" finds "frete"; a word in the assunto (weight A) ranks above the corpo
+        fretes = _numeros(_search(db, 'fretes'))
+        assert fretes[0] == 'CTE-1001' and sorted(fretes) == ['BOL-3003', 'CTE-1001', 'NF-2002']
+        ranked = _search(db, 'transportes')['items']
+        assert [i['numero_documento'] for i in ranked] == ['CTE-1001', 'BOL-3003']
+        assert ranked[0]['relevancia'] > ranked[1]['relevancia'] > 0
+        assert _numeros(_search(db, '"nota fiscal"')) == ['NF-2002']
+        assert sorted(_numeros(_search(db, 'frete -boleto'))) == ['CTE-1001', 'NF-2002']
+        # the bare digits of a CNPJ match a formatted one
+        assert _numeros(_search(db, '12345678000190')) == ['CTE-1001']
+
+        pages, cursor = [], None
+        while True:
+            page = _search(db, 'frete', limit=1, cursor=cursor)
+            pages += _numeros(page)
+            cursor = page.get('next_cursor')
+            if not cursor:
+                break
+        assert sorted(pages) == ['BOL-3003', 'CTE-1001', 'NF-2002']
+
+        # the generated columns follow updates, as ingestion and the backfill write them
+        db.execute(text("UPDATE emails SET assunto = 'Cobrança de armazenagem' WHERE assunto = 'Reunião'"))
+        db.commit()
+        assert len(_search(db, 'armazenagem')['items']) == 1
+
+
+def test_postgres_unaccent_and_trigram(pg_engine):
+    Session = sessionmaker(bind=pg_engine)
+    with Session() as db:
+        installed = set(db.scalars(text("SELECT extname FROM pg_extension")))
+        _seed(db)
+        if 'unaccent' not in installed and 'pg_trgm' not in installed:
+            pytest.skip('unaccent and pg_trgm are not available on this server')
+        if 'unaccent' in installed:
+            assert _numeros(_search(db, 'pecas')) == ['NF-2002']
+        if 'pg_trgm' in installed:
+            # a misspelt fornecedor and a fragment of a number
+            assert set(_numeros(_search(db, 'Transprtes Rapidos'))) >= {'CTE-1001', 'BOL-3003'}
+            assert _numeros(_search(db, '3003')) == ['BOL-3003']
+            assert _numeros(_search(db, '345.678')) == ['CTE-1001']
+
+
+def test_concurrent_starts_migrate_once(pg_engine):
+    """API workers starting together: the second waits for the first instead of re-running revisions."""
+    import threading
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+    from sqlalchemy import text
+    from app.db import init_db
+
+    with pg_engine.begin() as conn:
+        conn.execute(text('DROP SCHEMA public CASCADE'))
+        conn.execute(text('CREATE SCHEMA public'))
+    errors = []
+
+    def start():
+        try:
+            init_db.create_tables(bind=pg_engine)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=start) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    head = ScriptDirectory.from_config(Config(init_db.ALEMBIC_INI)).get_current_head()
+    with pg_engine.connect() as conn:
+        assert conn.execute(text('SELECT version_num FROM alembic_version')).scalar() == head
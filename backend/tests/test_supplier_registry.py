@@ -0,0 +1,105 @@
+import pytest
+from sqlalchemy import select
+
+from app.db import models
+from app.services import classifier, supplier_registry
+from app.services.result_cache import ResultCache
+from app.services.supplier_registry import SupplierRegistry
+
+AMBIGUO = 'Segue em anexo o documento do mês. CNPJ 12.345.678/0001-90'
+
+
+def _documento(db, n, remetente, subtipo, cnpj='12.345.678/0001-90'):
+    email = models.Email(message_id=f'<r{n}@ex.com>', remetente=remetente)
+    db.add(email)
+    db.flush()
+    doc = models.DocumentoFinanceiro(email_id=email.id, tipo=models.DocumentType.DOCUMENTO_FORNECEDOR,
+                                     subtipo=subtipo, status=models.DocumentStatus.PENDENTE,
+                                     fornecedor='Transp Ltda', cnpj=cnpj)
+    db.add(doc)
+    db.commit()
+    return doc.id
+
+
+def _registro(db):
+    R = models.RegistroFornecedor
+    return db.execute(select(R.tipo_chave, R.chave, R.subtipo, R.quantidade)
+                      .order_by(R.tipo_chave, R.chave, R.subtipo)).all()
+
+
+@pytest.fixture
+def registry(db_session, monkeypatch):
+    registry = SupplierRegistry(db_session.info['sessionmaker'], refresh_interval=0)
+    monkeypatch.setattr(supplier_registry, 'REGISTRY', registry)
+    return registry
+
+
+def test_confirmations_build_the_registry_and_priors(client, db_session, registry):
+    frete = models.DocumentSubtipo.NF_FRETE
+    ids = [_documento(db_session, n, 'NF <nf@transp.com.br>', frete) for n in range(3)]
+    ids.append(_documento(db_session, 3, 'contato@gmail.com', models.DocumentSubtipo.NF_SERVICO, cnpj='98.765.432/0001-10'))
+    ids.append(_documento(db_session, 4, 'nf@misto.com', models.DocumentSubtipo.NF_SERVICO, cnpj=None))
+    ids.append(_documento(db_session, 5, 'nf@misto.com', models.DocumentSubtipo.NF_PRODUTO, cnpj=None))
+    for doc_id in ids:
+        assert client.post(f'/documentos/{doc_id}/confirmar', params={'usuario': 'ana'}).status_code == 200
+
+    incremental = _registro(db_session)
+    # public mail domains are not keys
+    assert incremental == [
+        ('cnpj', '12345678000190', 'NF_FRETE', 3),
+        ('cnpj', '98765432000110', 'NF_SERVICO', 1),
+        ('dominio', 'misto.com', 'NF_PRODUTO', 1),
+        ('dominio', 'misto.com', 'NF_SERVICO', 1),
+        ('dominio', 'transp.com.br', 'NF_FRETE', 3),
+    ]
+    assert supplier_registry.rebuild(db_session) == len(incremental)
+    assert _registro(db_session) == incremental
+
+    # only keys confirmed often enough with one subtipo decide
+    assert registry.refresh() == 2
+    assert classifier.classify_email('Boa tarde, segue.', [], 'faturamento@transp.com.br') == {
+        'tipo': 'DOCUMENTO_FORNECEDOR', 'subtipo': 'NF_FRETE', 'confidence': 0.99, 'fonte': 'registro'}
+    # an unknown sender quoting a known CNPJ
+    assert classifier.classify_email(AMBIGUO, [], 'alguem@gmail.com')['subtipo'] == 'NF_FRETE'
+    assert 'fonte' not in classifier.classify_email('Boa tarde, segue.', [], 'nf@misto.com')
+    # internal requisitions quote suppliers' CNPJs: always scored
+    assert classifier.classify_email(f'Requisição de compra. {AMBIGUO}', [], 'compras@empresa.com')['subtipo'] == 'REQUISICAO_COMPRA'
+
+    batch = [('Boa tarde, segue.', [], 'nf@transp.com.br'), ('Prestação de serviço - ISS informado', [], 'x@servicos.com')]
+    assert [r['subtipo'] for r in classifier.classify_emails(batch)] == ['NF_FRETE', 'NF_SERVICO']
+
+    # registry answers bypass the memo: they follow the next reload
+    cache = ResultCache(size=8)
+    assert cache.classify_email('Boa tarde, segue.', [], 'nf@transp.com.br')['fonte'] == 'registro'
+    assert cache.stats()['classificacao']['calculado'] == 0
+
+
+def test_registry_reloads_in_the_background(tmp_path):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    # a file database: the reload thread gets its own connection instead of sharing the test's
+    engine = create_engine(f"sqlite:///{tmp_path / 'registro.db'}")
+    models.Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    registry = SupplierRegistry(Session, refresh_interval=0.05)
+    try:
+        assert registry.prior('Boa tarde', 'nf@transp.com.br') is None
+        with Session() as db:
+            db.add(models.RegistroFornecedor(tipo_chave='dominio', chave='transp.com.br', subtipo='NF_FRETE', quantidade=5))
+            db.commit()
+        for _ in range(100):
+            if registry.prior('Boa tarde', 'nf@transp.com.br'):
+                break
+            registry._stop.wait(0.05)
+        assert registry.prior('Boa tarde', 'nf@transp.com.br')['subtipo'] == 'NF_FRETE'
+    finally:
+        registry.stop()
+        engine.dispose()
+
+
+def test_pool_workers_use_the_parent_table_without_a_thread(registry):
+    table = {('dominio', 'transp.com.br'): ('NF_FRETE', 1.0)}
+    supplier_registry.init_worker(table)
+    assert registry.prior('Boa tarde', 'nf@transp.com.br')['subtipo'] == 'NF_FRETE'
+    assert registry._thread is None
@@ -45,8 +45,8 @@ export default function Detail(){
 
       <div className="card">
         <h3>Preview</h3>
-        {doc.anexos && doc.anexos[0] && doc.anexos[0].preview_imagem && (
-          <img src={`data:image/png;base64,${doc.anexos[0].preview_imagem}`} alt="preview" style={{maxWidth: '800px'}} />
+        {doc.anexos && doc.anexos[0] && doc.anexos[0].previews && (
+          <img src={doc.anexos[0].previews.medio} alt="preview" style={{maxWidth: '800px'}} />
         )}
       </div>
 
@@ -1,14 +1,41 @@
 import React, {useEffect, useState} from 'react'
 import { Link } from 'react-router-dom'
 
+const EVENTOS = ['criado', 'classificado', 'confirmado']
+
 export default function Inbox(){
   const [docs, setDocs] = useState([])
+  const [cursor, setCursor] = useState(null)
 
-  useEffect(()=>{
-    fetch('/documentos')
+  const carregar = (after) => {
+    const params = new URLSearchParams({limit: '50'})
+    if (after) params.set('cursor', after)
+    fetch(`/documentos?${params}`)
       .then(r=>r.json())
-      .then(setDocs)
+      .then(page => {
+        setDocs(prev => after ? [...prev, ...page.items] : page.items)
+        setCursor(page.next_cursor || null)
+      })
       .catch(console.error)
+  }
+
+  useEffect(()=>{ carregar(null) },[])
+
+  // live updates: the server pushes each created/reclassified/confirmed documento;
+  // EventSource reconnects by itself and resumes with Last-Event-ID
+  useEffect(()=>{
+    const fonte = new EventSource('/documentos/eventos')
+    const aplicar = e => {
+      const doc = JSON.parse(e.data)
+      setDocs(prev => {
+        const i = prev.findIndex(d => d.id === doc.id)
+        if (i >= 0) return prev.map(d => d.id === doc.id ? doc : d)
+        return e.type === 'criado' ? [doc, ...prev] : prev
+      })
+    }
+    EVENTOS.forEach(t => fonte.addEventListener(t, aplicar))
+    fonte.addEventListener('recarregar', () => carregar(null))
+    return () => fonte.close()
   },[])
 
   return (
@@ -16,11 +43,12 @@ export default function Inbox(){
       <h1>Inbox Financeiro</h1>
       <table>
         <thead>
-          <tr><th>Tipo</th><th>Documento</th><th>Valor</th><th>Status</th><th>Confirmado em</th></tr>
+          <tr><th></th><th>Tipo</th><th>Documento</th><th>Valor</th><th>Status</th><th>Confirmado em</th></tr>
         </thead>
         <tbody>
           {docs.map(d=> (
             <tr key={d.id}>
+              <td><img className="thumb" src={`/documentos/${d.id}/thumbnail`} alt="" loading="lazy" onError={e=>{e.target.style.visibility='hidden'}} /></td>
               <td>{d.tipo}</td>
               <td><Link to={`/documento/${d.id}`}>{d.numero_documento || d.id}</Link></td>
               <td>{d.valor || '-'}</td>
@@ -30,6 +58,7 @@ export default function Inbox(){
           ))}
         </tbody>
       </table>
+      {cursor && <button onClick={()=>carregar(cursor)} style={{marginTop: '12px'}}>Carregar mais</button>}
     </div>
   )
 }